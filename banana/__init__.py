@@ -0,0 +1 @@
+# Banana Studio 公共运行时模块（不依赖 Gradio，主程序 / 插件 / 无头入口共用）
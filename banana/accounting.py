@@ -0,0 +1,280 @@
+# Token / 费用记账：逐次调用落库（SQLite），按会话 / 队列任务 / 日汇总，并做预算检查
+import argparse
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from banana.pricing import estimate_call_cost
+
+DEFAULT_USAGE_DB = Path("usage.db")
+
+# 预算状态
+BUDGET_OK = "ok"
+BUDGET_SOFT = "soft"   # 超过软预算：继续执行，只提示
+BUDGET_HARD = "hard"   # 超过硬预算：对话拒绝发送，队列暂停
+
+# 支持的预算作用域
+BUDGET_SCOPES = ("session", "task", "daily")
+
+# 允许聚合的维度 -> SQL 表达式
+GROUP_BY_EXPR = {
+    "model": "model",
+    "image_size": "image_size",
+    "session": "session_id",
+    "flow": "flow",
+    "task": "task_id",
+    "source": "source",
+    "day": "date(ts, 'unixepoch', 'localtime')",
+    "hour": "strftime('%Y-%m-%d %H:00', ts, 'unixepoch', 'localtime')",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    session_id TEXT NOT NULL DEFAULT '',
+    flow TEXT NOT NULL DEFAULT '',
+    task_id TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT '',
+    model TEXT NOT NULL,
+    image_size TEXT NOT NULL DEFAULT '',
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    candidates_tokens INTEGER NOT NULL DEFAULT 0,
+    thoughts_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    images INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_usage_ts ON usage(ts);
+CREATE INDEX IF NOT EXISTS idx_usage_session ON usage(session_id);
+CREATE INDEX IF NOT EXISTS idx_usage_task ON usage(task_id);
+"""
+
+
+def usage_from_response(response) -> Dict[str, int]:
+    """
+    从 GenerateContentResponse.usage_metadata 提取 token 计数（字段缺失时记 0）
+    """
+    meta = getattr(response, "usage_metadata", None)
+
+    def _get(name: str) -> int:
+        return int(getattr(meta, name, None) or 0) if meta is not None else 0
+
+    return {
+        "prompt_tokens": _get("prompt_token_count"),
+        "candidates_tokens": _get("candidates_token_count"),
+        "thoughts_tokens": _get("thoughts_token_count"),
+        "cached_tokens": _get("cached_content_token_count"),
+        "total_tokens": _get("total_token_count"),
+    }
+
+
+def _day_start(now: Optional[float] = None) -> float:
+    d = datetime.fromtimestamp(now or time.time())
+    return datetime(d.year, d.month, d.day).timestamp()
+
+
+class UsageLedger:
+    """
+    用量账本。线程安全；每次写入都立即提交，进程崩溃也不会丢账。
+
+    budget_provider 返回形如
+        {"session": {"soft": 1.0, "hard": 5.0}, "task": {...}, "daily": {...}}
+    的预算配置（美元），每次检查时调用，修改配置后无需重启即可生效。
+    """
+
+    def __init__(self, db_path: Path = DEFAULT_USAGE_DB, budget_provider: Optional[Callable[[], Dict[str, Any]]] = None):
+        self.db_path = Path(db_path)
+        self.budget_provider = budget_provider or (lambda: {})
+        self._lock = threading.Lock()
+        # 多个进程共用同一个账本文件：WAL + busy timeout
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    # ---------- 写入 ----------
+    def record(
+        self,
+        model: str,
+        image_size: str = "",
+        usage: Optional[Dict[str, int]] = None,
+        images: int = 0,
+        session_id: str = "",
+        flow: str = "",
+        task_id: str = "",
+        source: str = "",
+    ) -> Dict[str, Any]:
+        """
+        记录一次调用，返回包含估算费用的记录
+        """
+        usage = usage or {}
+        row = {
+            "ts": time.time(),
+            "session_id": session_id or "",
+            "flow": flow or "",
+            "task_id": str(task_id or ""),
+            "source": source or "",
+            "model": model,
+            "image_size": image_size or "",
+            "prompt_tokens": int(usage.get("prompt_tokens", 0)),
+            "candidates_tokens": int(usage.get("candidates_tokens", 0)),
+            "thoughts_tokens": int(usage.get("thoughts_tokens", 0)),
+            "cached_tokens": int(usage.get("cached_tokens", 0)),
+            "total_tokens": int(usage.get("total_tokens", 0)),
+            "images": int(images),
+        }
+        row["cost_usd"] = estimate_call_cost(
+            model, image_size,
+            prompt_tokens=row["prompt_tokens"],
+            candidates_tokens=row["candidates_tokens"],
+            thoughts_tokens=row["thoughts_tokens"],
+            images=row["images"],
+            cached_tokens=row["cached_tokens"],
+        )
+        cols = ", ".join(row.keys())
+        marks = ", ".join("?" for _ in row)
+        with self._lock:
+            self._conn.execute(f"INSERT INTO usage ({cols}) VALUES ({marks})", tuple(row.values()))
+            self._conn.commit()
+        return row
+
+    # ---------- 查询 ----------
+    def totals(self, session_id: str = "", task_id: str = "", since: Optional[float] = None) -> Dict[str, float]:
+        """
+        按条件汇总：调用次数 / token / 图片数 / 费用
+        """
+        where, args = ["1=1"], []
+        if session_id:
+            where.append("session_id = ?")
+            args.append(session_id)
+        if task_id:
+            where.append("task_id = ?")
+            args.append(str(task_id))
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        sql = (
+            "SELECT COUNT(*), COALESCE(SUM(prompt_tokens),0), COALESCE(SUM(candidates_tokens),0), "
+            "COALESCE(SUM(thoughts_tokens),0), COALESCE(SUM(images),0), COALESCE(SUM(cost_usd),0) "
+            f"FROM usage WHERE {' AND '.join(where)}"
+        )
+        with self._lock:
+            calls, p, c, t, imgs, cost = self._conn.execute(sql, args).fetchone()
+        return {
+            "calls": calls, "prompt_tokens": p, "candidates_tokens": c,
+            "thoughts_tokens": t, "images": imgs, "cost_usd": cost,
+        }
+
+    def summarize(self, group_by: str = "day", since: Optional[float] = None, until: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        容量规划用：按维度聚合（model / image_size / session / flow / task / source / day / hour）
+        """
+        if group_by not in GROUP_BY_EXPR:
+            raise ValueError(f"不支持的聚合维度: {group_by}，可选 {list(GROUP_BY_EXPR)}")
+        expr = GROUP_BY_EXPR[group_by]
+        where, args = ["1=1"], []
+        if since is not None:
+            where.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            args.append(until)
+        sql = (
+            f"SELECT {expr} AS k, COUNT(*), SUM(prompt_tokens), SUM(candidates_tokens), SUM(thoughts_tokens), "
+            f"SUM(images), SUM(cost_usd) FROM usage WHERE {' AND '.join(where)} GROUP BY k ORDER BY k"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [
+            {
+                group_by: k, "calls": n, "prompt_tokens": p, "candidates_tokens": c,
+                "thoughts_tokens": t, "images": imgs, "cost_usd": cost,
+            }
+            for k, n, p, c, t, imgs, cost in rows
+        ]
+
+    # ---------- 预算 ----------
+    def check_budget(self, session_id: str = "", task_id: str = "") -> Tuple[str, str]:
+        """
+        依次检查 daily / session / task 三个作用域，返回最严重的 (状态, 说明)
+        """
+        budgets = self.budget_provider() or {}
+        worst, msgs = BUDGET_OK, []
+        scopes = {
+            "daily": ("今日总", lambda: self.totals(since=_day_start())),
+            "session": ("会话", lambda: self.totals(session_id=session_id)),
+            "task": ("任务", lambda: self.totals(task_id=task_id)),
+        }
+        for scope, (name, fetch) in scopes.items():
+            limits = budgets.get(scope) or {}
+            if not limits or (scope == "session" and not session_id) or (scope == "task" and not task_id):
+                continue
+            spent = fetch()["cost_usd"]
+            hard, soft = limits.get("hard"), limits.get("soft")
+            if hard is not None and spent >= float(hard):
+                worst = BUDGET_HARD
+                msgs.append(f"{name}花费 ${spent:.2f} 已达硬预算 ${float(hard):.2f}")
+            elif soft is not None and spent >= float(soft):
+                if worst == BUDGET_OK:
+                    worst = BUDGET_SOFT
+                msgs.append(f"{name}花费 ${spent:.2f} 已超软预算 ${float(soft):.2f}")
+        return worst, "；".join(msgs)
+
+
+# ========== 进程级单例 ==========
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def configure_ledger(db_path: Path = DEFAULT_USAGE_DB, budget_provider: Optional[Callable[[], Dict[str, Any]]] = None) -> UsageLedger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger(db_path, budget_provider)
+        elif budget_provider is not None:
+            _ledger.budget_provider = budget_provider
+        return _ledger
+
+
+def get_ledger() -> UsageLedger:
+    return _ledger or configure_ledger()
+
+
+def format_totals(totals: Dict[str, float]) -> str:
+    return (
+        f"调用 {totals['calls']} 次 ｜ 输入 {totals['prompt_tokens']} tok ｜ 输出 {totals['candidates_tokens']} tok ｜ "
+        f"思考 {totals['thoughts_tokens']} tok ｜ 图片 {totals['images']} 张 ｜ 估算 ${totals['cost_usd']:.3f}"
+    )
+
+
+# ========== 命令行查询 ==========
+# python -m banana.accounting --group-by model --since 2026-10-01
+def _parse_date(s: Optional[str]) -> Optional[float]:
+    return datetime.fromisoformat(s).timestamp() if s else None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Banana Studio 用量汇总")
+    parser.add_argument("--db", default=str(DEFAULT_USAGE_DB))
+    parser.add_argument("--group-by", default="day", choices=list(GROUP_BY_EXPR))
+    parser.add_argument("--since", help="起始日期 (YYYY-MM-DD)")
+    parser.add_argument("--until", help="截止日期 (YYYY-MM-DD，不含)")
+    args = parser.parse_args(argv)
+
+    ledger = UsageLedger(Path(args.db))
+    rows = ledger.summarize(args.group_by, since=_parse_date(args.since), until=_parse_date(args.until))
+    print(f"{args.group_by:<24}{'calls':>8}{'prompt':>12}{'output':>12}{'thoughts':>10}{'images':>8}{'cost($)':>10}")
+    for r in rows:
+        print(
+            f"{str(r[args.group_by]):<24}{r['calls']:>8}{r['prompt_tokens']:>12}{r['candidates_tokens']:>12}"
+            f"{r['thoughts_tokens']:>10}{r['images']:>8}{r['cost_usd']:>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class CancelledError(RuntimeError):
+    """请求已被取消（用户点击取消 / 浏览器断开）"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """请求超过截止时间仍未返回"""
+
+
+class CancelToken:
+    """
+    一次交互（一轮对话 / 一个队列任务）对应的取消令牌。
+    跨线程共享：UI 回调负责 cancel()，执行方在关键节点检查 cancelled。
+    """
+
+    def __init__(self, session_id: str = "", scope: str = ""):
+        self.session_id = session_id
+        self.scope = scope
+        self.reason = ""
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "用户取消") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise CancelledError(self.reason or "已取消")
+
+    def sleep(self, seconds: float) -> bool:
+        """
+        可被取消打断的 sleep，返回 True 表示等待期间被取消。
+        """
+        if seconds <= 0:
+            return self._event.is_set()
+        return self._event.wait(seconds)
+
+
+# ========== 会话级令牌注册表 ==========
+# key: (session_id, scope) -> [CancelToken, ...]
+_registry: Dict[Tuple[str, str], List[CancelToken]] = {}
+_registry_lock = threading.Lock()
+
+
+def new_token(session_id: str = "", scope: str = "") -> CancelToken:
+    token = CancelToken(session_id=session_id or "", scope=scope or "")
+    with _registry_lock:
+        _registry.setdefault((token.session_id, token.scope), []).append(token)
+    return token
+
+
+def release_token(token: Optional[CancelToken]) -> None:
+    if token is None:
+        return
+    key = (token.session_id, token.scope)
+    with _registry_lock:
+        tokens = _registry.get(key)
+        if not tokens:
+            return
+        try:
+            tokens.remove(token)
+        except ValueError:
+            pass
+        if not tokens:
+            _registry.pop(key, None)
+
+
+def cancel_session(session_id: str, scope: Optional[str] = None, reason: str = "用户取消") -> int:
+    """
+    取消某个会话下的所有令牌；scope 为 None 时取消该会话全部作用域。
+    返回被取消的令牌数量。
+    """
+    with _registry_lock:
+        targets = [
+            t
+            for (sid, sc), tokens in _registry.items()
+            if sid == (session_id or "") and (scope is None or sc == scope)
+            for t in tokens
+        ]
+    for t in targets:
+        t.cancel(reason)
+    return len(targets)
+
+
+# ========== 带截止时间的阻塞调用 ==========
+# SDK 的 generate_content 是阻塞调用，放到工作线程里执行，主线程轮询取消/超时。
+# 注意：SDK 的同步调用无法从外部中断，取消 / 超时只是不再等待；已经发出的请求仍在工作线程里跑完，
+# 最长持续到 HttpOptions.timeout，服务端照常计费。on_abandoned 用于给这类调用补记用量。
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="banana-call")
+_POLL_INTERVAL = 0.2
+
+
+def run_with_deadline(
+    fn: Callable[[], Any],
+    timeout: Optional[float] = None,
+    token: Optional[CancelToken] = None,
+    on_abandoned: Optional[Callable[[Any], None]] = None,
+) -> Any:
+    """
+    在工作线程执行 fn()，直到返回 / 超时 / 被取消。
+    - 超时：抛出 DeadlineExceededError
+    - 取消：抛出 CancelledError
+    on_abandoned: 超时 / 取消时 fn 已在执行（无法撤回），它之后成功返回时以返回值回调一次，
+        用于补记用量、清理副作用；fn 尚未开始时直接撤回，不会回调。
+    """
+    if token is not None:
+        token.raise_if_cancelled()
+
+    future = _executor.submit(fn)
+
+    def _abandon() -> None:
+        if future.cancel() or on_abandoned is None:
+            return
+
+        def _done(f) -> None:
+            if f.cancelled() or f.exception() is not None:
+                return
+            try:
+                on_abandoned(f.result())
+            except Exception as e:
+                print(f"[WARN] 处理被放弃的调用结果失败：{e}")
+
+        future.add_done_callback(_done)
+
+    deadline = time.monotonic() + timeout if timeout else None
+
+    while True:
+        wait = _POLL_INTERVAL
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                _abandon()
+                raise DeadlineExceededError(f"请求超时（>{timeout:g}s）")
+            wait = min(wait, remaining)
+        done, _ = wait_futures([future], timeout=wait)
+        if done:
+            return future.result()
+        if token is not None and token.cancelled:
+            _abandon()
+            raise CancelledError(token.reason or "已取消")
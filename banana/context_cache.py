@@ -0,0 +1,345 @@
+# 显式上下文缓存：把长对话的稳定前缀（系统指令 + 较早的轮次，含参考图）存成服务端 CachedContent，
+# 之后每轮只发送缓存之后的新消息，请求里带 cached_content=缓存名，不再重复上传同样的图片字节，
+# 缓存部分的输入 token 也按折扣价计费。
+# - 历史达到 min_messages 条才建缓存；缓存之后又新增 refresh_after 条消息时重建（覆盖到最新前缀），旧缓存删除
+# - 记录每个缓存的过期时间：剩余不足 renew_before_s 时延长 TTL；已过期、换了系统指令或历史被清空时重建
+# - 建缓存失败（模型不支持 / 内容不足最小 token 数等）时记下，前缀再增长 refresh_after 条之前不再尝试
+# GenaiCacheBackend 调用 client.caches；LocalCacheBackend 是进程内替身，不发请求，供测试和离线调试。
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 距过期不足这么多秒的缓存视为已过期（留出一次请求的时间）
+EXPIRY_MARGIN_S = 30.0
+
+
+class GenaiCacheBackend:
+    """通过 google-genai 的 client.caches 管理服务端缓存"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model: str, contents: List[Any], system_instruction: str, ttl_s: float, display_name: str = "") -> Tuple[str, float, int]:
+        """返回 (缓存名, 过期时间戳, 缓存的 token 数)"""
+        from google.genai import types
+
+        cache = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=contents,
+                system_instruction=system_instruction or None,
+                ttl=f"{int(ttl_s)}s",
+                display_name=display_name or None,
+            ),
+        )
+        meta = getattr(cache, "usage_metadata", None)
+        return cache.name, _expire_ts(cache, ttl_s), int(getattr(meta, "total_token_count", None) or 0)
+
+    def update(self, name: str, ttl_s: float) -> float:
+        """延长 TTL，返回新的过期时间戳"""
+        from google.genai import types
+
+        cache = self.client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{int(ttl_s)}s"))
+        return _expire_ts(cache, ttl_s)
+
+    def delete(self, name: str) -> None:
+        self.client.caches.delete(name=name)
+
+
+def _expire_ts(cache, ttl_s: float) -> float:
+    expire_time = getattr(cache, "expire_time", None)
+    if expire_time is not None and hasattr(expire_time, "timestamp"):
+        return expire_time.timestamp()
+    return time.time() + ttl_s
+
+
+class LocalCacheBackend:
+    """
+    进程内替身：接口与 GenaiCacheBackend 相同，只记录内容和过期时间。
+    calls 记下每次操作，便于测试断言建了几次缓存、续期 / 删除了哪些。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.caches: Dict[str, Dict[str, Any]] = {}
+        self.calls: List[Tuple[str, str]] = []
+
+    def create(self, model: str, contents: List[Any], system_instruction: str, ttl_s: float, display_name: str = "") -> Tuple[str, float, int]:
+        name = f"local/cachedContents/{uuid.uuid4().hex[:12]}"
+        expire_at = time.time() + ttl_s
+        with self._lock:
+            self.caches[name] = {
+                "model": model, "contents": list(contents), "system_instruction": system_instruction,
+                "expire_at": expire_at, "display_name": display_name,
+            }
+            self.calls.append(("create", name))
+        return name, expire_at, 0
+
+    def update(self, name: str, ttl_s: float) -> float:
+        with self._lock:
+            if name not in self.caches or self.caches[name]["expire_at"] <= time.time():
+                raise KeyError(f"缓存不存在或已过期：{name}")
+            self.caches[name]["expire_at"] = time.time() + ttl_s
+            self.calls.append(("update", name))
+            return self.caches[name]["expire_at"]
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self.caches.pop(name, None)
+            self.calls.append(("delete", name))
+
+
+@dataclass
+class CacheEntry:
+    name: str
+    model: str
+    covered: int        # 覆盖了历史消息的前多少条
+    fingerprint: str    # 系统指令 + 前 covered 条消息的指纹
+    expire_at: float
+    backend: Any
+    tokens: int = 0
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+def _file_stamp(path: str) -> str:
+    try:
+        st = os.stat(path)
+        return f"{path}:{st.st_size}:{st.st_mtime_ns}"
+    except OSError:
+        return path
+
+
+def fingerprint(system_instruction: str, messages: List[Dict[str, Any]]) -> str:
+    """系统指令 + 消息前缀的指纹（图片按路径 + 大小 + 修改时间，不读文件内容）"""
+    h = hashlib.sha1((system_instruction or "").strip().encode("utf-8"))
+    for msg in messages:
+        h.update(b"\x00" + str(msg.get("role", "")).encode("utf-8"))
+        h.update(b"\x01" + str(msg.get("text") or "").encode("utf-8"))
+        for img in msg.get("images") or []:
+            h.update(b"\x02" + _file_stamp(str(img)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _still_valid(entry: CacheEntry, system_instruction: str, history: List[Dict[str, Any]], now: float) -> bool:
+    """缓存未过期，且覆盖的前缀与当前历史一致"""
+    return (
+        entry.covered <= len(history)
+        and entry.expire_at - now > EXPIRY_MARGIN_S
+        and entry.fingerprint == fingerprint(system_instruction, history[: entry.covered])
+    )
+
+
+class ContextCacheManager:
+    """
+    按 (对话标识, 模型) 管理缓存。prepare() 返回本轮可用的 CacheEntry（None 表示不用缓存），
+    调用方只发送 history[entry.covered:] 并带上 cached_content=entry.name。
+    backend 为 None 时由调用方按请求传入（GenaiCacheBackend(client)）。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        ttl_s: float = 3600,
+        min_messages: int = 4,
+        refresh_after: int = 6,
+        renew_before_s: float = 300,
+        max_entries: int = 64,
+        backend: Any = None,
+    ):
+        self.enabled = bool(enabled)
+        self.ttl_s = float(ttl_s)
+        self.min_messages = max(1, int(min_messages))
+        self.refresh_after = max(1, int(refresh_after))
+        self.renew_before_s = float(renew_before_s)
+        self.max_entries = max(1, int(max_entries))
+        self.backend = backend
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._failed_at: Dict[Tuple[str, str], int] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self.stats = {"hits": 0, "created": 0, "renewed": 0, "failures": 0, "invalidated": 0}
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _bump(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def _discard(self, entry: Optional[CacheEntry]) -> None:
+        if entry is None:
+            return
+        try:
+            entry.backend.delete(entry.name)
+        except Exception as e:
+            print(f"[WARN] 删除上下文缓存 {entry.name} 失败：{e}")
+
+    def prepare(
+        self,
+        key: str,
+        model: str,
+        system_instruction: str,
+        history: List[Dict[str, Any]],
+        build_contents: Callable[[List[Dict[str, Any]]], List[Any]],
+        backend: Any = None,
+    ) -> Optional[CacheEntry]:
+        """
+        key: 对话标识；history: 本轮之前的全部消息；build_contents: 把消息列表转成 types.Content 列表
+        """
+        if not self.enabled or not key:
+            return None
+        backend = self.backend or backend
+        if backend is None:
+            return None
+        k = (key, model)
+        n = len(history)
+        with self._key_lock(k):
+            with self._lock:
+                entry = self._entries.get(k)
+            now = time.time()
+            if entry is not None and not _still_valid(entry, system_instruction, history, now):
+                # 历史被清空 / 改写、系统指令变了或已过期：作废
+                self._drop_entry(k)
+                entry = None
+
+            if entry is not None and n - entry.covered < self.refresh_after:
+                if entry.expire_at - now < self.renew_before_s:
+                    try:
+                        entry.expire_at = entry.backend.update(entry.name, self.ttl_s)
+                        self._bump("renewed")
+                    except Exception as e:
+                        print(f"[WARN] 上下文缓存续期失败，本轮不使用缓存：{e}")
+                        self._drop_entry(k)
+                        return None
+                entry.hits += 1
+                self._bump("hits")
+                with self._lock:
+                    self._entries.move_to_end(k)
+                return entry
+
+            # 需要新建（首次达到阈值，或前缀已增长 refresh_after 条）
+            if n < self.min_messages:
+                return entry
+            failed_at = self._failed_at.get(k)
+            if failed_at is not None and n - failed_at < self.refresh_after:
+                return entry
+
+            started = time.perf_counter()
+            try:
+                name, expire_at, tokens = backend.create(
+                    model, build_contents(history), system_instruction.strip(), self.ttl_s,
+                    display_name=f"banana-chat-{key[:16]}",
+                )
+            except Exception as e:
+                self._failed_at[k] = n
+                self._bump("failures")
+                print(f"[WARN] 创建上下文缓存失败（{model}，{n} 条消息），本轮不使用新缓存：{type(e).__name__}: {e}")
+                return entry
+            self._failed_at.pop(k, None)
+            new_entry = CacheEntry(
+                name=name, model=model, covered=n,
+                fingerprint=fingerprint(system_instruction, history),
+                expire_at=expire_at, backend=backend, tokens=tokens,
+            )
+            self._bump("created")
+            print(
+                f"[INFO] 上下文缓存已建立：{model}，覆盖 {n} 条消息"
+                + (f"，{tokens} tokens" if tokens else "")
+                + f"，耗时 {time.perf_counter() - started:.2f}s，TTL {self.ttl_s:.0f}s"
+            )
+            self._drop_entry(k)
+            evicted = []
+            with self._lock:
+                self._entries[k] = new_entry
+                while len(self._entries) > self.max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+            for old in evicted:
+                self._discard(old)
+            return new_entry
+
+    def _drop_entry(self, k: Tuple[str, str]) -> None:
+        with self._lock:
+            entry = self._entries.pop(k, None)
+        self._discard(entry)
+
+    def peek(self, key: str, model: str, system_instruction: str, history: List[Dict[str, Any]]) -> int:
+        """当前仍然有效的缓存覆盖了 history 的前多少条（不建、不续期缓存）"""
+        if not self.enabled or not key:
+            return 0
+        with self._lock:
+            entry = self._entries.get((key, model))
+        if entry is None or not _still_valid(entry, system_instruction, history, time.time()):
+            return 0
+        return entry.covered
+
+    def invalidate(self, key: str, model: str) -> None:
+        """服务端拒绝了缓存（已被删除 / 过期）：作废该缓存，下一轮重建"""
+        self._bump("invalidated")
+        self._drop_entry((key, model))
+
+    def drop(self, key: str) -> None:
+        """清空对话时删除该对话的所有缓存"""
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == key]
+        for k in keys:
+            self._drop_entry(k)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {
+                **self.stats,
+                "active": [
+                    {"model": e.model, "covered": e.covered, "tokens": e.tokens, "hits": e.hits,
+                     "expires_in": max(0.0, e.expire_at - now)}
+                    for e in self._entries.values()
+                ],
+            }
+
+
+def format_cache_snapshot(snap: Dict[str, Any]) -> str:
+    """上下文缓存统计文本（从未建过缓存时返回空串）"""
+    if not snap["created"] and not snap["failures"]:
+        return ""
+    return (
+        f"上下文缓存: {len(snap['active'])} 个有效，命中 {snap['hits']} 次，"
+        f"新建 {snap['created']}，续期 {snap['renewed']}，失败 {snap['failures']}"
+    )
+
+
+# ========== 进程级单例 ==========
+_manager: Optional[ContextCacheManager] = None
+_manager_lock = threading.Lock()
+
+
+def configure_context_cache(backend: str = "genai", **kwargs) -> ContextCacheManager:
+    """
+    创建（或更新）全局缓存管理器。backend="local" 时使用 LocalCacheBackend（测试 / 离线调试），
+    其余参数见 ContextCacheManager。已有缓存条目在重新配置后保留。
+    """
+    global _manager
+    local = LocalCacheBackend() if backend == "local" else None
+    with _manager_lock:
+        if _manager is None:
+            _manager = ContextCacheManager(backend=local, **kwargs)
+        else:
+            for name, value in kwargs.items():
+                if hasattr(_manager, name):
+                    setattr(_manager, name, value)
+            if backend == "local" and not isinstance(_manager.backend, LocalCacheBackend):
+                _manager.backend = local
+            elif backend != "local":
+                _manager.backend = None
+        return _manager
+
+
+def get_context_cache() -> ContextCacheManager:
+    return _manager or configure_context_cache()
@@ -0,0 +1,1020 @@
+# 核心调用层：凭证加载 / Client / 参数构造 / call_gemini_vertex
+# 不依赖 Gradio，供 Web UI、插件和无头入口（banana.headless）共用
+# google-genai 导入较慢（pydantic 模型较多），推迟到第一次真正发请求时再导入，
+# 模块级只在类型检查时引用
+from __future__ import annotations
+
+import copy
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from pprint import pprint
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
+
+from banana.accounting import get_ledger, usage_from_response
+from banana.cancellation import CancelledError, DeadlineExceededError, run_with_deadline
+from banana.context_cache import GenaiCacheBackend, get_context_cache
+from banana.errors import ERR_INVALID, classify_error
+from banana.preflight import get_preflight
+from banana.storage import get_storage, is_disk_full
+from banana.variants import get_transcoder, resolve_original
+from banana.warmup import mark_activity
+
+# 预设配置文件路径
+CONFIG_PATH = Path("config.json")
+# 生成图片默认保存目录
+OUTPUT_DIR = Path("outputs")
+
+# 打印请求报文
+def _debug_print_send(model_name, system_instruction, user_text, image_files, generate_config=None, contents=None):
+    print("\n" + "=" * 80)
+    print("[SEND] Gemini Request")
+    print("Model:", model_name)
+
+    if system_instruction:
+        print("\n[System Instruction]\n", system_instruction)
+
+    if user_text:
+        print("\n[User Text]\n", user_text)
+
+    if image_files:
+        print("\n[User Images]")
+        for i, img in enumerate(image_files):
+            p = img.name if hasattr(img, "name") else img
+            print(f"  [{i}] {p}")
+
+    if contents is not None:
+        print("\n[Contents]")
+        pprint(contents)
+
+    if generate_config is not None:
+        print("\n[Generate Config]")
+        # google-genai 的对象通常有 model_dump；没有就 pprint
+        try:
+            pprint(generate_config.model_dump())
+        except Exception:
+            pprint(generate_config)
+
+    print("=" * 80 + "\n")
+
+# 打印接受报文
+def _debug_print_recv(response):
+    print("\n" + "=" * 80)
+    print("[RECV] Gemini Response")
+    try:
+        print(json.dumps(response.model_dump(), ensure_ascii=False, indent=2))
+    except Exception:
+        pprint(response)
+    print("=" * 80 + "\n")
+
+def load_google_api_key_from_file() -> None:
+    """
+    尝试同时加载 'GOOGLE_CLOUD_API_KEY.json' (Vertex) 和 'GOOGLE_CLOUD_API_KEY.txt' (AI Studio)。
+    将所有找到的凭证都写入环境变量，供后续逻辑选用。
+    """
+    # === 1. 读取 Vertex JSON (Service Account) ===
+    vertex_json_path = Path("GOOGLE_CLOUD_API_KEY.json")
+    if vertex_json_path.exists() and vertex_json_path.is_file():
+        try:
+            abs_path = str(vertex_json_path.resolve())
+            with open(vertex_json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+                project_id = data.get("project_id")
+            
+            if project_id:
+                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = abs_path
+                os.environ["GOOGLE_CLOUD_PROJECT"] = project_id
+                print(f"[INFO] 已加载 Vertex 凭证: {vertex_json_path.name} (Project: {project_id})")
+            else:
+                print(f"[WARN] {vertex_json_path} 缺少 'project_id' 字段，跳过 Vertex 加载。")
+        except Exception as e:
+            print(f"[ERROR] 读取 Vertex JSON 失败: {e}")
+    
+    # === 2. 读取 AI Studio API Key ===
+    # (不管上面是否成功，这里都继续读，作为备用)
+    api_key_txt_path = Path("GOOGLE_CLOUD_API_KEY.txt")
+    if api_key_txt_path.exists() and api_key_txt_path.is_file():
+        try:
+            key = api_key_txt_path.read_text(encoding="utf-8").strip()
+            if key:
+                os.environ["GOOGLE_CLOUD_API_KEY"] = key
+                print(f"[INFO] 已加载 API Key: {api_key_txt_path.name}")
+            else:
+                print(f"[WARN] {api_key_txt_path} 内容为空。")
+        except Exception as e:
+            print(f"[ERROR] 读取 API Key TXT 失败: {e}")
+
+# ========== 基本配置 ==========
+
+DEFAULT_MODEL_OPTIONS = [
+    "gemini-2.5-flash",          # 文本/多模态输入，文本输出（官方 quickstart 推荐）
+    "gemini-3.1-pro-preview",      # 3.1 Pro 语言模型（多模态输入，文本输出）
+    "gemini-3-flash-preview",    # 3.0 Flash 语言模型（多模态输入，文本输出）
+    "gemini-3-pro-image-preview",# Nano Banana Pro 图像生成
+    "gemini-3.1-flash-image-preview",# Nano Banana 2 图像生成
+    "gemini-2.5-flash-image",    # 2.5 图像生成
+]
+
+# 与 Vertex 示例类似的宽高比 & 尺寸
+ASPECT_RATIO_OPTIONS = [
+    "1:1 正方形4096x4096",
+    "2:3 照片3392x5056",
+    "3:2 横版照片5056x3392",    
+    "3:4 竖版海报3584x4800",
+    "4:3 传统横版4800x3584",
+    "4:5 证件照3712x4608",
+    "5:4 老屏幕4608x3712",
+    "9:16 人像3072x5504",
+    "16:9 风景5504x3072",
+    "21:9 超宽屏6336x2688"
+    ]
+
+# 电影级宽屏 
+# """
+# 1:1       1024x1024	1210	2048x2048	1210	4096x4096	2000
+# 2:3	    848x1264	1210	1696x2528	1210	3392x5056	2000
+# 3:2	    1264x848	1210	2528x1696	1210	5056x3392	2000
+# 3:4	    896x1200	1210	1792x2400	1210	3584x4800	2000
+# 4:3	    1200x896	1210	2400x1792	1210	4800x3584	2000
+# 4:5	    928x1152	1210	1856x2304	1210	3712x4608	2000
+# 5:4	    1152x928	1210	2304x1856	1210	4608x3712	2000
+# 9:16      768x1376	1210	1536x2752	1210	3072x5504	2000
+# 16:9	    1376x768	1210	2752x1536	1210	5504x3072	2000
+# 21:9	    1584x672	1210	3168x1344	1210	6336x2688	2000
+# """
+
+
+IMAGE_SIZE_OPTIONS = [
+    "1K",
+    "2K",
+    "4K",
+]
+
+DEFAULT_ADVANCED_CONFIG: Dict[str, Any] = {
+    "temperature": 0.9,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 8192,
+    "system_instruction": "",
+}
+
+# 单次请求截止时间（秒），按 模型 -> 图像尺寸 配置，"default" 为该模型兜底值
+# 可在 config.json 的 "request_timeouts" 段覆盖，格式相同
+DEFAULT_REQUEST_TIMEOUT = 120.0
+REQUEST_TIMEOUTS: Dict[str, Dict[str, float]] = {
+    "gemini-3-pro-image-preview": {"1K": 120, "2K": 180, "4K": 300, "default": 180},
+    "gemini-3.1-flash-image-preview": {"1K": 90, "2K": 120, "4K": 240, "default": 120},
+    "gemini-2.5-flash-image": {"default": 90},
+    "gemini-2.5-flash": {"default": 60},
+    "gemini-3-flash-preview": {"default": 90},
+    "gemini-3.1-pro-preview": {"default": 180},
+}
+
+
+# config.json 的读取缓存：按文件 (mtime_ns, size, inode) 校验，文件没变时不重新解析（与 banana.presets 一致）
+# 各 load_*_config 每次调用都经过这里，改完配置仍然即时生效
+_config_lock = threading.Lock()
+_config_cache: Tuple[Tuple[str, int, int, int], Dict[str, Any]] | None = None
+
+
+def _config_stat_key() -> Tuple[str, int, int, int]:
+    try:
+        st = os.stat(CONFIG_PATH)
+    except OSError:
+        return (str(CONFIG_PATH), 0, 0, 0)
+    return (str(CONFIG_PATH), st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def read_config() -> Dict[str, Any]:
+    """整个 config.json（不存在 / 解析失败时为空 dict；调用方不得修改返回值）"""
+    global _config_cache
+    key = _config_stat_key()
+    with _config_lock:
+        if _config_cache is not None and _config_cache[0] == key:
+            return _config_cache[1]
+    data: Any = {}
+    if key[1:] != (0, 0, 0):
+        try:
+            with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except Exception as e:
+            # 同一份坏文件只提示一次：出错结果同样按 stat 缓存
+            print(f"[WARN] 读取 {CONFIG_PATH} 失败：{e}")
+            data = {}
+    if not isinstance(data, dict):
+        data = {}
+    with _config_lock:
+        _config_cache = (key, data)
+    return data
+
+
+def _config_section(name: str) -> Dict[str, Any]:
+    """config.json 中名为 name 的段（不存在或不是对象时为空 dict；调用方不得修改返回值）"""
+    section = read_config().get(name)
+    return section if isinstance(section, dict) else {}
+
+
+def _load_section(name: str, defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """defaults 的副本，再用 config.json 中 name 段里已知的键覆盖（只覆盖第一层）；返回值可以修改"""
+    cfg = copy.deepcopy(defaults)
+    cfg.update({k: copy.deepcopy(v) for k, v in _config_section(name).items() if k in defaults})
+    return cfg
+
+
+def load_request_timeouts() -> Dict[str, Dict[str, float]]:
+    """
+    合并内置超时表与 config.json 中的 "request_timeouts" 覆盖项
+    """
+    merged = {k: dict(v) for k, v in REQUEST_TIMEOUTS.items()}
+    try:
+        for model, sizes in _config_section("request_timeouts").items():
+            if isinstance(sizes, (int, float)):
+                sizes = {"default": sizes}
+            if isinstance(sizes, dict):
+                merged.setdefault(model, {}).update(
+                    {str(k): float(v) for k, v in sizes.items() if isinstance(v, (int, float))}
+                )
+    except Exception as e:
+        print(f"[WARN] 读取 request_timeouts 配置失败：{e}")
+    return merged
+
+
+def load_scheduler_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "scheduler" 段：
+    {"scheduler": {"max_concurrency": 2, "weights": {"alice": 2, "*": 1}}}
+    weights 的 key 为登录用户名（启用 auth 时）或会话 ID，"*" 为默认权重
+    """
+    cfg: Dict[str, Any] = {"max_concurrency": 2, "weights": {}}
+    sched = _config_section("scheduler")
+    try:
+        if isinstance(sched.get("max_concurrency"), int):
+            cfg["max_concurrency"] = sched["max_concurrency"]
+        if isinstance(sched.get("weights"), dict):
+            cfg["weights"] = {str(k): float(v) for k, v in sched["weights"].items()}
+    except Exception as e:
+        print(f"[WARN] 读取 scheduler 配置失败：{e}")
+    return cfg
+
+
+# 启动预热默认值（config.json 的 "warmup" 段可覆盖）
+DEFAULT_WARMUP_CONFIG: Dict[str, Any] = {
+    "enabled": True,
+    "model": "gemini-3-pro-image-preview",  # 预热时 GET 一次该模型的元数据，建立 TLS 连接
+    "idle_rewarm_s": 240,                    # 空闲这么久之后重新预热一次
+    "check_interval_s": 30,                  # 后台线程的检查间隔
+}
+
+
+def load_warmup_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "warmup" 段：
+    {"warmup": {"enabled": true, "model": "gemini-3-pro-image-preview", "idle_rewarm_s": 240}}
+    """
+    return _load_section("warmup", DEFAULT_WARMUP_CONFIG)
+
+
+# 熔断 / 回退路由默认值（config.json 的 "routing" 段可覆盖）
+DEFAULT_ROUTING_CONFIG: Dict[str, Any] = {
+    "fallback_enabled": True,
+    "fallbacks": {
+        "gemini-3-pro-image-preview": ["gemini-3.1-flash-image-preview"],
+    },
+    "breaker": {
+        "window_s": 60,             # 统计窗口
+        "min_requests": 4,          # 窗口内至少这么多请求才按失败率判断
+        "failure_rate": 0.5,        # 失败率阈值
+        "consecutive_failures": 3,  # 连续失败次数阈值
+        "open_s": 60,               # 熔断后多久放探测请求
+    },
+}
+
+
+def load_routing_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "routing" 段：
+    {"routing": {"fallback_enabled": true,
+                 "fallbacks": {"gemini-3-pro-image-preview": ["gemini-3.1-flash-image-preview"]},
+                 "breaker": {"failure_rate": 0.5, "open_s": 60}}}
+    """
+    cfg = copy.deepcopy(DEFAULT_ROUTING_CONFIG)
+    section = _config_section("routing")
+    try:
+        if "fallback_enabled" in section:
+            cfg["fallback_enabled"] = bool(section["fallback_enabled"])
+        if isinstance(section.get("fallbacks"), dict):
+            cfg["fallbacks"] = {str(k): [str(m) for m in v] for k, v in section["fallbacks"].items()}
+        if isinstance(section.get("breaker"), dict):
+            cfg["breaker"].update({k: v for k, v in section["breaker"].items() if k in cfg["breaker"]})
+    except Exception as e:
+        print(f"[WARN] 读取 routing 配置失败：{e}")
+    return cfg
+
+
+# 显式上下文缓存默认值（config.json 的 "context_cache" 段可覆盖；对话页的开关决定是否使用）
+DEFAULT_CONTEXT_CACHE_CONFIG: Dict[str, Any] = {
+    "ttl_s": 3600,          # 缓存 TTL，临近过期且仍在使用时自动续期
+    "min_messages": 4,      # 历史达到这么多条消息才建缓存
+    "refresh_after": 6,     # 缓存之后又新增这么多条消息时重建
+    "renew_before_s": 300,  # 剩余 TTL 不足这么多秒时续期
+    "backend": "genai",     # "local" = 进程内替身，不发请求（测试 / 离线调试）
+}
+
+
+def load_context_cache_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "context_cache" 段：
+    {"context_cache": {"ttl_s": 3600, "min_messages": 4, "refresh_after": 6}}
+    """
+    return _load_section("context_cache", DEFAULT_CONTEXT_CACHE_CONFIG)
+
+
+# 发送前预检默认值（config.json 的 "preflight" 段可覆盖）
+DEFAULT_PREFLIGHT_CONFIG: Dict[str, Any] = {
+    "enabled": True,
+    "mode": "trim",         # "trim" = 超限时丢弃最早的历史；"reject" = 直接拒绝
+    "margin": 0.95,         # 只用到模型输入上限的这个比例
+    "verify": False,        # 估算接近上限时调用 count_tokens 复核
+    "verify_above": 0.8,
+    "max_request_mb": 20,   # 内联数据上限
+    "limits": {},           # 覆盖各模型的输入 token 上限
+}
+
+
+def load_preflight_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "preflight" 段：
+    {"preflight": {"mode": "trim", "verify": true, "limits": {"gemini-3-pro-image-preview": 65536}}}
+    """
+    return _load_section("preflight", DEFAULT_PREFLIGHT_CONFIG)
+
+
+# 输出目录配额与 LRU 清理默认值（config.json 的 "storage" 段可覆盖，dirs 按目录合并）
+DEFAULT_STORAGE_CONFIG: Dict[str, Any] = {
+    "enabled": True,
+    "interval_s": 300,          # 后台清理间隔
+    "dirs": {                   # 嵌套目录归属最深的配置；max_mb / max_age_days 为 0 表示不限
+        "outputs": {"max_mb": 20480, "max_age_days": 0},
+        "outputs/gif": {"max_mb": 5120, "max_age_days": 30},
+        "exports": {"max_mb": 5120, "max_age_days": 0, "unit": "dir"},
+    },
+    "min_free_mb": 2048,        # 磁盘剩余空间低于此值时跨目录额外清理
+    "grace_s": 600,             # 这么多秒内写入的文件不删
+    "hold_ttl_s": 86400,        # 会话引用的文件保留时长
+    "pins_path": "storage_pins.json",
+    "max_dirs_per_pass": 200,   # 每轮最多重新列举的目录数
+}
+
+
+def load_storage_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "storage" 段：
+    {"storage": {"dirs": {"outputs": {"max_mb": 10240}, "outputs/gif": {"max_age_days": 7}}, "min_free_mb": 4096}}
+    """
+    cfg = _load_section("storage", {k: v for k, v in DEFAULT_STORAGE_CONFIG.items() if k != "dirs"})
+    cfg["dirs"] = copy.deepcopy(DEFAULT_STORAGE_CONFIG["dirs"])
+    dirs = _config_section("storage").get("dirs")
+    for path, spec in (dirs.items() if isinstance(dirs, dict) else ()):
+        if isinstance(spec, dict):
+            cfg["dirs"].setdefault(path, {}).update(spec)
+        elif spec is None:
+            cfg["dirs"].pop(path, None)  # null 表示不再管理该目录
+    return cfg
+
+
+# 输出图片的 Web 友好变体默认值（config.json 的 "variants" 段可覆盖，variants 整体替换）
+DEFAULT_VARIANTS_CONFIG: Dict[str, Any] = {
+    "enabled": True,
+    "variants": {   # 变体名 -> 格式（webp / avif / jpeg）、质量、长边上限（0 = 原尺寸）
+        "web": {"format": "webp", "quality": 85, "max_side": 2048},
+        "thumb": {"format": "webp", "quality": 75, "max_side": 512},
+    },
+    "max_backlog": 64,      # 排队超过这么多张时跳过新图
+    "cold_dir": "",         # 冷存储目录；为空表示不迁移原图
+    "cold_after_days": 0,   # 有变体且超过这么多天的原图迁到 cold_dir
+    "cold_roots": ["outputs"],
+}
+
+
+def load_variants_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "variants" 段：
+    {"variants": {"variants": {"web": {"format": "avif", "quality": 60, "max_side": 2048}}, "cold_dir": "D:/cold", "cold_after_days": 30}}
+    """
+    return _load_section("variants", DEFAULT_VARIANTS_CONFIG)
+
+
+# 队列结果近似重复检测默认值（config.json 的 "dedupe" 段可覆盖）
+DEFAULT_DEDUPE_CONFIG: Dict[str, Any] = {
+    "enabled": True,
+    "threshold": 10,        # 感知哈希（64 位）汉明距离不超过该值视为近似重复
+    "history_size": 200,    # 每个会话保留的历史哈希数，新结果也与之比较
+    "converge_after": 2,    # 开启“收敛时提前停止”后，连续这么多张重复即停止
+}
+
+
+def load_dedupe_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "dedupe" 段：
+    {"dedupe": {"threshold": 6, "converge_after": 3}}
+    """
+    return _load_section("dedupe", DEFAULT_DEDUPE_CONFIG)
+
+
+# 精灵图批量转换的输入限制（config.json 的 "sprite_batch" 段可覆盖）
+DEFAULT_SPRITE_BATCH_CONFIG: Dict[str, Any] = {
+    "input_roots": [],       # 允许按路径读取的服务器目录；为空时不接受目录 / zip 路径输入
+    "max_files": 2000,       # 一次最多收集的图片数
+    "max_zip_member_mb": 64, # zip 中单张图片解压后的上限
+    "max_zip_mb": 1024,      # 单个 zip 解压后的总上限
+}
+
+
+def load_sprite_batch_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "sprite_batch" 段：
+    {"sprite_batch": {"input_roots": ["D:/sprites", "/data/sprites"], "max_zip_mb": 512}}
+    """
+    return _load_section("sprite_batch", DEFAULT_SPRITE_BATCH_CONFIG)
+
+
+# 无头 HTTP API 的输入限制（config.json 的 "headless" 段可覆盖）
+DEFAULT_HEADLESS_CONFIG: Dict[str, Any] = {
+    "input_roots": [],  # 任务 images / history[].images 允许引用的服务器目录；为空时 HTTP API 不接受图片路径
+}
+
+
+def load_headless_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "headless" 段：
+    {"headless": {"input_roots": ["/data/refs", "outputs"]}}
+    """
+    return _load_section("headless", DEFAULT_HEADLESS_CONFIG)
+
+
+def load_retry_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "retry" 段（按错误类别覆盖 banana.retry.DEFAULT_RETRY_RULES）：
+    {"retry": {"max_elapsed_s": 300, "rules": {"rate_limit": {"max_attempts": 6, "base_delay": 5}}}}
+    """
+    cfg: Dict[str, Any] = {"rules": {}, "max_elapsed_s": 300.0}
+    section = _config_section("retry")
+    if isinstance(section.get("rules"), dict):
+        cfg["rules"] = copy.deepcopy(section["rules"])
+    if isinstance(section.get("max_elapsed_s"), (int, float)):
+        cfg["max_elapsed_s"] = float(section["max_elapsed_s"])
+    return cfg
+
+
+def load_budget_config() -> Dict[str, Any]:
+    """
+    读取 config.json 中的 "budgets" 段（美元），每次预算检查时调用；文件没变时不重新解析，改完配置即时生效：
+    {"budgets": {"session": {"soft": 1, "hard": 5}, "task": {"hard": 2}, "daily": {"soft": 20, "hard": 50}}}
+    """
+    return copy.deepcopy(_config_section("budgets"))
+
+
+# resolve_request_timeout 的合并结果：(read_config() 返回的对象, 超时表)
+_timeouts_cache: Tuple[Dict[str, Any], Dict[str, Dict[str, float]]] | None = None
+
+
+def resolve_request_timeout(model_name: str, image_size: str | None = None) -> float:
+    """
+    根据模型和图像尺寸查找截止时间；找不到时依次退回模型默认值 / 全局 "*" / DEFAULT_REQUEST_TIMEOUT
+    合并后的超时表按 config.json 的缓存内容复用，文件没变时不重新合并
+    """
+    global _timeouts_cache
+    config = read_config()
+    cached = _timeouts_cache
+    if cached is not None and cached[0] is config:
+        table = cached[1]
+    else:
+        table = load_request_timeouts()
+        _timeouts_cache = (config, table)
+    per_model = table.get(model_name) or table.get("*") or {}
+    if image_size and image_size in per_model:
+        return float(per_model[image_size])
+    return float(per_model.get("default", DEFAULT_REQUEST_TIMEOUT))
+
+
+# ========== 工具函数：client & 参数构造 ==========
+def create_client(explicit_key: str | None = None, project: str | None = None, location: str = "global") -> genai.Client:
+    """
+    创建 Client。
+    策略：优先尝试 Vertex AI (Project ID) -> 失败则降级到 AI Studio (API Key)。
+    """
+    from google import genai
+
+    # 获取环境中的配置
+    project_id = project or os.environ.get("GOOGLE_CLOUD_PROJECT")
+    api_key = explicit_key or os.environ.get("GOOGLE_CLOUD_API_KEY")
+
+    # === 尝试 1: Vertex AI ===
+    if project_id:
+        try:
+            # print(f"[DEBUG] 尝试连接 Vertex AI (Project: {project_id})...")
+            return genai.Client(
+                vertexai=True,
+                project=project_id,
+                location=location
+            )
+        except Exception as e:
+            print(f"[WARN] Vertex AI Client 初始化失败 ({e})，尝试降级到 API Key 模式...")
+    
+    # === 尝试 2: API Key (AI Studio) ===
+    # 跑到这里说明：要么没 Project ID，要么 Vertex 初始化挂了 
+    if api_key:
+        print("[INFO] 使用 API Key 模式 (AI Studio)")
+        return genai.Client(
+            vertexai=False,
+            api_key=api_key
+        )
+    
+    # === 彻底失败 ===
+    raise RuntimeError(
+        "❌ 无法创建 Client：既没有有效的 Vertex Project ID，也没有可用的 API Key。\n"
+        "请检查根目录下是否存在 'GOOGLE_CLOUD_API_KEY.json' 或 'GOOGLE_CLOUD_API_KEY.txt'。"
+    )
+    
+# ========== Client 池 ==========
+# genai.Client 创建时要解析凭证、建立 HTTP 连接池，按 (key, project, location) 复用，
+# 主程序、插件和无头入口共享同一批 Client
+_client_pool: Dict[Tuple[str, str, str], genai.Client] = {}
+_client_pool_lock = threading.Lock()
+
+
+def get_client(explicit_key: str | None = None, project: str | None = None, location: str = "global") -> genai.Client:
+    """
+    从 Client 池取一个 Client，没有则调用 create_client 创建并缓存
+    """
+    key = (
+        explicit_key or os.environ.get("GOOGLE_CLOUD_API_KEY") or "",
+        project or os.environ.get("GOOGLE_CLOUD_PROJECT") or "",
+        location,
+    )
+    with _client_pool_lock:
+        client = _client_pool.get(key)
+        if client is None:
+            client = create_client(explicit_key, project=project, location=location)
+            _client_pool[key] = client
+        return client
+
+
+def ui_aspect_to_vertex(value: str) -> str:
+    """
+    将 UI 显示的 '1:1 (Square)' 转成 Vertex 接受的 '1:1'
+    """
+    if not value:
+        return "1:1"
+    if value.startswith("1:1"):
+        return "1:1"
+    if value.startswith("3:2"):
+        return "3:2"
+    if value.startswith("2:3"):
+        return "2:3"
+    if value.startswith("3:4"):
+        return "3:4"
+    if value.startswith("4:3"):
+        return "4:3"
+    if value.startswith("4:5"):
+        return "4:5"
+    if value.startswith("5:4"):
+        return "5:4"
+    if value.startswith("16:9"):
+        return "16:9"
+    if value.startswith("9:16"):
+        return "9:16"
+    if value.startswith("21:9"):
+        return "21:9"
+    return "1:1"
+
+
+def build_generate_config(
+    temperature: float,
+    top_p: float,
+    top_k: int,
+    max_output_tokens: int,
+    aspect_ratio_ui: str,
+    image_size_ui: str,
+    want_image: bool,
+    want_thinking: bool,
+    want_search: bool,
+    timeout: float | None = None,
+    candidate_count: int = 1,
+    cached_content: str | None = None,
+) -> types.GenerateContentConfig:
+    """
+    构造 GenerateContentConfig。
+
+    - 文本模型：只设置采样参数 + 关掉安全过滤
+    - 图像模型：加上 response_modalities + ImageConfig(aspect_ratio, image_size)
+    - 思考模型：尝试加上 ThinkingConfig(thinking_level="HIGH")，如果 SDK 不支持会自动忽略
+    - timeout（秒）：写入 HttpOptions，让 SDK 层面的 HTTP 请求也会在截止时间后断开
+    - candidate_count > 1：一次请求返回多个候选（模型不支持时服务端返回 400）
+    - cached_content：显式上下文缓存名（系统指令已在缓存里）
+    """
+    from google.genai import types
+
+    safety_settings = [
+        types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
+        types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
+        types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
+        types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
+    ]
+
+    cfg_kwargs: Dict[str, Any] = dict(
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        max_output_tokens=max_output_tokens,
+        safety_settings=safety_settings,
+    )
+    if timeout:
+        cfg_kwargs["http_options"] = types.HttpOptions(timeout=int(timeout * 1000))
+    if candidate_count and candidate_count > 1:
+        cfg_kwargs["candidate_count"] = int(candidate_count)
+    if cached_content:
+        cfg_kwargs["cached_content"] = cached_content
+    # === Google Search / Grounding ===
+    if want_search:
+        cfg_kwargs["tools"] = [{"google_search": {}}]
+
+    # === 图像模型：参考 Nano-Banana Pro 示例，带上 aspect_ratio + image_size ===
+    if want_image:
+        aspect_ratio = ui_aspect_to_vertex(aspect_ratio_ui)
+        image_size = image_size_ui or "1K"
+        
+        # --- 新增：人物生成参数 ---
+        # "allow_all" = Allow (All ages)
+        # "allow_adult" = Allow (Adults only)
+        # "dont_allow" = Don't allow
+        person_generation = "allow_all" 
+
+        try:
+            img_cfg = types.ImageConfig(
+                aspect_ratio=aspect_ratio,
+                image_size=image_size,
+                # person_generation=person_generation, # <--- 加上这一行！
+            )
+        except Exception as e:
+            print(f"[WARN] 当前 ImageConfig 不支持高级参数，退回基础配置：{e}")
+            img_cfg = types.ImageConfig(aspect_ratio=aspect_ratio)
+
+        cfg_kwargs["response_modalities"] = ["TEXT", "IMAGE"]
+        cfg_kwargs["image_config"] = img_cfg
+
+    # === 思考模型：尝试加上 thinking_config ===
+    if want_thinking:
+        try:
+            # 修改：去掉不支持的 thinking_level 参数，只实例化对象
+            # 如果新版 SDK 需要 include_thoughts=True，通常是在 generate_content 的调用里，而不是 Config 里
+            # 这里先设为空配置，或者根据你的 SDK 版本查阅文档。
+            # 为了防止报错，我们先传入一个空字典或最基础的配置
+            thinking_cfg = types.ThinkingConfig(include_thoughts=True) 
+            cfg_kwargs["thinking_config"] = thinking_cfg
+        except Exception as e:
+            print(f"[WARN] ThinkingConfig 配置出错，已忽略：{e}")
+
+    return types.GenerateContentConfig(**cfg_kwargs)
+
+
+def file_to_image_part(path: str) -> types.Part:
+    """
+    将本地文件路径转换为 Part，用于图片输入。
+    类似 Vertex 示例里的 Part.from_uri，只是我们这里是本地文件。
+    历史里的生成图可能已迁到冷存储，按变体清单找到原图的当前位置。
+    """
+    from google.genai import types
+
+    path = resolve_original(str(path))
+    mime, _ = mimetypes.guess_type(path)
+    if not mime:
+        # 默认 png
+        mime = "image/png"
+    with open(path, "rb") as f:
+        data = f.read()
+    return types.Part.from_bytes(data=data, mime_type=mime)
+
+
+def messages_to_contents(messages: List[Dict[str, Any]]) -> List[types.Content]:
+    """
+    把 raw_messages（{"role", "text", "images"}）转换成 Content 列表；读不到的图片跳过
+    """
+    from google.genai import types
+
+    contents: List[types.Content] = []
+    for msg in messages:
+        parts = []
+        if msg.get("text"): parts.append(types.Part.from_text(text=msg.get("text")))
+        for img in msg.get("images", []):
+            try: parts.append(file_to_image_part(img))
+            except: continue
+        if parts: contents.append(types.Content(role="user" if msg.get("role")=="user" else "model", parts=parts))
+    return contents
+
+# ========== 多候选支持 ==========
+# 不支持 candidate_count > 1 的模型：第一次带多候选请求因 candidate_count 被 400 拒绝后记下来，之后直接改为并行多次请求
+_single_candidate_models: set = set()
+
+# 4xx 错误信息里指向多候选参数的说法（INVALID_ARGUMENT: "candidateCount must be 1" / "Multiple candidates is not enabled"）
+_CANDIDATE_COUNT_ERROR = re.compile(r"candidate[_\s]*count|multiple\s+candidates", re.IGNORECASE)
+
+
+def supports_candidate_count(model_name: str) -> bool:
+    return model_name not in _single_candidate_models
+
+
+def is_candidate_count_error(exc: BaseException) -> bool:
+    """参数错误且明确是因为 candidate_count（其他 4xx 是请求本身的问题，改成并行单候选也会同样失败）"""
+    return classify_error(exc) == ERR_INVALID and bool(_CANDIDATE_COUNT_ERROR.search(str(exc)))
+
+
+def mark_single_candidate(model_name: str) -> None:
+    if model_name not in _single_candidate_models:
+        _single_candidate_models.add(model_name)
+        print(f"[INFO] 模型 {model_name} 不支持多候选，之后改为并行请求")
+
+# ========== 主业务逻辑：调用 Gemini（Vertex AI） ==========
+def call_gemini_vertex(
+    api_key: str,
+    model_name: str,
+    history_messages: List[Dict[str, Any]],
+    user_text: str,
+    user_images: List[str],
+    aspect_ratio: str,
+    image_size: str,
+    system_instruction: str,
+    temperature: float,
+    top_p: float,
+    top_k: int,
+    max_output_tokens: int,
+    enable_search: bool,
+    timeout: float | None = None,
+    cancel_token=None,
+    usage_tags: Dict[str, Any] | None = None,
+    output_dir: str | Path | None = None,
+    candidate_count: int = 1,
+    context_cache_key: str | None = None,
+) -> Tuple[str, List[str]]:  # <--- 修改返回值类型提示
+    """
+    修改后：返回 (文本内容, 生成的图片路径列表)
+
+    timeout: 截止时间（秒），None 表示按 resolve_request_timeout 查表
+    cancel_token: banana.cancellation.CancelToken，被取消时抛出 CancelledError
+    usage_tags: 记账标签 {session_id, flow, task_id, source}，响应里的 usage_metadata 会记入用量账本
+    output_dir: 图片保存目录，默认 OUTPUT_DIR
+    candidate_count: 一次请求的候选数；所有候选中的文本和图片都会解析出来
+    context_cache_key: 对话标识；给出时把系统指令和较早的历史放进显式上下文缓存（banana.context_cache），
+        本轮只发送缓存之后的消息。开启 Google Search 时不使用缓存（tools 需要写进缓存本身），
+        预检需要裁掉最早的历史时也不使用（前缀每轮都在变，缓存无法命中）
+
+    发送前按 banana.preflight 估算输入大小：超限时裁掉最早的历史并在回复末尾注明，
+    或（mode="reject" / 本轮消息本身超限）抛出 PreflightError
+    """
+    from google.genai import types
+
+    mark_activity()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    if timeout is None:
+        timeout = resolve_request_timeout(model_name, image_size)
+
+    # 1) 从 Client 池获取 client (确保 location="global")
+    client = get_client(api_key, location="global")
+
+    # 2) 预检：估算输入 token / 上传大小，超限时裁掉最早的历史（或按配置直接拒绝，抛出 PreflightError）
+    use_cache = bool(context_cache_key) and not enable_search
+    preflight = get_preflight()
+    trimmed = 0
+    if preflight.enabled:
+        def _count_tokens(dropped: int) -> int:
+            full = [types.Content(role="system", parts=[types.Part.from_text(text=system_instruction.strip())])] if system_instruction.strip() else []
+            full += messages_to_contents(history_messages[dropped:])
+            full += messages_to_contents([{"role": "user", "text": user_text, "images": user_images}])
+            return client.models.count_tokens(model=model_name, contents=full).total_tokens
+
+        # peek 与 prepare 都基于完整历史：缓存只覆盖未裁剪的前缀
+        inline_from = get_context_cache().peek(context_cache_key, model_name, system_instruction, history_messages) if use_cache else 0
+        check = preflight.check(
+            model_name, system_instruction, history_messages, user_text, user_images,
+            inline_from=inline_from, count_fn=_count_tokens,
+        )
+        if check.dropped and use_cache:
+            # 裁掉最早的历史后前缀每轮都在变，缓存永远命中不了，只会每轮新建：本轮不用缓存，
+            # 原本在缓存里的消息改为随请求上传，按不走缓存重新预检
+            use_cache = False
+            if inline_from:
+                check = preflight.check(
+                    model_name, system_instruction, history_messages, user_text, user_images,
+                    count_fn=_count_tokens,
+                )
+        if check.dropped:
+            trimmed = check.dropped
+            history_messages = history_messages[trimmed:]
+            print(f"[WARN] 输入超出 {model_name} 上限，已省略最早的 {trimmed} 条历史（剩余约 {check.tokens} tokens）")
+
+    # 3) 组装 contents
+    # 使用上下文缓存时，系统指令和前 cache_entry.covered 条历史已在服务端，只发送其后的消息
+    cache_entry = None
+    if use_cache:
+        cache_entry = get_context_cache().prepare(
+            context_cache_key, model_name, system_instruction, history_messages,
+            build_contents=messages_to_contents, backend=GenaiCacheBackend(client),
+        )
+
+    def _build_contents(entry) -> List[types.Content]:
+        contents: List[types.Content] = []
+        if entry is None and system_instruction.strip():
+            contents.append(types.Content(role="system", parts=[types.Part.from_text(text=system_instruction.strip())]))
+        contents.extend(messages_to_contents(history_messages[entry.covered:] if entry else history_messages))
+
+        current_parts = []
+        if user_text: current_parts.append(types.Part.from_text(text=user_text))
+        for img in user_images:
+            try: current_parts.append(file_to_image_part(img))
+            except: continue
+        if current_parts: contents.append(types.Content(role="user", parts=current_parts))
+        return contents
+
+    contents = _build_contents(cache_entry)
+
+    # 4) 构造 Config
+    image_models = {"gemini-2.5-flash-image", "gemini-3-pro-image-preview", "gemini-3.1-flash-image-preview"}
+    want_image = model_name in image_models
+    want_thinking = ( "gemini-3.1-pro-preview" or "gemini-3-flash-preview" ) in model_name or "thinking" in model_name.lower() # 稍微放宽判断
+
+    def _build_config(entry) -> types.GenerateContentConfig:
+        return build_generate_config(
+            temperature=temperature, top_p=top_p, top_k=top_k, max_output_tokens=max_output_tokens,
+            aspect_ratio_ui=aspect_ratio, image_size_ui=image_size,
+            want_image=want_image, want_thinking=want_thinking,
+            want_search=bool(enable_search),
+            timeout=timeout,
+            candidate_count=candidate_count,
+            cached_content=entry.name if entry else None,
+        )
+
+    generate_config = _build_config(cache_entry)
+    
+    _debug_print_send(
+        model_name=model_name,
+        system_instruction=system_instruction,
+        user_text=user_text,
+        image_files=user_images,
+        generate_config=generate_config,
+    )
+
+# 5) 调用
+    def _record_abandoned(resp) -> None:
+        # 超时 / 取消后仍跑完的请求服务端照常计费，补记用量（此时还没有解析 / 保存图片，无需清理）
+        images = sum(
+            1
+            for cand in getattr(resp, "candidates", None) or []
+            for part in getattr(getattr(cand, "content", None), "parts", None) or []
+            if not getattr(part, "text", None) and not getattr(part, "thought", None)
+            and (getattr(part, "inline_data", None) is not None or callable(getattr(part, "as_image", None)))
+        )
+        get_ledger().record(
+            model=model_name, image_size=image_size if want_image else "",
+            usage=usage_from_response(resp), images=images,
+            **{**(usage_tags or {}), "source": f"{(usage_tags or {}).get('source', '')}:abandoned"},
+        )
+        print(f"[WARN] 已放弃的 {model_name} 请求仍然返回，已补记用量（{images} 张图）")
+
+    def _send(contents, generate_config):
+        # HTTP 层超时之外再留一点余量；被放弃的调用最长跑到 HttpOptions 超时，返回后补记用量
+        return run_with_deadline(
+            lambda: client.models.generate_content(
+                model=model_name,
+                contents=contents if len(contents) > 1 else (contents[0] if contents else user_text),
+                config=generate_config,
+            ),
+            timeout=timeout + 5 if timeout else None,
+            token=cancel_token,
+            on_abandoned=_record_abandoned,
+        )
+
+    try:
+        try:
+            response = _send(contents, generate_config)
+        except (CancelledError, DeadlineExceededError):
+            raise
+        except Exception as e:
+            if cache_entry is None or classify_error(e) != ERR_INVALID:
+                raise
+            # 缓存可能已在服务端被删除 / 过期：作废后不带缓存重发一次
+            print(f"[WARN] 带上下文缓存的请求被拒绝，改为完整发送：{e}")
+            get_context_cache().invalidate(context_cache_key, model_name)
+            response = _send(_build_contents(None), _build_config(None))
+    except (CancelledError, DeadlineExceededError):
+        raise
+    except Exception as e:
+        # 原样抛出：保留 APIError 的 code / status，交给 banana.errors 分类、banana.retry 决定是否重试
+        print(f"[ERROR] 调用 Vertex Gemini 失败：{type(e).__name__}: {e}")
+        raise
+
+    # 6) 解析结果 (🛠️ 增强调试版)
+    _debug_print_recv(response) # 打印响应
+
+    def _record_usage(n_images: int) -> None:
+        # 被拦截的请求同样计费，所以每条返回路径都要记账
+        try:
+            get_ledger().record(
+                model=model_name, image_size=image_size if want_image else "",
+                usage=usage_from_response(response), images=n_images,
+                **(usage_tags or {}),
+            )
+        except Exception as e:
+            print(f"[WARN] 用量记账失败：{e}")
+
+    text_chunks = []
+    generated_images = []
+
+    # 先检查有没有 candidates
+    if not hasattr(response, "candidates") or not response.candidates:
+        _record_usage(0)
+        # 这种情况通常是 prompt_feedback 直接拦截了
+        feedback = getattr(response, "prompt_feedback", "无反馈信息")
+        return f"⚠️ 模型未返回任何候选结果 (Blocked)。\n反馈信息: {feedback}", []
+
+    first_candidate = response.candidates[0]
+    finish_reason = getattr(first_candidate, "finish_reason", "UNKNOWN")
+    multi = len(response.candidates) > 1
+
+    # 提取每个候选的 Parts (文本和图片)
+    # response.text / response.parts 只覆盖第一个候选，这里逐个候选遍历
+    for idx, candidate in enumerate(response.candidates, 1):
+        content = getattr(candidate, "content", None)
+        cand_texts = []
+        for part in getattr(content, "parts", None) or []:
+            if getattr(part, "thought", None): continue
+            if getattr(part, "text", None):
+                cand_texts.append(part.text)
+                continue
+            
+            # 处理图片
+            as_image = getattr(part, "as_image", None)
+            if callable(as_image):
+                img = as_image()
+                if img is not None:
+                    out_dir = Path(output_dir or OUTPUT_DIR)
+                    out_dir.mkdir(parents=True, exist_ok=True)
+                    # 并发请求可能落在同一毫秒，追加随机后缀避免互相覆盖
+                    filename = f"{model_name}_{int(time.time()*1000)}_{uuid.uuid4().hex[:6]}.png"
+                    out_path = out_dir / filename
+                    saved = False
+                    try:
+                        img.save(out_path)
+                        saved = True
+                    except OSError as e:
+                        # 磁盘已满：立即按配额清理一轮后重试一次，仍失败则丢弃这张图
+                        if is_disk_full(e) and get_storage().reclaim_now():
+                            try:
+                                img.save(out_path)
+                                saved = True
+                            except Exception as retry_err:
+                                print(f"[WARN] 清理磁盘后保存生成的图片仍失败：{retry_err}")
+                        else:
+                            print(f"[WARN] 保存生成的图片失败：{e}")
+                    except Exception as e:
+                        print(f"[WARN] 保存生成的图片失败：{e}")
+                    if saved:
+                        generated_images.append(str(out_path))
+                        # 后台进程池生成 WebP 等变体，不阻塞本次返回
+                        get_transcoder().submit(str(out_path))
+        cand_text = "\n".join(t.strip() for t in cand_texts if t.strip())
+        if cand_text:
+            text_chunks.append(f"**候选 {idx}**\n{cand_text}" if multi else cand_text)
+
+    final_text = "\n".join(t.strip() for t in text_chunks if t.strip())
+    _record_usage(len(generated_images))
+    
+    # 🛠️ 关键修改：如果什么都没拿到，检查 Finish Reason
+    if not final_text and not generated_images:
+        # 如果是因为安全原因被拦截
+        if "SAFETY" in str(finish_reason):
+            return f"🛡️ 内容被安全策略拦截 (Finish Reason: {finish_reason})。\n请尝试修改提示词或图片。", []
+        # 如果是其他原因
+        elif finish_reason != "STOP":
+             return f"⚠️ 模型停止生成，但未返回内容 (Finish Reason: {finish_reason})。\n这通常是因为输入了两张图但没有提供足够的文字指令，或者模型对多图输入感到困惑。", []
+        else:
+             return "⚠️ API 返回成功 (STOP)，但内容为空。这可能是 Vertex AI 的临时故障或模型输出了空字符串。", []
+
+    # 如果只有图没有字，给个提示
+    if not final_text and generated_images:
+        final_text = "✅ 图像已生成（见下方）"
+    if trimmed:
+        final_text += f"\n\n（对话过长，本轮省略了最早的 {trimmed} 条历史）"
+
+    return final_text, generated_images
@@ -0,0 +1,233 @@
+# 队列结果的近似重复检测（感知哈希，纯 NumPy 向量化）
+# - 每张结果缩到 32x32 灰度做二维 DCT，取左上 8x8 低频（去掉直流分量）与中位数比较，得到 64 位 pHash；
+#   汉明距离不超过 threshold 视为近似重复（缩放 / 重新压缩 / 轻微噪声基本不影响哈希）
+# - 同一任务内按出现顺序聚类：新结果归入最近的已有簇，否则自成一簇，簇的第一张为代表
+# - 另按会话保留最近 history_size 个哈希，新结果也与之前任务的结果比较（只提示，不参与聚类）
+# - 连续 converge_after 张都与本任务之前的结果重复时视为“输出已收敛”，队列可据此提前停止
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# 哈希前缩放到的边长 / 保留的低频边长（64 位）
+HASH_IMAGE_SIDE = 32
+HASH_BITS_SIDE = 8
+# 最多保留这么多个会话的历史哈希
+MAX_HISTORY_SCOPES = 256
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """正交 DCT-II 矩阵：D @ x 为 x 的一维 DCT"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d
+
+
+_DCT = _dct_matrix(HASH_IMAGE_SIDE)
+# 逐字节的 1 的个数，用于向量化求汉明距离
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def phash_array(gray: np.ndarray) -> int:
+    """HASH_IMAGE_SIDE x HASH_IMAGE_SIDE 灰度数组 -> 64 位感知哈希"""
+    coeffs = _DCT @ gray.astype(np.float64) @ _DCT.T
+    low = coeffs[:HASH_BITS_SIDE, :HASH_BITS_SIDE].ravel()
+    bits = low > np.median(low[1:])
+    bits[0] = False  # 直流分量只反映整体亮度
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def phash_image(path: str) -> int:
+    """读图并计算感知哈希；JPEG 按 draft 直接以低分辨率解码"""
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft("L", (HASH_IMAGE_SIDE * 4, HASH_IMAGE_SIDE * 4))
+        small = img.convert("L").resize((HASH_IMAGE_SIDE, HASH_IMAGE_SIDE), Image.BOX)
+    return phash_array(np.asarray(small))
+
+
+def hamming(value: int, others: np.ndarray) -> np.ndarray:
+    """value 与 others（uint64 数组）中每个哈希的汉明距离"""
+    if not len(others):
+        return np.zeros(0, dtype=np.int64)
+    x = np.bitwise_xor(others, np.uint64(value))
+    return _POPCOUNT[x.view(np.uint8)].reshape(len(others), 8).sum(axis=1, dtype=np.int64)
+
+
+class HashHistory:
+    """按会话保留最近的结果哈希（环形缓冲），供新结果与之前任务的结果比较"""
+
+    def __init__(self, size: int = 200):
+        self.size = max(0, int(size))
+        self._scopes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def nearest(self, scope: str, value: int, exclude_task: str = "") -> Optional[Dict[str, Any]]:
+        """该会话历史中（不含 exclude_task）距离最近的一项 {"path", "task_id", "distance"}；没有历史时返回 None"""
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None or not entry["count"]:
+                return None
+            n = entry["count"]
+            dist = hamming(value, entry["hashes"][:n])
+            if exclude_task:
+                dist = np.where(np.array(entry["tasks"][:n]) == exclude_task, 65, dist)
+            i = int(dist.argmin())
+            if dist[i] > 64:
+                return None
+            return {"path": entry["paths"][i], "task_id": entry["tasks"][i], "distance": int(dist[i])}
+
+    def add(self, scope: str, value: int, path: str, task_id: str = "") -> None:
+        if not self.size:
+            return
+        with self._lock:
+            entry = self._scopes.get(scope)
+            if entry is None:
+                entry = {"hashes": np.zeros(self.size, dtype=np.uint64), "paths": [""] * self.size,
+                         "tasks": [""] * self.size, "next": 0, "count": 0}
+                self._scopes[scope] = entry
+                while len(self._scopes) > MAX_HISTORY_SCOPES:
+                    self._scopes.popitem(last=False)
+            else:
+                self._scopes.move_to_end(scope)
+            i = entry["next"]
+            entry["hashes"][i] = np.uint64(value)
+            entry["paths"][i] = path
+            entry["tasks"][i] = task_id
+            entry["next"] = (i + 1) % self.size
+            entry["count"] = min(self.size, entry["count"] + 1)
+
+
+class DuplicateTracker:
+    """
+    一个队列任务内的近似重复聚类。add(path) 返回该结果的信息：
+    {"hash", "cluster"（簇代表的路径）, "duplicate_of"（重复时为簇代表，否则为空）, "distance", "history"（与之前任务重复时为那张图）}
+    """
+
+    def __init__(
+        self,
+        threshold: int = 10,
+        converge_after: int = 0,
+        history: Optional[HashHistory] = None,
+        scope: str = "",
+        task_id: str = "",
+    ):
+        self.threshold = int(threshold)
+        self.converge_after = max(0, int(converge_after))
+        self.history = history
+        self.scope = scope
+        self.task_id = task_id
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._reps: List[str] = []
+        self._rep_hashes = np.zeros(0, dtype=np.uint64)
+        self._streak = 0
+        self._lock = threading.Lock()
+
+    def add(self, path: str) -> Dict[str, Any]:
+        with self._lock:
+            if path in self._info:
+                return self._info[path]
+        try:
+            from banana.variants import pick_variant
+
+            # 有变体（如缩略图）时读最小的那个，原图已迁到冷存储也能找到
+            value = phash_image(pick_variant(path, min_side=0))
+        except Exception as e:
+            print(f"[WARN] 计算感知哈希失败 {path}: {e}")
+            return {"hash": None, "cluster": path, "duplicate_of": "", "distance": 0, "history": ""}
+
+        seen = None
+        if self.history is not None:
+            seen = self.history.nearest(self.scope, value, exclude_task=self.task_id)
+            self.history.add(self.scope, value, path, self.task_id)
+        with self._lock:
+            info = {"hash": value, "cluster": path, "duplicate_of": "", "distance": 0, "history": ""}
+            dist = hamming(value, self._rep_hashes)
+            if len(dist) and dist.min() <= self.threshold:
+                i = int(dist.argmin())
+                info.update(cluster=self._reps[i], duplicate_of=self._reps[i], distance=int(dist[i]))
+                self._streak += 1
+            else:
+                self._reps.append(path)
+                self._rep_hashes = np.append(self._rep_hashes, np.uint64(value))
+                self._streak = 0
+            if seen is not None and seen["distance"] <= self.threshold:
+                info["history"] = seen["path"]
+            self._info[path] = info
+            return info
+
+    def info(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._info.get(path)
+
+    @property
+    def converged(self) -> bool:
+        """最近连续 converge_after 张都与本任务之前的结果近似重复"""
+        return bool(self.converge_after) and self._streak >= self.converge_after
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "results": len(self._info),
+                "clusters": len(self._reps),
+                "duplicates": sum(1 for i in self._info.values() if i["duplicate_of"]),
+                "history": sum(1 for i in self._info.values() if i["history"]),
+            }
+
+
+def format_duplicate_summary(summary: Dict[str, int]) -> str:
+    if not summary["results"]:
+        return ""
+    text = f"♻️ {summary['results']} 张结果 / {summary['clusters']} 组不同画面"
+    if summary["duplicates"]:
+        text += f"，{summary['duplicates']} 张近似重复"
+    if summary["history"]:
+        text += f"，{summary['history']} 张与之前的任务近似"
+    return text
+
+
+_dedupe_config: Dict[str, Any] = {"enabled": True, "threshold": 10, "converge_after": 2}
+_history: Optional[HashHistory] = None
+_history_lock = threading.Lock()
+
+
+def configure_dedupe(
+    enabled: bool = True,
+    threshold: int = 10,
+    history_size: int = 200,
+    converge_after: int = 2,
+) -> HashHistory:
+    """按配置创建全局历史哈希表；threshold 为判定近似重复的最大汉明距离（0-64）"""
+    global _history
+    with _history_lock:
+        _dedupe_config.update(enabled=bool(enabled), threshold=max(0, min(64, int(threshold))),
+                              converge_after=max(0, int(converge_after)))
+        _history = HashHistory(history_size)
+        if enabled:
+            print(f"[INFO] 近似重复检测已启用：汉明距离 ≤ {_dedupe_config['threshold']}，每个会话保留 {_history.size} 个历史哈希")
+        return _history
+
+
+def get_hash_history() -> HashHistory:
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = HashHistory()
+        return _history
+
+
+def new_tracker(scope: str = "", task_id: str = "", early_stop: bool = False) -> Optional[DuplicateTracker]:
+    """按全局配置为一个队列任务创建聚类器；未启用时返回 None。early_stop 为 False 时不判断收敛"""
+    if not _dedupe_config["enabled"]:
+        return None
+    return DuplicateTracker(
+        threshold=_dedupe_config["threshold"],
+        converge_after=_dedupe_config["converge_after"] if early_stop else 0,
+        history=get_hash_history(),
+        scope=scope,
+        task_id=task_id,
+    )
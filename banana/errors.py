@@ -0,0 +1,116 @@
+# 错误分类：把 SDK / HTTP / 本地异常归到有限的几类，供重试策略（banana.retry）和熔断器（banana.routing）共用
+# 优先看 google.genai.errors.APIError 的 code / status，其次看 httpx 与标准库的网络异常类型，
+# 不再在 str(e) 里搜 "429" / "400"。
+import sys
+from typing import List, Optional
+
+from banana.cancellation import CancelledError, DeadlineExceededError
+
+ERR_RATE_LIMIT = "rate_limit"      # 429 / RESOURCE_EXHAUSTED
+ERR_UNAVAILABLE = "unavailable"    # 500 / 502 / 503，服务端过载或内部错误
+ERR_TIMEOUT = "timeout"            # 本地截止时间、408 / 504、HTTP 读超时
+ERR_NETWORK = "network"            # 连接失败、连接被重置等传输层错误
+ERR_CIRCUIT_OPEN = "circuit_open"  # 主模型与备选都在熔断
+ERR_INVALID = "invalid"            # 400 / 404 / 413 / 422，请求本身有问题
+ERR_AUTH = "auth"                  # 401 / 403，凭证或权限问题
+ERR_CANCELLED = "cancelled"        # 用户取消
+ERR_UNKNOWN = "unknown"
+
+ERROR_LABELS = {
+    ERR_RATE_LIMIT: "触发限流 (429)",
+    ERR_UNAVAILABLE: "服务端繁忙 (5xx)",
+    ERR_TIMEOUT: "请求超时",
+    ERR_NETWORK: "网络错误",
+    ERR_CIRCUIT_OPEN: "模型熔断中",
+    ERR_INVALID: "参数错误 (4xx)",
+    ERR_AUTH: "认证 / 权限错误",
+    ERR_CANCELLED: "已取消",
+    ERR_UNKNOWN: "未知错误",
+}
+
+# 计入熔断器的服务商侧故障
+PROVIDER_FAILURES = frozenset({ERR_RATE_LIMIT, ERR_UNAVAILABLE, ERR_TIMEOUT, ERR_NETWORK})
+
+_CODE_CLASSES = {
+    429: ERR_RATE_LIMIT,
+    408: ERR_TIMEOUT, 504: ERR_TIMEOUT,
+    500: ERR_UNAVAILABLE, 502: ERR_UNAVAILABLE, 503: ERR_UNAVAILABLE,
+    400: ERR_INVALID, 404: ERR_INVALID, 409: ERR_INVALID, 413: ERR_INVALID, 422: ERR_INVALID,
+    401: ERR_AUTH, 403: ERR_AUTH,
+}
+
+_STATUS_CLASSES = {
+    "RESOURCE_EXHAUSTED": ERR_RATE_LIMIT,
+    "UNAVAILABLE": ERR_UNAVAILABLE,
+    "INTERNAL": ERR_UNAVAILABLE,
+    "DEADLINE_EXCEEDED": ERR_TIMEOUT,
+    "INVALID_ARGUMENT": ERR_INVALID,
+    "FAILED_PRECONDITION": ERR_INVALID,
+    "NOT_FOUND": ERR_INVALID,
+    "UNAUTHENTICATED": ERR_AUTH,
+    "PERMISSION_DENIED": ERR_AUTH,
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """主模型和所有备选模型都处于熔断状态"""
+
+    def __init__(self, models: List[str], retry_after: float):
+        self.models = models
+        self.retry_after = retry_after
+        super().__init__(f"模型 {', '.join(models)} 熔断中，约 {retry_after:.0f} 秒后重试")
+
+
+def error_code(exc: BaseException) -> Optional[int]:
+    """APIError（以及 httpx.HTTPStatusError）上的 HTTP 状态码"""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(exc: BaseException) -> str:
+    """把异常归类为 ERR_* 之一"""
+    if isinstance(exc, CancelledError):
+        return ERR_CANCELLED
+    if isinstance(exc, DeadlineExceededError):
+        return ERR_TIMEOUT
+    if isinstance(exc, CircuitOpenError):
+        return ERR_CIRCUIT_OPEN
+
+    # google.genai.errors.APIError：code 为 HTTP 状态码，status 为 gRPC 风格的状态名
+    # （只有 SDK 已被导入时才可能抛出这类异常，这里按属性判断，不额外导入 SDK）
+    code = error_code(exc)
+    if code in _CODE_CLASSES:
+        return _CODE_CLASSES[code]
+    status = getattr(exc, "status", None)
+    if isinstance(status, str) and status.upper() in _STATUS_CLASSES:
+        return _STATUS_CLASSES[status.upper()]
+    if code is not None and 500 <= code < 600:
+        return ERR_UNAVAILABLE
+    if code is not None and 400 <= code < 500:
+        return ERR_INVALID
+
+    httpx = sys.modules.get("httpx")
+    if httpx is not None:
+        if isinstance(exc, httpx.TimeoutException):
+            return ERR_TIMEOUT
+        if isinstance(exc, httpx.TransportError):
+            return ERR_NETWORK
+    if isinstance(exc, TimeoutError):
+        return ERR_TIMEOUT
+    if isinstance(exc, ConnectionError):
+        return ERR_NETWORK
+    return ERR_UNKNOWN
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """是否属于服务商侧故障（限流 / 过载 / 5xx / 超时 / 网络）"""
+    return classify_error(exc) in PROVIDER_FAILURES
+
+
+def describe_error(exc: BaseException) -> str:
+    """面向用户的错误描述：分类标签 + 原始信息"""
+    return f"{ERROR_LABELS[classify_error(exc)]}：{exc}"
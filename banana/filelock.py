@@ -0,0 +1,64 @@
+# 基于锁文件的跨进程互斥锁：POSIX 用 fcntl.flock，Windows 用 msvcrt.locking
+# 多个 worker 进程读写同一个 JSON 文件（固定列表、预设等）时，用它保护“读取 -> 修改 -> 原子写回”整个过程
+import os
+import time
+from typing import Optional
+
+# 等待锁文件的默认最长时间 / 重试间隔
+LOCK_TIMEOUT_S = 10.0
+LOCK_POLL_S = 0.02
+
+
+class FileLockTimeout(RuntimeError):
+    pass
+
+
+class FileLock:
+    """with FileLock(path): ...；path 为锁文件（不存在时创建，不会被删除）"""
+
+    def __init__(self, path: str, timeout_s: float = LOCK_TIMEOUT_S):
+        self.path = path
+        self.timeout_s = timeout_s
+        self._fd: Optional[int] = None
+
+    def _try_lock(self, fd: int) -> bool:
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def __enter__(self) -> "FileLock":
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + self.timeout_s
+        while not self._try_lock(fd):
+            if time.monotonic() >= deadline:
+                os.close(fd)
+                raise FileLockTimeout(f"等待锁文件 {self.path} 超时（{self.timeout_s:.0f} 秒）")
+            time.sleep(LOCK_POLL_S)
+        self._fd = fd
+        return self
+
+    def __exit__(self, *exc) -> None:
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
@@ -0,0 +1,471 @@
+# 无头入口：不加载 Gradio，直接复用 banana.core 的 client / 参数构造 / 输出保存
+#
+#   批处理：python -m banana.headless run jobs.jsonl -o results.jsonl -p 4
+#   HTTP  ：python -m banana.headless serve --port 8787 -p 4
+#
+# 任务（JSONL 每行一个）：
+#   {"id": "a1", "prompt": "...", "model": "gemini-3-pro-image-preview",
+#    "images": ["ref.png"], "aspect_ratio": "16:9", "image_size": "2K", "temperature": 0.9, ...}
+# 结果（JSONL，按完成顺序流式输出）：
+#   {"id": "a1", "ok": true, "text": "...", "images": ["outputs/...png"], "elapsed_s": 21.3, ...}
+#
+# HTTP API 读取的是服务器上的文件：任务里的图片路径只能位于 config.json 的 headless.input_roots 之内；
+# 监听非本机地址时必须设置 BANANA_API_TOKEN
+import argparse
+import ipaddress
+import json
+import os
+import select
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from banana.accounting import BUDGET_HARD, configure_ledger, get_ledger
+from banana.cancellation import CancelToken
+from banana.core import (
+    DEFAULT_ADVANCED_CONFIG,
+    call_gemini_vertex,
+    load_budget_config,
+    load_google_api_key_from_file,
+    load_headless_config,
+    load_preflight_config,
+    load_retry_config,
+    load_routing_config,
+    load_scheduler_config,
+)
+from banana.pricing import estimate_latency
+from banana.errors import classify_error
+from banana.preflight import configure_preflight
+from banana.retry import configure_retry_policy, get_retry_policy
+from banana.routing import configure_router, get_router
+from banana.scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, configure_scheduler, get_scheduler
+from banana.sprite_batch import is_within_roots
+from banana.warmup import last_warmup, start_background_warmup
+
+DEFAULT_JOB: Dict[str, Any] = {
+    "model": "gemini-3-pro-image-preview",
+    "prompt": "",
+    "images": [],
+    "history": [],
+    "aspect_ratio": "1:1",
+    "image_size": "1K",
+    "system_instruction": DEFAULT_ADVANCED_CONFIG["system_instruction"],
+    "temperature": DEFAULT_ADVANCED_CONFIG["temperature"],
+    "top_p": DEFAULT_ADVANCED_CONFIG["top_p"],
+    "top_k": DEFAULT_ADVANCED_CONFIG["top_k"],
+    "max_output_tokens": DEFAULT_ADVANCED_CONFIG["max_output_tokens"],
+    "enable_search": False,
+    "timeout": None,
+    "priority": PRIORITY_NORMAL,
+}
+
+
+def normalize_job(raw: Dict[str, Any], index: int = 0) -> Dict[str, Any]:
+    """补全默认值并做类型转换；缺少 prompt 且没有图片时抛 ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError("任务必须是 JSON 对象")
+    if "_error" in raw:
+        raise ValueError(f"JSON 解析失败: {raw['_error']}")
+    job = {**DEFAULT_JOB, **raw}
+    job["id"] = str(raw.get("id", index))
+    job["images"] = [str(p) for p in (job["images"] or [])]
+    job["history"] = list(job["history"] or [])
+    job["temperature"] = float(job["temperature"])
+    job["top_p"] = float(job["top_p"])
+    job["top_k"] = int(job["top_k"])
+    job["max_output_tokens"] = int(job["max_output_tokens"])
+    job["enable_search"] = bool(job["enable_search"])
+    # PRIORITY_INTERACTIVE 留给界面上的对话，任务最高只能是 PRIORITY_HIGH
+    job["priority"] = min(max(int(job["priority"]), PRIORITY_HIGH), PRIORITY_LOW)
+    if not str(job["prompt"]).strip() and not job["images"]:
+        raise ValueError("prompt 与 images 不能同时为空")
+    return job
+
+
+def check_input_paths(job: Dict[str, Any], input_roots: Iterable[str]) -> None:
+    """
+    HTTP API 用：任务的 images 与 history[].images 都必须位于 input_roots 之内，
+    否则抛 ValueError；input_roots 为空时不接受任何图片路径
+    """
+    paths = list(job["images"])
+    for message in job["history"]:
+        if isinstance(message, dict):
+            paths += [str(p) for p in message.get("images") or []]
+    if not paths:
+        return
+    roots = [str(r) for r in input_roots or [] if r]
+    if not roots:
+        raise ValueError("服务器未配置 headless.input_roots，不接受图片路径")
+    for path in paths:
+        if not is_within_roots(path, roots):
+            raise ValueError(f"图片路径不在允许的目录内：{path}")
+
+
+def run_job(
+    job: Dict[str, Any],
+    api_key: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+    flow: str = "headless",
+    source: str = "cli",
+) -> Dict[str, Any]:
+    """
+    执行单个（已 normalize 的）任务，异常收敛为 ok=false 的结果行
+    重试 -> 熔断路由 -> 调度器：只有真正发出请求时才占用调度器名额，退避等待期间不占
+    结果中 model 为实际使用的模型（主模型熔断时可能是备选），requested_model 为任务指定的模型，
+    retries 为重试次数；失败时 error_class 为错误类别（banana.errors）
+    """
+    started = time.time()
+    result: Dict[str, Any] = {"id": job["id"], "model": job["model"], "requested_model": job["model"], "retries": 0}
+
+    def _on_retry(state, exc, delay):
+        result["retries"] = state.retries
+
+    def _call(model_name: str):
+        return call_gemini_vertex(
+            api_key=api_key or "",
+            model_name=model_name,
+            history_messages=job["history"],
+            user_text=job["prompt"],
+            user_images=job["images"],
+            aspect_ratio=job["aspect_ratio"],
+            image_size=job["image_size"],
+            system_instruction=job["system_instruction"] or "",
+            temperature=job["temperature"],
+            top_p=job["top_p"],
+            top_k=job["top_k"],
+            max_output_tokens=job["max_output_tokens"],
+            enable_search=job["enable_search"],
+            timeout=job["timeout"],
+            cancel_token=cancel_token,
+            usage_tags={"flow": flow, "task_id": job["id"], "source": source},
+            output_dir=output_dir,
+        )
+
+    def _attempt(model_name: str):
+        return get_scheduler().run(
+            lambda: _call(model_name),
+            flow=flow,
+            priority=job["priority"],
+            cost=estimate_latency(model_name, job["image_size"], job["enable_search"]),
+            label=f"{source} {job['id']}",
+            cancel_token=cancel_token,
+        )
+
+    try:
+        budget_state, budget_msg = get_ledger().check_budget()
+        if budget_state == BUDGET_HARD:
+            raise RuntimeError(f"预算已用尽：{budget_msg}")
+        (text, images), used_model = get_retry_policy().run(
+            lambda: get_router().call(job["model"], _attempt),
+            token=cancel_token,
+            on_retry=_on_retry,
+        )
+        result.update(ok=True, model=used_model, text=text, images=images)
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}", error_class=classify_error(e), images=[])
+    result["elapsed_s"] = round(time.time() - started, 3)
+    return result
+
+
+def run_jobs(
+    jobs: Iterable[Dict[str, Any]],
+    parallel: int = 4,
+    api_key: Optional[str] = None,
+    output_dir: Optional[str] = None,
+    cancel_token: Optional[CancelToken] = None,
+    flow: str = "headless",
+    source: str = "cli",
+    input_roots: Optional[Iterable[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    并发执行任务并按完成顺序产出结果。
+    在途任务数限制为 parallel * 2，超大的 JSONL 不会一次性读进内存；
+    实际并发请求数由调度器控制（run_job 每次尝试才向调度器排队）。
+    input_roots: 不为 None 时任务的图片路径必须位于其中（见 check_input_paths）
+    """
+    window = max(1, parallel) * 2
+    executor = ThreadPoolExecutor(max_workers=window, thread_name_prefix="banana-headless")
+    in_flight = {}
+    jobs_iter = iter(enumerate(jobs))
+    exhausted = False
+
+    try:
+        while True:
+            while not exhausted and len(in_flight) < window:
+                if cancel_token is not None and cancel_token.cancelled:
+                    exhausted = True
+                    break
+                try:
+                    index, raw = next(jobs_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:
+                    job = normalize_job(raw, index)
+                    if input_roots is not None:
+                        check_input_paths(job, input_roots)
+                except (TypeError, ValueError) as e:
+                    raw_id = raw.get("id", index) if isinstance(raw, dict) else index
+                    yield {"id": str(raw_id), "ok": False, "error": f"无效任务: {e}", "images": []}
+                    continue
+                future = executor.submit(run_job, job, api_key, output_dir, cancel_token, flow, source)
+                in_flight[future] = job["id"]
+
+            if not in_flight:
+                return
+            done, _ = wait_futures(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id = in_flight.pop(future)
+                try:
+                    yield future.result()
+                except BaseException as e:
+                    yield {"id": job_id, "ok": False, "error": f"{type(e).__name__}: {e}", "images": []}
+    finally:
+        # 提前退出（如客户端断开）时，尚未开始的任务直接丢弃
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_jsonl(stream) -> Iterator[Any]:
+    """逐行解析 JSONL，空行和 # 注释行跳过；坏行以 {"_error": ...} 形式交给下游报错"""
+    for lineno, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"id": f"line{lineno}", "_error": str(e)}
+
+
+def _dumps(obj: Dict[str, Any]) -> str:
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+# ========== HTTP API ==========
+class _ApiHandler(BaseHTTPRequestHandler):
+    # HTTP/1.0 + 不带 Content-Length：响应体按行写出即可实现流式返回
+    protocol_version = "HTTP/1.0"
+    server_version = "BananaHeadless/1.0"
+
+    parallel = 4
+    api_key: Optional[str] = None
+    output_dir: Optional[str] = None
+    auth_token: Optional[str] = None
+    input_roots: list = []
+
+    def log_message(self, fmt, *args):
+        print(f"[API] {self.address_string()} {fmt % args}")
+
+    def _send_json(self, status: int, obj: Dict[str, Any]) -> None:
+        body = _dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if not self.auth_token:
+            return True
+        return self.headers.get("Authorization", "") == f"Bearer {self.auth_token}"
+
+    def _flow(self) -> str:
+        # 调用方可用 X-Client-Id 区分团队 / 流水线，调度器按它做公平排队
+        return self.headers.get("X-Client-Id") or f"api:{self.client_address[0]}"
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length > 0 else b""
+
+    def _watch_disconnect(self, token: CancelToken, done: threading.Event) -> None:
+        """
+        单个请求等待结果期间轮询连接：对端关闭（可读且读到 EOF）时取消 token，
+        排队中的任务直接出队，正在进行的调用在下一个检查点停止。
+        """
+        sock = self.connection
+        while not done.is_set():
+            try:
+                readable, _, _ = select.select([sock], [], [], 0.5)
+                if not readable:
+                    continue
+                if sock.recv(1, socket.MSG_PEEK):
+                    return  # 客户端又发了数据（流水线请求），不是断开，停止检测
+            except (OSError, ValueError):
+                pass
+            if not done.is_set():
+                token.cancel("客户端已断开")
+                print(f"[API] {self.address_string()} 断开连接，任务已取消")
+            return
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json(200, {"ok": True, "warmup": last_warmup()})
+        elif self.path == "/v1/queue":
+            self._send_json(200, {
+                **get_scheduler().snapshot(),
+                "breakers": get_router().snapshot(),
+                "retries": get_retry_policy().stats.snapshot(),
+            })
+        else:
+            self._send_json(404, {"ok": False, "error": "not found"})
+
+    def do_POST(self):
+        if not self._authorized():
+            self._send_json(401, {"ok": False, "error": "unauthorized"})
+            return
+        body = self._read_body().decode("utf-8", errors="replace")
+
+        if self.path == "/v1/generate":
+            try:
+                job = normalize_job(json.loads(body or "{}"))
+                check_input_paths(job, self.input_roots)
+            except (TypeError, ValueError) as e:
+                self._send_json(400, {"ok": False, "error": str(e)})
+                return
+            token = CancelToken(scope="api")
+            done = threading.Event()
+            threading.Thread(target=self._watch_disconnect, args=(token, done), daemon=True).start()
+            try:
+                result = run_job(job, self.api_key, self.output_dir, token, self._flow(), "api")
+            finally:
+                done.set()
+            if token.cancelled:
+                return
+            try:
+                self._send_json(200 if result["ok"] else 502, result)
+            except (BrokenPipeError, ConnectionResetError):
+                print(f"[API] {self.address_string()} 断开连接，结果未送达")
+
+        elif self.path == "/v1/jobs":
+            # 请求体：JSONL、任务数组 [...]，或 {"jobs": [...]}
+            try:
+                parsed = json.loads(body)
+                if isinstance(parsed, dict) and "jobs" in parsed:
+                    jobs = parsed.get("jobs") or []
+                elif isinstance(parsed, list):
+                    jobs = parsed
+                else:
+                    jobs = [parsed]
+            except json.JSONDecodeError:
+                jobs = list(iter_jsonl(body.splitlines()))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.end_headers()
+            token = CancelToken(scope="api")
+            try:
+                for result in run_jobs(
+                    jobs, self.parallel, self.api_key, self.output_dir, token, self._flow(), "api",
+                    self.input_roots,
+                ):
+                    self.wfile.write(_dumps(result).encode("utf-8"))
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端断开：剩余任务全部取消，不再消耗配额
+                token.cancel("客户端已断开")
+                print(f"[API] {self.address_string()} 断开连接，剩余任务已取消")
+        else:
+            self._send_json(404, {"ok": False, "error": "not found"})
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def serve(host: str = "127.0.0.1", port: int = 8787, parallel: int = 4,
+          api_key: Optional[str] = None, output_dir: Optional[str] = None) -> None:
+    """监听非本机地址（如 0.0.0.0）而没有设置 BANANA_API_TOKEN 时抛 RuntimeError，不启动"""
+    auth_token = os.environ.get("BANANA_API_TOKEN") or None
+    if not auth_token and not _is_loopback(host):
+        raise RuntimeError(f"监听 {host} 会把 API 暴露给其他机器，请先设置环境变量 BANANA_API_TOKEN")
+    handler = type("ApiHandler", (_ApiHandler,), {
+        "parallel": parallel,
+        "api_key": api_key,
+        "output_dir": output_dir,
+        "auth_token": auth_token,
+        "input_roots": [r for r in load_headless_config()["input_roots"] or [] if r],
+    })
+    httpd = ThreadingHTTPServer((host, port), handler)
+    print(f"[banana] Headless API running on http://{host}:{port} (parallel={parallel})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+# ========== 命令行 ==========
+def _init_runtime(parallel: int, api_key: Optional[str] = None, warmup: bool = True) -> None:
+    load_google_api_key_from_file()
+    sched_cfg = load_scheduler_config()
+    configure_scheduler(max_concurrency=parallel, weights=sched_cfg["weights"])
+    configure_ledger(budget_provider=load_budget_config)
+    configure_router(**load_routing_config())
+    configure_retry_policy(**load_retry_config())
+    configure_preflight(**load_preflight_config())
+    if warmup:
+        # 与读取任务 / 监听端口并行，第一个任务不再承担建连和签发令牌的耗时
+        start_background_warmup(api_key)
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m banana.headless", description="Banana Studio 无头批量生成")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="执行 JSONL 任务文件")
+    p_run.add_argument("jobs", help="JSONL 任务文件，- 表示 stdin")
+    p_run.add_argument("-o", "--output", default="-", help="结果 JSONL，默认 stdout")
+    p_run.add_argument("-p", "--parallel", type=int, default=4, help="并发请求数")
+    p_run.add_argument("--out-dir", default=None, help="图片保存目录（默认 outputs/）")
+    p_run.add_argument("--api-key", default=None, help="覆盖 GOOGLE_CLOUD_API_KEY")
+
+    p_srv = sub.add_parser("serve", help="启动 HTTP JSON API")
+    p_srv.add_argument("--host", default="127.0.0.1")
+    p_srv.add_argument("--port", type=int, default=8787)
+    p_srv.add_argument("-p", "--parallel", type=int, default=4, help="并发请求数")
+    p_srv.add_argument("--out-dir", default=None, help="图片保存目录（默认 outputs/）")
+    p_srv.add_argument("--api-key", default=None, help="覆盖 GOOGLE_CLOUD_API_KEY")
+
+    for p in (p_run, p_srv):
+        p.add_argument("--no-warmup", action="store_true", help="不在后台预热连接")
+
+    args = parser.parse_args(argv)
+    _init_runtime(args.parallel, args.api_key, warmup=not args.no_warmup)
+
+    if args.command == "serve":
+        try:
+            serve(args.host, args.port, args.parallel, args.api_key, args.out_dir)
+        except RuntimeError as e:
+            print(f"[ERROR] {e}")
+            return 2
+        return 0
+
+    src = sys.stdin if args.jobs == "-" else open(args.jobs, "r", encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    failed = 0
+    try:
+        for result in run_jobs(iter_jsonl(src), args.parallel, args.api_key, args.out_dir):
+            failed += 0 if result["ok"] else 1
+            dst.write(_dumps(result))
+            dst.flush()
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# 插件宿主上下文：主程序把共享的调用函数 / Client 池 / 配置 / 输出目录通过 create_tab(host) 交给插件，
+# 插件不再 import nano_banana_pro（以 __main__ 运行时会把整个主程序再执行一遍，状态也会分裂成两份）
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from banana import core
+
+MANIFEST_NAME = "manifest.json"
+
+
+class OutputStore:
+    """
+    统一管理生成文件的落盘位置：outputs/<子目录>/<前缀>_<时间戳>_<随机>.<扩展名>
+    """
+
+    def __init__(self, root: Optional[Path] = None, exports_root: Path = Path("exports")):
+        self.root = Path(root or core.OUTPUT_DIR)
+        self.exports_root = Path(exports_root)
+
+    def dir(self, *parts: str) -> Path:
+        path = self.root.joinpath(*parts)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def new_path(self, prefix: str, ext: str, *subdir: str) -> Path:
+        ext = ext if ext.startswith(".") else f".{ext}"
+        name = f"{prefix}_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}{ext}"
+        return self.dir(*subdir) / name
+
+
+@dataclass
+class PluginHost:
+    """
+    create_tab(host) 收到的上下文对象
+    - call_model: 与主对话相同的 call_gemini_vertex
+    - get_client: 共享 Client 池
+    - load_config: 读取 config.json（整个 dict）
+    - outputs: 输出目录管理
+    """
+    call_model: Callable[..., Any] = core.call_gemini_vertex
+    get_client: Callable[..., Any] = core.get_client
+    config_path: Path = core.CONFIG_PATH
+    outputs: OutputStore = field(default_factory=OutputStore)
+    model_options: List[str] = field(default_factory=lambda: list(core.DEFAULT_MODEL_OPTIONS))
+    aspect_ratio_options: List[str] = field(default_factory=lambda: list(core.ASPECT_RATIO_OPTIONS))
+    image_size_options: List[str] = field(default_factory=lambda: list(core.IMAGE_SIZE_OPTIONS))
+
+    def load_config(self) -> Dict[str, Any]:
+        if not self.config_path.exists():
+            return {}
+        try:
+            data = json.loads(self.config_path.read_text(encoding="utf-8"))
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            print(f"[WARN] 插件读取 {self.config_path} 失败：{e}")
+            return {}
+
+
+@dataclass
+class PluginSpec:
+    name: str
+    file: Path
+    enabled: bool = True
+    order: int = 100
+
+
+def read_plugin_manifest(plugin_dir: Path) -> List[PluginSpec]:
+    """
+    读取 plugins/manifest.json（不 import 任何插件代码）：
+    {"plugins": [{"name": "queue_manager", "file": "queue_manager.py", "enabled": true, "order": 10}, ...]}
+
+    清单里没有列出的 .py 文件仍会被发现并排在最后；enabled=false 的插件完全不会被导入。
+    没有清单时退回目录扫描。
+    """
+    specs: Dict[str, PluginSpec] = {}
+    manifest = plugin_dir / MANIFEST_NAME
+    if manifest.exists():
+        try:
+            data = json.loads(manifest.read_text(encoding="utf-8"))
+            for i, entry in enumerate(data.get("plugins", [])):
+                name = entry.get("name") or Path(entry["file"]).stem
+                specs[name] = PluginSpec(
+                    name=name,
+                    file=plugin_dir / entry.get("file", f"{name}.py"),
+                    enabled=bool(entry.get("enabled", True)),
+                    order=int(entry.get("order", i)),
+                )
+        except Exception as e:
+            print(f"[WARN] 插件清单 {manifest} 解析失败，退回目录扫描：{e}")
+            specs = {}
+
+    for path in sorted(plugin_dir.glob("*.py")):
+        if path.name.startswith("__") or path.stem in specs:
+            continue
+        specs[path.stem] = PluginSpec(name=path.stem, file=path, order=10_000)
+
+    return sorted(specs.values(), key=lambda s: (s.order, s.name))
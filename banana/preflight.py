@@ -0,0 +1,289 @@
+# 发送前的输入预检：在上传几 MB 图片之前估算输入 token 和请求体大小，超限时裁剪历史或直接拒绝
+# - 文本按字符类别折算 token（CJK 约 1 字 1 token，其余约 4 字符 1 token）
+# - 图片只读文件头拿到宽高，按模型的图片计费规则折算（Gemini 3 每张固定，2.x 按 768px 分块），
+#   内联上传按 base64 膨胀 4/3 估算字节数
+# - 估算结果按内容缓存：文本按内容，图片按 (路径, 大小, 修改时间)，同一段历史之后每轮只需查表
+# - 估算接近上限时可选调用 count_tokens 复核，避免估算偏高误伤正常请求
+import math
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+MODE_TRIM = "trim"      # 超限时从最早的历史开始丢弃，直到放得下
+MODE_REJECT = "reject"  # 超限时直接拒绝
+
+# 各模型的输入 token 上限（未列出的模型用 DEFAULT_INPUT_TOKEN_LIMIT）
+INPUT_TOKEN_LIMITS: Dict[str, int] = {
+    "gemini-3-pro-image-preview": 65536,
+    "gemini-3.1-flash-image-preview": 131072,
+    "gemini-2.5-flash-image": 32768,
+}
+DEFAULT_INPUT_TOKEN_LIMIT = 1048576
+
+# 单次请求的内联数据上限（MB）
+DEFAULT_MAX_REQUEST_MB = 20.0
+
+# 图片 token：Gemini 3 默认高分辨率每张固定；2.x 小图固定，大图按 768x768 分块
+GEMINI3_IMAGE_TOKENS = 1120
+SMALL_IMAGE_TOKENS = 258
+SMALL_IMAGE_MAX_SIDE = 384
+IMAGE_TILE_SIDE = 768
+# 读不出尺寸时的估算值
+UNKNOWN_IMAGE_TOKENS = 1120
+
+# 每条消息的结构开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+MEMO_SIZE = 4096
+
+
+class PreflightError(ValueError):
+    """请求超出模型输入上限 / 请求体上限（按 413 归为参数错误，不重试）"""
+
+    code = 413
+
+    def __init__(self, message: str, tokens: int = 0, limit: int = 0):
+        self.tokens = tokens
+        self.limit = limit
+        super().__init__(message)
+
+
+@dataclass
+class PreflightResult:
+    tokens: int             # 估算（或复核后）的输入 token
+    limit: int              # 允许的 token 数（已乘 margin）
+    request_bytes: int      # 估算的内联上传字节数
+    dropped: int = 0        # 被裁掉的历史消息条数
+    verified: bool = False  # tokens 是否来自 count_tokens
+    elapsed_ms: float = 0.0
+
+
+def image_dimensions(path: str) -> Optional[Tuple[int, int]]:
+    """只读文件头获取 PNG / GIF / JPEG / WebP 的宽高，无法识别时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:6] in (b"GIF87a", b"GIF89a"):
+                return struct.unpack("<HH", head[6:10])
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                chunk = head[12:16]
+                if chunk == b"VP8X":
+                    return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+                if chunk == b"VP8L":
+                    bits = int.from_bytes(head[21:25], "little")
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b"VP8 ":
+                    w, h = struct.unpack("<HH", head[26:30])
+                    return w & 0x3FFF, h & 0x3FFF
+                return None
+            if head[:2] == b"\xff\xd8":
+                # 逐个段跳过，直到 SOF 段
+                f.seek(2)
+                while True:
+                    marker = f.read(2)
+                    if len(marker) < 2 or marker[0] != 0xFF:
+                        return None
+                    kind = marker[1]
+                    if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+                        continue
+                    length = struct.unpack(">H", f.read(2))[0]
+                    if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+                        h, w = struct.unpack(">HH", f.read(5)[1:5])
+                        return w, h
+                    f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+    return None
+
+
+def image_tokens(model: str, size: Optional[Tuple[int, int]]) -> int:
+    """按模型的图片计费规则折算一张输入图的 token"""
+    if size is None:
+        return UNKNOWN_IMAGE_TOKENS
+    if model.startswith("gemini-3"):
+        return GEMINI3_IMAGE_TOKENS
+    w, h = size
+    if w <= SMALL_IMAGE_MAX_SIDE and h <= SMALL_IMAGE_MAX_SIDE:
+        return SMALL_IMAGE_TOKENS
+    return math.ceil(w / IMAGE_TILE_SIDE) * math.ceil(h / IMAGE_TILE_SIDE) * SMALL_IMAGE_TOKENS
+
+
+def text_tokens(text: str) -> int:
+    """文本 token 估算：CJK 字符按 1 个，其余按 4 个字符 1 个"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class Preflight:
+    """
+    mode: MODE_TRIM / MODE_REJECT
+    margin: 实际允许的比例（估算有误差，默认留 5% 余量）
+    verify: 估算超过 verify_above * 上限时调用 count_tokens 复核
+    limits: 覆盖 INPUT_TOKEN_LIMITS
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        mode: str = MODE_TRIM,
+        margin: float = 0.95,
+        verify: bool = False,
+        verify_above: float = 0.8,
+        max_request_mb: float = DEFAULT_MAX_REQUEST_MB,
+        limits: Optional[Dict[str, int]] = None,
+    ):
+        self.enabled = bool(enabled)
+        self.mode = mode if mode in (MODE_TRIM, MODE_REJECT) else MODE_TRIM
+        self.margin = float(margin)
+        self.verify = bool(verify)
+        self.verify_above = float(verify_above)
+        self.max_request_bytes = int(float(max_request_mb) * 1024 * 1024)
+        self.limits = {**INPUT_TOKEN_LIMITS, **{str(k): int(v) for k, v in (limits or {}).items()}}
+
+        self._memo: "OrderedDict[Any, Tuple[int, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def limit(self, model: str) -> int:
+        return int(self.limits.get(model, DEFAULT_INPUT_TOKEN_LIMIT) * self.margin)
+
+    # ---------- 带缓存的估算 ----------
+    def _memo_get(self, key):
+        with self._lock:
+            value = self._memo.get(key)
+            if value is not None:
+                self._memo.move_to_end(key)
+            return value
+
+    def _memo_put(self, key, value) -> None:
+        with self._lock:
+            self._memo[key] = value
+            while len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+
+    def estimate_image(self, model: str, path: str) -> Tuple[int, int]:
+        """返回 (token, 内联上传字节数)；读不到的文件记 0（发送时同样会被跳过）"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 0, 0
+        family = "gemini-3" if model.startswith("gemini-3") else model
+        key = ("i", family, path, st.st_size, st.st_mtime_ns)
+        value = self._memo_get(key)
+        if value is None:
+            value = (image_tokens(model, image_dimensions(path)), math.ceil(st.st_size * 4 / 3))
+            self._memo_put(key, value)
+        return value
+
+    def estimate_text(self, text: str) -> int:
+        if not text:
+            return 0
+        key = ("t", text)
+        value = self._memo_get(key)
+        if value is None:
+            value = (text_tokens(text), 0)
+            self._memo_put(key, value)
+        return value[0]
+
+    def estimate_message(self, model: str, text: str, images: List[str]) -> Tuple[int, int]:
+        tokens = MESSAGE_OVERHEAD_TOKENS + self.estimate_text(text)
+        size = len((text or "").encode("utf-8"))
+        for img in images or []:
+            t, b = self.estimate_image(model, str(img))
+            tokens += t
+            size += b
+        return tokens, size
+
+    # ---------- 预检 ----------
+    def check(
+        self,
+        model: str,
+        system_instruction: str,
+        history: List[Dict[str, Any]],
+        user_text: str,
+        user_images: List[str],
+        inline_from: int = 0,
+        count_fn: Optional[Callable[[int], int]] = None,
+    ) -> PreflightResult:
+        """
+        history: 本轮之前的消息；inline_from: 前多少条已在上下文缓存里（计 token，不计上传字节）
+        count_fn(dropped): 复核用，返回丢弃前 dropped 条历史后的真实 token 数
+        返回 PreflightResult（dropped 为需要裁掉的历史条数）；无法满足时抛出 PreflightError
+        """
+        started = time.perf_counter()
+        limit = self.limit(model)
+        fixed_tokens, fixed_bytes = self.estimate_message(model, user_text, user_images)
+        fixed_tokens += self.estimate_text(system_instruction or "")
+        per_msg = [self.estimate_message(model, m.get("text") or "", m.get("images") or []) for m in history]
+
+        if fixed_tokens > limit or fixed_bytes > self.max_request_bytes:
+            raise PreflightError(
+                f"本轮消息约 {fixed_tokens} tokens / {fixed_bytes / 1048576:.1f} MB，"
+                f"超出 {model} 的上限（{limit} tokens / {self.max_request_bytes / 1048576:.0f} MB），请减少图片或缩短文本",
+                tokens=fixed_tokens, limit=limit,
+            )
+
+        # 后缀和：丢弃前 i 条之后剩余历史的 token / 字节
+        n = len(per_msg)
+        tail_tokens = [0] * (n + 1)
+        tail_bytes = [0] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            tail_tokens[i] = tail_tokens[i + 1] + per_msg[i][0]
+            tail_bytes[i] = tail_bytes[i + 1] + per_msg[i][1]
+
+        def _totals(dropped: int) -> Tuple[int, int]:
+            return fixed_tokens + tail_tokens[dropped], fixed_bytes + tail_bytes[min(n, max(dropped, inline_from))]
+
+        dropped = 0
+        tokens, size = _totals(0)
+        verified = False
+        if self.verify and count_fn is not None and tokens > limit * self.verify_above and size <= self.max_request_bytes:
+            try:
+                tokens = int(count_fn(0))
+                verified = True
+            except Exception as e:
+                print(f"[WARN] count_tokens 复核失败，沿用估算值：{e}")
+
+        if tokens > limit or size > self.max_request_bytes:
+            if self.mode == MODE_REJECT:
+                raise PreflightError(
+                    f"请求约 {tokens} tokens / {size / 1048576:.1f} MB，超出 {model} 的上限"
+                    f"（{limit} tokens / {self.max_request_bytes / 1048576:.0f} MB），请清空对话或减少图片",
+                    tokens=tokens, limit=limit,
+                )
+            # 从最早的消息开始丢，保证剩余历史以用户消息开头
+            while dropped < len(per_msg) and (tokens > limit or size > self.max_request_bytes):
+                dropped += 1
+                while dropped < len(per_msg) and history[dropped].get("role") != "user":
+                    dropped += 1
+                tokens, size = _totals(dropped)
+                verified = False
+
+        return PreflightResult(
+            tokens=tokens, limit=limit, request_bytes=size, dropped=dropped, verified=verified,
+            elapsed_ms=(time.perf_counter() - started) * 1000,
+        )
+
+
+# ========== 进程级单例 ==========
+_preflight: Optional[Preflight] = None
+_preflight_lock = threading.Lock()
+
+
+def configure_preflight(**kwargs) -> Preflight:
+    """创建（或替换）全局预检器，参数见 Preflight；估算缓存随实例重建"""
+    global _preflight
+    with _preflight_lock:
+        _preflight = Preflight(**kwargs)
+        return _preflight
+
+
+def get_preflight() -> Preflight:
+    return _preflight or configure_preflight()
@@ -0,0 +1,161 @@
+# 参数预设存储：config.json 的 "presets" 段（共享）+ "user_presets" 段（按登录用户分开）
+# - 读：按文件 (mtime, size, inode) 校验的内存缓存，文件没变时不重新解析
+# - 写：进程内锁 + 锁文件（fcntl / msvcrt）保护“读取 -> 修改 -> 写临时文件 -> os.replace”整个过程，
+#   每次只改动一个预设，多个会话 / 进程同时保存不会互相覆盖，写到一半崩溃也不会留下半个文件
+# - 通知：version() 返回文件版本标识，页面定时比较，别的会话 / 进程改了预设时自动刷新下拉框
+# - 命名空间：未登录时只有共享预设；登录用户看到“共享 + 自己的”，保存 / 删除只作用于自己的
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from banana.filelock import LOCK_TIMEOUT_S, FileLock
+
+SHARED_SECTION = "presets"
+USER_SECTION = "user_presets"
+
+
+def _is_legacy(data: Dict[str, Any]) -> bool:
+    """旧格式：整个 json 就是 {预设名: 参数}"""
+    return bool(data) and SHARED_SECTION not in data and all(
+        isinstance(v, dict) and "model_name" in v for v in data.values()
+    )
+
+
+class PresetStore:
+    def __init__(self, path: str = "config.json", lock_timeout_s: float = LOCK_TIMEOUT_S):
+        self.path = str(path)
+        self.lock_timeout_s = lock_timeout_s
+        self._lock = threading.Lock()
+        # 同一进程内的写入先在这里排队，不必都去轮询锁文件
+        self._write_lock = threading.Lock()
+        self._cache: Optional[Tuple[Tuple[int, int, int], Dict[str, Any]]] = None
+        self._stats = {"reads": 0, "parses": 0, "writes": 0}
+
+    # ---------- 读取 ----------
+    def _stat_key(self) -> Tuple[int, int, int]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return (0, 0, 0)
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _parse(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        self._stats["parses"] += 1
+        if not isinstance(data, dict):
+            return {}
+        if _is_legacy(data):
+            return {SHARED_SECTION: data}
+        return data
+
+    def _read(self) -> Dict[str, Any]:
+        """整个 config.json（文件没变时直接用缓存；调用方不得修改返回值）"""
+        key = self._stat_key()
+        with self._lock:
+            self._stats["reads"] += 1
+            if self._cache is not None and self._cache[0] == key:
+                return self._cache[1]
+        try:
+            data = self._parse()
+        except Exception as e:
+            print(f"[WARN] 读取 {self.path} 失败：{e}")
+            data = {}
+        with self._lock:
+            self._cache = (key, data)
+        return data
+
+    def version(self) -> str:
+        """预设文件的版本标识：文件被任何会话 / 进程改写后都会变化"""
+        return "{}-{}-{}".format(*self._stat_key())
+
+    def presets(self, user: str = "") -> Dict[str, Any]:
+        """某个用户可见的预设：共享预设，登录用户再叠加自己的（同名时以自己的为准）"""
+        data = self._read()
+        merged = dict(data.get(SHARED_SECTION) or {})
+        if user:
+            merged.update((data.get(USER_SECTION) or {}).get(user) or {})
+        return {k: dict(v) for k, v in merged.items() if isinstance(v, dict)}
+
+    def snapshot(self, user: str = "") -> Tuple[str, Dict[str, Any]]:
+        """(版本, 预设)；版本在读取之前取，读到更新的内容时最多多刷新一次，不会漏掉变化"""
+        ver = self.version()
+        return ver, self.presets(user)
+
+    # ---------- 写入 ----------
+    def _write(self, data: Dict[str, Any]) -> None:
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._stats["writes"] += 1
+
+    def update(self, user: str, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        """
+        在锁内重新读取最新文件，对该用户的命名空间（未登录时为共享预设）执行 fn(presets) 原地修改，
+        再原子写回。返回 fn 的返回值。其他配置段原样保留。
+        """
+        with self._write_lock, FileLock(f"{self.path}.lock", self.lock_timeout_s):
+            # 锁内不用缓存，直接读最新内容；文件损坏时抛出异常，不覆盖
+            data = self._parse()
+            if user:
+                space = data.setdefault(USER_SECTION, {}).setdefault(user, {})
+            else:
+                space = data.setdefault(SHARED_SECTION, {})
+            result = fn(space)
+            if user and not space:
+                data[USER_SECTION].pop(user, None)
+            self._write(data)
+            with self._lock:
+                self._cache = (self._stat_key(), data)
+        return result
+
+    def put(self, name: str, params: Dict[str, Any], user: str = "") -> None:
+        self.update(user, lambda space: space.__setitem__(name, dict(params)))
+
+    def delete(self, name: str, user: str = "") -> bool:
+        """只删除该用户命名空间里的预设；返回是否删除了"""
+        return self.update(user, lambda space: space.pop(name, None) is not None)
+
+    def replace_all(self, presets: Dict[str, Any], user: str = "") -> None:
+        """整体替换该命名空间的预设"""
+
+        def _replace(space: Dict[str, Any]) -> None:
+            space.clear()
+            space.update(presets)
+
+        self.update(user, _replace)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_store: Optional[PresetStore] = None
+_store_lock = threading.Lock()
+
+
+def configure_preset_store(path: str = "config.json", lock_timeout_s: float = LOCK_TIMEOUT_S) -> PresetStore:
+    global _store
+    with _store_lock:
+        _store = PresetStore(path, lock_timeout_s)
+        return _store
+
+
+def get_preset_store() -> PresetStore:
+    """未配置时使用当前目录下的 config.json"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PresetStore()
+        return _store
@@ -0,0 +1,87 @@
+# 价格 / 耗时估算表（估算值，仅用于排序和预算提示，以官方计费为准）
+from typing import Dict
+
+# 每张输出图像的估算价格（美元），按 模型 -> 图像尺寸
+IMAGE_PRICE_USD: Dict[str, Dict[str, float]] = {
+    "gemini-3-pro-image-preview": {"1K": 0.134, "2K": 0.134, "4K": 0.24},
+    "gemini-3.1-flash-image-preview": {"1K": 0.067, "2K": 0.101, "4K": 0.151},
+    "gemini-2.5-flash-image": {"1K": 0.039, "2K": 0.039, "4K": 0.039},
+}
+
+# 单次请求的估算耗时（秒），按 模型 -> 图像尺寸
+EST_LATENCY_S: Dict[str, Dict[str, float]] = {
+    "gemini-3-pro-image-preview": {"1K": 25, "2K": 35, "4K": 60},
+    "gemini-3.1-flash-image-preview": {"1K": 12, "2K": 18, "4K": 35},
+    "gemini-2.5-flash-image": {"1K": 10, "2K": 10, "4K": 10},
+}
+
+# 文本 token 单价（美元 / 百万 token）：input / output（output 含思考 token）
+TOKEN_PRICE_USD_PER_M: Dict[str, Dict[str, float]] = {
+    "gemini-3-pro-image-preview": {"input": 2.0, "output": 12.0},
+    "gemini-3.1-flash-image-preview": {"input": 0.5, "output": 3.0},
+    "gemini-2.5-flash-image": {"input": 0.3, "output": 2.5},
+    "gemini-2.5-flash": {"input": 0.3, "output": 2.5},
+    "gemini-3-flash-preview": {"input": 0.5, "output": 3.0},
+    "gemini-3.1-pro-preview": {"input": 2.0, "output": 12.0},
+}
+
+# 命中显式上下文缓存的输入 token 按普通输入单价的这个比例计费（缓存存储费按时长另计，这里不估算）
+CACHED_INPUT_RATE = 0.1
+
+# 每张输出图像折算的 token 数（candidates_token_count 中包含这部分，计价时要扣掉避免重复）
+IMAGE_OUTPUT_TOKENS: Dict[str, int] = {"1K": 1120, "2K": 1120, "4K": 2000}
+
+# 开启 Google Search 时额外的检索耗时（秒）
+SEARCH_EXTRA_LATENCY_S = 6.0
+
+_FALLBACK_PRICE = 0.134
+_FALLBACK_LATENCY = 30.0
+_FALLBACK_TOKEN_PRICE = {"input": 2.0, "output": 12.0}
+
+
+def _lookup(table: Dict[str, Dict[str, float]], model_name: str, image_size: str, fallback: float) -> float:
+    per_model = table.get(model_name)
+    if not per_model:
+        return fallback
+    size = (image_size or "1K").upper()
+    if size in per_model:
+        return float(per_model[size])
+    # 未知尺寸按该模型最贵的档位估算，宁高勿低
+    return float(max(per_model.values()))
+
+
+def estimate_image_cost(model_name: str, image_size: str) -> float:
+    """估算生成一张图的价格（美元）"""
+    return _lookup(IMAGE_PRICE_USD, model_name, image_size, _FALLBACK_PRICE)
+
+
+def estimate_latency(model_name: str, image_size: str, enable_search: bool = False) -> float:
+    """估算一次图像请求的耗时（秒）"""
+    t = _lookup(EST_LATENCY_S, model_name, image_size, _FALLBACK_LATENCY)
+    if enable_search:
+        t += SEARCH_EXTRA_LATENCY_S
+    return t
+
+
+def estimate_call_cost(
+    model_name: str,
+    image_size: str,
+    prompt_tokens: int = 0,
+    candidates_tokens: int = 0,
+    thoughts_tokens: int = 0,
+    images: int = 0,
+    cached_tokens: int = 0,
+) -> float:
+    """
+    按 usage_metadata 估算一次调用的价格（美元）：
+    输入 token（其中命中缓存的部分按 CACHED_INPUT_RATE 折算）+ 文本/思考输出 token + 输出图像（按张计价）
+    """
+    price = TOKEN_PRICE_USD_PER_M.get(model_name, _FALLBACK_TOKEN_PRICE)
+    image_tokens = images * IMAGE_OUTPUT_TOKENS.get((image_size or "1K").upper(), IMAGE_OUTPUT_TOKENS["4K"])
+    text_out = max(0, int(candidates_tokens) - image_tokens) + int(thoughts_tokens)
+    cached = min(int(cached_tokens), int(prompt_tokens))
+    billed_input = int(prompt_tokens) - cached + cached * CACHED_INPUT_RATE
+    cost = billed_input * price["input"] / 1e6 + text_out * price["output"] / 1e6
+    if images:
+        cost += images * estimate_image_cost(model_name, image_size)
+    return cost
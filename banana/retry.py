@@ -0,0 +1,208 @@
+# 重试策略引擎：按错误类别（banana.errors）决定是否重试、退避多久
+# - 每类错误单独配置：最大尝试次数、初始等待、倍率、上限、抖动比例
+# - 整体受 max_elapsed_s 限制：预计等待会超过总时长就直接放弃
+# - 进程级统计每类错误的出现 / 重试 / 放弃次数，以及重试后成功的次数，供监控面板和 /v1/queue 展示
+# 对话、队列、无头入口共用同一个策略（get_retry_policy），队列这类生成器用 begin() 拿到 RetryState
+# 自己驱动循环（以便在等待前 yield 状态），其余调用方直接 run()。
+import random
+import threading
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Any, Callable, Dict, Optional
+
+from banana.cancellation import CancelledError
+from banana.errors import (
+    ERR_AUTH,
+    ERR_CANCELLED,
+    ERR_CIRCUIT_OPEN,
+    ERR_INVALID,
+    ERR_NETWORK,
+    ERR_RATE_LIMIT,
+    ERR_TIMEOUT,
+    ERR_UNAVAILABLE,
+    ERR_UNKNOWN,
+    ERROR_LABELS,
+    classify_error,
+)
+
+
+@dataclass
+class RetryRule:
+    retryable: bool = True
+    max_attempts: int = 3       # 包括第一次
+    base_delay: float = 2.0     # 第一次重试前的等待（秒）
+    multiplier: float = 2.0
+    max_delay: float = 30.0
+    jitter: float = 0.5         # 在 [delay*(1-jitter), delay] 内随机，避免多个任务同时重试
+
+
+DEFAULT_RETRY_RULES: Dict[str, RetryRule] = {
+    ERR_RATE_LIMIT: RetryRule(max_attempts=5, base_delay=5, max_delay=60),
+    ERR_UNAVAILABLE: RetryRule(max_attempts=4, base_delay=3, max_delay=30),
+    ERR_TIMEOUT: RetryRule(max_attempts=3, base_delay=1, max_delay=10),
+    ERR_NETWORK: RetryRule(max_attempts=4, base_delay=1, max_delay=15),
+    ERR_CIRCUIT_OPEN: RetryRule(max_attempts=3, base_delay=5, max_delay=120, jitter=0.2),
+    ERR_UNKNOWN: RetryRule(max_attempts=2, base_delay=5, max_delay=5),
+    ERR_INVALID: RetryRule(retryable=False, max_attempts=1),
+    ERR_AUTH: RetryRule(retryable=False, max_attempts=1),
+    ERR_CANCELLED: RetryRule(retryable=False, max_attempts=1),
+}
+
+# 单次调用（含所有重试）的默认总时长上限
+DEFAULT_MAX_ELAPSED_S = 300.0
+
+
+class RetryStats:
+    """进程级重试统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_class: Dict[str, Dict[str, int]] = {}
+        self.recovered = 0  # 经过至少一次重试后成功的调用数
+
+    def record(self, err_class: str, retried: bool) -> None:
+        with self._lock:
+            row = self._by_class.setdefault(err_class, {"errors": 0, "retries": 0, "giveups": 0})
+            row["errors"] += 1
+            row["retries" if retried else "giveups"] += 1
+
+    def record_recovered(self) -> None:
+        with self._lock:
+            self.recovered += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"by_class": {k: dict(v) for k, v in self._by_class.items()}, "recovered": self.recovered}
+
+
+def format_retry_stats(snap: Dict[str, Any]) -> str:
+    """重试统计文本（没有任何错误时返回空串）"""
+    if not snap["by_class"]:
+        return ""
+    lines = [
+        f"{ERROR_LABELS.get(cls, cls)}: {row['errors']} 次，重试 {row['retries']}，放弃 {row['giveups']}"
+        for cls, row in sorted(snap["by_class"].items(), key=lambda kv: -kv[1]["errors"])
+    ]
+    lines.append(f"重试后成功: {snap['recovered']} 次")
+    return "\n".join(lines)
+
+
+class RetryState:
+    """一次逻辑调用的重试状态；on_error 返回下一次重试前的等待秒数，None 表示放弃"""
+
+    def __init__(self, policy: "RetryPolicy", max_elapsed_s: Optional[float] = None):
+        self.policy = policy
+        self.max_elapsed_s = policy.max_elapsed_s if max_elapsed_s is None else max_elapsed_s
+        self.started = time.monotonic()
+        self.attempts = 0   # 已失败的尝试次数
+        self.retries = 0    # 已安排的重试次数
+        self.last_class: Optional[str] = None
+
+    def on_error(self, exc: BaseException) -> Optional[float]:
+        err_class = classify_error(exc)
+        self.last_class = err_class
+        self.attempts += 1
+        rule = self.policy.rule(err_class)
+
+        delay: Optional[float] = None
+        if rule.retryable and self.attempts < rule.max_attempts:
+            delay = self.policy.backoff(rule, self.attempts)
+            # 熔断时至少等到探测时间
+            delay = max(delay, float(getattr(exc, "retry_after", 0) or 0))
+            if time.monotonic() - self.started + delay > self.max_elapsed_s:
+                delay = None
+
+        self.policy.stats.record(err_class, retried=delay is not None)
+        if delay is not None:
+            self.retries += 1
+        return delay
+
+    def on_success(self) -> None:
+        if self.retries:
+            self.policy.stats.record_recovered()
+
+
+class RetryPolicy:
+    def __init__(self, rules: Optional[Dict[str, RetryRule]] = None, max_elapsed_s: float = DEFAULT_MAX_ELAPSED_S):
+        self.rules = dict(DEFAULT_RETRY_RULES)
+        self.rules.update(rules or {})
+        self.max_elapsed_s = float(max_elapsed_s)
+        self.stats = RetryStats()
+
+    def rule(self, err_class: str) -> RetryRule:
+        return self.rules.get(err_class) or self.rules[ERR_UNKNOWN]
+
+    @staticmethod
+    def backoff(rule: RetryRule, attempt: int) -> float:
+        """第 attempt 次失败后的等待：指数退避 + 抖动"""
+        delay = min(rule.max_delay, rule.base_delay * (rule.multiplier ** (attempt - 1)))
+        return random.uniform(delay * (1 - rule.jitter), delay) if rule.jitter else delay
+
+    def begin(self, max_elapsed_s: Optional[float] = None) -> RetryState:
+        return RetryState(self, max_elapsed_s)
+
+    def run(
+        self,
+        fn: Callable[[], Any],
+        token=None,
+        on_retry: Optional[Callable[[RetryState, BaseException, float], None]] = None,
+        max_elapsed_s: Optional[float] = None,
+    ) -> Any:
+        """
+        执行 fn，按策略重试；不可重试或用尽次数时原样抛出最后一个异常。
+        token（CancelToken）被取消时等待会被打断并抛出 CancelledError。
+        返回值之外的重试次数可通过 on_retry 回调获取。
+        """
+        state = self.begin(max_elapsed_s)
+        while True:
+            try:
+                result = fn()
+            except CancelledError:
+                raise
+            except Exception as e:
+                delay = state.on_error(e)
+                if delay is None:
+                    raise
+                print(f"[WARN] {ERROR_LABELS.get(state.last_class, state.last_class)}，{delay:.1f}s 后第 {state.attempts + 1} 次尝试：{e}")
+                if on_retry is not None:
+                    on_retry(state, e, delay)
+                if token is not None:
+                    if token.sleep(delay):
+                        raise CancelledError(token.reason)
+                else:
+                    time.sleep(delay)
+                continue
+            state.on_success()
+            return result
+
+
+# ========== 进程级单例 ==========
+_policy: Optional[RetryPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def configure_retry_policy(rules: Optional[Dict[str, Dict[str, Any]]] = None, max_elapsed_s: float = DEFAULT_MAX_ELAPSED_S) -> RetryPolicy:
+    """
+    创建（或更新）全局重试策略。rules 为 {错误类别: {RetryRule 字段: 值}}，未列出的字段沿用默认值。
+    """
+    global _policy
+    known = {f.name for f in fields(RetryRule)}
+    merged = {
+        cls: replace(
+            DEFAULT_RETRY_RULES.get(cls, DEFAULT_RETRY_RULES[ERR_UNKNOWN]),
+            **{k: v for k, v in overrides.items() if k in known},
+        )
+        for cls, overrides in (rules or {}).items()
+        if isinstance(overrides, dict)
+    }
+    with _policy_lock:
+        if _policy is None:
+            _policy = RetryPolicy(merged, max_elapsed_s)
+        else:
+            _policy.rules = {**DEFAULT_RETRY_RULES, **merged}
+            _policy.max_elapsed_s = float(max_elapsed_s)
+        return _policy
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _policy or configure_retry_policy()
@@ -0,0 +1,141 @@
+# 语义重写（Flash Rewrite）：用快速文本模型把一条提示词改写成 N 个变体
+# - 一个任务只调用一次模型，要求以 JSON 字符串数组返回全部变体（N 次调用 -> 1 次）
+# - 按 (提示词, N, 模型) 缓存，重跑同一任务不再重写
+# - submit_rewrite 在独立的小线程池里执行，不占用全局调度器的出图槽位，
+#   队列可以一边跑第一张（原始提示词），一边等改写结果
+# 模型调用失败时退回到固定风格后缀，保证队列不会因为重写失败而中断。
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from banana.accounting import get_ledger, usage_from_response
+from banana.cancellation import run_with_deadline
+
+# 默认改写模型：便宜、延迟低的文本模型
+REWRITE_MODEL = "gemini-2.5-flash"
+# 单次改写请求的超时（秒）
+REWRITE_TIMEOUT_S = 30.0
+# 缓存条数上限（LRU）
+REWRITE_CACHE_SIZE = 256
+# 模型不可用时的兜底风格后缀（原先的简化实现）
+FALLBACK_MODIFIERS = ["Cinematic Lighting", "Wide Angle", "Close-up", "Cyberpunk Style", "Watercolor"]
+
+REWRITE_INSTRUCTION = (
+    "You rewrite image-generation prompts into diverse variants.\n"
+    "Return a JSON array of exactly {n} strings. Each string is a complete, standalone prompt that keeps the "
+    "subject and every explicit requirement of the original, but varies composition, camera, lighting, "
+    "mood or style so the resulting images differ noticeably. Keep the language of the original prompt.\n\n"
+    "Original prompt:\n{prompt}"
+)
+
+_cache: "OrderedDict[Tuple[str, int, str], List[str]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="banana-rewrite")
+
+
+def _cache_get(key: Tuple[str, int, str]) -> Optional[List[str]]:
+    with _cache_lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+        return value
+
+
+def _cache_put(key: Tuple[str, int, str], value: List[str]) -> None:
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > REWRITE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def fallback_variants(prompt: str, n: int) -> List[str]:
+    """兜底：原始提示词 + 固定风格后缀"""
+    return [prompt] + [f"{prompt}, {FALLBACK_MODIFIERS[(i - 1) % len(FALLBACK_MODIFIERS)]}" for i in range(1, n)]
+
+
+def _parse_variants(text: str, n: int) -> List[str]:
+    data = json.loads(text or "[]")
+    if isinstance(data, dict):
+        # 兼容 {"variants": [...]} 之类的包装
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    variants = [str(v).strip() for v in data if str(v).strip()] if isinstance(data, list) else []
+    if not variants:
+        raise ValueError("改写结果为空")
+    return variants[:n]
+
+
+def rewrite_prompt(
+    prompt: str,
+    n: int,
+    model: str = REWRITE_MODEL,
+    api_key: Optional[str] = None,
+    cancel_token=None,
+    usage_tags: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[str], bool]:
+    """
+    返回 (N 个提示词, 是否命中缓存)。第 0 个始终是原始提示词（第一张图无需等待改写），
+    其余 N-1 个来自模型的一次 JSON 调用；不足时用兜底后缀补齐。
+    """
+    n = max(1, int(n))
+    key = (prompt, n, model)
+    cached = _cache_get(key)
+    if cached is not None:
+        return list(cached), True
+    if n == 1:
+        return [prompt], False
+
+    from google.genai import types
+
+    from banana.core import get_client
+
+    want = n - 1
+    config = types.GenerateContentConfig(
+        temperature=1.0,
+        response_mime_type="application/json",
+        response_schema={"type": "ARRAY", "items": {"type": "STRING"}},
+        http_options=types.HttpOptions(timeout=int(REWRITE_TIMEOUT_S * 1000)),
+    )
+    try:
+        client = get_client(api_key, location="global")
+        response = run_with_deadline(
+            lambda: client.models.generate_content(
+                model=model,
+                contents=REWRITE_INSTRUCTION.format(n=want, prompt=prompt),
+                config=config,
+            ),
+            timeout=REWRITE_TIMEOUT_S + 5,
+            token=cancel_token,
+            on_abandoned=lambda resp: get_ledger().record(
+                model=model, usage=usage_from_response(resp), **{**(usage_tags or {}), "source": "rewrite:abandoned"},
+            ),
+        )
+    except Exception as e:
+        if cancel_token is not None and cancel_token.cancelled:
+            raise
+        print(f"[WARN] 语义重写失败，改用固定风格后缀：{e}")
+        return fallback_variants(prompt, n), False
+
+    try:
+        get_ledger().record(model=model, usage=usage_from_response(response), **{**(usage_tags or {}), "source": "rewrite"})
+    except Exception as e:
+        print(f"[WARN] 用量记账失败：{e}")
+
+    try:
+        rewrites = _parse_variants(getattr(response, "text", ""), want)
+    except Exception as e:
+        print(f"[WARN] 语义重写结果无法解析，改用固定风格后缀：{e}")
+        return fallback_variants(prompt, n), False
+
+    variants = [prompt] + rewrites
+    if len(variants) < n:
+        variants += fallback_variants(prompt, n)[len(variants):]
+    _cache_put(key, variants)
+    return list(variants), False
+
+
+def submit_rewrite(prompt: str, n: int, **kwargs) -> "Future[Tuple[List[str], bool]]":
+    """在后台线程池执行 rewrite_prompt，返回 Future"""
+    return _executor.submit(rewrite_prompt, prompt, n, **kwargs)
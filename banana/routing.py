@@ -0,0 +1,257 @@
+# 按模型的熔断器 + 回退路由
+# 服务商故障（限流 / 过载 / 5xx / 超时，分类见 banana.errors）时，某个模型的错误率超过阈值就熔断：
+# 熔断期间请求不再发往该模型，而是路由到配置的备选模型（如 gemini-3.1-flash-image-preview），
+# 冷却时间过后放少量探测请求（半开），成功则恢复。
+# 调用方通过 ModelRouter.call 拿到 (结果, 实际使用的模型)，把实际模型记在结果上。
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from banana.cancellation import CancelledError
+from banana.errors import CircuitOpenError, is_provider_failure
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器（滑动时间窗口）
+    - closed：窗口内请求数 >= min_requests 且失败率 >= failure_rate，或连续失败 >= consecutive_failures 时打开
+    - open：open_s 秒内拒绝请求
+    - half_open：冷却结束后最多放行 half_open_max 个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(
+        self,
+        model: str,
+        window_s: float = 60,
+        min_requests: int = 4,
+        failure_rate: float = 0.5,
+        consecutive_failures: int = 3,
+        open_s: float = 60,
+        half_open_max: int = 1,
+    ):
+        self.model = model
+        self.window_s = float(window_s)
+        self.min_requests = int(min_requests)
+        self.failure_rate = float(failure_rate)
+        self.consecutive_failures = int(consecutive_failures)
+        self.open_s = float(open_s)
+        self.half_open_max = int(half_open_max)
+
+        self._lock = threading.Lock()
+        self._events: deque = deque()  # (时间, 是否失败)
+        self._streak = 0
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self.trips = 0
+
+    def _prune(self, now: float) -> None:
+        while self._events and now - self._events[0][0] > self.window_s:
+            self._events.popleft()
+
+    def _update_state(self, now: float) -> None:
+        if self._state == STATE_OPEN and now - self._opened_at >= self.open_s:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update_state(time.time())
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._state != STATE_OPEN:
+                return 0.0
+            return max(0.0, self.open_s - (time.time() - self._opened_at))
+
+    def allow(self) -> bool:
+        """是否放行一个请求（半开状态下会占用一个探测名额）"""
+        with self._lock:
+            self._update_state(time.time())
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                return True
+            return False
+
+    def release(self) -> None:
+        """请求被取消、没有结论时归还半开状态的探测名额"""
+        with self._lock:
+            if self._state == STATE_HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def _open(self, now: float) -> None:
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self.trips += 1
+        print(f"[WARN] 模型 {self.model} 熔断 {self.open_s:.0f}s（窗口内失败过多）")
+
+    def record_success(self) -> None:
+        with self._lock:
+            now = time.time()
+            self._events.append((now, False))
+            self._prune(now)
+            self._streak = 0
+            if self._state == STATE_HALF_OPEN:
+                self._state = STATE_CLOSED
+                self._events.clear()
+                print(f"[INFO] 模型 {self.model} 已恢复")
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.time()
+            self._events.append((now, True))
+            self._prune(now)
+            self._streak += 1
+            if self._state == STATE_HALF_OPEN:
+                self._open(now)
+                return
+            if self._state != STATE_CLOSED:
+                return
+            total = len(self._events)
+            failed = sum(1 for _, f in self._events if f)
+            if self._streak >= self.consecutive_failures or (
+                total >= self.min_requests and failed / total >= self.failure_rate
+            ):
+                self._open(now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            self._update_state(now)
+            total = len(self._events)
+            failed = sum(1 for _, f in self._events if f)
+            return {
+                "model": self.model,
+                "state": self._state,
+                "requests": total,
+                "failures": failed,
+                "retry_after": max(0.0, self.open_s - (now - self._opened_at)) if self._state == STATE_OPEN else 0.0,
+                "trips": self.trips,
+            }
+
+
+class ModelRouter:
+    """
+    fallbacks: {主模型: [备选模型, ...]}；fallback_enabled=False 时只熔断、不切换
+    breaker: CircuitBreaker 的参数
+    """
+
+    def __init__(
+        self,
+        fallbacks: Optional[Dict[str, List[str]]] = None,
+        fallback_enabled: bool = True,
+        breaker: Optional[Dict[str, Any]] = None,
+    ):
+        self.fallbacks = {k: list(v) for k, v in (fallbacks or {}).items()}
+        self.fallback_enabled = bool(fallback_enabled)
+        self._breaker_cfg = dict(breaker or {})
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(model)
+            if b is None:
+                b = CircuitBreaker(model, **self._breaker_cfg)
+                self._breakers[model] = b
+            return b
+
+    def candidates(self, model: str) -> List[str]:
+        """按优先顺序列出可尝试的模型（主模型在前）"""
+        chain = [model]
+        if self.fallback_enabled:
+            chain += [m for m in self.fallbacks.get(model, []) if m != model]
+        return chain
+
+    def call(self, model: str, fn: Callable[[str], Any]) -> Tuple[Any, str]:
+        """
+        按候选顺序调用 fn(模型名)，返回 (结果, 实际使用的模型)。
+        - 熔断中的模型直接跳过
+        - 服务商故障计入熔断；如果这次失败让模型熔断了且还有备选，立即改用备选
+        - 其他异常（参数错误 / 取消）原样抛出
+        全部熔断时抛出 CircuitOpenError（附带最早恢复时间），不再浪费时间发注定失败的请求
+        """
+        chain = self.candidates(model)
+        last_exc: Optional[BaseException] = None
+        for m in chain:
+            b = self.breaker(m)
+            if not b.allow():
+                continue
+            try:
+                result = fn(m)
+            except CancelledError:
+                b.release()
+                raise
+            except Exception as e:
+                if not is_provider_failure(e):
+                    # 参数错误之类说明服务本身可用，对熔断器而言算一次成功
+                    b.record_success()
+                    raise
+                b.record_failure()
+                last_exc = e
+                if b.state == STATE_CLOSED or m == chain[-1]:
+                    raise
+                print(f"[WARN] 模型 {m} 失败并熔断，改用备选模型")
+                continue
+            b.record_success()
+            return result, m
+        if last_exc is not None:
+            raise last_exc
+        retry_after = min((self.breaker(m).retry_after() for m in chain), default=0.0)
+        raise CircuitOpenError(chain, retry_after)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return [b.snapshot() for b in breakers]
+
+
+def format_router_snapshot(snap: List[Dict[str, Any]]) -> str:
+    """熔断器状态文本（只列出非 closed 或近期有请求的模型）"""
+    icons = {STATE_CLOSED: "🟢", STATE_HALF_OPEN: "🟡", STATE_OPEN: "🔴"}
+    lines = []
+    for b in snap:
+        if b["state"] == STATE_CLOSED and not b["requests"]:
+            continue
+        line = f"{icons.get(b['state'], '')} {b['model']}: {b['failures']}/{b['requests']} 失败"
+        if b["state"] == STATE_OPEN:
+            line += f"，熔断中（{b['retry_after']:.0f}s 后探测）"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# ========== 进程级单例 ==========
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def configure_router(
+    fallbacks: Optional[Dict[str, List[str]]] = None,
+    fallback_enabled: bool = True,
+    breaker: Optional[Dict[str, Any]] = None,
+) -> ModelRouter:
+    """
+    创建（或返回已创建的）全局路由器。回退表和开关可重复更新，熔断参数只在首次创建时生效。
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(fallbacks, fallback_enabled, breaker)
+        else:
+            _router.fallbacks = {k: list(v) for k, v in (fallbacks or {}).items()}
+            _router.fallback_enabled = bool(fallback_enabled)
+        return _router
+
+
+def get_router() -> ModelRouter:
+    return _router or configure_router()
@@ -0,0 +1,256 @@
+# 进程级任务调度器：所有会话共享，按优先级 + 会话加权公平排队（WFQ）分发 API 调用
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, wait as wait_futures
+from typing import Any, Callable, Dict, List, Optional
+
+from banana.cancellation import CancelledError, CancelToken
+
+# 优先级：数值越小越先执行；对话轮次永远排在批量任务前面
+PRIORITY_INTERACTIVE = 0
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 20
+PRIORITY_LOW = 30
+
+# 闲置超过这么久（无排队 / 执行中的条目）的会话，从公平队列状态和统计里移除
+FLOW_IDLE_TTL_S = 3600
+# 清理闲置会话的最小间隔
+FLOW_PRUNE_INTERVAL_S = 60
+
+PRIORITY_LABELS = {
+    PRIORITY_INTERACTIVE: "对话",
+    PRIORITY_HIGH: "高",
+    PRIORITY_NORMAL: "普通",
+    PRIORITY_LOW: "低",
+}
+
+
+class _WorkItem:
+    __slots__ = (
+        "fn", "future", "flow", "priority", "cost", "label",
+        "cancel_token", "start_tag", "finish_tag", "submitted_at", "started_at",
+    )
+
+    def __init__(self, fn, flow, priority, cost, label, cancel_token):
+        self.fn = fn
+        self.future: Future = Future()
+        self.flow = flow
+        self.priority = priority
+        self.cost = cost
+        self.label = label
+        self.cancel_token = cancel_token
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.submitted_at = time.time()
+        self.started_at = 0.0
+
+
+class Scheduler:
+    """
+    固定并发度的工作线程池 + 优先队列。
+
+    - 同一优先级内按 Start-time Fair Queuing 排序：
+      每个会话（flow）维护自己的虚拟完成时间，重度用户的任务会被自然推后，
+      轻度用户的单个请求不会被别人的大批量任务饿死。
+    - 对话（PRIORITY_INTERACTIVE）总是排在批量任务前面，空出的下一个槽位立即被对话占用。
+    - 已在执行中的请求不会被打断，抢占发生在批量任务的条目之间。
+    """
+
+    def __init__(self, max_concurrency: int = 2, weights: Optional[Dict[str, float]] = None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._weights: Dict[str, float] = {flow: max(0.01, float(w)) for flow, w in (weights or {}).items()}
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._running: List[_WorkItem] = []
+        self._stats: Dict[str, Dict[str, float]] = {}
+        # 每个会话最近一次提交的时间（一个浏览器会话一个 flow，需定期清理）
+        self._last_seen: Dict[str, float] = {}
+        self._last_prune = time.time()
+        self._workers: List[threading.Thread] = []
+        for i in range(self.max_concurrency):
+            t = threading.Thread(target=self._worker_loop, name=f"banana-sched-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    # ---------- 配置 ----------
+    def set_weight(self, flow: str, weight: float) -> None:
+        with self._cond:
+            self._weights[flow] = max(0.01, float(weight))
+
+    def weight_of(self, flow: str) -> float:
+        return self._weights.get(flow, self._weights.get("*", 1.0))
+
+    # ---------- 提交 ----------
+    def submit(
+        self,
+        fn: Callable[[], Any],
+        flow: str = "",
+        priority: int = PRIORITY_NORMAL,
+        cost: float = 1.0,
+        label: str = "",
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Future:
+        """
+        提交一个调用单元，返回 concurrent.futures.Future。
+        cost 为估算耗时（秒），决定该会话虚拟时间前进的幅度。
+        """
+        item = _WorkItem(fn, flow or "anonymous", int(priority), max(0.001, float(cost)), label, cancel_token)
+        with self._cond:
+            item.start_tag = max(self._virtual_time, self._last_finish.get(item.flow, 0.0))
+            item.finish_tag = item.start_tag + item.cost / self.weight_of(item.flow)
+            self._last_finish[item.flow] = item.finish_tag
+            heapq.heappush(self._heap, (item.priority, item.finish_tag, next(self._seq), item))
+            st = self._stats.setdefault(item.flow, {"submitted": 0, "completed": 0, "wait_s": 0.0})
+            st["submitted"] += 1
+            self._last_seen[item.flow] = item.submitted_at
+            if item.submitted_at - self._last_prune >= FLOW_PRUNE_INTERVAL_S:
+                self._prune_idle_flows(item.submitted_at)
+            self._cond.notify()
+        return item.future
+
+    def run(
+        self,
+        fn: Callable[[], Any],
+        flow: str = "",
+        priority: int = PRIORITY_NORMAL,
+        cost: float = 1.0,
+        label: str = "",
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Any:
+        """
+        提交并阻塞等待结果。排队期间被取消时直接出队并抛出 CancelledError。
+        """
+        future = self.submit(fn, flow=flow, priority=priority, cost=cost, label=label, cancel_token=cancel_token)
+        while True:
+            done, _ = wait_futures([future], timeout=0.2)
+            if done:
+                return future.result()
+            # 仍在排队时可以直接撤回；已开始执行的由被调用方自己响应 cancel_token
+            if cancel_token is not None and cancel_token.cancelled and future.cancel():
+                raise CancelledError(cancel_token.reason or "已取消")
+
+    def _prune_idle_flows(self, now: float) -> None:
+        """
+        移除闲置会话的虚拟完成时间与统计（调用方持有 self._cond）。
+        只移除没有排队 / 执行中条目的会话；它下次提交时从全局虚拟时间起步，
+        最多比保留状态时提前一个条目的份额，闲置这么久之后可以忽略。
+        """
+        self._last_prune = now
+        active = {entry[3].flow for entry in self._heap} | {it.flow for it in self._running}
+        for flow, seen in list(self._last_seen.items()):
+            if flow in active or now - seen < FLOW_IDLE_TTL_S:
+                continue
+            self._last_seen.pop(flow, None)
+            self._last_finish.pop(flow, None)
+            self._stats.pop(flow, None)
+
+    # ---------- 工作线程 ----------
+    def _next_item(self) -> _WorkItem:
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, _, _, item = heapq.heappop(self._heap)
+                    if item.future.cancelled():
+                        continue
+                    if item.cancel_token is not None and item.cancel_token.cancelled:
+                        item.future.set_exception(CancelledError(item.cancel_token.reason or "已取消"))
+                        continue
+                    if not item.future.set_running_or_notify_cancel():
+                        continue
+                    self._virtual_time = max(self._virtual_time, item.start_tag)
+                    item.started_at = time.time()
+                    self._running.append(item)
+                    st = self._stats[item.flow]
+                    st["wait_s"] += item.started_at - item.submitted_at
+                    return item
+                self._cond.wait()
+
+    def _worker_loop(self) -> None:
+        while True:
+            item = self._next_item()
+            try:
+                item.future.set_result(item.fn())
+            except BaseException as e:  # noqa: B902 - 异常交给调用方处理
+                item.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running.remove(item)
+                    self._stats[item.flow]["completed"] += 1
+
+    # ---------- 监控 ----------
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        返回全局队列快照：执行中 / 排队中的条目与各会话统计
+        """
+        now = time.time()
+        with self._cond:
+            running = [
+                {
+                    "flow": it.flow, "label": it.label,
+                    "priority": PRIORITY_LABELS.get(it.priority, str(it.priority)),
+                    "elapsed_s": now - it.started_at,
+                }
+                for it in self._running
+            ]
+            pending_items = sorted(
+                (entry for entry in self._heap if not entry[3].future.cancelled()),
+                key=lambda e: e[:3],
+            )
+            pending = [
+                {
+                    "flow": it.flow, "label": it.label,
+                    "priority": PRIORITY_LABELS.get(it.priority, str(it.priority)),
+                    "waiting_s": now - it.submitted_at,
+                }
+                for _, _, _, it in pending_items
+            ]
+            stats = {flow: dict(st) for flow, st in self._stats.items()}
+        return {
+            "max_concurrency": self.max_concurrency,
+            "running": running,
+            "pending": pending,
+            "flows": stats,
+        }
+
+
+def format_scheduler_snapshot(snap: Dict[str, Any], max_pending: int = 10) -> str:
+    """把 snapshot() 渲染成监控面板文本"""
+    lines = [
+        f"=== 🌐 全局调度 ({time.strftime('%H:%M:%S')}) ===",
+        f"并发槽位: {len(snap['running'])}/{snap['max_concurrency']} ｜ 排队: {len(snap['pending'])}",
+    ]
+    for it in snap["running"]:
+        lines.append(f"🔄 [{it['priority']}] {it['flow'][:8]} {it['label']} ({it['elapsed_s']:.0f}s)")
+    for it in snap["pending"][:max_pending]:
+        lines.append(f"⏳ [{it['priority']}] {it['flow'][:8]} {it['label']} (等待 {it['waiting_s']:.0f}s)")
+    if len(snap["pending"]) > max_pending:
+        lines.append(f"... 其余 {len(snap['pending']) - max_pending} 项")
+    return "\n".join(lines)
+
+
+# ========== 进程级单例 ==========
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def configure_scheduler(max_concurrency: int = 2, weights: Optional[Dict[str, float]] = None) -> Scheduler:
+    """
+    创建（或返回已创建的）全局调度器。并发度只在首次创建时生效，权重可重复更新。
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(max_concurrency=max_concurrency, weights=weights)
+        else:
+            for flow, w in (weights or {}).items():
+                _scheduler.set_weight(flow, w)
+        return _scheduler
+
+
+def get_scheduler() -> Scheduler:
+    return _scheduler or configure_scheduler()
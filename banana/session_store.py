@@ -0,0 +1,357 @@
+# 会话状态外置存储：对话原始消息 / 聊天记录 / 导出目录 / 队列任务
+# 多个进程（或多台机器）共享同一个存储后，任意进程都能接着处理同一个用户的会话。
+#
+# 后端只需要实现 Redis 的最小子集：get(key) / set(key, value, ex=秒) / delete(key)
+#   - sqlite:///sessions.db  默认，单机多进程共享（WAL）
+#   - redis://host:6379/0    需要安装 redis 包，多机共享
+#   - memory://              进程内的 Redis 替身（LocalRedis），用于测试 / 单进程
+# 读-改-写用 update(key, fn, ex=秒) 原子完成：LocalRedis 持锁、SQLite 用 BEGIN IMMEDIATE 事务、
+# Redis 用 WATCH / MULTI 乐观重试，多个进程同时改同一条记录不会互相覆盖
+# 列出一个会话下的全部字段用 scan_prefix(前缀)：LocalRedis / SQLite 直接实现，Redis 用 SCAN + MGET
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+DEFAULT_STORE_URL = "sqlite:///sessions.db"
+DEFAULT_SESSION_TTL = 7 * 24 * 3600  # 会话闲置 7 天后过期
+
+
+class LocalRedis:
+    """
+    进程内的 Redis 替身，实现 get / set(ex=) / delete，行为与 redis-py 一致（返回 bytes）
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value, ex: Optional[int] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+    def scan_prefix(self, prefix: str) -> List[Tuple[str, bytes]]:
+        """以 prefix 开头、未过期的全部 (key, value)"""
+        now = time.time()
+        with self._lock:
+            return [
+                (k, v) for k, (v, expires_at) in self._data.items()
+                if k.startswith(prefix) and (expires_at is None or expires_at > now)
+            ]
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ex: Optional[int] = None) -> bytes:
+        """持锁执行 fn(旧值或 None) 并写回其返回值"""
+        with self._lock:
+            item = self._data.get(key)
+            old = item[0] if item is not None and (item[1] is None or item[1] > time.time()) else None
+            value = fn(old)
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            self._data[key] = (value, time.time() + ex if ex else None)
+            return value
+
+
+class SQLiteKV:
+    """
+    SQLite 实现的 Redis 子集。WAL 模式下同一台机器上的多个进程可以并发读写。
+    过期键在读取时惰性删除。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程一个连接，避免跨线程共享 sqlite 连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            conn.commit()
+            return None
+        return bytes(value)
+
+    def set(self, key: str, value, ex: Optional[int] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, value, time.time() + ex if ex else None),
+        )
+        conn.commit()
+        return True
+
+    def delete(self, *keys: str) -> int:
+        conn = self._conn()
+        n = 0
+        for k in keys:
+            n += conn.execute("DELETE FROM kv WHERE key = ?", (k,)).rowcount
+        conn.commit()
+        return n
+
+    def scan_prefix(self, prefix: str) -> List[Tuple[str, bytes]]:
+        """以 prefix 开头、未过期的全部 (key, value)；按主键范围查询，不扫全表"""
+        rows = self._conn().execute(
+            "SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\U0010ffff", time.time()),
+        ).fetchall()
+        return [(k, bytes(v)) for k, v in rows]
+
+    def update(self, key: str, fn: Callable[[Optional[bytes]], bytes], ex: Optional[int] = None) -> bytes:
+        """在 BEGIN IMMEDIATE 事务里读取、执行 fn(旧值或 None)、写回，其他进程的写入在此期间排队"""
+        conn = self._conn()
+        conn.commit()  # 结束可能残留的隐式事务
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+            old = None
+            if row is not None and (row[1] is None or row[1] > time.time()):
+                old = bytes(row[0])
+            value = fn(old)
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, time.time() + ex if ex else None),
+            )
+            conn.commit()
+            return value
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def _redis_scan_prefix(kv, prefix: str) -> List[Tuple[str, bytes]]:
+    """redis-py：SCAN 匹配前缀（转义通配符）后 MGET；扫描与读取之间过期的键跳过"""
+    pattern = "".join("\\" + c if c in "*?[]\\" else c for c in prefix) + "*"
+    keys = [k.decode("utf-8") if isinstance(k, bytes) else k for k in kv.scan_iter(match=pattern, count=500)]
+    if not keys:
+        return []
+    return [(k, v) for k, v in zip(keys, kv.mget(keys)) if v is not None]
+
+
+def _redis_update(kv, key: str, fn: Callable[[Optional[bytes]], bytes], ex: Optional[int] = None) -> bytes:
+    """redis-py 没有 update：WATCH 键，读取并计算新值后在 MULTI 中写回，期间键被别人改过则重试"""
+    import redis
+
+    with kv.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                value = fn(pipe.get(key))
+                pipe.multi()
+                pipe.set(key, value, ex=ex)
+                pipe.execute()
+                return value
+            except redis.WatchError:
+                continue
+
+
+def open_kv(url: str):
+    """
+    根据 URL 创建键值后端：sqlite:///path | redis://... | memory://
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # sqlite:///相对路径 或 sqlite:////绝对路径
+        path = parsed.netloc + parsed.path if parsed.netloc else parsed.path[1:]
+        return SQLiteKV(path or "sessions.db")
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        try:
+            import redis  # 可选依赖
+        except ImportError as e:
+            raise RuntimeError("使用 redis:// 会话存储需要先 pip install redis") from e
+        return redis.Redis.from_url(url)
+    if parsed.scheme == "memory":
+        return LocalRedis()
+    raise ValueError(f"不支持的会话存储: {url}")
+
+
+def _chat_state(value: Any) -> Dict[str, Any]:
+    """规范化对话记录（返回新的列表，调用方可以直接修改）"""
+    value = value if isinstance(value, dict) else {}
+    return {
+        "raw_messages": list(value.get("raw_messages") or []),
+        "history": list(value.get("history") or []),
+        "export_dir": value.get("export_dir") or "",
+    }
+
+
+class SessionStore:
+    """
+    按 (会话 ID, 字段名) 存取 JSON 值，每次写入都会刷新 TTL
+    """
+
+    def __init__(self, kv, ttl: int = DEFAULT_SESSION_TTL, prefix: str = "banana:session"):
+        self.kv = kv
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, session_id: str, name: str) -> str:
+        return f"{self.prefix}:{session_id}:{name}"
+
+    def get(self, session_id: str, name: str, default: Any = None) -> Any:
+        if not session_id:
+            return default
+        raw = self.kv.get(self._key(session_id, name))
+        if raw is None:
+            return default
+        try:
+            return json.loads(raw)
+        except (TypeError, ValueError):
+            return default
+
+    def put(self, session_id: str, name: str, value: Any, ttl: Optional[float] = None) -> None:
+        """写入并刷新 TTL；ttl 为空时使用会话默认 TTL"""
+        if not session_id:
+            return
+        ex = self.ttl if ttl is None else max(1, int(ttl))
+        self.kv.set(self._key(session_id, name), json.dumps(value, ensure_ascii=False), ex=ex)
+
+    def fields(self, session_id: str) -> Dict[str, Any]:
+        """某个会话下全部未过期的字段 {字段名: 值}"""
+        if not session_id:
+            return {}
+        prefix = self._key(session_id, "")
+        if hasattr(self.kv, "scan_prefix"):
+            rows = self.kv.scan_prefix(prefix)
+        else:
+            rows = _redis_scan_prefix(self.kv, prefix)
+        out: Dict[str, Any] = {}
+        for key, raw in rows:
+            try:
+                out[key[len(prefix):]] = json.loads(raw)
+            except (TypeError, ValueError):
+                continue
+        return out
+
+    def update(self, session_id: str, name: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        """
+        原子地读取 -> fn(当前值) -> 写回，返回新值（同时刷新 TTL）。
+        fn 可能因并发冲突被重复调用，不要在里面做有副作用的事。
+        """
+        if not session_id:
+            return fn(default)
+
+        def _apply(raw: Optional[bytes]) -> bytes:
+            current = default
+            if raw is not None:
+                try:
+                    current = json.loads(raw)
+                except (TypeError, ValueError):
+                    pass
+            return json.dumps(fn(current), ensure_ascii=False).encode("utf-8")
+
+        key = self._key(session_id, name)
+        if hasattr(self.kv, "update"):
+            raw = self.kv.update(key, _apply, ex=self.ttl)
+        else:
+            raw = _redis_update(self.kv, key, _apply, ex=self.ttl)
+        return json.loads(raw)
+
+    def drop(self, session_id: str, *names: str) -> None:
+        if session_id and names:
+            self.kv.delete(*(self._key(session_id, n) for n in names))
+
+    # ---------- 对话 Tab ----------
+    # 原始消息 / 聊天记录 / 导出目录保存在同一条记录 "chat" 里，一轮对话整体原子写回；
+    # 旧版本分三条记录保存的会话在读取时合并
+    def _legacy_chat(self, session_id: str) -> Dict[str, Any]:
+        return {
+            "raw_messages": self.get(session_id, "raw_messages", []),
+            "history": self.get(session_id, "history", []),
+            "export_dir": self.get(session_id, "export_dir", ""),
+        }
+
+    def load_chat(self, session_id: str) -> Dict[str, Any]:
+        chat = self.get(session_id, "chat")
+        return _chat_state(chat if chat is not None else self._legacy_chat(session_id))
+
+    def save_chat(self, session_id: str, raw_messages, history, export_dir: str) -> None:
+        self.put(session_id, "chat", _chat_state({"raw_messages": raw_messages, "history": history, "export_dir": export_dir}))
+
+    def update_chat(self, session_id: str, fn: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """原子地修改对话状态（同一会话的两轮可能由不同标签页 / 进程同时写回），返回新状态"""
+        # 旧记录在事务外先读：SQLite 的读取可能提交当前事务
+        legacy = self._legacy_chat(session_id) if self.get(session_id, "chat") is None else None
+        return self.update(
+            session_id, "chat", lambda chat: _chat_state(fn(_chat_state(chat or legacy))), default=None,
+        )
+
+    # ---------- 队列 Tab ----------
+    def load_queue(self, session_id: str) -> list:
+        return self.get(session_id, "queue", [])
+
+    def save_queue(self, session_id: str, tasks: list) -> None:
+        self.put(session_id, "queue", tasks or [])
+
+    def update_queue(self, session_id: str, fn: Callable[[list], list]) -> list:
+        """原子地修改任务列表（同一会话的多个任务可能在不同进程里同时写回）"""
+        return self.update(session_id, "queue", lambda tasks: fn(list(tasks or [])) or [], default=[])
+
+    def load_shown(self, session_id: str) -> list:
+        """队列画廊当前各位置对应的原图路径"""
+        return self.get(session_id, "queue_shown", [])
+
+    def save_shown(self, session_id: str, paths: list) -> None:
+        self.put(session_id, "queue_shown", list(paths or []))
+
+
+# ========== 进程级单例 ==========
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """
+    由环境变量 BANANA_SESSION_STORE（URL）与 BANANA_SESSION_TTL（秒）配置
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = os.environ.get("BANANA_SESSION_STORE", DEFAULT_STORE_URL)
+            ttl = int(os.environ.get("BANANA_SESSION_TTL", DEFAULT_SESSION_TTL))
+            _store = SessionStore(open_kv(url), ttl=ttl)
+            print(f"[INFO] 会话存储: {url}")
+        return _store
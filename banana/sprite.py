@@ -0,0 +1,354 @@
+# 精灵图切帧与动图编码（不依赖 Gradio，供 gif_tool 插件使用）
+# - 整张精灵图只转换一次为 NumPy 数组，帧是 as_strided 得到的零拷贝视图，不再逐帧 image.crop
+# - 从抽样帧上统一计算一次全局调色板（所有帧共用，避免逐帧量化导致的闪烁），
+#   再通过 32x32x32 的颜色查找表一次性把所有帧映射成调色板索引
+# - 编码器直接收到已量化的 P 模式帧，保存时不再逐帧量化
+# 除 GIF 外还可输出动态 WebP / APNG（Pillow）和 MP4 / WebM（本机 ffmpeg 或 imageio-ffmpeg 自带的 ffmpeg）：
+# - 相同的连续帧合并为一帧并累加时长（视频按固定帧率输出，静止画面由编码器自行压缩）
+# - GIF / APNG 由 Pillow 只写入与上一帧不同的矩形区域，WebP 由 libwebp 的动画编码器做子帧裁剪
+# - convert_sprite_sheet 按格式分别记录文件大小与编码耗时，供用户挑选
+import os
+import shutil
+import subprocess
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+# 全局调色板的颜色数（GIF 最多 256 色，留一个索引给透明）
+PALETTE_COLORS = 255
+TRANSPARENT_INDEX = 255
+# alpha 低于此值的像素视为透明
+ALPHA_THRESHOLD = 128
+# 计算调色板时最多抽样的像素数
+PALETTE_SAMPLE_PIXELS = 1 << 18
+# 颜色查找表每个通道保留的位数（5 位 = 32 级，表大小 32768）
+LUT_BITS = 5
+
+FORMAT_GIF = "gif"
+FORMAT_WEBP = "webp"
+FORMAT_APNG = "apng"
+FORMAT_MP4 = "mp4"
+FORMAT_WEBM = "webm"
+FORMAT_EXT = {FORMAT_GIF: ".gif", FORMAT_WEBP: ".webp", FORMAT_APNG: ".png", FORMAT_MP4: ".mp4", FORMAT_WEBM: ".webm"}
+FORMAT_LABELS = {FORMAT_GIF: "GIF", FORMAT_WEBP: "WebP", FORMAT_APNG: "APNG", FORMAT_MP4: "MP4", FORMAT_WEBM: "WebM"}
+VIDEO_FORMATS = (FORMAT_MP4, FORMAT_WEBM)
+
+# 动态 WebP 的有损质量（0~100）
+WEBP_QUALITY = 80
+# 视频编码超时（秒）
+VIDEO_TIMEOUT_S = 300
+
+
+def sheet_to_array(image: Image.Image) -> np.ndarray:
+    """整张精灵图转为 HxWx3（RGB）或 HxWx4（带透明通道）的 uint8 数组，只转换一次"""
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    return np.ascontiguousarray(np.asarray(image.convert("RGBA" if has_alpha else "RGB")))
+
+
+def slice_frames(
+    sheet: np.ndarray,
+    rows: int,
+    cols: int,
+    cell: Optional[Sequence[int]] = None,
+) -> List[np.ndarray]:
+    """
+    按行列切帧，返回行优先的帧列表（与原先逐帧裁剪的顺序一致），每一帧都是 sheet 的零拷贝视图。
+    除不尽的右侧 / 底部像素被丢弃。
+    cell: (起点 x, 起点 y, 格宽, 格高)，来自 banana.sprite_grid.detect_grid，用于四周留白的精灵图；
+    不传则从左上角开始按图宽 / 列数、图高 / 行数等分。
+    """
+    rows, cols = max(1, int(rows)), max(1, int(cols))
+    if cell:
+        x0, y0, frame_w, frame_h = (int(v) for v in cell)
+        if x0 < 0 or y0 < 0 or x0 + frame_w * cols > sheet.shape[1] or y0 + frame_h * rows > sheet.shape[0]:
+            raise ValueError(f"网格 {tuple(cell)} 超出精灵图 {sheet.shape[1]}x{sheet.shape[0]} 的范围")
+        sheet = sheet[y0:, x0:]
+    else:
+        frame_h, frame_w = sheet.shape[0] // rows, sheet.shape[1] // cols
+    if frame_h <= 0 or frame_w <= 0:
+        raise ValueError(f"精灵图 {sheet.shape[1]}x{sheet.shape[0]} 无法切成 {rows} 行 {cols} 列")
+    s0, s1, s2 = sheet.strides
+    grid = np.lib.stride_tricks.as_strided(
+        sheet,
+        shape=(rows, cols, frame_h, frame_w, sheet.shape[2]),
+        strides=(frame_h * s0, frame_w * s1, s0, s1, s2),
+        writeable=False,
+    )
+    return [grid[r, c] for r in range(rows) for c in range(cols)]
+
+
+def build_palette(frames: List[np.ndarray], colors: int = PALETTE_COLORS, sample_pixels: int = PALETTE_SAMPLE_PIXELS) -> np.ndarray:
+    """
+    在所有帧的抽样像素上计算一次全局调色板，返回 (colors, 3) 的 uint8 数组。
+    透明像素不参与计算。
+    """
+    frame_h, frame_w, channels = frames[0].shape
+    # 每帧按相同的行列步长抽样，使总像素数不超过 sample_pixels
+    step = max(1, int(np.ceil(np.sqrt(len(frames) * frame_h * frame_w / sample_pixels))))
+    sample = np.concatenate([f[::step, ::step].reshape(-1, channels) for f in frames])
+    if channels == 4:
+        sample = sample[sample[:, 3] >= ALPHA_THRESHOLD]
+    rgb = np.ascontiguousarray(sample[:, :3])
+    if len(rgb) == 0:
+        return np.zeros((colors, 3), dtype=np.uint8)
+    strip = Image.fromarray(rgb.reshape(1, -1, 3), "RGB")
+    quantized = strip.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    palette = np.array(quantized.getpalette()[: colors * 3], dtype=np.uint8).reshape(-1, 3)
+    if len(palette) < colors:
+        palette = np.vstack([palette, np.zeros((colors - len(palette), 3), dtype=np.uint8)])
+    return palette
+
+
+def _palette_lut(palette: np.ndarray) -> np.ndarray:
+    """颜色查找表：每个 LUT_BITS 位量化后的 RGB 格子 -> 最近的调色板索引"""
+    levels = 1 << LUT_BITS
+    step = 256 // levels
+    centers = np.arange(levels, dtype=np.float32) * step + step // 2
+    r, g, b = np.meshgrid(centers, centers, centers, indexing="ij")
+    cells = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+    pal = palette.astype(np.float32)
+    # |c - p|^2 = |c|^2 - 2 c·p + |p|^2，|c|^2 对 argmin 无影响；一次矩阵乘法代替逐色求差
+    dist = (pal ** 2).sum(axis=1)[None, :] - 2 * cells @ pal.T
+    return dist.argmin(axis=1).astype(np.uint8)
+
+
+def quantize_frames(frames: List[np.ndarray], palette: np.ndarray) -> np.ndarray:
+    """把所有帧按全局调色板映射成 (n, 帧高, 帧宽) 的索引数组；透明像素映射到 TRANSPARENT_INDEX"""
+    lut = _palette_lut(palette)
+    shift = 8 - LUT_BITS
+    frame_h, frame_w, channels = frames[0].shape
+    out = np.empty((len(frames), frame_h, frame_w), dtype=np.uint8)
+    for i, f in enumerate(frames):
+        # 每帧一次向量化查表（帧是视图，这里才第一次读取像素）
+        key = (
+            (f[..., 0] >> shift).astype(np.uint16) << (2 * LUT_BITS)
+            | (f[..., 1] >> shift).astype(np.uint16) << LUT_BITS
+            | (f[..., 2] >> shift).astype(np.uint16)
+        )
+        out[i] = lut[key]
+        if channels == 4:
+            out[i][f[..., 3] < ALPHA_THRESHOLD] = TRANSPARENT_INDEX
+    return out
+
+
+def to_palette_images(indexed: np.ndarray, palette: np.ndarray) -> List[Image.Image]:
+    """索引数组 -> 共享同一调色板的 P 模式帧"""
+    flat_palette = np.zeros((256, 3), dtype=np.uint8)
+    flat_palette[: len(palette)] = palette
+    flat_palette = flat_palette.ravel().tolist()
+    images = []
+    for frame in indexed:
+        img = Image.fromarray(frame, "P")
+        img.putpalette(flat_palette)
+        images.append(img)
+    return images
+
+
+def dedupe_frames(frames: Sequence[np.ndarray], duration: int) -> Tuple[List[int], List[int]]:
+    """合并相同的连续帧：返回 (保留的帧下标, 每个保留帧的时长 ms)"""
+    keep = [0]
+    durations = [int(duration)]
+    for i in range(1, len(frames)):
+        if np.array_equal(frames[i], frames[keep[-1]]):
+            durations[-1] += int(duration)
+        else:
+            keep.append(i)
+            durations.append(int(duration))
+    return keep, durations
+
+
+def encode_gif(
+    indexed: np.ndarray,
+    palette: np.ndarray,
+    out_path: str,
+    duration,
+    loop: bool,
+    transparent: bool = False,
+) -> None:
+    """已量化的帧直接写 GIF（optimize=False：不再重排 / 重新量化调色板）；duration 可为每帧时长列表"""
+    frames = to_palette_images(indexed, palette)
+    kwargs = dict(save_all=True, append_images=frames[1:], duration=duration, loop=0 if loop else 1, optimize=False)
+    if transparent:
+        kwargs.update(transparency=TRANSPARENT_INDEX, disposal=2)
+    frames[0].save(out_path, **kwargs)
+
+
+def _to_images(frames: Sequence[np.ndarray]) -> List[Image.Image]:
+    return [Image.fromarray(np.ascontiguousarray(f)) for f in frames]
+
+
+def encode_webp(frames: Sequence[np.ndarray], out_path: str, durations: List[int], loop: bool, quality: int = WEBP_QUALITY) -> None:
+    """动态 WebP（有损，保留透明通道）；libwebp 只编码与上一帧不同的子区域"""
+    images = _to_images(frames)
+    images[0].save(
+        out_path, format="WEBP", save_all=True, append_images=images[1:],
+        duration=durations, loop=0 if loop else 1, quality=int(quality), method=4,
+    )
+
+
+def encode_apng(frames: Sequence[np.ndarray], out_path: str, durations: List[int], loop: bool) -> None:
+    """APNG（无损）；Pillow 只写入与上一帧不同的矩形区域"""
+    images = _to_images(frames)
+    images[0].save(
+        out_path, format="PNG", save_all=True, append_images=images[1:],
+        duration=durations, loop=0 if loop else 1,
+    )
+
+
+def find_ffmpeg() -> Optional[str]:
+    """本机 ffmpeg：优先 PATH，其次 imageio-ffmpeg 自带的可执行文件（可选依赖）"""
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def available_formats() -> List[str]:
+    """当前环境可输出的格式（视频格式需要 ffmpeg）"""
+    formats = [FORMAT_GIF, FORMAT_WEBP, FORMAT_APNG]
+    if find_ffmpeg():
+        formats += list(VIDEO_FORMATS)
+    return formats
+
+
+def encode_video(frames: Sequence[np.ndarray], out_path: str, duration: int, fmt: str) -> None:
+    """
+    通过 ffmpeg 管道编码 MP4（H.264）/ WebM（VP9，保留透明通道），固定帧率 1000/duration。
+    MP4 不支持透明，透明像素先合成到白底上；奇数宽高补齐到偶数。
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise RuntimeError("未找到 ffmpeg（安装 ffmpeg 或 pip install imageio-ffmpeg 后可输出视频）")
+    frame_h, frame_w, channels = frames[0].shape
+    has_alpha = channels == 4
+    if fmt == FORMAT_WEBM:
+        pix_in = "rgba" if has_alpha else "rgb24"
+        codec = ["-c:v", "libvpx-vp9", "-pix_fmt", "yuva420p" if has_alpha else "yuv420p", "-b:v", "0", "-crf", "32", "-row-mt", "1"]
+    else:
+        pix_in = "rgb24"
+        codec = ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-crf", "20", "-movflags", "+faststart"]
+    cmd = [
+        ffmpeg, "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", pix_in, "-s", f"{frame_w}x{frame_h}", "-framerate", f"{1000 / max(1, int(duration)):.6g}",
+        "-i", "-",
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        *codec, out_path,
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        for f in frames:
+            if has_alpha and pix_in == "rgb24":
+                alpha = f[..., 3:4].astype(np.uint16)
+                f = ((f[..., :3].astype(np.uint16) * alpha + 255 * (255 - alpha)) // 255).astype(np.uint8)
+            proc.stdin.write(np.ascontiguousarray(f).tobytes())
+        proc.stdin.close()
+        stderr = proc.stderr.read()
+        if proc.wait(timeout=VIDEO_TIMEOUT_S) != 0:
+            raise RuntimeError(f"ffmpeg 编码失败：{stderr.decode('utf-8', 'replace').strip()[-300:]}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+
+
+def convert_sprite_sheet(
+    image: Image.Image,
+    rows: int,
+    cols: int,
+    duration: int,
+    loop: bool,
+    formats: Sequence[str],
+    out_path_for: Callable[[str], str],
+    dedupe: bool = True,
+    cell: Optional[Sequence[int]] = None,
+    occupied: Optional[Sequence[int]] = None,
+) -> Dict[str, Any]:
+    """
+    精灵图 -> 多种动图格式。切帧只做一次，各格式共用；单个格式失败不影响其他格式。
+    out_path_for(格式) 返回该格式的输出路径。
+    cell / occupied 来自网格自动识别：按识别出的起点与格距切帧，只保留有内容的格子（非满格精灵图）。
+    返回 {"frames": 原始帧数, "prepare_s": 切帧耗时, "results": [{format, path, bytes, encode_s, frames, error}]}
+    """
+    started = time.perf_counter()
+    sheet = sheet_to_array(image)
+    frames = slice_frames(sheet, rows, cols, cell)
+    if occupied:
+        frames = [frames[i] for i in occupied if 0 <= i < len(frames)]
+    transparent = sheet.shape[2] == 4
+    prepare_s = time.perf_counter() - started
+    all_frames = (list(range(len(frames))), [int(duration)] * len(frames))
+    rgb_dedup: Optional[Tuple[List[int], List[int]]] = None
+
+    results = []
+    for fmt in formats:
+        t0 = time.perf_counter()
+        row: Dict[str, Any] = {"format": fmt, "path": None, "bytes": 0, "frames": len(frames), "error": ""}
+        try:
+            path = out_path_for(fmt)
+            if fmt == FORMAT_GIF:
+                palette = build_palette(frames)
+                indexed = quantize_frames(frames, palette)
+                # 量化后再去重：颜色差异被调色板抹平的帧也能合并
+                keep, durations = dedupe_frames(indexed, duration) if dedupe else all_frames
+                encode_gif(indexed[keep], palette, path, durations, loop, transparent=transparent)
+            elif fmt in (FORMAT_WEBP, FORMAT_APNG):
+                if rgb_dedup is None:
+                    rgb_dedup = dedupe_frames(frames, duration) if dedupe else all_frames
+                keep, durations = rgb_dedup
+                encoder = encode_webp if fmt == FORMAT_WEBP else encode_apng
+                encoder([frames[i] for i in keep], path, durations, loop)
+            elif fmt in VIDEO_FORMATS:
+                keep = all_frames[0]
+                encode_video(frames, path, duration, fmt)
+            else:
+                raise ValueError(f"不支持的格式：{fmt}")
+            row.update(path=path, bytes=os.path.getsize(path), frames=len(keep))
+        except Exception as e:
+            row["error"] = str(e)
+            print(f"[WARN] 精灵图输出 {FORMAT_LABELS.get(fmt, fmt)} 失败：{e}")
+        row["encode_s"] = time.perf_counter() - t0
+        results.append(row)
+    return {"frames": len(frames), "prepare_s": prepare_s, "results": results}
+
+
+def format_convert_report(report: Dict[str, Any]) -> str:
+    """各格式的大小 / 编码耗时（Markdown 表格）"""
+    lines = [
+        f"共 {report['frames']} 帧，切帧 {report['prepare_s'] * 1000:.0f} ms",
+        "",
+        "| 格式 | 大小 | 编码耗时 | 帧数 |",
+        "|---|---|---|---|",
+    ]
+    for r in report["results"]:
+        label = FORMAT_LABELS.get(r["format"], r["format"])
+        if r["error"]:
+            lines.append(f"| {label} | ❌ {r['error']} | {r['encode_s']:.2f}s | - |")
+        else:
+            lines.append(f"| {label} | {r['bytes'] / 1024:.0f} KB | {r['encode_s']:.2f}s | {r['frames']} |")
+    return "\n".join(lines)
+
+
+def sprite_sheet_to_gif(
+    image: Image.Image,
+    rows: int,
+    cols: int,
+    duration: int,
+    loop: bool,
+    out_path: str,
+) -> Tuple[int, float]:
+    """
+    精灵图 -> GIF，返回 (帧数, 耗时秒)
+    """
+    started = time.perf_counter()
+    sheet = sheet_to_array(image)
+    frames = slice_frames(sheet, rows, cols)
+    palette = build_palette(frames)
+    indexed = quantize_frames(frames, palette)
+    encode_gif(indexed, palette, out_path, duration, loop, transparent=sheet.shape[2] == 4)
+    return len(frames), time.perf_counter() - started
@@ -0,0 +1,266 @@
+# 精灵图批量转换：多个文件 / 目录 / zip 一次提交，在进程池里按 CPU 核数并行转换
+# - 工作函数必须能被子进程按模块名导入，所以放在 banana 包里（插件以 banana_plugins.* 加载，子进程导入不到）
+# - 进程池用 spawn 启动：主进程里有 Gradio / 调度器等线程，fork 出来的子进程可能卡在它们持有的锁上
+# - run_batch 按完成顺序逐个产出结果，UI 可以边转边往画廊里追加
+import csv
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+
+# 一次批量最多收集的图片数；zip 中单个成员 / 全部成员解压后的字节上限（防 zip 炸弹）
+MAX_INPUT_FILES = 2000
+MAX_ZIP_MEMBER_BYTES = 64 * 1024 * 1024
+MAX_ZIP_TOTAL_BYTES = 1024 * 1024 * 1024
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """进程级共享的转换进程池（默认 CPU 核数个进程），第一次使用时才创建"""
+    global _pool
+    with _pool_lock:
+        # 子进程异常退出后进程池不可再用，重建一个
+        if _pool is not None and getattr(_pool, "_broken", False):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+        if _pool is None:
+            workers = max_workers or os.cpu_count() or 2
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            print(f"[INFO] 精灵图转换进程池已启动：{workers} 个进程")
+        return _pool
+
+
+class _LimitedReader:
+    """包装 zip 成员的读取流：实际解压出的字节数超过 limit 时抛 ValueError（不信任 zip 头里声明的大小）"""
+
+    def __init__(self, src, limit: int, name: str):
+        self._src = src
+        self.limit = limit
+        self.name = name
+        self.read_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._src.read(size if size is not None and size >= 0 else self.limit + 1)
+        self.read_bytes += len(data)
+        if self.read_bytes > self.limit:
+            raise ValueError(f"zip 中的 {self.name} 解压后超过 {self.limit // (1024 * 1024)} MB 上限")
+        return data
+
+
+def is_within_roots(path: str, roots: Iterable[str]) -> bool:
+    """path（解析符号链接后）是否位于 roots 中某个目录之内"""
+    real = os.path.realpath(path)
+    for root in roots:
+        base = os.path.realpath(root)
+        try:
+            if os.path.commonpath([real, base]) == base:
+                return True
+        except ValueError:  # Windows 上不同盘符
+            continue
+    return False
+
+
+def collect_inputs(
+    paths: Iterable[str],
+    extract_dir: Optional[str] = None,
+    max_files: int = MAX_INPUT_FILES,
+    max_member_bytes: int = MAX_ZIP_MEMBER_BYTES,
+    max_zip_bytes: int = MAX_ZIP_TOTAL_BYTES,
+) -> List[str]:
+    """
+    展开输入：图片原样保留，目录递归收集其中的图片，zip 解压其中的图片（只取文件名，防止路径穿越）。
+    返回按出现顺序去重后的图片路径列表。
+    图片总数超过 max_files、zip 成员解压后超过 max_member_bytes 或单个 zip 合计超过 max_zip_bytes 时抛 ValueError；
+    zip 成员按块流式写盘，不整体读进内存。
+    """
+    out: List[str] = []
+    seen = set()
+
+    def _add(p: str) -> None:
+        key = os.path.abspath(p)
+        if key not in seen:
+            if len(out) >= max_files:
+                raise ValueError(f"输入的图片超过 {max_files} 张上限，请分批提交")
+            seen.add(key)
+            out.append(p)
+
+    for raw in paths:
+        if not raw:
+            continue
+        path = Path(str(raw).strip().strip('"'))
+        if path.is_dir():
+            for child in sorted(path.rglob("*")):
+                if child.is_file() and child.suffix.lower() in IMAGE_EXTS:
+                    _add(str(child))
+        elif path.suffix.lower() == ".zip" and path.is_file():
+            target = Path(extract_dir or tempfile.mkdtemp(prefix="sprite_zip_")) / path.stem
+            target.mkdir(parents=True, exist_ok=True)
+            budget = max_zip_bytes
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    name = Path(info.filename).name
+                    if info.is_dir() or Path(name).suffix.lower() not in IMAGE_EXTS or name.startswith("."):
+                        continue
+                    if info.file_size > max_member_bytes or info.file_size > budget:
+                        raise ValueError(f"zip 中的 {name} 过大（{info.file_size / (1024 * 1024):.0f} MB）")
+                    dest = target / name
+                    if dest.exists():
+                        dest = target / f"{dest.stem}_{len(out)}{dest.suffix}"
+                    with zf.open(info) as src:
+                        reader = _LimitedReader(src, min(max_member_bytes, budget), name)
+                        try:
+                            with open(dest, "wb") as dst:
+                                shutil.copyfileobj(reader, dst, 1024 * 1024)
+                        except ValueError:
+                            dest.unlink(missing_ok=True)
+                            raise
+                    budget -= reader.read_bytes
+                    _add(str(dest))
+        elif path.is_file() and path.suffix.lower() in IMAGE_EXTS:
+            _add(str(path))
+    return out
+
+
+def parse_overrides(text: str) -> Dict[str, Dict[str, int]]:
+    """
+    逐文件设置，每行：文件名, 行数, 列数[, 帧间隔ms]（# 开头为注释）
+    文件名不区分大小写，可省略扩展名。返回 {小写文件名或主干名: {"rows", "cols", "duration"}}
+    """
+    result: Dict[str, Dict[str, int]] = {}
+    for row in csv.reader(io.StringIO(text or "")):
+        cells = [c.strip() for c in row]
+        if not cells or not cells[0] or cells[0].startswith("#"):
+            continue
+        if len(cells) < 3:
+            raise ValueError(f"逐文件设置格式应为“文件名, 行数, 列数[, 帧间隔ms]”：{','.join(cells)}")
+        try:
+            item = {"rows": int(cells[1]), "cols": int(cells[2])}
+            if len(cells) > 3 and cells[3]:
+                item["duration"] = int(cells[3])
+        except ValueError:
+            raise ValueError(f"逐文件设置中的数字无法解析：{','.join(cells)}")
+        result[cells[0].lower()] = item
+    return result
+
+
+def _override_for(path: str, overrides: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+    name = Path(path).name.lower()
+    return overrides.get(name) or overrides.get(Path(name).stem) or {}
+
+
+def settings_for(path: str, shared: Dict[str, Any], overrides: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """共享设置 + 该文件的覆盖项（按文件名或主干名匹配）"""
+    return {**shared, **_override_for(path, overrides)}
+
+
+def _safe_stem(path: str) -> str:
+    return re.sub(r"[^\w\-]+", "_", Path(path).stem)[:60] or "sprite"
+
+
+def convert_file(
+    path: str,
+    out_dir: str,
+    index: int,
+    rows: int,
+    cols: int,
+    duration: int,
+    loop: bool,
+    formats: List[str],
+    dedupe: bool = True,
+    auto_grid: bool = False,
+) -> Dict[str, Any]:
+    """
+    在子进程中执行：读图 -> banana.sprite.convert_sprite_sheet。
+    auto_grid 为 True 时先识别网格，识别成功则以识别结果代替 rows / cols。
+    输出文件名为 <序号>_<原文件名><扩展名>，返回值只含可序列化的基础类型。
+    """
+    from PIL import Image
+
+    from banana.sprite import FORMAT_EXT, convert_sprite_sheet, sheet_to_array
+    from banana.sprite_grid import detect_grid
+
+    started = time.perf_counter()
+    stem = f"{index:03d}_{_safe_stem(path)}"
+    row: Dict[str, Any] = {"source": path, "name": Path(path).name, "rows": rows, "cols": cols, "error": "", "results": []}
+    try:
+        with Image.open(path) as img:
+            img.load()
+            cell, occupied = None, None
+            if auto_grid:
+                guess = detect_grid(sheet_to_array(img))
+                if guess.method != "none":
+                    rows, cols, cell, occupied = guess.rows, guess.cols, guess.cell, guess.occupied
+                    row.update(rows=rows, cols=cols, grid=guess.method)
+            report = convert_sprite_sheet(
+                img, rows, cols, duration, loop, formats,
+                lambda fmt: os.path.join(out_dir, stem + FORMAT_EXT[fmt]),
+                dedupe=dedupe, cell=cell, occupied=occupied,
+            )
+        row["frames"] = report["frames"]
+        row["results"] = report["results"]
+        errors = [r["error"] for r in report["results"] if r["error"]]
+        if errors and len(errors) == len(report["results"]):
+            row["error"] = errors[0]
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["elapsed_s"] = time.perf_counter() - started
+    return row
+
+
+def run_batch(
+    files: List[str],
+    shared: Dict[str, Any],
+    overrides: Dict[str, Dict[str, int]],
+    formats: List[str],
+    out_dir: str,
+    dedupe: bool = True,
+    pool: Optional[ProcessPoolExecutor] = None,
+    auto_grid: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    把 files 提交到进程池，按完成顺序逐个产出 convert_file 的结果。
+    auto_grid 时，没有逐文件设置的文件各自识别网格；有逐文件设置的以设置为准。
+    生成器被提前关闭（页面断开 / 取消）时，尚未开始的任务会被取消。
+    """
+    pool = pool or get_process_pool()
+    os.makedirs(out_dir, exist_ok=True)
+    futures: Dict[Future, str] = {}
+    for i, path in enumerate(files, 1):
+        s = settings_for(path, shared, overrides)
+        fut = pool.submit(
+            convert_file, path, out_dir, i,
+            int(s["rows"]), int(s["cols"]), int(s["duration"]), bool(s["loop"]), list(formats), bool(dedupe),
+            bool(auto_grid) and not _override_for(path, overrides),
+        )
+        futures[fut] = path
+    try:
+        for fut in as_completed(futures):
+            try:
+                yield fut.result()
+            except Exception as e:
+                # 子进程崩溃（BrokenProcessPool）等
+                path = futures[fut]
+                yield {"source": path, "name": Path(path).name, "error": f"{type(e).__name__}: {e}", "results": [], "elapsed_s": 0.0}
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+def make_archive(paths: List[str], zip_path: str) -> str:
+    """把输出文件打包为 zip（动图已压缩，按 STORED 存储，不再浪费 CPU）"""
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as zf:
+        for p in paths:
+            zf.write(p, arcname=Path(p).name)
+    return zip_path
@@ -0,0 +1,220 @@
+# 精灵图网格自动识别（纯 NumPy 向量化，4K 以上的图先按步长降采样再分析）
+# 1) 间隙法：有透明通道或纯色背景时，按行 / 列统计前景像素的投影，背景间隙把画面切成行带，
+#    每个行带内再按列切出各帧，得到每帧的包围框；各帧中心拟合出等距网格（起点 + 间距），
+#    能处理四周留白、帧间距不等于图宽 / 列数的排版，以及每行帧数不同的非满格精灵图
+# 2) 交界法：没有可用背景（帧与帧紧贴）时，找整列 / 整行颜色跳变最集中的等分格数
+# 结果只是建议值：UI 把行列数填进输入框，用户仍可手动修改。
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 分析时图像长边的上限（超过则按整数步长降采样）
+ANALYSIS_MAX_SIDE = 2048
+# 每个方向最多识别的格数
+MAX_CELLS = 32
+# 与背景色的最大通道差超过该值视为前景
+BG_TOLERANCE = 24
+# alpha 超过该值视为前景
+ALPHA_FOREGROUND = 16
+# 边框像素中至少这么多比例接近同一颜色，才认为存在纯色背景
+BG_BORDER_RATIO = 0.6
+# 一行 / 一列中前景像素少于该比例视为空（抗锯齿噪点）
+NOISE_RATIO = 0.002
+# 比最大间隙的这个比例还窄的间隙视为帧内部的空隙（如角色两腿之间），予以合并
+INNER_GAP_RATIO = 0.4
+# 交界法：交界处的颜色跳变至少是整体中位数的这么多倍才接受
+SEAM_MIN_SCORE = 3.0
+# 交界法沿均值方向抽样的行 / 列数
+SEAM_SAMPLE_LINES = 512
+
+
+@dataclass
+class GridGuess:
+    rows: int = 1
+    cols: int = 1
+    cell: Tuple[int, int, int, int] = (0, 0, 0, 0)  # 等距网格：(起点 x, 起点 y, 格宽, 格高)，原图坐标
+    boxes: List[Tuple[int, int, int, int]] = field(default_factory=list)  # 各帧内容包围框 (left, top, right, bottom)
+    occupied: List[int] = field(default_factory=list)  # 有内容的格子（行优先下标）；为空表示全部
+    method: str = "none"  # "gutters" / "seams" / "none"
+    confidence: float = 0.0
+    elapsed_ms: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _foreground_mask(arr: np.ndarray) -> Optional[np.ndarray]:
+    """前景掩码：优先用透明通道，其次用边框推断出的纯色背景；都没有时返回 None"""
+    if arr.shape[2] == 4 and arr[..., 3].min() < 255:
+        return arr[..., 3] > ALPHA_FOREGROUND
+    border = np.concatenate([arr[0, :, :3], arr[-1, :, :3], arr[:, 0, :3], arr[:, -1, :3]]).astype(np.int16)
+    bg = np.median(border, axis=0)
+    if (np.abs(border - bg).max(axis=1) <= BG_TOLERANCE).mean() < BG_BORDER_RATIO:
+        return None
+    # 逐通道与 uint8 阈值比较，避免整图转 int16（4K 图上快数倍）
+    lo = np.clip(bg - BG_TOLERANCE, 0, 255).astype(np.uint8)
+    hi = np.clip(bg + BG_TOLERANCE, 0, 255).astype(np.uint8)
+    mask = np.zeros(arr.shape[:2], dtype=bool)
+    for ch in range(3):
+        plane = arr[..., ch]
+        mask |= (plane < lo[ch]) | (plane > hi[ch])
+    return mask
+
+
+def _spans(active: np.ndarray) -> List[Tuple[int, int]]:
+    """布尔序列中连续 True 的区间 [start, end)，并合并帧内部的窄间隙"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    spans = list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+    if len(spans) < 3:
+        return spans
+    gaps = [b[0] - a[1] for a, b in zip(spans, spans[1:])]
+    threshold = max(gaps) * INNER_GAP_RATIO
+    merged = [spans[0]]
+    for span, gap in zip(spans[1:], gaps):
+        if gap < threshold:
+            merged[-1] = (merged[-1][0], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def _fit_axis(centers: List[float], length: int) -> Tuple[int, int, float]:
+    """由各帧中心拟合等距网格，返回 (起点, 间距, 偏差比例)"""
+    n = len(centers)
+    if n == 1:
+        return 0, length, 0.0
+    pitch = (centers[-1] - centers[0]) / (n - 1)
+    if pitch * n > length:
+        pitch = length / n
+    start = int(round(min(max(0.0, centers[0] - pitch / 2), length - pitch * n)))
+    expected = np.array([centers[0] + i * pitch for i in range(n)])
+    deviation = float(np.abs(np.array(centers) - expected).max() / pitch)
+    return start, int(pitch), deviation
+
+
+def _detect_gutters(fg: np.ndarray) -> Optional[GridGuess]:
+    h, w = fg.shape
+    row_active = fg.sum(axis=1) > max(1, w * NOISE_RATIO)
+    bands = _spans(row_active)
+    if not bands:
+        return None
+    band_cols: List[List[Tuple[int, int]]] = []
+    for top, bottom in bands:
+        col_active = fg[top:bottom].sum(axis=0) > max(1, (bottom - top) * NOISE_RATIO)
+        band_cols.append(_spans(col_active))
+    cols = max(len(c) for c in band_cols)
+    rows = len(bands)
+    if rows * cols <= 1 or rows > MAX_CELLS or cols > MAX_CELLS:
+        return None
+
+    boxes = []
+    for (top, bottom), spans in zip(bands, band_cols):
+        for left, right in spans:
+            ys = np.flatnonzero(fg[top:bottom, left:right].any(axis=1))
+            boxes.append((left, top + int(ys[0]), right, top + int(ys[-1]) + 1))
+
+    # 列中心取帧数最多的行带；行中心取各行带
+    widest = max(range(rows), key=lambda i: len(band_cols[i]))
+    x0, pitch_x, dev_x = _fit_axis([(a + b) / 2 for a, b in band_cols[widest]], w)
+    y0, pitch_y, dev_y = _fit_axis([(a + b) / 2 for a, b in bands], h)
+
+    occupied = sorted({
+        min(rows - 1, max(0, int(((t + b) / 2 - y0) // pitch_y))) * cols
+        + min(cols - 1, max(0, int(((l + r) / 2 - x0) // pitch_x)))
+        for l, t, r, b in boxes
+    })
+    return GridGuess(
+        rows=rows, cols=cols, cell=(x0, y0, pitch_x, pitch_y), boxes=boxes,
+        occupied=[] if len(occupied) == rows * cols else occupied,
+        method="gutters", confidence=round(max(0.0, 1.0 - 2 * max(dev_x, dev_y)), 2),
+    )
+
+
+def _seam_strength(arr: np.ndarray, axis: int) -> np.ndarray:
+    """相邻两列（axis=1）/ 两行（axis=0）之间的平均颜色跳变，长度为该方向像素数 - 1"""
+    # 求均值的那个方向再抽稀到 SEAM_SAMPLE_LINES 条左右，交界位置的精度不受影响
+    other = 1 - axis
+    step = max(1, arr.shape[other] // SEAM_SAMPLE_LINES)
+    arr = arr[::step] if other == 0 else arr[:, ::step]
+    strength = np.zeros(arr.shape[axis] - 1, dtype=np.float32)
+    for ch in range(3):
+        plane = arr[..., ch].astype(np.int16)
+        strength += np.abs(np.diff(plane, axis=axis)).mean(axis=1 - axis, dtype=np.float32)
+    return strength
+
+
+def _seam_count(strength: np.ndarray) -> Tuple[int, float]:
+    """
+    帧紧贴时，帧与帧的交界处会出现整列 / 整行的颜色跳变。
+    k 格时取各交界处（±1 像素）的跳变均值与整体中位数之比作为得分；
+    k 的约数的交界是 k 的交界的子集、得分相近，所以在接近最高分的候选里取最大的 k。
+    返回 (格数, 置信度)。
+    """
+    n = len(strength) + 1
+    baseline = float(np.median(strength)) + 1.0
+    scores = {}
+    for k in range(2, MAX_CELLS + 1):
+        size = n // k
+        if size < 8:
+            break
+        seams = np.arange(1, k) * size - 1
+        window = np.stack([strength[np.clip(seams + d, 0, n - 2)] for d in (-1, 0, 1)])
+        scores[k] = float(window.max(axis=0).mean()) / baseline
+    if not scores:
+        return 1, 0.0
+    best = max(scores.values())
+    if best < SEAM_MIN_SCORE:
+        return 1, 0.0
+    k = max(k for k, s in scores.items() if s >= best * 0.8)
+    return k, round(min(1.0, scores[k] / (SEAM_MIN_SCORE * 4)), 2)
+
+
+def detect_grid(arr: np.ndarray) -> GridGuess:
+    """
+    arr: banana.sprite.sheet_to_array 的结果（HxWx3 / HxWx4 uint8）。
+    返回 GridGuess；method == "none" 表示没有识别出网格。
+    """
+    started = time.perf_counter()
+    h, w = arr.shape[:2]
+    step = max(1, -(-max(h, w) // ANALYSIS_MAX_SIDE))
+    small = arr[::step, ::step]
+
+    guess: Optional[GridGuess] = None
+    fg = _foreground_mask(small)
+    if fg is not None and fg.any():
+        guess = _detect_gutters(fg)
+    if guess is None:
+        cols, conf_x = _seam_count(_seam_strength(small, axis=1))
+        rows, conf_y = _seam_count(_seam_strength(small, axis=0))
+        sh, sw = small.shape[:2]
+        guess = GridGuess(
+            rows=rows, cols=cols, cell=(0, 0, sw // cols, sh // rows),
+            method="seams" if rows * cols > 1 else "none",
+            confidence=min(c for c, n in ((conf_x, cols), (conf_y, rows), (1.0, 2)) if n > 1),
+        )
+
+    if step > 1:
+        x0, y0, cw, ch = guess.cell
+        guess.cell = (x0 * step, y0 * step, cw * step, ch * step)
+        guess.boxes = [(l * step, t * step, min(w, r * step), min(h, b * step)) for l, t, r, b in guess.boxes]
+    # 降采样 / 取整后确保网格不越界
+    x0, y0, cw, ch = guess.cell
+    cw, ch = min(cw, (w - x0) // guess.cols), min(ch, (h - y0) // guess.rows)
+    guess.cell = (x0, y0, cw, ch)
+    guess.elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    return guess
+
+
+def format_grid_guess(guess: GridGuess) -> str:
+    if guess.method == "none":
+        return f"未识别出网格（{guess.elapsed_ms:.0f} ms），请手动填写行列数"
+    method = "背景间隙" if guess.method == "gutters" else "帧交界"
+    x0, y0, cw, ch = guess.cell
+    text = f"🔍 {guess.rows} 行 × {guess.cols} 列（{method}，置信度 {guess.confidence:.0%}，{guess.elapsed_ms:.0f} ms），每帧 {cw}×{ch}"
+    if x0 or y0:
+        text += f"，起点 ({x0}, {y0})"
+    if guess.occupied:
+        text += f"，有内容的格子 {len(guess.occupied)} / {guess.rows * guess.cols}"
+    return text
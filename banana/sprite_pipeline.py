@@ -0,0 +1,193 @@
+# 精灵动画流水线：画图模型逐帧并发生成 -> 内存中拼成精灵图 -> 直接交给 banana.sprite 转换
+# - 每帧是一次独立的 call_gemini_vertex，经全局调度器排队（并发度 / 公平性与队列任务一致），
+#   经路由器在主模型熔断时切换备选，失败按全局重试策略退让
+# - 一致性靠共享参考图：用户给了参考图就所有帧共用；没给时先生成第 1 帧作为关键帧，
+#   其余帧以它为参考并发生成
+# - 生成的单帧由 call_gemini_vertex 照常保存（方便单独下载 / 重用）；拼好的精灵图只存在于内存，
+#   不再经过“下载 -> 上传”
+# - 硬预算：每帧发出请求前检查，超出时尚未发出的帧暂停等待（与队列的预算暂停一致），期间产出暂停状态
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from banana.cancellation import CancelledError
+from banana.pricing import estimate_latency
+from banana.retry import get_retry_policy
+from banana.routing import get_router
+from banana.scheduler import PRIORITY_HIGH, get_scheduler
+
+# 单个动画最多的帧数
+PIPELINE_MAX_FRAMES = 32
+# 等待调度结果的线程数（真正的并发度由调度器的 max_concurrency 决定）
+PIPELINE_WORKERS = 8
+# 硬预算超出时重新检查的间隔（秒）
+BUDGET_POLL_S = 10.0
+
+FRAME_PROMPT_TEMPLATE = (
+    "{subject}\n\n"
+    "This is frame {index} of {total} of a seamlessly looping \"{action}\" animation. "
+    "Show the pose at {percent}% of the cycle. Keep the exact same character design, colors, proportions, "
+    "camera angle, framing and scale as the reference image; only the pose changes. "
+    "Full body, centered, plain solid background, no text, no borders."
+)
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="banana-sprite-gen")
+
+
+def frame_prompts(subject: str, action: str, frames: int) -> List[str]:
+    """每帧一条提示词：同一主体，动作循环中的不同相位"""
+    frames = max(1, min(PIPELINE_MAX_FRAMES, int(frames)))
+    return [
+        FRAME_PROMPT_TEMPLATE.format(
+            subject=subject.strip(), action=(action or "idle").strip(),
+            index=i + 1, total=frames, percent=round(100 * i / frames),
+        )
+        for i in range(frames)
+    ]
+
+
+def load_frame(path: str, max_side: int = 0) -> Image.Image:
+    """读入生成的单帧（RGBA）；max_side > 0 时按长边缩小"""
+    with Image.open(path) as img:
+        frame = img.convert("RGBA")
+    if max_side and max(frame.size) > max_side:
+        scale = max_side / max(frame.size)
+        frame = frame.resize((max(1, round(frame.width * scale)), max(1, round(frame.height * scale))), Image.LANCZOS)
+    return frame
+
+
+def assemble_sheet(frames: Sequence[Image.Image], cols: int) -> Tuple[Image.Image, int, int, List[int]]:
+    """
+    把各帧按行优先拼成一张精灵图（内存中），尺寸不一致的帧缩放到第一帧的大小。
+    返回 (精灵图, 行数, 列数, 有内容的格子)；最后一行不满时 occupied 列出有内容的格子，否则为空列表。
+    """
+    if not frames:
+        raise ValueError("没有可拼接的帧")
+    cols = max(1, min(int(cols), len(frames)))
+    rows = math.ceil(len(frames) / cols)
+    fw, fh = frames[0].size
+    sheet = np.zeros((rows * fh, cols * fw, 4), dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        if frame.size != (fw, fh):
+            frame = frame.resize((fw, fh), Image.LANCZOS)
+        r, c = divmod(i, cols)
+        sheet[r * fh:(r + 1) * fh, c * fw:(c + 1) * fw] = np.asarray(frame.convert("RGBA"))
+    occupied = [] if len(frames) == rows * cols else list(range(len(frames)))
+    return Image.fromarray(sheet, "RGBA"), rows, cols, occupied
+
+
+def generate_frames(
+    call_fn: Callable[..., Tuple[str, List[str]]],
+    prompts: List[str],
+    reference_images: List[str],
+    model_name: str,
+    call_kwargs: Dict[str, Any],
+    key_frame: bool = True,
+    flow: str = "",
+    priority: int = PRIORITY_HIGH,
+    cancel_token=None,
+    usage_tags: Optional[Dict[str, Any]] = None,
+    budget_gate: Optional[Callable[[], str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    生成各帧，按完成顺序产出 {"index", "path", "model", "error"}。
+    call_fn: call_gemini_vertex（或宿主的 call_model）；call_kwargs 为除模型 / 提示词 / 参考图以外的参数。
+    key_frame: 没有参考图时先生成第 1 帧，其余帧以它为参考。
+    budget_gate: 每帧发出请求前调用，返回非空说明（硬预算已超出）时该帧暂停，每 BUDGET_POLL_S 秒重新检查；
+        暂停期间额外产出 {"index": -1, "paused": 说明}（每次进入暂停产出一次）
+    被取消时尚未开始的帧直接出队，已产出的结果保留。
+    """
+    scheduler = get_scheduler()
+    router = get_router()
+    policy = get_retry_policy()
+    size = call_kwargs.get("image_size", "1K")
+    paused: Dict[int, str] = {}  # 正在等待预算的帧 -> 说明
+    paused_lock = threading.Lock()
+
+    def _wait_budget(index: int) -> None:
+        msg = budget_gate() if budget_gate is not None else ""
+        try:
+            while msg:
+                with paused_lock:
+                    paused[index] = msg
+                if cancel_token is not None:
+                    if cancel_token.sleep(BUDGET_POLL_S):
+                        cancel_token.raise_if_cancelled()
+                else:
+                    time.sleep(BUDGET_POLL_S)
+                msg = budget_gate()
+        finally:
+            with paused_lock:
+                paused.pop(index, None)
+
+    def _one(index: int, refs: List[str]) -> Dict[str, Any]:
+        def _call(m: str):
+            # 拿到调度槽位、真正发请求前才检查预算：排队中的帧在预算超出后不会再发出
+            _wait_budget(index)
+            return call_fn(
+                model_name=m,
+                history_messages=[],
+                user_text=prompts[index],
+                user_images=list(refs),
+                cancel_token=cancel_token,
+                usage_tags={**(usage_tags or {}), "source": "sprite_pipeline"},
+                **call_kwargs,
+            )
+
+        def _attempt():
+            return router.call(
+                model_name,
+                lambda m: scheduler.run(
+                    lambda: _call(m),
+                    flow=flow,
+                    priority=priority,
+                    cost=estimate_latency(m, size, False),
+                    label=f"动画帧 {index + 1}/{len(prompts)}",
+                    cancel_token=cancel_token,
+                ),
+            )
+
+        row: Dict[str, Any] = {"index": index, "path": None, "model": model_name, "error": ""}
+        try:
+            (text, paths), used = policy.run(_attempt, token=cancel_token)
+            row["model"] = used
+            if paths:
+                row["path"] = paths[0]
+            else:
+                row["error"] = (text or "模型没有返回图片").strip()[:200]
+        except CancelledError as e:
+            row["error"] = f"已取消：{e}"
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+        return row
+
+    refs = list(reference_images or [])
+    start = 0
+    if not refs and key_frame and len(prompts) > 1:
+        first = _one(0, [])
+        yield first
+        if first["path"]:
+            refs = [first["path"]]
+        start = 1
+
+    futures = [_executor.submit(_one, i, refs) for i in range(start, len(prompts))]
+    pending = set(futures)
+    was_paused = False
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield fut.result()
+            with paused_lock:
+                msg = next(iter(paused.values()), "")
+            if msg and not was_paused:
+                yield {"index": -1, "path": None, "model": model_name, "error": "", "paused": msg}
+            was_paused = bool(msg)
+    finally:
+        for fut in futures:
+            fut.cancel()
@@ -0,0 +1,146 @@
+# 启动耗时分析：python nano_banana_pro.py --profile-startup
+# 父进程用 `python -X importtime` 重新拉起入口脚本，子进程（带 BANANA_STARTUP_PROFILE 环境变量）
+# 照常走完启动流程但不 launch，把各阶段 / 各插件耗时写成 JSON；
+# 父进程再把 importtime 输出按顶层包聚合，合成一份报告。
+# 基准脚本 benchmarks/startup.py 复用这里的 profile_startup 检查启动预算。
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 子进程 JSON 输出路径（同时作为“正在分析”的标记）
+PROFILE_ENV = "BANANA_STARTUP_PROFILE"
+# 启动预算（秒）：进程启动 → UI 构建完成，基准脚本默认按这个值判定
+STARTUP_BUDGET_S = 8.0
+# 这些模块应该推迟到第一次请求时才导入，出现在启动路径里视为回退
+LAZY_MODULES = ("google.genai",)
+
+_phases: List[Dict[str, Any]] = []
+_plugins: List[Dict[str, Any]] = []
+
+
+def is_profiling() -> bool:
+    """当前进程是否是 --profile-startup 拉起的子进程"""
+    return bool(os.environ.get(PROFILE_ENV))
+
+
+@contextmanager
+def phase(name: str):
+    """记录一个启动阶段的耗时（不在分析模式下也只是多一次计时，开销可以忽略）"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append({"name": name, "ms": (time.perf_counter() - t0) * 1000})
+
+
+def record_plugins(report: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """保存 load_plugins_from_dir 返回的插件加载报告，原样返回"""
+    _plugins[:] = list(report or [])
+    return report
+
+
+def write_profile(path: str | None = None) -> None:
+    """子进程：把阶段 / 插件耗时和已加载的惰性模块写到 JSON"""
+    path = path or os.environ.get(PROFILE_ENV)
+    if not path:
+        return
+    data = {
+        "phases": _phases,
+        "plugins": _plugins,
+        "lazy_loaded": [m for m in LAZY_MODULES if m in sys.modules],
+    }
+    Path(path).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def parse_importtime(stderr: str) -> Dict[str, float]:
+    """
+    解析 -X importtime 的输出，按顶层包聚合 self 时间（毫秒）。
+    行格式：`import time:      self |  cumulative | <缩进>package.module`
+    """
+    totals: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0].strip())
+        except ValueError:
+            continue  # 表头
+        top = parts[2].strip().split(".")[0]
+        totals[top] = totals.get(top, 0.0) + self_us / 1000
+    return totals
+
+
+def profile_startup(script: str, args: List[str] | None = None, timeout: float = 300) -> Dict[str, Any]:
+    """
+    用 -X importtime 跑一遍 `script --profile-startup`，返回：
+    {wall_s, returncode, imports: {包: ms}, phases, plugins, lazy_loaded, error}
+    """
+    fd, out_path = tempfile.mkstemp(prefix="banana_startup_", suffix=".json")
+    os.close(fd)
+    env = dict(os.environ, **{PROFILE_ENV: out_path})
+    cmd = [sys.executable, "-X", "importtime", script, "--profile-startup", *(args or [])]
+    t0 = time.perf_counter()
+    try:
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True, timeout=timeout)
+        wall = time.perf_counter() - t0
+        try:
+            data = json.loads(Path(out_path).read_text(encoding="utf-8") or "{}")
+        except (OSError, ValueError):
+            data = {}
+    finally:
+        try:
+            os.remove(out_path)
+        except OSError:
+            pass
+
+    error = ""
+    if proc.returncode != 0 or not data:
+        # importtime 的行混在 stderr 里，只保留真正的报错部分
+        tail = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+        error = "\n".join(tail[-20:]) or f"exit code {proc.returncode}"
+    return {
+        "wall_s": wall,
+        "returncode": proc.returncode,
+        "imports": parse_importtime(proc.stderr),
+        "phases": data.get("phases", []),
+        "plugins": data.get("plugins", []),
+        "lazy_loaded": data.get("lazy_loaded", []),
+        "error": error,
+    }
+
+
+def format_startup_report(report: Dict[str, Any], top: int = 15) -> str:
+    lines = ["=== 启动耗时分析 ===", f"总耗时（进程启动 → UI 就绪）: {report['wall_s']:.2f}s"]
+    if report.get("error"):
+        lines += ["", "[ERROR] 子进程启动失败:", report["error"]]
+        return "\n".join(lines)
+
+    imports = sorted(report["imports"].items(), key=lambda kv: -kv[1])
+    total_import = sum(ms for _, ms in imports)
+    lines += ["", f"[导入] 合计 {total_import:.0f}ms，按顶层包 (self 时间) Top {top}:"]
+    for name, ms in imports[:top]:
+        lines.append(f"  {name:<28}{ms:>9.1f}ms")
+
+    lines += ["", "[阶段]"]
+    for p in report["phases"]:
+        lines.append(f"  {p['name']:<28}{p['ms']:>9.1f}ms")
+
+    if report["plugins"]:
+        lines += ["", "[插件]"]
+        for p in report["plugins"]:
+            lines.append(
+                f"  {p['name']:<20} 导入 {p.get('import_ms', 0):>7.1f}ms / 构建 {p.get('build_ms', 0):>7.1f}ms  ({p.get('status', '')})"
+            )
+
+    if report["lazy_loaded"]:
+        lines += ["", f"[WARN] 以下模块应当惰性导入，却出现在启动路径中: {', '.join(report['lazy_loaded'])}"]
+    return "\n".join(lines)
@@ -0,0 +1,606 @@
+# 输出目录的磁盘配额与 LRU 清理（outputs/、outputs/gif/、exports/ …）
+# - 每个目录单独配置容量上限 / 最长保留时间；嵌套目录归属最深的那个配置（outputs/gif 不计入 outputs）
+# - 最近使用时间 = max(修改时间, 访问时间, 进程内 touch 的时间)，超额时从最久未用的开始删
+# - 不删：固定（pin）的文件 / 目录、活跃会话引用的文件、宽限期内刚写入的文件
+# - 增量扫描：记住每个目录的 mtime 和子目录列表，目录 mtime 没变就不重新列举其中的文件，
+#   每轮最多重新列举 max_dirs_per_pass 个目录；首次建索引也分摊到多轮完成
+# - 写盘遇到磁盘已满（ENOSPC）时可调用 reclaim_now() 立即清理后重试，不再让整个实例挂掉
+# - 原图与 variants/ 下它的变体、清单（banana.variants）是同一个清理单位，一起保留或一起删除；
+#   原图已迁到冷存储时清单不删（冷存储里的原图要靠它找到）
+# - 多进程：固定列表在锁文件保护下“重新读取 -> 合并 -> 原子写回”，每轮清理前也重新读取；
+#   会话引用登记在共享的会话存储里，任一进程的清理线程都能看到其他进程的活跃会话
+import errno
+import json
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from banana.filelock import FileLock
+from banana.variants import VARIANT_DIR
+
+# 清理单位：逐个文件，或以根目录下的一级子目录为整体（exports/<会话> 里的 chat.md 与图片一起删）
+UNIT_FILE = "file"
+UNIT_DIR = "dir"
+
+MB = 1024 * 1024
+
+# 会话引用在会话存储中的位置：每个引用一条记录 (HOLDS_SESSION, 引用 ID) -> [路径...]，过期由存储的 TTL 负责
+HOLDS_SESSION = "storage-holds"
+
+
+@dataclass
+class RootPolicy:
+    path: str
+    max_bytes: int = 0      # 0 = 不限容量
+    max_age_s: float = 0.0  # 0 = 不限时间
+    unit: str = UNIT_FILE
+
+
+@dataclass
+class _DirState:
+    root: str
+    mtime_ns: int = -1
+    files: Dict[str, Tuple[int, float]] = field(default_factory=dict)  # 文件名 -> (字节数, 最近使用时间)
+    subdirs: List[str] = field(default_factory=list)
+
+
+@dataclass
+class _Item:
+    path: str
+    size: int
+    last_used: float
+    is_dir: bool = False
+    members: List[str] = field(default_factory=list)  # 同一单位的文件（原图 + 变体 + 清单）；为空时只有 path
+
+
+def _norm(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _paths_in(value: Any, out: Set[str]) -> None:
+    """从任意嵌套的 list / dict 中收集字符串（会话记录里的图片路径）"""
+    if isinstance(value, str):
+        if value and len(value) < 1024:
+            out.add(value)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _paths_in(v, out)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _paths_in(v, out)
+
+
+def _is_protected(item: _Item, protected: Set[str]) -> bool:
+    """自身 / 任一成员、任一上级目录被固定 / 引用，或（目录单位时）其中有文件被固定 / 引用"""
+    for path in [item.path, *item.members]:
+        while True:
+            if path in protected:
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return item.is_dir and any(p.startswith(item.path + os.sep) for p in protected)
+
+
+def _variant_owner(name: str, stems: Dict[str, str]) -> Optional[str]:
+    """variants/ 下的文件名 <主干>.<变体名>.<扩展名> / <主干>.json 对应的原图文件名（stems: 主干 -> 原图文件名）"""
+    stem = name
+    while True:
+        stem, ext = os.path.splitext(stem)
+        if not ext:
+            return None
+        if stem in stems:
+            return stems[stem]
+
+
+class StorageManager:
+    """
+    roots: 受管目录及其策略
+    min_free_bytes: 所在磁盘剩余空间低于该值时，跨目录按 LRU 额外清理
+    grace_s: 修改时间在这么多秒以内的文件不删（可能正被写入 / 刚返回给页面）
+    hold_ttl_s: 会话引用的保留时长，会话每次保存时续期
+    pins_path: 固定列表的保存位置（JSON）
+    hold_store: 登记会话引用的共享会话存储（SessionStore）；None 时只记在本进程内
+    """
+
+    def __init__(
+        self,
+        roots: Iterable[RootPolicy],
+        min_free_bytes: int = 0,
+        grace_s: float = 600.0,
+        hold_ttl_s: float = 86400.0,
+        pins_path: Optional[str] = None,
+        max_dirs_per_pass: int = 200,
+        hold_store: Any = None,
+    ):
+        # 深的在前：判断归属时先匹配最深的根目录
+        self.roots = sorted(roots, key=lambda r: len(_norm(r.path)), reverse=True)
+        self.min_free_bytes = int(min_free_bytes)
+        self.grace_s = float(grace_s)
+        self.hold_ttl_s = float(hold_ttl_s)
+        self.pins_path = pins_path
+        self.max_dirs_per_pass = max(1, int(max_dirs_per_pass))
+        self.hold_store = hold_store
+        self._lock = threading.RLock()
+        self._dirs: Dict[str, _DirState] = {}
+        self._touched: Dict[str, float] = {}
+        # 本进程登记的引用；使用共享存储时为最近一次读到的全部引用
+        self._holds: Dict[str, Tuple[float, Set[str]]] = {}
+        # 引用 ID -> (上次写入共享存储的时间, 路径)，内容没变时不必每次都写
+        self._hold_written: Dict[str, Tuple[float, Set[str]]] = {}
+        self._pins: Set[str] = self._load_pins()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, Any] = {
+            "sweeps": 0, "reclaimed_files": 0, "reclaimed_bytes": 0, "protected": 0,
+            "last_sweep": 0.0, "last_sweep_ms": 0.0, "last_relisted": 0, "errors": 0,
+        }
+        self._per_root: Dict[str, Dict[str, int]] = {}
+
+    # ---------- 固定 / 引用 / 访问 ----------
+    def _load_pins(self) -> Set[str]:
+        if not self.pins_path or not os.path.exists(self.pins_path):
+            return set()
+        try:
+            with open(self.pins_path, "r", encoding="utf-8") as f:
+                return {_norm(p) for p in json.load(f)}
+        except Exception as e:
+            print(f"[WARN] 读取固定列表 {self.pins_path} 失败：{e}")
+            return set()
+
+    def _save_pins(self) -> None:
+        if not self.pins_path:
+            return
+        tmp = f"{self.pins_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sorted(self._pins), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.pins_path)
+
+    def _reload_pins(self) -> None:
+        """重新读取固定列表（其他进程可能刚改过）"""
+        if not self.pins_path:
+            return
+        with self._lock, FileLock(f"{self.pins_path}.lock"):
+            self._pins = self._load_pins()
+
+    def _change_pins(self, add: Set[str], remove: Set[str]) -> int:
+        """锁文件内重新读取最新列表、合并本次改动再写回，不覆盖其他进程的固定；返回实际变化的项数"""
+        with self._lock:
+            if not self.pins_path:
+                before = set(self._pins)
+                self._pins = (before | add) - remove
+                return len(self._pins ^ before)
+            with FileLock(f"{self.pins_path}.lock"):
+                before = self._load_pins()
+                self._pins = (before | add) - remove
+                if self._pins != before:
+                    self._save_pins()
+                return len(self._pins ^ before)
+
+    def pin(self, *paths: str) -> int:
+        return self._change_pins({_norm(p) for p in paths if p}, set())
+
+    def unpin(self, *paths: str) -> int:
+        return self._change_pins(set(), {_norm(p) for p in paths if p})
+
+    def pins(self) -> List[str]:
+        self._reload_pins()
+        with self._lock:
+            return sorted(self._pins)
+
+    def touch(self, *paths: str) -> None:
+        """记录一次使用（例如被重新引用 / 下载），刷新 LRU 顺序"""
+        now = time.time()
+        with self._lock:
+            for p in paths:
+                if p:
+                    self._touched[_norm(p)] = now
+
+    def hold(self, session_id: str, *values: Any) -> None:
+        """
+        登记会话引用的文件：values 可以是路径，也可以是包含路径的会话记录（list / dict）。
+        同一会话再次登记时替换旧的引用并续期。
+        """
+        if not session_id:
+            return
+        found: Set[str] = set()
+        for v in values:
+            _paths_in(v, found)
+        managed = {_norm(p) for p in found if self._root_of(_norm(p)) is not None}
+        now = time.time()
+        expires_at = now + self.hold_ttl_s
+        with self._lock:
+            self._holds[session_id] = (expires_at, managed)
+            if self.hold_store is None:
+                return
+            last = self._hold_written.get(session_id)
+            if last is None and not managed:
+                return
+            # 同样的引用在十分之一 TTL 内已写过，不必重写（queue 每产出一张都会登记一次）
+            if last is not None and last[1] == managed and now - last[0] < self.hold_ttl_s / 10:
+                return
+            for sid in [s for s, (t, _) in self._hold_written.items() if now - t > self.hold_ttl_s]:
+                del self._hold_written[sid]
+            self._hold_written[session_id] = (now, managed)
+        try:
+            self.hold_store.put(HOLDS_SESSION, session_id, sorted(managed), ttl=self.hold_ttl_s)
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"[WARN] 登记会话引用失败：{e}")
+
+    def release(self, session_id: str) -> None:
+        with self._lock:
+            self._holds.pop(session_id, None)
+            self._hold_written.pop(session_id, None)
+        if self.hold_store is not None:
+            try:
+                self.hold_store.drop(HOLDS_SESSION, session_id)
+            except Exception as e:
+                self._stats["errors"] += 1
+                print(f"[WARN] 释放会话引用失败：{e}")
+
+    def _protected(self, now: float) -> Set[str]:
+        """当前受保护的路径：所有进程登记的未过期引用 + 最新的固定列表"""
+        self._reload_pins()
+        shared = None
+        if self.hold_store is not None:
+            # 读不到共享引用时抛出，本轮不清理，宁可多留文件也不误删
+            shared = self.hold_store.fields(HOLDS_SESSION)
+        with self._lock:
+            if shared is not None:
+                # 过期由存储的 TTL 负责；读到的都是有效引用
+                expires_at = now + self.hold_ttl_s
+                self._holds = {sid: (expires_at, {_norm(p) for p in paths}) for sid, paths in shared.items()}
+            for sid in [s for s, (exp, _) in self._holds.items() if exp < now]:
+                del self._holds[sid]
+            held = set().union(*(paths for _, paths in self._holds.values())) if self._holds else set()
+            return held | self._pins
+
+    def protected_paths(self) -> Set[str]:
+        """当前受保护的路径（已规范化）：供冷存储迁移等其他会移动文件的逻辑跳过"""
+        return self._protected(time.time())
+
+    def is_protected(self, path: str, protected: Optional[Set[str]] = None) -> bool:
+        """path 自身或其上级目录是否被固定 / 引用；批量判断时先取一次 protected_paths() 传入"""
+        if protected is None:
+            protected = self.protected_paths()
+        return _is_protected(_Item(_norm(path), 0, 0.0), protected)
+
+    # ---------- 增量索引 ----------
+    def _root_of(self, path: str) -> Optional[RootPolicy]:
+        for r in self.roots:
+            base = _norm(r.path)
+            if path == base or path.startswith(base + os.sep):
+                return r
+        return None
+
+    def _forget_dir(self, path: str) -> None:
+        prefix = path + os.sep
+        for d in [d for d in self._dirs if d == path or d.startswith(prefix)]:
+            del self._dirs[d]
+
+    def _relist(self, path: str, state: _DirState, mtime_ns: int) -> None:
+        files: Dict[str, Tuple[int, float]] = {}
+        subdirs: List[str] = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(_norm(entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        files[entry.name] = (st.st_size, max(st.st_mtime, st.st_atime))
+                except FileNotFoundError:
+                    continue
+        for gone in set(state.subdirs) - set(subdirs):
+            self._forget_dir(gone)
+        state.files, state.subdirs, state.mtime_ns = files, subdirs, mtime_ns
+
+    def refresh(self, max_dirs: Optional[int] = None) -> int:
+        """
+        增量更新索引：每个目录 stat 一次，只有 mtime 变化的目录才重新列举文件。
+        返回本轮重新列举的目录数；超过 max_dirs 的留到下一轮。
+        """
+        budget = self.max_dirs_per_pass if max_dirs is None else max_dirs
+        relisted = 0
+        with self._lock:
+            for root in self.roots:
+                base = _norm(root.path)
+                stack = [base]
+                while stack:
+                    d = stack.pop()
+                    if d != base and self._root_of(d) is not root:
+                        continue  # 属于更深的另一个受管目录
+                    try:
+                        mtime_ns = os.stat(d).st_mtime_ns
+                    except FileNotFoundError:
+                        self._forget_dir(d)
+                        continue
+                    state = self._dirs.get(d)
+                    if state is None or state.mtime_ns != mtime_ns:
+                        if relisted >= budget:
+                            if state is None:
+                                continue
+                        else:
+                            state = state or self._dirs.setdefault(d, _DirState(root=base))
+                            try:
+                                self._relist(d, state, mtime_ns)
+                                relisted += 1
+                            except OSError as e:
+                                self._stats["errors"] += 1
+                                print(f"[WARN] 列举目录 {d} 失败：{e}")
+                    stack.extend(state.subdirs)
+        return relisted
+
+    def _items(self, root: RootPolicy) -> List[_Item]:
+        base = _norm(root.path)
+        touched = self._touched
+        items: Dict[str, _Item] = {}
+        for d, state in self._dirs.items():
+            if state.root != base:
+                continue
+            parent = os.path.dirname(d)
+            variants_of = None
+            if os.path.basename(d) == VARIANT_DIR and (root.unit == UNIT_FILE or parent == base):
+                parent_state = self._dirs.get(parent)
+                variants_of = {os.path.splitext(n)[0]: n for n in (parent_state.files if parent_state else {})}
+            for name, (size, used) in state.files.items():
+                path = os.path.join(d, name)
+                used = max(used, touched.get(path, 0.0))
+                if variants_of is not None:
+                    owner = _variant_owner(name, variants_of)
+                    if owner is None and name.endswith(".json"):
+                        continue  # 原图已迁到冷存储（或还没列举到）：清单保留
+                    key = os.path.join(parent, owner) if owner else path
+                elif root.unit == UNIT_DIR and d != base:
+                    # 归入根目录下的一级子目录：大小累加，最近使用取最大
+                    key = os.path.join(base, os.path.relpath(d, base).split(os.sep)[0])
+                    item = items.setdefault(key, _Item(key, 0, 0.0, is_dir=True))
+                    item.size += size
+                    item.last_used = max(item.last_used, used)
+                    continue
+                else:
+                    key = path
+                item = items.setdefault(key, _Item(key, 0, 0.0))
+                item.members.append(path)
+                item.size += size
+                item.last_used = max(item.last_used, used)
+        return list(items.values())
+
+    # ---------- 清理 ----------
+    def _delete(self, item: _Item) -> bool:
+        if item.is_dir:
+            try:
+                shutil.rmtree(item.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self._stats["errors"] += 1
+                print(f"[WARN] 清理 {item.path} 失败：{e}")
+                return False
+            self._forget_dir(item.path)
+            self._touched.pop(item.path, None)
+            return True
+        # 先删变体、再删清单、最后删原图：中途失败时原图和清单还在，不会留下找不到原图的变体
+        order = {path: (path == item.path, path.endswith(".json")) for path in item.members or [item.path]}
+        for path in sorted(order, key=order.get):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self._stats["errors"] += 1
+                print(f"[WARN] 清理 {path} 失败：{e}")
+                return False
+            state = self._dirs.get(os.path.dirname(path))
+            if state is not None:
+                state.files.pop(os.path.basename(path), None)
+            self._touched.pop(path, None)
+        return True
+
+    def _evict(self, items: List[_Item], need_bytes: int, max_age_s: float, now: float, protected: Set[str]) -> Tuple[int, int]:
+        """按最近使用时间从旧到新删除：过期的全部删，之后删到腾出 need_bytes 为止"""
+        files = freed = 0
+        for item in sorted(items, key=lambda i: i.last_used):
+            expired = max_age_s > 0 and now - item.last_used > max_age_s
+            if not expired and need_bytes - freed <= 0:
+                break
+            if now - item.last_used < self.grace_s or _is_protected(item, protected):
+                self._stats["protected"] += 1
+                continue
+            if self._delete(item):
+                files += 1
+                freed += item.size
+        return files, freed
+
+    def sweep(self, max_dirs: Optional[int] = None) -> Dict[str, Any]:
+        """一轮：增量刷新索引 -> 各目录按配额清理 -> 磁盘剩余空间不足时跨目录清理"""
+        started = time.perf_counter()
+        now = time.time()
+        relisted = self.refresh(max_dirs)
+        protected = self._protected(now)
+        reclaimed_files = reclaimed_bytes = 0
+        with self._lock:
+            for root in self.roots:
+                items = self._items(root)
+                total = sum(i.size for i in items)
+                over = total - root.max_bytes if root.max_bytes > 0 else 0
+                n, freed = self._evict(items, over, root.max_age_s, now, protected)
+                per = self._per_root.setdefault(root.path, {"reclaimed_files": 0, "reclaimed_bytes": 0})
+                per.update(files=len(items) - n, bytes=total - freed)
+                per["reclaimed_files"] += n
+                per["reclaimed_bytes"] += freed
+                reclaimed_files += n
+                reclaimed_bytes += freed
+
+            if self.min_free_bytes > 0:
+                n, freed = self._reclaim_free_space(now, protected)
+                reclaimed_files += n
+                reclaimed_bytes += freed
+
+            self._stats["sweeps"] += 1
+            self._stats["reclaimed_files"] += reclaimed_files
+            self._stats["reclaimed_bytes"] += reclaimed_bytes
+            self._stats["last_sweep"] = now
+            self._stats["last_sweep_ms"] = (time.perf_counter() - started) * 1000
+            self._stats["last_relisted"] = relisted
+        if reclaimed_files:
+            print(f"[INFO] 存储清理：删除 {reclaimed_files} 项，释放 {reclaimed_bytes / MB:.1f} MB")
+        return {"files": reclaimed_files, "bytes": reclaimed_bytes, "relisted": relisted}
+
+    def _reclaim_free_space(self, now: float, protected: Set[str]) -> Tuple[int, int]:
+        files = freed = 0
+        seen_devices = set()
+        for root in self.roots:
+            if not os.path.isdir(root.path):
+                continue
+            try:
+                dev = os.stat(root.path).st_dev
+                if dev in seen_devices:
+                    continue
+                seen_devices.add(dev)
+                free = shutil.disk_usage(root.path).free
+            except OSError:
+                continue
+            if free >= self.min_free_bytes:
+                continue
+            items = [i for r in self.roots if os.path.isdir(r.path) and os.stat(r.path).st_dev == dev for i in self._items(r)]
+            n, b = self._evict(items, self.min_free_bytes - free, 0.0, now, protected)
+            print(f"[WARN] 磁盘剩余 {free / MB:.0f} MB，低于 {self.min_free_bytes / MB:.0f} MB，已额外清理 {n} 项（{b / MB:.1f} MB）")
+            files += n
+            freed += b
+        return files, freed
+
+    def reclaim_now(self) -> bool:
+        """写盘遇到磁盘已满时调用：完整刷新索引后立即清理，返回是否释放了空间"""
+        result = self.sweep(max_dirs=1 << 30)
+        return result["bytes"] > 0
+
+    # ---------- 后台清理线程 ----------
+    def start(self, interval_s: float = 300.0) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def _loop():
+            while not self._stop.is_set():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    print(f"[WARN] 存储清理失败：{e}")
+                self._stop.wait(interval_s)
+
+        self._thread = threading.Thread(target=_loop, name="banana-storage-sweeper", daemon=True)
+        self._thread.start()
+        print(f"[INFO] 存储清理已启动：{len(self.roots)} 个目录，每 {interval_s:.0f}s 一轮")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "pins": len(self._pins),
+                "holds": len(self._holds),
+                "indexed_dirs": len(self._dirs),
+                "roots": [
+                    {"path": r.path, "max_bytes": r.max_bytes, "max_age_s": r.max_age_s, **self._per_root.get(r.path, {})}
+                    for r in sorted(self.roots, key=lambda r: r.path)
+                ],
+            }
+
+
+def format_storage_snapshot(snap: Dict[str, Any]) -> str:
+    """各目录占用 / 配额与累计清理量（还没有跑过一轮时返回空串）"""
+    if not snap["sweeps"]:
+        return ""
+    lines = []
+    for r in snap["roots"]:
+        quota = f"{r['max_bytes'] / MB:.0f} MB" if r["max_bytes"] else "不限"
+        lines.append(
+            f"{r['path']}: {r.get('files', 0)} 项 {r.get('bytes', 0) / MB:.1f} MB / {quota}，"
+            f"累计清理 {r.get('reclaimed_files', 0)} 项 {r.get('reclaimed_bytes', 0) / MB:.1f} MB"
+        )
+    lines.append(
+        f"固定 {snap['pins']} 项，活跃会话 {snap['holds']} 个，跳过受保护 {snap['protected']} 次；"
+        f"上一轮 {snap['last_sweep_ms']:.0f} ms（重新列举 {snap['last_relisted']} 个目录）"
+    )
+    return "\n".join(lines)
+
+
+def is_disk_full(exc: BaseException) -> bool:
+    return isinstance(exc, OSError) and exc.errno in (errno.ENOSPC, errno.EDQUOT)
+
+
+# ========== 进程级单例 ==========
+def _shared_hold_store():
+    from banana.session_store import get_session_store
+
+    try:
+        return get_session_store()
+    except Exception as e:
+        print(f"[WARN] 会话存储不可用，会话引用只在本进程内有效：{e}")
+        return None
+
+
+_manager: Optional[StorageManager] = None
+_manager_lock = threading.Lock()
+
+
+def configure_storage(
+    enabled: bool = True,
+    interval_s: float = 300.0,
+    dirs: Optional[Dict[str, Dict[str, Any]]] = None,
+    min_free_mb: float = 0,
+    grace_s: float = 600.0,
+    hold_ttl_s: float = 86400.0,
+    pins_path: Optional[str] = None,
+    max_dirs_per_pass: int = 200,
+    shared_holds: bool = True,
+) -> StorageManager:
+    """
+    按配置创建全局存储管理器；enabled 时启动后台清理线程。
+    dirs: {"outputs": {"max_mb": 20480, "max_age_days": 0, "unit": "file"}, ...}
+    shared_holds: 会话引用登记在 banana.session_store 里，多个进程共享
+    """
+    global _manager
+    roots = [
+        RootPolicy(
+            path=path,
+            max_bytes=int(float(spec.get("max_mb", 0) or 0) * MB),
+            max_age_s=float(spec.get("max_age_days", 0) or 0) * 86400,
+            unit=spec.get("unit", UNIT_FILE),
+        )
+        for path, spec in (dirs or {}).items()
+        if isinstance(spec, dict)
+    ]
+    with _manager_lock:
+        if _manager is not None:
+            _manager.stop()
+        _manager = StorageManager(
+            roots,
+            min_free_bytes=int(float(min_free_mb or 0) * MB),
+            grace_s=grace_s,
+            hold_ttl_s=hold_ttl_s,
+            pins_path=pins_path,
+            max_dirs_per_pass=max_dirs_per_pass,
+            hold_store=_shared_hold_store() if shared_holds else None,
+        )
+        if enabled and roots:
+            _manager.start(interval_s)
+        return _manager
+
+
+def get_storage() -> StorageManager:
+    """未配置时返回一个不管理任何目录的实例（hold / touch 等调用都是空操作）"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = StorageManager([])
+        return _manager
@@ -0,0 +1,162 @@
+# 参数扫描（笛卡尔网格）规划：展开 / 采样 / 去重 / 估算 / 排序
+import random
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from banana.pricing import estimate_image_cost, estimate_latency
+
+# 参与扫描的参数轴：key -> (默认值, 归一化函数)
+# 归一化保证 "1:1 正方形" 与 "1:1"、"0.90" 与 "0.9" 被视为同一取值
+
+
+def _norm_aspect(x: str) -> str:
+    m = re.match(r"\s*(\d+)\s*:\s*(\d+)", str(x))
+    return f"{int(m.group(1))}:{int(m.group(2))}" if m else "1:1"
+
+
+def _norm_size(x: str) -> str:
+    return str(x).strip().upper() or "1K"
+
+
+def _norm_search(x: str) -> int:
+    return 1 if str(x).strip().lower() in ("1", "true", "yes", "y", "on") else 0
+
+
+def _norm_float(x: str) -> float:
+    return round(float(x), 4)
+
+
+def _norm_int(x: str) -> int:
+    return int(float(x))
+
+
+SWEEP_AXES: Dict[str, Tuple[Any, Callable[[str], Any]]] = {
+    "aspect_ratio": ("1:1", _norm_aspect),
+    "image_size": ("1K", _norm_size),
+    "enable_search": (0, _norm_search),
+    "temperature": (0.9, _norm_float),
+    "top_p": (0.95, _norm_float),
+    "top_k": (40, _norm_int),
+    "max_output_tokens": (8192, _norm_int),
+}
+
+# 标签里使用的短名
+AXIS_SHORT = {
+    "aspect_ratio": "AR",
+    "image_size": "Size",
+    "enable_search": "Search",
+    "temperature": "T",
+    "top_p": "P",
+    "top_k": "K",
+    "max_output_tokens": "Tok",
+}
+
+SWEEP_MODE_FULL = "完整网格 (Full)"
+SWEEP_MODE_SAMPLED = "随机采样 (Sampled)"
+
+
+def parse_axis_values(input_str: str, default_val, converter) -> List[Any]:
+    """
+    解析逗号分隔的取值并去重（保留首次出现顺序），无法解析的值直接丢弃
+    """
+    values: List[Any] = []
+    for raw in str(input_str or "").split(","):
+        if not raw.strip():
+            continue
+        try:
+            v = converter(raw)
+        except (TypeError, ValueError):
+            continue
+        if v not in values:
+            values.append(v)
+    return values or [default_val]
+
+
+def _decode_index(index: int, radices: List[int]) -> List[int]:
+    """把网格线性下标拆成各轴下标（最后一轴变化最快）"""
+    digits = []
+    for r in reversed(radices):
+        index, d = divmod(index, r)
+        digits.append(d)
+    return list(reversed(digits))
+
+
+def plan_sweep(
+    param_arrays: Dict[str, str],
+    model_name: str,
+    mode: str = SWEEP_MODE_FULL,
+    max_items: int = 64,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    根据参数数组生成扫描计划。
+
+    - 完整网格：所有组合；超过 max_items 时截断（按网格顺序）
+    - 随机采样：在整个网格中无放回抽取 max_items 个组合（不展开整个网格）
+    - 每个组合附带估算价格 / 耗时，执行顺序按「便宜、快」优先，便于先看到预览
+
+    返回 {"items": [...], "axes": {...}, "grid_columns": int, "total_grid": int,
+          "est_cost": float, "est_seconds": float}
+    每个 item: {"params", "label", "grid_index", "est_cost", "est_seconds"}
+    """
+    axes: Dict[str, List[Any]] = {}
+    for key, (default_val, converter) in SWEEP_AXES.items():
+        axes[key] = parse_axis_values(param_arrays.get(key, ""), default_val, converter)
+
+    keys = list(axes.keys())
+    radices = [len(axes[k]) for k in keys]
+    total = 1
+    for r in radices:
+        total *= r
+
+    max_items = max(1, int(max_items))
+    if mode == SWEEP_MODE_SAMPLED and total > max_items:
+        rng = random.Random(seed)
+        indices = sorted(rng.sample(range(total), max_items))
+    else:
+        indices = list(range(min(total, max_items)))
+
+    # 只有取值多于一个的轴才进入标签，避免标签被常量参数淹没
+    varying = [k for k in keys if len(axes[k]) > 1]
+
+    items = []
+    for grid_index in indices:
+        digits = _decode_index(grid_index, radices)
+        params = {k: axes[k][d] for k, d in zip(keys, digits)}
+        label = ", ".join(f"{AXIS_SHORT[k]}={params[k]}" for k in varying) or "默认参数"
+        items.append({
+            "params": params,
+            "label": label,
+            "grid_index": grid_index,
+            "est_cost": estimate_image_cost(model_name, params["image_size"]),
+            "est_seconds": estimate_latency(model_name, params["image_size"], bool(params["enable_search"])),
+        })
+
+    # 便宜 / 快的组合先跑；同价位保持网格顺序
+    items.sort(key=lambda it: (it["est_cost"], it["est_seconds"], it["grid_index"]))
+
+    return {
+        "items": items,
+        "axes": axes,
+        "grid_columns": len(axes[varying[-1]]) if varying else 1,
+        "total_grid": total,
+        "est_cost": sum(it["est_cost"] for it in items),
+        "est_seconds": sum(it["est_seconds"] for it in items),
+    }
+
+
+def format_sweep_plan(plan: Dict[str, Any]) -> str:
+    """把扫描计划渲染成 Markdown 表格（用于 UI 预览）"""
+    items = plan["items"]
+    lines = [
+        f"**网格总组合数**: {plan['total_grid']} ｜ **本次执行**: {len(items)} ｜ "
+        f"**预计成本**: ${plan['est_cost']:.2f} ｜ **预计耗时**: {plan['est_seconds'] / 60:.1f} 分钟（串行）",
+        "",
+        "| 顺序 | 网格位置 | 参数组合 | 预计成本 | 预计耗时 |",
+        "|---|---|---|---|---|",
+    ]
+    for order, it in enumerate(items, 1):
+        lines.append(
+            f"| {order} | {it['grid_index']} | {it['label']} | ${it['est_cost']:.3f} | {it['est_seconds']:.0f}s |"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,371 @@
+# 生成图片的 Web 友好变体：每张新输出的 PNG 在后台进程池里转成若干 WebP / AVIF / JPEG 变体
+# - 变体与清单放在原图同目录的 variants/ 下：<原文件名主干>.<变体名>.<扩展名> 与 <主干>.json
+# - 进程池复用 banana.sprite_batch.get_process_pool；排队数超过 max_backlog 时直接跳过（原图照常可用）
+# - pick_variant 按用途挑最小的合格文件（界面展示 / 导出），没有变体时退回原图
+# - 可选冷存储：有了变体且超过 cold_after_days 天的原图移到 cold_dir，清单记下新位置
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, wait as wait_futures
+from typing import Any, Callable, Dict, List, Optional
+
+VARIANT_DIR = "variants"
+
+# 变体格式 -> (Pillow 格式名, 扩展名)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", ".webp"),
+    "avif": ("AVIF", ".avif"),
+    "jpeg": ("JPEG", ".jpg"),
+}
+
+
+def available_variant_formats() -> List[str]:
+    """当前 Pillow 能编码的变体格式（AVIF 需要带 libavif 编译的 Pillow）"""
+    from PIL import features
+
+    return [f for f in VARIANT_FORMATS if f == "jpeg" or features.check(f)]
+
+
+def manifest_path(original: str) -> str:
+    folder, name = os.path.split(original)
+    return os.path.join(folder, VARIANT_DIR, os.path.splitext(name)[0] + ".json")
+
+
+def read_manifest(original: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(manifest_path(original), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(original: str, manifest: Dict[str, Any]) -> None:
+    path = manifest_path(original)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def transcode_image(src: str, specs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    在子进程中执行：按 specs 生成各变体并写清单，返回清单。
+    specs: {"web": {"format": "webp", "quality": 85, "max_side": 2048}, ...}；max_side 为 0 表示保持原尺寸。
+    同一尺寸只缩放一次，多个变体共用。
+    """
+    from PIL import Image
+
+    started = time.perf_counter()
+    folder, name = os.path.split(src)
+    stem = os.path.splitext(name)[0]
+    out_dir = os.path.join(folder, VARIANT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with Image.open(src) as img:
+        img.load()
+        original_size = img.size
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        base = img.convert("RGBA" if has_alpha else "RGB")
+
+    manifest: Dict[str, Any] = {
+        "original": src,
+        "width": original_size[0],
+        "height": original_size[1],
+        "bytes": os.path.getsize(src),
+        "variants": {},
+    }
+    resized: Dict[int, Any] = {}
+    for vname, spec in specs.items():
+        fmt = spec.get("format", "webp")
+        pil_format, ext = VARIANT_FORMATS[fmt]
+        max_side = int(spec.get("max_side", 0) or 0)
+        key = max_side if max_side and max_side < max(original_size) else 0
+        if key not in resized:
+            if key:
+                scale = key / max(original_size)
+                size = (max(1, round(original_size[0] * scale)), max(1, round(original_size[1] * scale)))
+                resized[key] = base.resize(size, Image.LANCZOS)
+            else:
+                resized[key] = base
+        frame = resized[key]
+        if fmt == "jpeg" and frame.mode != "RGB":
+            # JPEG 不支持透明，铺白底
+            flat = Image.new("RGB", frame.size, (255, 255, 255))
+            flat.paste(frame, mask=frame.getchannel("A"))
+            frame = flat
+        out_path = os.path.join(out_dir, f"{stem}.{vname}{ext}")
+        options: Dict[str, Any] = {"quality": int(spec.get("quality", 85))}
+        if fmt == "webp":
+            options["method"] = 4
+        elif fmt == "jpeg":
+            options.update(optimize=True, progressive=True)
+        frame.save(out_path, format=pil_format, **options)
+        manifest["variants"][vname] = {
+            "path": out_path,
+            "format": fmt,
+            "width": frame.size[0],
+            "height": frame.size[1],
+            "bytes": os.path.getsize(out_path),
+        }
+    manifest["elapsed_s"] = round(time.perf_counter() - started, 3)
+    _write_manifest(src, manifest)
+    return manifest
+
+
+def pick_variant(
+    original: str,
+    min_side: int = 0,
+    max_bytes: int = 0,
+    formats: Optional[List[str]] = None,
+) -> str:
+    """
+    在原图与各变体中挑出满足要求的最小文件：长边 >= min_side（原图本身更小时以原图为准）、
+    大小 <= max_bytes（0 = 不限）、格式在 formats 内（None = 不限，原图的格式记为 "png"）。
+    都不满足或还没有变体时返回原图（原图已移到冷存储则返回冷存储路径）。
+    """
+    manifest = read_manifest(original)
+    if not manifest:
+        return original
+    source = original if os.path.exists(original) else manifest.get("cold_path") or original
+    need = min(int(min_side or 0), max(manifest["width"], manifest["height"]))
+    # 原图本身也参与比较：简单图案的 PNG 可能比有损变体还小
+    candidates = list(manifest["variants"].values()) + [{
+        "path": source, "format": "png", "width": manifest["width"], "height": manifest["height"], "bytes": manifest["bytes"],
+    }]
+    best, best_bytes = None, None
+    for v in candidates:
+        if max(v["width"], v["height"]) < need:
+            continue
+        if max_bytes and v["bytes"] > max_bytes:
+            continue
+        if formats is not None and v["format"] not in formats:
+            continue
+        if best_bytes is None or v["bytes"] < best_bytes:
+            if os.path.exists(v["path"]):
+                best, best_bytes = v["path"], v["bytes"]
+    return best or source
+
+
+def resolve_original(original: str) -> str:
+    """原图的当前位置：还在原处时原样返回，已迁到冷存储时返回清单里记下的 cold_path"""
+    if os.path.exists(original):
+        return original
+    manifest = read_manifest(original)
+    cold = (manifest or {}).get("cold_path")
+    return cold if cold and os.path.exists(cold) else original
+
+
+def tier_to_cold(original: str, root: str, cold_dir: str) -> Optional[str]:
+    """把已有变体的原图移到冷存储目录（保持相对 root 的路径），返回新路径"""
+    manifest = read_manifest(original)
+    if not manifest or not manifest["variants"] or not os.path.exists(original):
+        return None
+    rel = os.path.relpath(os.path.abspath(original), os.path.abspath(root))
+    dest = os.path.join(cold_dir, rel)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    shutil.move(original, dest)
+    manifest["cold_path"] = dest
+    _write_manifest(original, manifest)
+    return dest
+
+
+class Transcoder:
+    """
+    specs: 变体定义（见 transcode_image）；为空时 submit 是空操作
+    max_backlog: 最多同时排队 / 执行的原图数，超过时跳过
+    cold_dir / cold_after_days: 冷存储；cold_after_days 为 0 时不迁移
+    """
+
+    def __init__(
+        self,
+        specs: Optional[Dict[str, Dict[str, Any]]] = None,
+        max_backlog: int = 64,
+        pool_factory: Optional[Callable[[], Any]] = None,
+        cold_dir: str = "",
+        cold_after_days: float = 0,
+    ):
+        usable = set(available_variant_formats()) if specs else set()
+        self.specs: Dict[str, Dict[str, Any]] = {}
+        for name, spec in (specs or {}).items():
+            fmt = spec.get("format", "webp")
+            if fmt in usable:
+                self.specs[name] = dict(spec)
+            else:
+                print(f"[WARN] 变体 {name} 的格式 {fmt} 在当前环境不可用，已跳过")
+        self.max_backlog = max(1, int(max_backlog))
+        self._pool_factory = pool_factory
+        self.cold_dir = cold_dir
+        self.cold_after_s = float(cold_after_days or 0) * 86400
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._stop = threading.Event()
+        self._stats = {"submitted": 0, "done": 0, "failed": 0, "dropped": 0, "original_bytes": 0, "variant_bytes": 0, "tiered": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.specs)
+
+    def _pool(self):
+        if self._pool_factory is not None:
+            return self._pool_factory()
+        from banana.sprite_batch import get_process_pool
+
+        return get_process_pool()
+
+    def submit(self, path: str) -> bool:
+        """提交一张新输出（不阻塞）；返回是否进入了队列"""
+        if not self.specs or not path:
+            return False
+        with self._lock:
+            if path in self._pending:
+                return True
+            if len(self._pending) >= self.max_backlog:
+                self._stats["dropped"] += 1
+                return False
+            try:
+                future = self._pool().submit(transcode_image, path, self.specs)
+            except Exception as e:
+                self._stats["failed"] += 1
+                print(f"[WARN] 提交变体转码失败：{e}")
+                return False
+            self._pending[path] = future
+            self._stats["submitted"] += 1
+        future.add_done_callback(lambda f, p=path: self._on_done(p, f))
+        return True
+
+    def _on_done(self, path: str, future: Future) -> None:
+        with self._lock:
+            self._pending.pop(path, None)
+            if future.cancelled():
+                self._stats["failed"] += 1
+                return
+            exc = future.exception()
+            if exc is not None:
+                self._stats["failed"] += 1
+                print(f"[WARN] 变体转码失败 {path}：{exc}")
+                return
+            manifest = future.result()
+            self._stats["done"] += 1
+            self._stats["original_bytes"] += manifest["bytes"]
+            self._stats["variant_bytes"] += sum(v["bytes"] for v in manifest["variants"].values())
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """等待当前队列全部完成（测试 / 退出前使用）"""
+        with self._lock:
+            pending = list(self._pending.values())
+        wait_futures(pending, timeout=timeout)
+
+    def tier_cold(self, root: str) -> int:
+        """
+        把 root 下（不含 variants/）已有变体、且修改时间早于 cold_after_days 的原图移到冷存储；
+        存储管理器里被固定或被活跃会话引用的原图不迁移
+        """
+        if not self.cold_dir or self.cold_after_s <= 0 or not os.path.isdir(root):
+            return 0
+        from banana.storage import get_storage
+
+        storage = get_storage()
+        try:
+            protected = storage.protected_paths()
+        except Exception as e:
+            print(f"[WARN] 读取固定 / 会话引用失败，本轮不迁移冷存储：{e}")
+            return 0
+        cutoff = time.time() - self.cold_after_s
+        moved = 0
+        for folder, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if d != VARIANT_DIR]
+            for name in files:
+                path = os.path.join(folder, name)
+                if not name.lower().endswith(".png") or os.path.getmtime(path) > cutoff:
+                    continue
+                if storage.is_protected(path, protected):
+                    continue
+                try:
+                    if tier_to_cold(path, root, self.cold_dir):
+                        moved += 1
+                except OSError as e:
+                    print(f"[WARN] 迁移到冷存储失败 {path}：{e}")
+        if moved:
+            with self._lock:
+                self._stats["tiered"] += moved
+            print(f"[INFO] {moved} 张原图已迁移到冷存储 {self.cold_dir}")
+        return moved
+
+    def start_tiering(self, roots: List[str], interval_s: float = 3600.0) -> None:
+        """后台定期把 roots 下的旧原图迁移到冷存储"""
+        if not self.cold_dir or self.cold_after_s <= 0:
+            return
+
+        def _loop():
+            while not self._stop.wait(interval_s):
+                for root in roots:
+                    try:
+                        self.tier_cold(root)
+                    except Exception as e:
+                        print(f"[WARN] 冷存储迁移失败：{e}")
+
+        threading.Thread(target=_loop, name="banana-cold-tier", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "backlog": len(self._pending), "variants": list(self.specs)}
+
+
+def format_transcoder_snapshot(snap: Dict[str, Any]) -> str:
+    """变体转码统计（还没有提交过时返回空串）"""
+    if not snap["submitted"] and not snap["dropped"]:
+        return ""
+    ratio = snap["variant_bytes"] / snap["original_bytes"] if snap["original_bytes"] else 0.0
+    text = (
+        f"变体转码（{', '.join(snap['variants'])}）：完成 {snap['done']}，排队 {snap['backlog']}，"
+        f"失败 {snap['failed']}，因积压跳过 {snap['dropped']}；变体总大小为原图的 {ratio:.0%}"
+    )
+    if snap["tiered"]:
+        text += f"，已迁移冷存储 {snap['tiered']} 张"
+    return text
+
+
+# ========== 进程级单例 ==========
+_transcoder: Optional[Transcoder] = None
+_transcoder_lock = threading.Lock()
+
+
+def configure_transcoder(
+    enabled: bool = True,
+    variants: Optional[Dict[str, Dict[str, Any]]] = None,
+    max_backlog: int = 64,
+    cold_dir: str = "",
+    cold_after_days: float = 0,
+    cold_roots: Optional[List[str]] = None,
+) -> Transcoder:
+    """
+    按配置创建全局转码器。variants 见 transcode_image；cold_roots 为参与冷存储迁移的目录。
+    """
+    global _transcoder
+    with _transcoder_lock:
+        if _transcoder is not None:
+            _transcoder.stop()
+        _transcoder = Transcoder(
+            specs=variants if enabled else None,
+            max_backlog=max_backlog,
+            cold_dir=cold_dir,
+            cold_after_days=cold_after_days,
+        )
+        if _transcoder.enabled:
+            print(f"[INFO] 输出变体转码已启用：{', '.join(_transcoder.specs)}")
+            _transcoder.start_tiering(list(cold_roots or []))
+        return _transcoder
+
+
+def get_transcoder() -> Transcoder:
+    """未配置时返回一个不转码的实例（submit 为空操作）"""
+    global _transcoder
+    with _transcoder_lock:
+        if _transcoder is None:
+            _transcoder = Transcoder()
+        return _transcoder
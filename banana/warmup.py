@@ -0,0 +1,151 @@
+# 连接预热：启动时（以及空闲一段时间后）在后台把第一次请求要付的代价提前付掉
+# - 导入 google-genai SDK（core 里是惰性导入）
+# - 从 Client 池创建 Client（解析凭证）
+# - 服务账号模式下提前签发 / 刷新 OAuth 访问令牌
+# - GET 一次模型元数据，完成 DNS + TLS 握手，连接留在 SDK 的 HTTP 连接池里复用
+# 每一步的耗时都会记录下来，last_warmup() 可随时取最近一次的报告。
+import threading
+import time
+from datetime import timezone
+from typing import Any, Dict, Optional
+
+# 令牌距离过期不足这么多秒时由后台线程提前刷新
+TOKEN_REFRESH_AHEAD_S = 300
+
+_last_activity = time.time()
+_last_report: Dict[str, Any] = {}
+_token_expiry: Optional[float] = None
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+
+
+def mark_activity() -> None:
+    """每次真实请求时调用，用来判断是否处于空闲期"""
+    global _last_activity
+    _last_activity = time.time()
+
+
+def last_warmup() -> Dict[str, Any]:
+    """最近一次预热报告（没有预热过则为空字典）"""
+    with _lock:
+        return dict(_last_report)
+
+
+def _refresh_token(client) -> Optional[float]:
+    """
+    Vertex（服务账号）模式下刷新访问令牌，返回过期时间戳；API Key 模式返回 None。
+    SDK 没有公开的刷新接口，这里用 BaseApiClient 的 _access_token()（令牌有效时不会重复签发）。
+    """
+    api = getattr(client, "_api_client", None)
+    if api is None or not getattr(api, "vertexai", False):
+        return None
+    access_token = getattr(api, "_access_token", None)
+    if callable(access_token):
+        access_token()
+    expiry = getattr(getattr(api, "_credentials", None), "expiry", None)
+    if expiry is None:
+        return None
+    # google-auth 的 expiry 是不带时区的 UTC 时间
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry.timestamp()
+
+
+def warm_up(api_key: Optional[str] = None, model: Optional[str] = None, connect: bool = True) -> Dict[str, Any]:
+    """
+    同步执行一次预热，返回报告：
+    {ok, at, sdk_ms, client_ms, token_ms, connect_ms, total_ms, token_expires_in, error}
+    任何一步失败都不会抛出，只记录在 error 里（预热失败不影响正常请求）。
+    """
+    global _token_expiry
+    from banana.core import DEFAULT_WARMUP_CONFIG, get_client
+
+    model = model or DEFAULT_WARMUP_CONFIG["model"]
+    report: Dict[str, Any] = {"ok": False, "at": time.time(), "error": ""}
+    t_start = time.perf_counter()
+    step = "sdk"
+    try:
+        t0 = time.perf_counter()
+        from google.genai import types  # noqa: F401  (pydantic 模型在首次导入时构建，比较慢)
+        report["sdk_ms"] = (time.perf_counter() - t0) * 1000
+
+        step = "client"
+        t0 = time.perf_counter()
+        client = get_client(api_key, location="global")
+        report["client_ms"] = (time.perf_counter() - t0) * 1000
+
+        step = "token"
+        t0 = time.perf_counter()
+        expiry = _refresh_token(client)
+        report["token_ms"] = (time.perf_counter() - t0) * 1000
+        _token_expiry = expiry
+        report["token_expires_in"] = round(expiry - time.time()) if expiry else None
+
+        if connect:
+            step = "connect"
+            t0 = time.perf_counter()
+            client.models.get(model=model)
+            report["connect_ms"] = (time.perf_counter() - t0) * 1000
+        report["ok"] = True
+    except Exception as e:
+        report["error"] = f"{step}: {e}"
+    report["total_ms"] = (time.perf_counter() - t_start) * 1000
+
+    with _lock:
+        _last_report.clear()
+        _last_report.update(report)
+    return report
+
+
+def format_warmup(report: Dict[str, Any]) -> str:
+    if not report:
+        return "未预热"
+    steps = [
+        f"{label} {report[key]:.0f}ms"
+        for key, label in (("sdk_ms", "SDK 导入"), ("client_ms", "Client"), ("token_ms", "令牌"), ("connect_ms", "连接"))
+        if key in report
+    ]
+    text = f"预热{'完成' if report.get('ok') else '失败'}，共 {report.get('total_ms', 0):.0f}ms（{' / '.join(steps)}）"
+    if report.get("token_expires_in"):
+        text += f"，令牌 {report['token_expires_in'] // 60} 分钟后过期"
+    if report.get("error"):
+        text += f"：{report['error']}"
+    return text
+
+
+def _warmup_loop(api_key: Optional[str], cfg: Dict[str, Any]) -> None:
+    report = warm_up(api_key, cfg.get("model"))
+    print(f"[{'INFO' if report['ok'] else 'WARN'}] {format_warmup(report)}")
+
+    idle_s = float(cfg.get("idle_rewarm_s") or 0)
+    interval = max(1.0, float(cfg.get("check_interval_s") or 30))
+    while True:
+        time.sleep(interval)
+        now = time.time()
+        last = last_warmup().get("at", 0)
+        token_due = _token_expiry is not None and _token_expiry - now < TOKEN_REFRESH_AHEAD_S
+        idle_due = idle_s > 0 and now - max(_last_activity, last) >= idle_s
+        if not (token_due or idle_due):
+            continue
+        report = warm_up(api_key, cfg.get("model"))
+        if not report["ok"]:
+            print(f"[WARN] {format_warmup(report)}")
+
+
+def start_background_warmup(api_key: Optional[str] = None, cfg: Optional[Dict[str, Any]] = None) -> Optional[threading.Thread]:
+    """
+    启动后台预热线程（进程内只启动一次）。cfg 默认读取 config.json 的 "warmup" 段，
+    enabled=false 时直接返回 None。
+    """
+    global _thread
+    if cfg is None:
+        from banana.core import load_warmup_config
+        cfg = load_warmup_config()
+    if not cfg.get("enabled", True):
+        return None
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return _thread
+        _thread = threading.Thread(target=_warmup_loop, args=(api_key, cfg), name="banana-warmup", daemon=True)
+        _thread.start()
+        return _thread
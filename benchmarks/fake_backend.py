@@ -0,0 +1,135 @@
+# 压测用的本地假模型后端：替换 banana.core.get_client，返回与 google-genai 响应结构一致的对象
+# （candidates[].content.parts[].text / as_image()、usage_metadata），按设定的延迟 / 错误率模拟服务端，
+# 调度、重试、记账、保存、变体转码、近似重复检测等应用侧逻辑全部照常执行，不产生真实调用和费用。
+#
+# 单独启动一个带假后端的实例（压测脚本 benchmarks.loadtest 默认会自动拉起）：
+#   python -m benchmarks.fake_backend --port 7861 --latency 2 --error-rate 0.02 --workdir /tmp/banana_load
+import argparse
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Optional
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+class FakeAPIError(Exception):
+    """模拟 google.genai.errors.APIError：带 HTTP 状态码，banana.errors 按 code 分类（503 -> 服务不可用，可重试）"""
+
+    def __init__(self, code: int, status: str, message: str):
+        super().__init__(f"{code} {status}. {message}")
+        self.code = code
+        self.status = status
+
+
+class FakeModels:
+    def __init__(self, latency_s: float, jitter: float, error_rate: float, image_side: int, seed: Optional[int]):
+        self.latency_s = latency_s
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.image_side = image_side
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _draw(self) -> tuple:
+        with self._lock:
+            self.calls += 1
+            # 对数正态延迟：多数请求接近均值，少量长尾
+            delay = self.latency_s * self._rng.lognormvariate(0.0, self.jitter) if self.latency_s > 0 else 0.0
+            return delay, self._rng.random() < self.error_rate, self._rng.randrange(1 << 30)
+
+    def _image(self, seed: int) -> Image.Image:
+        # 每次不同的低频图案，PNG 大小接近真实输出的量级（而不是一张纯色图）
+        rng = np.random.default_rng(seed)
+        small = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+        img = Image.fromarray(small).resize((self.image_side, self.image_side), Image.BICUBIC)
+        noise = rng.integers(0, 12, (self.image_side, self.image_side, 3), dtype=np.uint8)
+        return Image.fromarray(np.asarray(img) + noise)
+
+    def generate_content(self, model: str, contents: Any = None, config: Any = None) -> SimpleNamespace:
+        delay, fail, seed = self._draw()
+        time.sleep(delay)
+        if fail:
+            raise FakeAPIError(503, "UNAVAILABLE", "fake backend overloaded")
+        parts = [SimpleNamespace(text=f"[fake {model}] ok", thought=None, as_image=None)]
+        if "image" in model:
+            img = self._image(seed)
+            parts.append(SimpleNamespace(text=None, thought=None, as_image=lambda: img))
+        return SimpleNamespace(
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts), finish_reason="STOP")],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=300, candidates_token_count=1290 if "image" in model else 40,
+                thoughts_token_count=0, cached_content_token_count=0, total_token_count=1590,
+            ),
+            prompt_feedback=None,
+        )
+
+    def count_tokens(self, model: str, contents: Any = None, **_: Any) -> SimpleNamespace:
+        return SimpleNamespace(total_tokens=300)
+
+
+class FakeClient:
+    def __init__(self, models: FakeModels):
+        self.models = models
+
+
+def install(latency_s: float = 2.0, jitter: float = 0.3, error_rate: float = 0.0, image_side: int = 1024, seed: Optional[int] = None) -> FakeModels:
+    """把 banana.core.get_client 换成假客户端（进程内全局生效），返回 FakeModels 以便读取调用次数"""
+    import banana.core as core
+
+    models = FakeModels(latency_s, jitter, error_rate, image_side, seed)
+    client = FakeClient(models)
+    core.get_client = lambda *args, **kwargs: client
+    return models
+
+
+def prepare_workdir(workdir: str) -> Path:
+    """
+    压测实例的工作目录：outputs / exports / 会话与用量数据库都写在这里，不污染仓库；
+    插件按相对路径加载，复制一份过去。不复制 config.json，保证每次用默认配置、结果可重复。
+    """
+    work = Path(workdir).resolve()
+    work.mkdir(parents=True, exist_ok=True)
+    target = work / "plugins"
+    if target.exists():
+        shutil.rmtree(target)
+    shutil.copytree(REPO_ROOT / "plugins", target, ignore=shutil.ignore_patterns("__pycache__"))
+    return work
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="带假模型后端的 Banana Studio 实例（压测用）")
+    parser.add_argument("--port", type=int, default=7861)
+    parser.add_argument("--latency", type=float, default=2.0, help="模拟的模型平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.3, help="延迟的对数正态标准差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟 503 错误的比例")
+    parser.add_argument("--image-side", type=int, default=1024, help="返回图片的边长")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workdir", default=os.path.join(os.getcwd(), "loadtest_work"))
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("GOOGLE_CLOUD_API_KEY", "fake-loadtest-key")
+    work = prepare_workdir(args.workdir)
+    os.chdir(work)
+    sys.path.insert(0, str(REPO_ROOT))
+
+    install(args.latency, args.jitter, args.error_rate, args.image_side, args.seed)
+    import nano_banana_pro
+
+    demo = nano_banana_pro.create_gradio_app()
+    print(f"[INFO] 假后端：平均延迟 {args.latency}s，错误率 {args.error_rate:.1%}，工作目录 {work}")
+    demo.launch(server_name="127.0.0.1", server_port=args.port, allowed_paths=[str(work)])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,554 @@
+# 并发用户压测：在仓库根目录运行
+#   python -m benchmarks.loadtest --users 8 --duration 60 --mix chat=3,queue=1,gif=1
+#   python -m benchmarks.loadtest --users 16 --rate 2 --duration 120 --latency 4 --error-rate 0.02 --json load.json
+# 默认自动拉起一个带假模型后端的实例（benchmarks.fake_backend，工作目录在临时目录下），结束后关闭；
+# --url 指向已在运行的实例时只负责发压，用 --pid 给出服务进程号以采集 CPU / 内存。
+#
+# 每个虚拟用户是一个独立的 gradio_client.Client（独立会话），按 --mix 的权重随机挑场景：
+#   chat  ：带参考图的多轮对话（/gr_chat_send_stored，沿用上一轮返回的会话 ID）
+#   queue ：智能队列批量生成（/process_queue_click）
+#   gif   ：精灵图转 GIF（/process_sprite_sheet，CPU 密集）
+# 到达模型：--rate 0 为闭环（用户做完一个场景，等 --think 秒后开始下一个）；
+#           --rate N 为开环泊松到达（平均每秒 N 个场景），空闲用户不够时排队，排队时间计入延迟。
+# 输出各场景的吞吐量、延迟分位数、错误率，以及服务进程（含子进程）的 CPU / 内存随时间变化；
+# 超出 --max-p95 / --max-error-rate 时以退出码 1 结束，可作为发版前的可重复基准。
+import argparse
+import json
+import os
+import queue as queue_mod
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.sprite import synthetic_sheet
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("chat", "queue", "gif")
+PERCENTILES = (50, 90, 95, 99)
+# 时间线最多显示的行数（采样点多时合并）
+TIMELINE_ROWS = 20
+
+
+# ---------------- 服务进程 ----------------
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, proc: Optional[subprocess.Popen], timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"服务进程已退出（退出码 {proc.returncode}）")
+        try:
+            with urllib.request.urlopen(url + "config", timeout=2) as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"等待 {url} 就绪超时（{timeout_s:.0f} 秒）")
+
+
+def start_server(args, workdir: str) -> subprocess.Popen:
+    """拉起带假后端的实例，stdout / stderr 写到工作目录下的 server.log"""
+    port = args.port or _free_port()
+    args.url = f"http://127.0.0.1:{port}/"
+    cmd = [
+        sys.executable, "-m", "benchmarks.fake_backend",
+        "--port", str(port), "--workdir", workdir,
+        "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate), "--image-side", str(args.image_side),
+        "--seed", str(args.seed),
+    ]
+    log = open(os.path.join(workdir, "server.log"), "w", encoding="utf-8")
+    env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+    proc = subprocess.Popen(cmd, cwd=str(REPO_ROOT), stdout=log, stderr=subprocess.STDOUT, env=env)
+    try:
+        _wait_ready(args.url, proc, args.startup_timeout)
+    except Exception:
+        proc.terminate()
+        raise
+    print(f"[INFO] 假后端实例已启动：{args.url}（pid {proc.pid}，日志 {log.name}）")
+    return proc
+
+
+# ---------------- CPU / 内存采样 ----------------
+
+class ProcessSampler:
+    """
+    定时采集服务进程及其全部子进程（转码 / 精灵图进程池）的 CPU 与内存。
+    装了 psutil 时用 psutil，否则在 Linux 上直接读 /proc；都不可用时不采样。
+    """
+
+    def __init__(self, pid: Optional[int], interval_s: float = 1.0):
+        self.pid = pid
+        self.interval_s = interval_s
+        self.samples: List[Dict[str, float]] = []
+        self.in_flight: Callable[[], int] = lambda: 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._psutil = None
+        self.available = False
+        if pid:
+            try:
+                import psutil
+
+                self._psutil = psutil
+                self.available = psutil.pid_exists(pid)
+            except ImportError:
+                self.available = os.path.exists(f"/proc/{pid}/stat")
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self._page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _tree_proc(self) -> List[int]:
+        """/proc 下 pid 及其所有后代"""
+        parents: Dict[int, int] = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat", "rb") as f:
+                        stat = f.read().rsplit(b")", 1)[1].split()
+                    parents[int(entry)] = int(stat[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+        tree, frontier = [self.pid], [self.pid]
+        while frontier:
+            frontier = [p for p, pp in parents.items() if pp in frontier]
+            tree.extend(frontier)
+        return tree
+
+    def _read(self) -> Optional[tuple]:
+        """(累计 CPU 秒数, 常驻内存字节数, 进程数)"""
+        if self._psutil is not None:
+            try:
+                root = self._psutil.Process(self.pid)
+                procs = [root] + root.children(recursive=True)
+            except self._psutil.Error:
+                return None
+            cpu = rss = 0.0
+            for p in procs:
+                try:
+                    t = p.cpu_times()
+                    cpu += t.user + t.system
+                    rss += p.memory_info().rss
+                except self._psutil.Error:
+                    continue
+            return cpu, rss, len(procs)
+        cpu = rss = 0.0
+        pids = self._tree_proc()
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/stat", "rb") as f:
+                    stat = f.read().rsplit(b")", 1)[1].split()
+                # ) 之后：state ppid ... utime(第 12 个) stime(第 13 个) ... rss(第 22 个，页数)
+                cpu += (int(stat[11]) + int(stat[12])) / self._ticks
+                rss += int(stat[21]) * self._page
+            except (OSError, IndexError, ValueError):
+                continue
+        return cpu, rss, len(pids)
+
+    def _loop(self, started: float) -> None:
+        last = self._read()
+        last_t = time.monotonic()
+        while not self._stop.wait(self.interval_s):
+            cur = self._read()
+            now = time.monotonic()
+            if cur is None or last is None:
+                break
+            self.samples.append({
+                "t": round(now - started, 2),
+                "cpu_pct": round(100 * (cur[0] - last[0]) / max(1e-6, now - last_t), 1),
+                "rss_mb": round(cur[1] / 1024 / 1024, 1),
+                "procs": cur[2],
+                "in_flight": self.in_flight(),
+            })
+            last, last_t = cur, now
+
+    def start(self, started: float) -> None:
+        if self.available:
+            self._thread = threading.Thread(target=self._loop, args=(started,), name="loadtest-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+# ---------------- 场景 ----------------
+
+class VirtualUser:
+    """一个浏览器会话：独立的 gradio_client.Client，对话场景的多轮之间沿用会话 ID 与历史"""
+
+    def __init__(self, url: str, args, assets: Dict[str, str]):
+        from gradio_client import Client
+
+        self.client = Client(url, verbose=False)
+        self.args = args
+        self.assets = assets
+        self.chat_key = ""
+        self.history: List[Any] = []
+
+    def chat(self) -> bool:
+        from gradio_client import handle_file
+
+        # 每个场景开始一段新对话，连续 chat_turns 轮；任一轮出错即判为失败
+        self.chat_key, self.history = "", []
+        ok = True
+        for turn in range(self.args.chat_turns):
+            out = self.client.predict(
+                user_input=f"Draw a small robot, variation {turn + 1}",
+                image_files=[handle_file(self.assets["ref"])] if turn == 0 else [],
+                history=self.history,
+                session_key=self.chat_key,
+                model_name=self.args.chat_model,
+                api_name="/gr_chat_send_stored",
+            )
+            self.history, self.chat_key = out[0] or [], out[4] or ""
+            last = self.history[-1] if self.history else {}
+            content = last.get("content") if isinstance(last, dict) else last
+            ok = ok and bool(self.history) and "❌" not in json.dumps(content, ensure_ascii=False)
+        return ok
+
+    def queue(self) -> bool:
+        out = self.client.predict(
+            prompt="A lighthouse at dusk",
+            ref_images=[],
+            batch_count=self.args.queue_batch,
+            api_key="",
+            queue_key="",
+            api_name="/process_queue_click",
+        )
+        log, gallery = out[1] or "", out[2] or []
+        return bool(gallery) and "❌ 执行过程中" not in log
+
+    def gif(self) -> bool:
+        from gradio_client import handle_file
+
+        grid = self.args.sheet_grid
+        out = self.client.predict(
+            image=handle_file(self.assets["sheet"]), rows=grid, cols=grid, duration=100,
+            loop=True, formats=["gif"], dedupe=True,
+            api_name="/process_sprite_sheet",
+        )
+        return out[0] is not None
+
+    def run(self, scenario: str) -> bool:
+        return getattr(self, scenario)()
+
+
+def make_assets(folder: str, sheet_size: int, sheet_grid: int) -> Dict[str, str]:
+    """对话用的参考图与 GIF 场景用的精灵图（固定随机种子，每次相同）"""
+    rng = np.random.default_rng(0)
+    ref = os.path.join(folder, "ref.png")
+    Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)).resize((768, 768), Image.BICUBIC).save(ref)
+    sheet = os.path.join(folder, "sheet.png")
+    synthetic_sheet(sheet_size, sheet_grid).save(sheet)
+    return {"ref": ref, "sheet": sheet}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"未知场景 {name}（可选：{', '.join(SCENARIOS)}）")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("--mix 至少要有一个权重大于 0 的场景")
+    return mix
+
+
+# ---------------- 发压 ----------------
+
+def run_load(args, users: List[VirtualUser], sampler: ProcessSampler) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+    results: List[Dict[str, Any]] = []
+    results_lock = threading.Lock()
+    in_flight = [0]
+    arrivals: "queue_mod.Queue[Optional[tuple]]" = queue_mod.Queue()
+    sampler.in_flight = lambda: in_flight[0]
+
+    started = time.monotonic()
+    deadline = started + args.duration
+
+    def _pick() -> str:
+        with rng_lock:
+            return rng.choices(names, weights)[0]
+
+    def _one(user: VirtualUser, scenario: str, arrived: float) -> None:
+        begin = time.monotonic()
+        with results_lock:
+            in_flight[0] += 1
+        error = ""
+        try:
+            ok = user.run(scenario)
+            if not ok:
+                error = "应用返回错误"
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)[:200]}"
+        end = time.monotonic()
+        with results_lock:
+            in_flight[0] -= 1
+            results.append({
+                "scenario": scenario, "ok": not error, "error": error,
+                "start": round(begin - started, 3), "end": round(end - started, 3),
+                "wait_s": round(begin - arrived, 3), "latency_s": round(end - arrived, 3),
+            })
+
+    def _closed_loop(user: VirtualUser, offset: float) -> None:
+        # 用户错开启动，避免所有人在同一瞬间发出第一个请求
+        time.sleep(offset)
+        while time.monotonic() < deadline:
+            _one(user, _pick(), time.monotonic())
+            if args.think > 0:
+                time.sleep(args.think)
+
+    def _open_loop(user: VirtualUser) -> None:
+        while True:
+            item = arrivals.get()
+            if item is None:
+                return
+            _one(user, *item)
+
+    if args.rate > 0:
+        workers = [threading.Thread(target=_open_loop, args=(u,), daemon=True) for u in users]
+    else:
+        spread = min(args.ramp, args.duration)
+        workers = [
+            threading.Thread(target=_closed_loop, args=(u, spread * i / max(1, len(users))), daemon=True)
+            for i, u in enumerate(users)
+        ]
+    sampler.start(started)
+    for w in workers:
+        w.start()
+
+    if args.rate > 0:
+        # 泊松到达：间隔服从指数分布；到点后停止产生新场景，已到达的照常执行完
+        next_at = started
+        while True:
+            next_at += rng.expovariate(args.rate)
+            if next_at >= deadline:
+                break
+            time.sleep(max(0.0, next_at - time.monotonic()))
+            arrivals.put((_pick(), next_at))
+        for _ in workers:
+            arrivals.put(None)
+
+    for w in workers:
+        w.join()
+    elapsed = time.monotonic() - started
+    sampler.stop()
+    return {"elapsed_s": round(elapsed, 2), "results": results, "samples": sampler.samples}
+
+
+# ---------------- 报告 ----------------
+
+def summarize(run: Dict[str, Any]) -> Dict[str, Any]:
+    elapsed = run["elapsed_s"]
+    rows: Dict[str, Dict[str, Any]] = {}
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for r in run["results"]:
+        groups.setdefault(r["scenario"], []).append(r)
+    groups["all"] = run["results"]
+    for name, items in groups.items():
+        lat = np.array([r["latency_s"] for r in items if r["ok"]])
+        wait = np.array([r["wait_s"] for r in items])
+        errors = [r for r in items if not r["ok"]]
+        row = {
+            "count": len(items),
+            "ok": len(items) - len(errors),
+            "error_rate": round(len(errors) / len(items), 4) if items else 0.0,
+            "throughput_per_min": round(60 * (len(items) - len(errors)) / elapsed, 2) if elapsed else 0.0,
+            "mean_wait_s": round(float(wait.mean()), 3) if len(wait) else 0.0,
+            "max_s": round(float(lat.max()), 3) if len(lat) else 0.0,
+        }
+        for p in PERCENTILES:
+            row[f"p{p}_s"] = round(float(np.percentile(lat, p)), 3) if len(lat) else 0.0
+        top: Dict[str, int] = {}
+        for r in errors:
+            top[r["error"]] = top.get(r["error"], 0) + 1
+        row["top_errors"] = sorted(top.items(), key=lambda kv: -kv[1])[:3]
+        rows[name] = row
+
+    samples = run["samples"]
+    resources = {}
+    if samples:
+        cpu = np.array([s["cpu_pct"] for s in samples])
+        rss = np.array([s["rss_mb"] for s in samples])
+        resources = {
+            "cpu_mean_pct": round(float(cpu.mean()), 1), "cpu_max_pct": round(float(cpu.max()), 1),
+            "rss_start_mb": float(rss[0]), "rss_max_mb": round(float(rss.max()), 1), "rss_end_mb": float(rss[-1]),
+            "max_procs": max(s["procs"] for s in samples),
+        }
+    return {"elapsed_s": elapsed, "scenarios": rows, "resources": resources}
+
+
+def _timeline(samples: List[Dict[str, float]]) -> List[Dict[str, float]]:
+    """采样点过多时按时间等分合并（CPU / 并发取均值，内存取最大值）"""
+    if len(samples) <= TIMELINE_ROWS:
+        return samples
+    out = []
+    for chunk in np.array_split(np.arange(len(samples)), TIMELINE_ROWS):
+        part = [samples[i] for i in chunk]
+        out.append({
+            "t": part[-1]["t"],
+            "cpu_pct": round(sum(s["cpu_pct"] for s in part) / len(part), 1),
+            "rss_mb": max(s["rss_mb"] for s in part),
+            "procs": max(s["procs"] for s in part),
+            "in_flight": round(sum(s["in_flight"] for s in part) / len(part), 1),
+        })
+    return out
+
+
+def format_load_report(args, summary: Dict[str, Any], samples: List[Dict[str, float]]) -> str:
+    mode = f"开环 {args.rate}/s" if args.rate > 0 else f"闭环（思考 {args.think}s）"
+    lines = [
+        f"=== 压测报告：{args.users} 个用户，{mode}，场景 {args.mix}，时长 {summary['elapsed_s']:.0f}s ===",
+        f"假后端：平均延迟 {args.latency}s，错误率 {args.error_rate:.1%}" if not args.external else f"目标：{args.url}",
+        "",
+        f"{'场景':<6}{'次数':>6}{'成功':>6}{'错误率':>8}{'吞吐/分':>9}{'排队':>7}"
+        + "".join(f"{'p' + str(p):>8}" for p in PERCENTILES) + f"{'最大':>8}",
+    ]
+    for name, row in summary["scenarios"].items():
+        lines.append(
+            f"{name:<8}{row['count']:>6}{row['ok']:>6}{row['error_rate']:>9.1%}{row['throughput_per_min']:>9.1f}"
+            f"{row['mean_wait_s']:>8.2f}" + "".join(f"{row[f'p{p}_s']:>8.2f}" for p in PERCENTILES) + f"{row['max_s']:>8.2f}"
+        )
+    for name, row in summary["scenarios"].items():
+        if name != "all":
+            for err, n in row["top_errors"]:
+                lines.append(f"  [{name}] ×{n} {err}")
+
+    res = summary["resources"]
+    if res:
+        lines += [
+            "",
+            f"服务进程：CPU 平均 {res['cpu_mean_pct']:.0f}% / 峰值 {res['cpu_max_pct']:.0f}%，"
+            f"内存 {res['rss_start_mb']:.0f} -> 峰值 {res['rss_max_mb']:.0f} -> 结束 {res['rss_end_mb']:.0f} MB，最多 {res['max_procs']} 个进程",
+            f"{'时间s':>7}{'CPU%':>8}{'内存MB':>9}{'进程':>6}{'并发':>6}",
+        ]
+        for s in _timeline(samples):
+            lines.append(f"{s['t']:>7.0f}{s['cpu_pct']:>8.0f}{s['rss_mb']:>9.0f}{s['procs']:>6}{s['in_flight']:>6}")
+    else:
+        lines += ["", "（未采集服务进程资源：外部实例请用 --pid 指定进程号；非 Linux 需要安装 psutil）"]
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Banana Studio 并发用户压测")
+    parser.add_argument("--url", default="", help="已在运行的实例地址；为空时自动拉起带假后端的实例")
+    parser.add_argument("--pid", type=int, default=0, help="外部实例的服务进程号（用于采集 CPU / 内存）")
+    parser.add_argument("--port", type=int, default=0, help="自动拉起实例时使用的端口（0 = 随机空闲端口）")
+    parser.add_argument("--users", type=int, default=8, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=60, help="发压时长（秒），到点后不再开始新场景")
+    parser.add_argument("--rate", type=float, default=0, help="开环到达率（场景/秒）；0 为闭环")
+    parser.add_argument("--think", type=float, default=1.0, help="闭环模式下两次场景之间的思考时间（秒）")
+    parser.add_argument("--ramp", type=float, default=5.0, help="闭环模式下用户错开启动的总时长（秒）")
+    parser.add_argument("--mix", default="chat=3,queue=1,gif=1", help="场景权重，如 chat=3,queue=1,gif=1")
+    parser.add_argument("--chat-turns", type=int, default=2, help="每个对话场景的轮数")
+    parser.add_argument("--chat-model", default="gemini-2.5-flash-image")
+    parser.add_argument("--queue-batch", type=int, default=2, help="每个队列场景生成的张数")
+    parser.add_argument("--sheet-size", type=int, default=2048, help="GIF 场景精灵图边长")
+    parser.add_argument("--sheet-grid", type=int, default=6, help="GIF 场景精灵图行 / 列数")
+    parser.add_argument("--latency", type=float, default=2.0, help="假后端的平均模型延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.3, help="假后端延迟的对数正态标准差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假后端返回 503 的比例")
+    parser.add_argument("--image-side", type=int, default=1024, help="假后端返回图片的边长")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子（场景选择 / 到达间隔 / 假后端）")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="CPU / 内存采样间隔（秒）")
+    parser.add_argument("--startup-timeout", type=float, default=180, help="等待实例就绪的最长时间（秒）")
+    parser.add_argument("--workdir", default="", help="自动拉起实例的工作目录（默认临时目录）")
+    parser.add_argument("--json", default="", help="把完整结果（含每次请求）写到这个 JSON 文件")
+    parser.add_argument("--max-p95", type=float, default=0, help="全部场景 p95 延迟上限（秒），超出时退出码 1")
+    parser.add_argument("--max-error-rate", type=float, default=-1, help="错误率上限（0-1），超出时退出码 1")
+    args = parser.parse_args(argv)
+    args.external = bool(args.url)
+    if args.url and not args.url.endswith("/"):
+        args.url += "/"
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="banana_load_")
+    os.makedirs(workdir, exist_ok=True)
+    proc = None
+    try:
+        if args.external:
+            _wait_ready(args.url, None, args.startup_timeout)
+            pid = args.pid or None
+        else:
+            proc = start_server(args, workdir)
+            pid = proc.pid
+        assets = make_assets(workdir, args.sheet_size, args.sheet_grid)
+
+        # 并行建立各用户的 Client（每个都要拉一次 /config）
+        t0 = time.perf_counter()
+        users: List[Optional[VirtualUser]] = [None] * max(1, args.users)
+
+        def _connect(i: int) -> None:
+            users[i] = VirtualUser(args.url, args, assets)
+
+        threads = [threading.Thread(target=_connect, args=(i,)) for i in range(len(users))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if any(u is None for u in users):
+            print("[ERROR] 部分虚拟用户连接失败")
+            return 1
+        print(f"[INFO] {len(users)} 个虚拟用户已连接（{time.perf_counter() - t0:.1f}s），开始发压 {args.duration:.0f}s ...")
+
+        sampler = ProcessSampler(pid, args.sample_interval)
+        run = run_load(args, users, sampler)
+        summary = summarize(run)
+        print()
+        print(format_load_report(args, summary, run["samples"]))
+
+        if args.json:
+            config = {k: v for k, v in vars(args).items()}
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"config": config, "summary": summary, **run}, f, ensure_ascii=False, indent=2)
+            print(f"\n[INFO] 完整结果已写入 {args.json}")
+
+        total = summary["scenarios"].get("all") or {}
+        failed = False
+        if not total.get("count"):
+            print("[ERROR] 时长内没有完成任何场景")
+            failed = True
+        if args.max_p95 > 0 and total.get("p95_s", 0) > args.max_p95:
+            print(f"[ERROR] p95 延迟 {total['p95_s']:.2f}s 超出上限 {args.max_p95:.2f}s")
+            failed = True
+        if args.max_error_rate >= 0 and total.get("error_rate", 0) > args.max_error_rate:
+            print(f"[ERROR] 错误率 {total['error_rate']:.1%} 超出上限 {args.max_error_rate:.1%}")
+            failed = True
+        if not failed and (args.max_p95 > 0 or args.max_error_rate >= 0):
+            print("[INFO] 压测指标在预算内")
+        return 1 if failed else 0
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+# 精灵图转换基准：在仓库根目录运行
+#   python -m benchmarks.sprite --size 4096 --grid 8 --formats gif,webp,apng,mp4
+# 用合成的精灵图对比原先的逐帧 crop + Pillow 逐帧量化，与 banana.sprite 的零拷贝切帧 + 全局调色板，
+# 并列出网格自动识别的结果 / 耗时，以及各输出格式的文件大小与编码耗时。
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from banana.sprite import FORMAT_EXT, available_formats, convert_sprite_sheet, format_convert_report, sheet_to_array, sprite_sheet_to_gif
+from banana.sprite_grid import detect_grid, format_grid_guess
+
+
+def synthetic_sheet(size: int, grid: int) -> Image.Image:
+    """渐变背景 + 逐帧移动的圆，颜色数远超 256，能体现量化开销"""
+    frame = size // grid
+    yy, xx = np.mgrid[0:frame, 0:frame]
+    tiles = []
+    for i in range(grid * grid):
+        t = np.empty((frame, frame, 3), dtype=np.uint8)
+        t[..., 0] = xx * 255 // frame
+        t[..., 1] = yy * 255 // frame
+        t[..., 2] = i * 255 // (grid * grid)
+        t[(xx - frame // 8 - i * frame // (grid * grid)) ** 2 + (yy - frame // 2) ** 2 < (frame // 8) ** 2] = (255, 255, 0)
+        tiles.append(t)
+    rows = [np.hstack(tiles[r * grid:(r + 1) * grid]) for r in range(grid)]
+    return Image.fromarray(np.vstack(rows))
+
+
+def legacy_convert(image: Image.Image, grid: int, out_path: str) -> None:
+    """原实现：逐帧 crop，保存时由 Pillow 逐帧量化"""
+    w, h = image.size
+    fw, fh = w // grid, h // grid
+    frames = [image.crop((c * fw, r * fh, c * fw + fw, r * fh + fh)) for r in range(grid) for c in range(grid)]
+    frames[0].save(out_path, save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="精灵图转 GIF 耗时对比")
+    parser.add_argument("--size", type=int, default=4096, help="精灵图边长（像素）")
+    parser.add_argument("--grid", type=int, default=8, help="行数 = 列数")
+    parser.add_argument("--skip-legacy", action="store_true", help="不跑原实现（很慢）")
+    parser.add_argument("--formats", default="", help="逗号分隔的输出格式，默认为当前环境可用的全部格式")
+    args = parser.parse_args(argv)
+
+    image = synthetic_sheet(args.size, args.grid)
+    print(f"网格识别: {format_grid_guess(detect_grid(sheet_to_array(image)))}")
+    with tempfile.TemporaryDirectory() as tmp:
+        new_path = os.path.join(tmp, "new.gif")
+        n, elapsed = sprite_sheet_to_gif(image, args.grid, args.grid, 100, True, new_path)
+        print(f"banana.sprite: {n} 帧，{elapsed:.2f}s，{os.path.getsize(new_path) / 1024:.0f} KB")
+
+        if not args.skip_legacy:
+            old_path = os.path.join(tmp, "old.gif")
+            started = time.perf_counter()
+            legacy_convert(image, args.grid, old_path)
+            legacy = time.perf_counter() - started
+            print(f"逐帧 crop:     {n} 帧，{legacy:.2f}s，{os.path.getsize(old_path) / 1024:.0f} KB")
+            print(f"加速 {legacy / elapsed:.1f}x")
+
+        formats = [f for f in args.formats.split(",") if f] or available_formats()
+        report = convert_sprite_sheet(
+            image, args.grid, args.grid, 100, True, formats,
+            lambda fmt: os.path.join(tmp, f"out{FORMAT_EXT.get(fmt, '.' + fmt)}"),
+        )
+        print()
+        print(format_convert_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,49 @@
+# 启动预算基准：在仓库根目录运行
+#   python -m benchmarks.startup --runs 3 --budget 8
+# 多次冷启动 nano_banana_pro.py --profile-startup，取中位数与预算比较；
+# 超出预算或惰性模块（google.genai）被提前导入时以退出码 1 结束，可直接放进 CI。
+import argparse
+import statistics
+import sys
+from pathlib import Path
+
+from banana.startup_profile import STARTUP_BUDGET_S, format_startup_report, profile_startup
+
+ENTRY = Path(__file__).resolve().parent.parent / "nano_banana_pro.py"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Banana Studio 启动耗时基准")
+    parser.add_argument("--runs", type=int, default=3, help="冷启动次数，取中位数")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_S, help="启动预算（秒）")
+    args = parser.parse_args(argv)
+
+    walls = []
+    last = None
+    for i in range(max(1, args.runs)):
+        last = profile_startup(str(ENTRY))
+        if last["error"]:
+            print(format_startup_report(last))
+            return 1
+        walls.append(last["wall_s"])
+        print(f"[INFO] 第 {i + 1} 次: {last['wall_s']:.2f}s")
+
+    print()
+    print(format_startup_report(last))
+    median = statistics.median(walls)
+    print(f"\n中位数 {median:.2f}s / 预算 {args.budget:.2f}s")
+
+    failed = False
+    if median > args.budget:
+        print(f"[ERROR] 启动耗时超出预算 {median - args.budget:.2f}s")
+        failed = True
+    if last["lazy_loaded"]:
+        print(f"[ERROR] 惰性模块被提前导入: {', '.join(last['lazy_loaded'])}")
+        failed = True
+    if not failed:
+        print("[INFO] 启动预算检查通过")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,108 +22,128 @@
 # Respect creators. Respect users.
 
 
+import argparse
+import importlib.util
+import inspect
 import os
-import mimetypes
-from typing import List, Dict, Any, Tuple
-
-import gradio as gr
-from google import genai
-from google.genai import types
-
-import os
-from pathlib import Path
-import json
-
 import re
-from datetime import datetime
-from PIL import Image
-
+import shutil
+import socket
+import sys
+import time
 import uuid
 from datetime import datetime
-import socket
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
 
-from pprint import pprint
-import importlib.util
-import sys
+import gradio as gr
 
-# 预设配置文件路径
-CONFIG_PATH = Path("config.json")
+from banana.cancellation import (
+    CancelledError,
+    cancel_session,
+    new_token,
+    release_token,
+)
+from banana.accounting import BUDGET_HARD, BUDGET_SOFT, configure_ledger, format_totals, get_ledger
+from banana.core import (  # noqa: F401  (部分名称供插件沿用 from nano_banana_pro import ...)
+    ASPECT_RATIO_OPTIONS,
+    CONFIG_PATH,
+    DEFAULT_ADVANCED_CONFIG,
+    DEFAULT_MODEL_OPTIONS,
+    IMAGE_SIZE_OPTIONS,
+    call_gemini_vertex,
+    create_client,
+    is_candidate_count_error,
+    load_budget_config,
+    load_context_cache_config,
+    load_dedupe_config,
+    load_google_api_key_from_file,
+    load_preflight_config,
+    load_retry_config,
+    load_routing_config,
+    load_scheduler_config,
+    load_storage_config,
+    load_variants_config,
+    mark_single_candidate,
+    resolve_request_timeout,
+    supports_candidate_count,
+)
+from banana.context_cache import configure_context_cache, get_context_cache
+from banana.dedupe import configure_dedupe
+from banana.errors import ERR_CIRCUIT_OPEN, ERR_TIMEOUT, classify_error, describe_error
+from banana.plugin_host import PluginHost, read_plugin_manifest
+from banana.preflight import configure_preflight
+from banana.presets import configure_preset_store, get_preset_store
+from banana.pricing import estimate_latency
+from banana.retry import configure_retry_policy, get_retry_policy
+from banana.routing import configure_router, get_router
+from banana.scheduler import PRIORITY_INTERACTIVE, configure_scheduler, get_scheduler
+from banana.session_store import get_session_store
+from banana.startup_profile import format_startup_report, is_profiling, phase, profile_startup, record_plugins, write_profile
+from banana.storage import configure_storage, get_storage
+from banana.variants import configure_transcoder, pick_variant
+from banana.warmup import start_background_warmup
+
+# 检查预设是否被其他会话 / 进程修改的间隔（秒）
+PRESET_POLL_S = 3.0
+# 对话的重试总时长上限（秒）：用户在等，比队列 / 无头任务的默认值更短
+CHAT_MAX_RETRY_ELAPSED_S = 60
+# 对话一次最多请求的变体数
+MAX_CHAT_VARIANTS = 4
+# 导出 Markdown 时选用变体的最小长边（原图更小时以原图为准）
+EXPORT_MIN_SIDE = 2048
 
 # 动态加载插件
-def load_plugins_from_dir(plugin_dir: str = "plugins"):
+def load_plugins_from_dir(plugin_dir: str = "plugins", host: PluginHost | None = None) -> List[Dict[str, Any]]:
     """
-    动态扫描指定目录，加载包含 create_tab 函数的插件
+    按 plugins/manifest.json 的顺序加载插件（清单外的 .py 排在最后，enabled=false 的不导入），
+    调用 create_tab(host) 在当前 gr.Tabs() 上下文中构建 Tab。
+    返回每个插件的加载报告：[{name, status, import_ms, build_ms}, ...]
     """
+    report: List[Dict[str, Any]] = []
     if not os.path.exists(plugin_dir):
         print(f"[INFO] 插件目录 {plugin_dir} 不存在，已跳过。")
-        return
-
-    # 遍历目录下的 .py 文件
-    for filename in os.listdir(plugin_dir):
-        if filename.endswith(".py") and not filename.startswith("__"):
-            file_path = os.path.join(plugin_dir, filename)
-            module_name = filename[:-3] # 去掉 .py
-            
-            try:
-                # 动态加载模块
-                spec = importlib.util.spec_from_file_location(module_name, file_path)
-                if spec and spec.loader:
-                    module = importlib.util.module_from_spec(spec)
-                    sys.modules[module_name] = module
-                    spec.loader.exec_module(module)
-                    
-                    # 检查是否存在 create_tab 函数
-                    if hasattr(module, "create_tab") and callable(module.create_tab):
-                        print(f"[PLUGIN] 正在加载插件: {filename} ...")
-                        # 执行插件构建逻辑
-                        module.create_tab()
-                    else:
-                        print(f"[PLUGIN] 跳过 {filename}: 未找到 'create_tab' 函数")
-            except Exception as e:
-                print(f"[ERROR] 加载插件 {filename} 失败: {e}")
-
-# 打印请求报文
-def _debug_print_send(model_name, system_instruction, user_text, image_files, generate_config=None, contents=None):
-    print("\n" + "=" * 80)
-    print("[SEND] Gemini Request")
-    print("Model:", model_name)
-
-    if system_instruction:
-        print("\n[System Instruction]\n", system_instruction)
-
-    if user_text:
-        print("\n[User Text]\n", user_text)
+        return report
+
+    host = host or PluginHost()
+    for spec in read_plugin_manifest(Path(plugin_dir)):
+        entry = {"name": spec.name, "status": "skipped", "import_ms": 0.0, "build_ms": 0.0}
+        report.append(entry)
+        if not spec.enabled:
+            print(f"[PLUGIN] 跳过 {spec.name}: 清单中已禁用")
+            continue
 
-    if image_files:
-        print("\n[User Images]")
-        for i, img in enumerate(image_files):
-            p = img.name if hasattr(img, "name") else img
-            print(f"  [{i}] {p}")
-
-    if contents is not None:
-        print("\n[Contents]")
-        pprint(contents)
-
-    if generate_config is not None:
-        print("\n[Generate Config]")
-        # google-genai 的对象通常有 model_dump；没有就 pprint
         try:
-            pprint(generate_config.model_dump())
-        except Exception:
-            pprint(generate_config)
-
-    print("=" * 80 + "\n")
+            # 动态加载模块（放在独立命名空间下，避免与同名的第三方模块冲突）
+            t0 = time.perf_counter()
+            module_name = f"banana_plugins.{spec.name}"
+            module_spec = importlib.util.spec_from_file_location(module_name, spec.file)
+            if not (module_spec and module_spec.loader):
+                raise ImportError(f"无法加载 {spec.file}")
+            module = importlib.util.module_from_spec(module_spec)
+            sys.modules[module_name] = module
+            module_spec.loader.exec_module(module)
+            entry["import_ms"] = (time.perf_counter() - t0) * 1000
+
+            # 检查是否存在 create_tab 函数
+            create_tab = getattr(module, "create_tab", None)
+            if not callable(create_tab):
+                print(f"[PLUGIN] 跳过 {spec.name}: 未找到 'create_tab' 函数")
+                continue
 
-# 打印接受报文
-def _debug_print_recv(response):
-    import json
-    print("\n" + "=" * 80)
-    print("[RECV] Gemini Response")
-    try:
-        print(json.dumps(response.model_dump(), ensure_ascii=False, indent=2))
-    except Exception:
-        pprint(response)
-    print("=" * 80 + "\n")
+            # 执行插件构建逻辑；兼容旧插件的无参 create_tab()
+            t1 = time.perf_counter()
+            if inspect.signature(create_tab).parameters:
+                create_tab(host)
+            else:
+                create_tab()
+            entry["build_ms"] = (time.perf_counter() - t1) * 1000
+            entry["status"] = "loaded"
+            print(f"[PLUGIN] 已加载 {spec.name}: 导入 {entry['import_ms']:.1f}ms / 构建 {entry['build_ms']:.1f}ms")
+        except Exception as e:
+            entry["status"] = f"error: {e}"
+            print(f"[ERROR] 加载插件 {spec.name} 失败: {e}")
+    return report
 
 def find_free_port(start: int = 7860, end: int = 7880, host: str = "127.0.0.1") -> int:
     for port in range(start, end + 1):
@@ -136,42 +156,46 @@ def find_free_port(start: int = 7860, end: int = 7880, host: str = "127.0.0.1")
                 continue
     raise RuntimeError(f"No free port found in range {start}-{end}")
 
-def load_presets_from_config() -> Dict[str, Any]:
+def _preset_user(request) -> str:
+    """预设命名空间：启用登录时按用户名，未登录时为空（共享预设）"""
+    return getattr(request, "username", None) or ""
+
+
+def load_presets_from_config(user: str = "") -> Dict[str, Any]:
     """
-    从 config.json 读取参数预设，格式：
+    从 config.json 读取参数预设（banana.presets 带缓存，文件没变时不重新解析），格式：
     {
       "presets": {
         "名称": { ...参数... },
         ...
-      }
+      },
+      "user_presets": {"用户名": {"名称": { ...参数... }}}
     }
+    user 非空时返回共享预设叠加该用户自己的预设
     """
-    if not CONFIG_PATH.exists():
-        return {}
-    try:
-        data = json.load(CONFIG_PATH.open("r", encoding="utf-8"))
-        if isinstance(data, dict):
-            if "presets" in data and isinstance(data["presets"], dict):
-                return data["presets"]
-            # 兼容旧格式：整个 json 就是 presets
-            return data
-    except Exception as e:
-        print(f"[WARN] 读取 config.json 失败：{e}")
-    return {}
+    return get_preset_store().presets(user)
 
 
-def save_presets_to_config(presets: Dict[str, Any]) -> None:
+def save_presets_to_config(presets: Dict[str, Any], user: str = "") -> None:
     """
-    将预设写回 config.json
+    将预设整体写回 config.json（加锁 + 原子替换，保留 presets 以外的其他配置段）
     """
-    data = {"presets": presets}
     try:
-        CONFIG_PATH.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        get_preset_store().replace_all(presets, user)
         print(f"[INFO] 已保存参数预设到 {CONFIG_PATH}")
     except Exception as e:
         print(f"[ERROR] 写入 config.json 失败：{e}")
 
 
+def _preset_outputs(user: str, value: Optional[str]):
+    """最新的 (presets_state, preset_dropdown, 预设版本)；value 不在预设中时选第一个"""
+    version, presets = get_preset_store().snapshot(user)
+    choices = list(presets.keys())
+    if value not in presets:
+        value = choices[0] if choices else None
+    return presets, gr.update(choices=choices, value=value), version
+
+
 def save_preset(
     preset_name: str,
     presets: Dict[str, Any],
@@ -183,37 +207,43 @@ def save_preset(
     top_k: int,
     max_output_tokens: int,
     system_instruction: str,
+    request: gr.Request = None,
 ):
     """
     Gradio 回调：保存当前参数为一个预设。
-    返回更新后的 presets_state 和 preset_dropdown。
+    只在锁内改动这一个预设，其他会话同时保存的预设不会被覆盖。
+    返回更新后的 presets_state、preset_dropdown 和预设版本。
     """
     name = (preset_name or "").strip() or "default"
-    presets = dict(presets or {})
-    presets[name] = {
-        "model_name": model_name,
-        "aspect_ratio": aspect_ratio,
-        "image_size": image_size,
-        "temperature": float(temperature),
-        "top_p": float(top_p),
-        "top_k": int(top_k),
-        "max_output_tokens": int(max_output_tokens),
-        "system_instruction": system_instruction,
-    }
-    save_presets_to_config(presets)
-    choices = list(presets.keys())
-    return presets, gr.update(choices=choices, value=name)
+    user = _preset_user(request)
+    try:
+        get_preset_store().put(name, {
+            "model_name": model_name,
+            "aspect_ratio": aspect_ratio,
+            "image_size": image_size,
+            "temperature": float(temperature),
+            "top_p": float(top_p),
+            "top_k": int(top_k),
+            "max_output_tokens": int(max_output_tokens),
+            "system_instruction": system_instruction,
+        }, user)
+        print(f"[INFO] 已保存参数预设 {name} 到 {CONFIG_PATH}")
+    except Exception as e:
+        print(f"[ERROR] 保存预设 {name} 失败：{e}")
+    return _preset_outputs(user, name)
 
 
 def load_preset(
     selected_name: str,
     presets: Dict[str, Any],
+    request: gr.Request = None,
 ):
     """
-    Gradio 回调：根据选择的预设，加载参数到 UI。
+    Gradio 回调：根据选择的预设，加载参数到 UI（优先取存储中的最新值）。
     返回顺序：model_name, aspect_ratio, image_size,
              temperature, top_p, top_k, max_output_tokens, system_instruction
     """
+    presets = get_preset_store().presets(_preset_user(request)) or presets
     if not selected_name or selected_name not in (presets or {}):
         # 不改动当前值
         upd = gr.update()
@@ -238,269 +268,44 @@ def load_preset(
 def delete_preset(
     selected_name: str,
     presets: Dict[str, Any],
+    request: gr.Request = None,
 ):
     """
-    Gradio 回调：删除当前选中的预设。
-    返回更新后的 presets_state 和 preset_dropdown。
-    """
-    presets = dict(presets or {})
-    if selected_name in presets:
-        del presets[selected_name]
-        save_presets_to_config(presets)
-    choices = list(presets.keys())
-    new_value = choices[0] if choices else None
-    return presets, gr.update(choices=choices, value=new_value)
-
-def load_google_api_key_from_file() -> None:
-    """
-    尝试同时加载 'GOOGLE_CLOUD_API_KEY.json' (Vertex) 和 'GOOGLE_CLOUD_API_KEY.txt' (AI Studio)。
-    将所有找到的凭证都写入环境变量，供后续逻辑选用。
+    Gradio 回调：删除当前选中的预设（登录用户只能删除自己的预设）。
+    返回更新后的 presets_state、preset_dropdown 和预设版本。
     """
-    # === 1. 读取 Vertex JSON (Service Account) ===
-    vertex_json_path = Path("GOOGLE_CLOUD_API_KEY.json")
-    if vertex_json_path.exists() and vertex_json_path.is_file():
+    user = _preset_user(request)
+    if selected_name:
         try:
-            abs_path = str(vertex_json_path.resolve())
-            with open(vertex_json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                project_id = data.get("project_id")
-            
-            if project_id:
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = abs_path
-                os.environ["GOOGLE_CLOUD_PROJECT"] = project_id
-                print(f"[INFO] 已加载 Vertex 凭证: {vertex_json_path.name} (Project: {project_id})")
-            else:
-                print(f"[WARN] {vertex_json_path} 缺少 'project_id' 字段，跳过 Vertex 加载。")
-        except Exception as e:
-            print(f"[ERROR] 读取 Vertex JSON 失败: {e}")
-    
-    # === 2. 读取 AI Studio API Key ===
-    # (不管上面是否成功，这里都继续读，作为备用)
-    api_key_txt_path = Path("GOOGLE_CLOUD_API_KEY.txt")
-    if api_key_txt_path.exists() and api_key_txt_path.is_file():
-        try:
-            key = api_key_txt_path.read_text(encoding="utf-8").strip()
-            if key:
-                os.environ["GOOGLE_CLOUD_API_KEY"] = key
-                print(f"[INFO] 已加载 API Key: {api_key_txt_path.name}")
-            else:
-                print(f"[WARN] {api_key_txt_path} 内容为空。")
+            if not get_preset_store().delete(selected_name, user):
+                print(f"[WARN] 预设 {selected_name} 不在当前用户的预设中，未删除")
         except Exception as e:
-            print(f"[ERROR] 读取 API Key TXT 失败: {e}")
-
-# ========== 基本配置 ==========
-
-DEFAULT_MODEL_OPTIONS = [
-    "gemini-2.5-flash",          # 文本/多模态输入，文本输出（官方 quickstart 推荐）
-    "gemini-3.1-pro-preview",      # 3.1 Pro 语言模型（多模态输入，文本输出）
-    "gemini-3-flash-preview",    # 3.0 Flash 语言模型（多模态输入，文本输出）
-    "gemini-3-pro-image-preview",# Nano Banana Pro 图像生成
-    "gemini-3.1-flash-image-preview",# Nano Banana 2 图像生成
-    "gemini-2.5-flash-image",    # 2.5 图像生成
-]
-
-# 与 Vertex 示例类似的宽高比 & 尺寸
-ASPECT_RATIO_OPTIONS = [
-    "1:1 正方形4096x4096",
-    "2:3 照片3392x5056",
-    "3:2 横版照片5056x3392",    
-    "3:4 竖版海报3584x4800",
-    "4:3 传统横版4800x3584",
-    "4:5 证件照3712x4608",
-    "5:4 老屏幕4608x3712",
-    "9:16 人像3072x5504",
-    "16:9 风景5504x3072",
-    "21:9 超宽屏6336x2688"
-    ]
-
-# 电影级宽屏 
-# """
-# 1:1       1024x1024	1210	2048x2048	1210	4096x4096	2000
-# 2:3	    848x1264	1210	1696x2528	1210	3392x5056	2000
-# 3:2	    1264x848	1210	2528x1696	1210	5056x3392	2000
-# 3:4	    896x1200	1210	1792x2400	1210	3584x4800	2000
-# 4:3	    1200x896	1210	2400x1792	1210	4800x3584	2000
-# 4:5	    928x1152	1210	1856x2304	1210	3712x4608	2000
-# 5:4	    1152x928	1210	2304x1856	1210	4608x3712	2000
-# 9:16      768x1376	1210	1536x2752	1210	3072x5504	2000
-# 16:9	    1376x768	1210	2752x1536	1210	5504x3072	2000
-# 21:9	    1584x672	1210	3168x1344	1210	6336x2688	2000
-# """
-
-
-IMAGE_SIZE_OPTIONS = [
-    "1K",
-    "2K",
-    "4K",
-]
-
-DEFAULT_ADVANCED_CONFIG: Dict[str, Any] = {
-    "temperature": 0.9,
-    "top_p": 0.95,
-    "top_k": 40,
-    "max_output_tokens": 8192,
-    "system_instruction": "",
-}
-
-
-# ========== 工具函数：client & 参数构造 ==========
-def create_client(explicit_key: str | None = None, project: str | None = None, location: str = "global") -> genai.Client:
-    """
-    创建 Client。
-    策略：优先尝试 Vertex AI (Project ID) -> 失败则降级到 AI Studio (API Key)。
-    """
-    # 获取环境中的配置
-    project_id = project or os.environ.get("GOOGLE_CLOUD_PROJECT")
-    api_key = explicit_key or os.environ.get("GOOGLE_CLOUD_API_KEY")
+            print(f"[ERROR] 删除预设 {selected_name} 失败：{e}")
+    return _preset_outputs(user, None)
 
-    # === 尝试 1: Vertex AI ===
-    if project_id:
-        try:
-            # print(f"[DEBUG] 尝试连接 Vertex AI (Project: {project_id})...")
-            return genai.Client(
-                vertexai=True,
-                project=project_id,
-                location=location
-            )
-        except Exception as e:
-            print(f"[WARN] Vertex AI Client 初始化失败 ({e})，尝试降级到 API Key 模式...")
-    
-    # === 尝试 2: API Key (AI Studio) ===
-    # 跑到这里说明：要么没 Project ID，要么 Vertex 初始化挂了 
-    if api_key:
-        print("[INFO] 使用 API Key 模式 (AI Studio)")
-        return genai.Client(
-            vertexai=False,
-            api_key=api_key
-        )
-    
-    # === 彻底失败 ===
-    raise RuntimeError(
-        "❌ 无法创建 Client：既没有有效的 Vertex Project ID，也没有可用的 API Key。\n"
-        "请检查根目录下是否存在 'GOOGLE_CLOUD_API_KEY.json' 或 'GOOGLE_CLOUD_API_KEY.txt'。"
-    )
-    
-def ui_aspect_to_vertex(value: str) -> str:
-    """
-    将 UI 显示的 '1:1 (Square)' 转成 Vertex 接受的 '1:1'
-    """
-    if not value:
-        return "1:1"
-    if value.startswith("1:1"):
-        return "1:1"
-    if value.startswith("3:2"):
-        return "3:2"
-    if value.startswith("2:3"):
-        return "2:3"
-    if value.startswith("3:4"):
-        return "3:4"
-    if value.startswith("4:3"):
-        return "4:3"
-    if value.startswith("4:5"):
-        return "4:5"
-    if value.startswith("5:4"):
-        return "5:4"
-    if value.startswith("16:9"):
-        return "16:9"
-    if value.startswith("9:16"):
-        return "9:16"
-    if value.startswith("21:9"):
-        return "21:9"
-    return "1:1"
-
-
-def build_generate_config(
-    temperature: float,
-    top_p: float,
-    top_k: int,
-    max_output_tokens: int,
-    aspect_ratio_ui: str,
-    image_size_ui: str,
-    want_image: bool,
-    want_thinking: bool,
-    want_search: bool,
-) -> types.GenerateContentConfig:
-    """
-    构造 GenerateContentConfig。
 
-    - 文本模型：只设置采样参数 + 关掉安全过滤
-    - 图像模型：加上 response_modalities + ImageConfig(aspect_ratio, image_size)
-    - 思考模型：尝试加上 ThinkingConfig(thinking_level="HIGH")，如果 SDK 不支持会自动忽略
+def refresh_presets(version: str, selected_name: str, presets: Dict[str, Any], request: gr.Request = None):
     """
-    safety_settings = [
-        types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
-        types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="OFF"),
-        types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="OFF"),
-        types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
-    ]
-
-    cfg_kwargs: Dict[str, Any] = dict(
-        temperature=temperature,
-        top_p=top_p,
-        top_k=top_k,
-        max_output_tokens=max_output_tokens,
-        safety_settings=safety_settings,
-    )
-    # === Google Search / Grounding ===
-    if want_search:
-        cfg_kwargs["tools"] = [{"google_search": {}}]
-
-    # === 图像模型：参考 Nano-Banana Pro 示例，带上 aspect_ratio + image_size ===
-    if want_image:
-        aspect_ratio = ui_aspect_to_vertex(aspect_ratio_ui)
-        image_size = image_size_ui or "1K"
-        
-        # --- 新增：人物生成参数 ---
-        # "allow_all" = Allow (All ages)
-        # "allow_adult" = Allow (Adults only)
-        # "dont_allow" = Don't allow
-        person_generation = "allow_all" 
-
-        try:
-            img_cfg = types.ImageConfig(
-                aspect_ratio=aspect_ratio,
-                image_size=image_size,
-                # person_generation=person_generation, # <--- 加上这一行！
-            )
-        except Exception as e:
-            print(f"[WARN] 当前 ImageConfig 不支持高级参数，退回基础配置：{e}")
-            img_cfg = types.ImageConfig(aspect_ratio=aspect_ratio)
-
-        cfg_kwargs["response_modalities"] = ["TEXT", "IMAGE"]
-        cfg_kwargs["image_config"] = img_cfg
-
-    # === 思考模型：尝试加上 thinking_config ===
-    if want_thinking:
-        try:
-            # 修改：去掉不支持的 thinking_level 参数，只实例化对象
-            # 如果新版 SDK 需要 include_thoughts=True，通常是在 generate_content 的调用里，而不是 Config 里
-            # 这里先设为空配置，或者根据你的 SDK 版本查阅文档。
-            # 为了防止报错，我们先传入一个空字典或最基础的配置
-            thinking_cfg = types.ThinkingConfig(include_thoughts=True) 
-            cfg_kwargs["thinking_config"] = thinking_cfg
-        except Exception as e:
-            print(f"[WARN] ThinkingConfig 配置出错，已忽略：{e}")
-
-    return types.GenerateContentConfig(**cfg_kwargs)
-
-
-def file_to_image_part(path: str) -> types.Part:
-    """
-    将本地文件路径转换为 Part，用于图片输入。
-    类似 Vertex 示例里的 Part.from_uri，只是我们这里是本地文件。
+    定时回调：其他会话 / 进程改了预设（文件版本变化）时刷新下拉框，否则不做改动
     """
-    mime, _ = mimetypes.guess_type(path)
-    if not mime:
-        # 默认 png
-        mime = "image/png"
-    with open(path, "rb") as f:
-        data = f.read()
-    return types.Part.from_bytes(data=data, mime_type=mime)
+    if version == get_preset_store().version():
+        return presets, gr.update(), version
+    return _preset_outputs(_preset_user(request), selected_name)
 
 def _save_as_jpg_under_1mb(src_path: str, dst_path: str, max_bytes: int = 1024 * 1024) -> None:
     """
     把 src_path 转成 JPG 保存到 dst_path，并尽量保证文件 <= max_bytes（默认 1MB）。
     """
+    from PIL import Image  # 只有导出时才用到，不放进启动路径
+
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    # 已有长边足够、不超过上限的 JPEG 变体时直接复制；否则从长边足够的最小变体开始压缩，比解码 4K PNG 快得多
+    jpeg = pick_variant(src_path, min_side=EXPORT_MIN_SIDE, max_bytes=max_bytes, formats=["jpeg"])
+    if jpeg != src_path and jpeg.lower().endswith(".jpg"):
+        shutil.copyfile(jpeg, dst_path)
+        return
+    src_path = pick_variant(src_path, min_side=EXPORT_MIN_SIDE)
+
     img = Image.open(src_path)
     if img.mode in ("RGBA", "P"):
         img = img.convert("RGB")
@@ -677,144 +482,6 @@ def export_chat_to_md(
     return md_path
 
 
-# ========== 主业务逻辑：调用 Gemini（Vertex AI） ==========
-def call_gemini_vertex(
-    api_key: str,
-    model_name: str,
-    history_messages: List[Dict[str, Any]],
-    user_text: str,
-    user_images: List[str],
-    aspect_ratio: str,
-    image_size: str,
-    system_instruction: str,
-    temperature: float,
-    top_p: float,
-    top_k: int,
-    max_output_tokens: int,
-    enable_search: bool,
-) -> Tuple[str, List[str]]:  # <--- 修改返回值类型提示
-    """
-    修改后：返回 (文本内容, 生成的图片路径列表)
-    """
-    # 1) 创建 client (确保 location="global")
-    # 如果你的 create_client 还没改默认值，建议这里强行传 global
-    client = create_client(api_key, location="global") 
-
-    # 2) 组装 contents (保持不变)
-    contents: List[types.Content] = []
-    
-    # ... (中间组装 contents 的代码完全保持不变，省略以节省篇幅) ...
-    if system_instruction.strip():
-        contents.append(types.Content(role="system", parts=[types.Part.from_text(text=system_instruction.strip())]))
-    for msg in history_messages:
-        # ... (保持原样) ...
-        parts = []
-        if msg.get("text"): parts.append(types.Part.from_text(text=msg.get("text")))
-        for img in msg.get("images", []):
-            try: parts.append(file_to_image_part(img))
-            except: continue
-        if parts: contents.append(types.Content(role="user" if msg.get("role")=="user" else "model", parts=parts))
-    
-    current_parts = []
-    if user_text: current_parts.append(types.Part.from_text(text=user_text))
-    for img in user_images:
-        try: current_parts.append(file_to_image_part(img))
-        except: continue
-    if current_parts: contents.append(types.Content(role="user", parts=current_parts))
-
-    # 3) 构造 Config 
-    image_models = {"gemini-2.5-flash-image", "gemini-3-pro-image-preview", "gemini-3.1-flash-image-preview"}
-    want_image = model_name in image_models
-    want_thinking = ( "gemini-3.1-pro-preview" or "gemini-3-flash-preview" ) in model_name or "thinking" in model_name.lower() # 稍微放宽判断
-
-    generate_config = build_generate_config(
-        temperature=temperature, top_p=top_p, top_k=top_k, max_output_tokens=max_output_tokens,
-        aspect_ratio_ui=aspect_ratio, image_size_ui=image_size,
-        want_image=want_image, want_thinking=want_thinking,
-        want_search=bool(enable_search),
-    )
-    
-    _debug_print_send(
-        model_name=model_name,
-        system_instruction=system_instruction,
-        user_text=user_text,
-        image_files=user_images,
-        generate_config=generate_config,
-    )
-
-# 4) 调用
-    try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=contents if len(contents) > 1 else (contents[0] if contents else user_text),
-            config=generate_config,
-        )
-    except Exception as e:
-        raise RuntimeError(f"调用 Vertex Gemini 失败：{e}")
-
-    # 5) 解析结果 (🛠️ 增强调试版)
-    _debug_print_recv(response) # 打印响应
-
-    text_chunks = []
-    generated_images = []
-
-    # 先检查有没有 candidates
-    if not hasattr(response, "candidates") or not response.candidates:
-        # 这种情况通常是 prompt_feedback 直接拦截了
-        feedback = getattr(response, "prompt_feedback", "无反馈信息")
-        return f"⚠️ 模型未返回任何候选结果 (Blocked)。\n反馈信息: {feedback}", []
-
-    first_candidate = response.candidates[0]
-    finish_reason = getattr(first_candidate, "finish_reason", "UNKNOWN")
-
-    # 提取文本
-    if getattr(response, "text", None):
-        text_chunks.append(response.text)
-
-    # 提取 Parts (文本和图片)
-    from pathlib import Path
-    import time
-
-    for part in getattr(response, "parts", []) or []:
-        if getattr(part, "thought", None): continue
-        if getattr(part, "text", None):
-            text_chunks.append(part.text)
-            continue
-        
-        # 处理图片
-        as_image = getattr(part, "as_image", None)
-        if callable(as_image):
-            img = as_image()
-            if img is not None:
-                out_dir = Path("outputs")
-                out_dir.mkdir(exist_ok=True)
-                filename = f"{model_name}_{int(time.time()*1000)}.png"
-                out_path = out_dir / filename
-                try:
-                    img.save(out_path)
-                    generated_images.append(str(out_path))
-                except Exception:
-                    pass
-
-    final_text = "\n".join(t.strip() for t in text_chunks if t.strip())
-    
-    # 🛠️ 关键修改：如果什么都没拿到，检查 Finish Reason
-    if not final_text and not generated_images:
-        # 如果是因为安全原因被拦截
-        if "SAFETY" in str(finish_reason):
-            return f"🛡️ 内容被安全策略拦截 (Finish Reason: {finish_reason})。\n请尝试修改提示词或图片。", []
-        # 如果是其他原因
-        elif finish_reason != "STOP":
-             return f"⚠️ 模型停止生成，但未返回内容 (Finish Reason: {finish_reason})。\n这通常是因为输入了两张图但没有提供足够的文字指令，或者模型对多图输入感到困惑。", []
-        else:
-             return "⚠️ API 返回成功 (STOP)，但内容为空。这可能是 Vertex AI 的临时故障或模型输出了空字符串。", []
-
-    # 如果只有图没有字，给个提示
-    if not final_text and generated_images:
-        final_text = "✅ 图像已生成（见下方）"
-    
-    return final_text, generated_images
-
 # ========== Gradio 交互逻辑 ==========
 def gr_chat_send(
     user_input: str,
@@ -826,12 +493,24 @@ def gr_chat_send(
     aspect_ratio: str, image_size: str, temperature: float, top_p: float, top_k: int, max_output_tokens: int, system_instruction: str,
     enable_search: bool,
     session_dir,
+    request: gr.Request = None,
+    variants: int = 1,
+    context_cache_key: str = "",
 ):
     user_input = (user_input or "").strip()
     image_files = image_files or []
 
+    sid = _session_id(request)
     if not user_input and not image_files:
-        return history, raw_messages, "", None, session_dir
+        return history, raw_messages, "", None, session_dir, gr.update()
+
+    # 硬预算：直接拒绝发送，保留输入框内容
+    budget_state, budget_msg = get_ledger().check_budget(session_id=sid)
+    if budget_state == BUDGET_HARD:
+        gr.Warning(f"预算已用尽，本次未发送：{budget_msg}")
+        return history, raw_messages, user_input, image_files, session_dir, _usage_text(sid, budget_msg)
+    if budget_state == BUDGET_SOFT:
+        gr.Warning(budget_msg)
 
     # ===== 1. 用户消息上屏 (核心修改) =====
     # 策略：不再构建 {"type": "image"} 字典，而是把图片转为 Markdown 文本
@@ -855,25 +534,90 @@ def gr_chat_send(
     raw_messages.append({"role": "user", "text": user_input, "images": image_files.copy()})
     
     # ===== 3. 调用 API =====
-    try:
-        reply_text, generated_images = call_gemini_vertex(
-            api_key=api_key, model_name=model_name,
+    # 经由全局调度器执行：对话优先级最高，会插到所有批量任务条目之前
+    # 路由器在所选模型熔断时改用备选模型，used_model 为实际回复的模型
+    # 失败按全局重试策略分类重试；对话是交互式的，总等待时长限制得更短
+    token = new_token(sid, scope="chat")
+    used_model = model_name
+    retries = []
+    call_ok = False
+
+    n_variants = max(1, int(variants or 1))
+
+    def _call(m: str, count: int):
+        return call_gemini_vertex(
+            api_key=api_key, model_name=m,
             history_messages=raw_messages[:-1],
             user_text=user_input, user_images=image_files,
             aspect_ratio=aspect_ratio, image_size=image_size,
             system_instruction=system_instruction,
             temperature=float(temperature), top_p=float(top_p), top_k=int(top_k), max_output_tokens=int(max_output_tokens),
             enable_search=bool(enable_search),
+            cancel_token=token,
+            usage_tags={"session_id": sid, "flow": _flow_id(request), "source": "chat"},
+            candidate_count=count,
+            context_cache_key=context_cache_key or None,
+        )
+
+    def _attempt(m: str):
+        sched_kwargs = dict(
+            flow=_flow_id(request),
+            priority=PRIORITY_INTERACTIVE,
+            cost=estimate_latency(m, image_size, bool(enable_search)),
+            cancel_token=token,
         )
+        # 多个变体：优先一次请求拿 N 个候选（历史和参考图只上传一次）
+        if n_variants == 1 or supports_candidate_count(m):
+            try:
+                return get_scheduler().run(lambda: _call(m, n_variants), label=f"对话 {m}", **sched_kwargs)
+            except Exception as e:
+                # 只有明确针对 candidate_count 的参数错误才说明模型不支持多候选；
+                # 其他请求级错误（预检拒绝、内容 / 参数问题）原样抛出，不改为并行、不记为不支持
+                if n_variants == 1 or not is_candidate_count_error(e):
+                    raise
+                mark_single_candidate(m)
+        # 模型不支持多候选：并行发 N 个单候选请求，各占一个调度槽位
+        futures = [
+            get_scheduler().submit(lambda: _call(m, 1), label=f"对话 {m} 变体 {k + 1}/{n_variants}", **sched_kwargs)
+            for k in range(n_variants)
+        ]
+        return _merge_variants(futures)
+
+    try:
+        (reply_text, generated_images), used_model = get_retry_policy().run(
+            lambda: get_router().call(model_name, _attempt),
+            token=token,
+            on_retry=lambda state, e, delay: retries.append(state.last_class),
+            max_elapsed_s=CHAT_MAX_RETRY_ELAPSED_S,
+        )
+        call_ok = True
+    except CancelledError as e:
+        reply_text = f"⏹️ 已取消：{e}"
+        generated_images = []
     except Exception as e:
         import traceback
         traceback.print_exc()
-        reply_text = f"❌ 出错：{e}"
+        err_class = classify_error(e)
+        if err_class == ERR_CIRCUIT_OPEN:
+            reply_text = f"🔌 {e}，请稍后再试或换一个模型。"
+        elif err_class == ERR_TIMEOUT:
+            reply_text = f"⏱️ {e}，已放弃本次请求。"
+        else:
+            reply_text = f"❌ 出错（{describe_error(e)}）"
+        if retries:
+            reply_text += f"\n（已重试 {len(retries)} 次）"
         generated_images = []
+    finally:
+        release_token(token)
 
     # ===== 4. 构建助手消息 (同样使用 Markdown 修复) =====
     
-    display_text = f"**[{model_name}]**\n{reply_text}" if reply_text else f"**[{model_name}]**"
+    header = f"**[{used_model}]**"
+    if used_model != model_name:
+        header += f"（{model_name} 熔断中，已自动回退）"
+    if retries and call_ok:
+        header += f"（重试 {len(retries)} 次后成功）"
+    display_text = f"{header}\n{reply_text}" if reply_text else header
     
     if generated_images:
         # 🛠️ 修复点 2：同样替换反斜杠
@@ -900,16 +644,159 @@ def gr_chat_send(
         "role": "model",
         "text": reply_text,
         "images": [], 
+        "model": used_model,
     })
 
-    return history, raw_messages, "", None, session_dir_new
+    return history, raw_messages, "", None, session_dir_new, _usage_text(sid)
+
+def _merge_variants(futures) -> Tuple[str, List[str]]:
+    """
+    合并并行变体请求的结果：文本按变体编号拼接，图片全部保留。
+    部分失败时保留成功的变体；全部失败时抛出第一个异常（交给重试策略）。
+    """
+    texts, images, errors = [], [], []
+    for k, future in enumerate(futures, 1):
+        try:
+            text, paths = future.result()
+        except CancelledError:
+            raise
+        except Exception as e:
+            errors.append(e)
+            texts.append(f"**变体 {k}**\n❌ {describe_error(e)}")
+            continue
+        images.extend(paths)
+        if text:
+            texts.append(f"**变体 {k}**\n{text}")
+    if len(errors) == len(futures):
+        raise errors[0]
+    return "\n".join(texts), images
+
+def _usage_text(session_id: str, note: str = "") -> str:
+    """对话区下方的本会话用量摘要"""
+    text = "📊 本会话用量：" + format_totals(get_ledger().totals(session_id=session_id))
+    return text + (f"\n\n⚠️ {note}" if note else "")
 
 def gr_clear(history, raw_messages):
     return [], []
 
+# ---------- 会话状态外置：原始消息 / 聊天记录 / 导出目录保存在 session_store ----------
+# 浏览器通过 BrowserState 持有一个稳定的会话 ID，任意一个进程收到请求都能从存储里取回状态
+
+def gr_restore_session(session_key: str):
+    """
+    页面加载：分配（或沿用）会话 ID，并恢复之前的聊天记录
+    """
+    session_key = session_key or uuid.uuid4().hex
+    state = get_session_store().load_chat(session_key)
+    return session_key, state["history"]
+
+def gr_chat_send_stored(
+    user_input: str,
+    image_files: List[str],
+    history: List[dict],
+    session_key: str,
+    api_key: str,
+    model_name: str,
+    aspect_ratio: str, image_size: str, temperature: float, top_p: float, top_k: int, max_output_tokens: int, system_instruction: str,
+    enable_search: bool,
+    variants: int = 1,
+    use_context_cache: bool = False,
+    request: gr.Request = None,
+):
+    """
+    从会话存储读出状态 -> gr_chat_send -> 把本轮追加到存储里的最新记录
+    history: 页面上的聊天记录，只用于界面；以会话存储里的记录为准（可能是另一个标签页的旧内容）
+    use_context_cache: 以会话存储的 key 作为上下文缓存的对话标识
+    """
+    session_key = session_key or uuid.uuid4().hex
+    store = get_session_store()
+    state = store.load_chat(session_key)
+    base_raw, base_history = state["raw_messages"], state["history"]
+    new_history, new_raw, user_out, files_out, session_dir, usage = gr_chat_send(
+        user_input, image_files, list(base_history), list(base_raw),
+        api_key, model_name,
+        aspect_ratio, image_size, temperature, top_p, top_k, max_output_tokens, system_instruction,
+        enable_search,
+        state["export_dir"],
+        request,
+        variants,
+        session_key if use_context_cache else "",
+    )
+    turn_raw, turn_history = new_raw[len(base_raw):], new_history[len(base_history):]
+
+    def _append_turn(chat):
+        # 生成期间同一会话的其他请求可能已写回别的轮次或清空了对话：在最新记录之后追加本轮
+        chat["raw_messages"] += turn_raw
+        chat["history"] += turn_history
+        chat["export_dir"] = chat["export_dir"] or session_dir or ""
+        return chat
+
+    if turn_raw:
+        state = store.update_chat(session_key, _append_turn)
+        # 会话引用的图片与导出目录不会被存储清理删除
+        get_storage().hold(session_key, state["raw_messages"], state["export_dir"])
+    return state["history"], user_out, files_out, usage, session_key
+
+def gr_clear_stored(session_key: str):
+    """清空对话（保留导出目录，后续轮次继续写入同一个 chat.md）"""
+    state = get_session_store().update_chat(session_key, lambda chat: {**chat, "raw_messages": [], "history": []})
+    get_context_cache().drop(session_key)
+    get_storage().hold(session_key, state["export_dir"])
+    return []
+
+def _session_id(request) -> str:
+    """
+    取 Gradio 会话标识（同一浏览器页面内所有 Tab 共享），无请求上下文时返回空串
+    """
+    return getattr(request, "session_hash", None) or ""
+
+def _flow_id(request) -> str:
+    """
+    调度器的公平队列单位：启用登录时按用户名，否则按浏览器会话
+    """
+    return getattr(request, "username", None) or _session_id(request) or "anonymous"
+
+def gr_cancel_chat(request: gr.Request = None):
+    """
+    Gradio 回调：取消当前会话中正在进行的对话请求
+    """
+    n = cancel_session(_session_id(request), scope="chat", reason="用户取消")
+    if n:
+        print(f"[INFO] 已取消 {n} 个对话请求")
+
+def gr_on_unload(request: gr.Request = None):
+    """
+    浏览器页面关闭 / 断开时，取消该会话下所有进行中的请求（对话 + 队列）
+    """
+    sid = _session_id(request)
+    if sid and cancel_session(sid, reason="浏览器已断开"):
+        print(f"[INFO] 会话 {sid[:8]} 已断开，进行中的请求已取消")
+
 # ========== 搭建 Gradio UI ==========
 
 def create_gradio_app() -> gr.Blocks:
+    # 初始化进程级调度器（所有会话 / 插件共享）
+    configure_scheduler(**load_scheduler_config())
+    # 用量账本：预算配置每次检查时从 config.json 重新读取
+    configure_ledger(budget_provider=load_budget_config)
+    # 按模型熔断 + 回退路由（对话 / 队列共享熔断状态）
+    configure_router(**load_routing_config())
+    # 按错误类别的重试策略（对话 / 队列共用，统计显示在队列页的全局调度面板）
+    configure_retry_policy(**load_retry_config())
+    # 显式上下文缓存（对话页开关决定是否使用）
+    configure_context_cache(**load_context_cache_config())
+    # 发送前预检（输入 token / 上传大小）
+    configure_preflight(**load_preflight_config())
+    # 输出目录配额与 LRU 清理（后台增量扫描）
+    configure_storage(**load_storage_config())
+    # 新输出图片在后台进程池生成 WebP 等变体，展示 / 导出时挑最小的合格文件
+    configure_transcoder(**load_variants_config())
+    # 队列结果的感知哈希近似重复检测（任务内聚类 + 会话历史）
+    configure_dedupe(**load_dedupe_config())
+
+    # 参数预设存储（带缓存，加锁原子写入）
+    configure_preset_store(CONFIG_PATH)
+
     # 先从 config.json 读取预设
     presets = load_presets_from_config()
     if presets:
@@ -944,8 +831,9 @@ def create_gradio_app() -> gr.Blocks:
             
             # === Tab 1: 主对话界面 (原来的界面) ===
             with gr.Tab("🍌 Banana Studio"):
-                raw_messages_state = gr.State([])  # 保存原始结构 [{'role', 'text', 'images'}, ...]
-                export_session_dir = gr.State(value="")
+                # 会话 ID 存在浏览器 localStorage 中；原始消息 / 导出目录等状态放在外部会话存储，
+                # 这样多个进程（负载均衡后）都能处理同一个会话，刷新页面也不会丢失
+                session_key = gr.BrowserState("", storage_key="banana_session_id")
 
                 with gr.Row():
                     # ===== 左侧：参数区 =====
@@ -969,6 +857,19 @@ def create_gradio_app() -> gr.Blocks:
                             value=False,
                         )
 
+                        variants = gr.Slider(
+                            label="变体数量（一次返回多个候选，模型不支持时改为并行请求）",
+                            minimum=1,
+                            maximum=MAX_CHAT_VARIANTS,
+                            value=1,
+                            step=1,
+                        )
+
+                        use_context_cache = gr.Checkbox(
+                            label="上下文缓存（长对话把系统指令和较早的轮次缓存在服务端，每轮只上传新消息）",
+                            value=False,
+                        )
+
                         aspect_ratio = gr.Dropdown(
                             label="图像宽高比（用于 image_config，仅当前示例中传给配置）",
                             choices=ASPECT_RATIO_OPTIONS,
@@ -1023,6 +924,8 @@ def create_gradio_app() -> gr.Blocks:
 
                         # 状态：所有预设
                         presets_state = gr.State(presets)
+                        # 预设文件版本：定时比较，其他会话保存 / 删除预设后自动刷新（初始为空，首次刷新时载入登录用户自己的预设）
+                        preset_version = gr.State("")
 
                         preset_name_input = gr.Textbox(
                             label="预设名称",
@@ -1059,6 +962,7 @@ def create_gradio_app() -> gr.Blocks:
                             outputs=[
                                 presets_state,
                                 preset_dropdown,
+                                preset_version,
                             ],
                         )
 
@@ -1089,9 +993,17 @@ def create_gradio_app() -> gr.Blocks:
                             outputs=[
                                 presets_state,
                                 preset_dropdown,
+                                preset_version,
                             ],
                         )
 
+                        gr.Timer(PRESET_POLL_S).tick(
+                            fn=refresh_presets,
+                            inputs=[preset_version, preset_dropdown, presets_state],
+                            outputs=[presets_state, preset_dropdown, preset_version],
+                            show_progress="hidden",
+                        )
+
                         gr.Markdown(
                             "> 🔐 当前示例中，所有 SafetySetting 的 threshold 均为 `OFF`，"
                             "仅建议在本地/开发环境中使用。"
@@ -1119,18 +1031,21 @@ def create_gradio_app() -> gr.Blocks:
                             file_count="multiple",
                         )
 
+                        usage_box = gr.Markdown("📊 本会话用量：暂无")
+
                         with gr.Row():
                             send_btn = gr.Button("发送", variant="primary")
+                            cancel_btn = gr.Button("⏹️ 取消", variant="stop")
                             clear_btn = gr.Button("清空对话")
 
                         # 绑定发送事件
                         send_btn.click(
-                            fn=gr_chat_send,
+                            fn=gr_chat_send_stored,
                             inputs=[
                                 user_input,
                                 image_upload,
                                 chatbot,
-                                raw_messages_state,
+                                session_key,
                                 api_key,
                                 model_name,
                                 aspect_ratio,
@@ -1141,39 +1056,80 @@ def create_gradio_app() -> gr.Blocks:
                                 max_output_tokens,
                                 system_instruction,
                                 enable_search,
-                                export_session_dir,
+                                variants,
+                                use_context_cache,
                             ],
                             outputs=[
                                 chatbot,
-                                raw_messages_state,
                                 user_input,
                                 image_upload,
-                                export_session_dir,
+                                usage_box,
+                                session_key,
                             ],
+                            # 并发由全局调度器控制，这里不再让 Gradio 串行排队
+                            concurrency_limit=None,
                         )
 
+                        cancel_btn.click(fn=gr_cancel_chat, inputs=None, outputs=None, queue=False)
+
                         clear_btn.click(
-                            fn=gr_clear,
-                            inputs=[chatbot, raw_messages_state],
-                            outputs=[chatbot, raw_messages_state],
+                            fn=gr_clear_stored,
+                            inputs=[session_key],
+                            outputs=[chatbot],
+                        )
+
+                        # 页面加载时恢复会话
+                        demo.load(
+                            fn=gr_restore_session,
+                            inputs=[session_key],
+                            outputs=[session_key, chatbot],
                         )
             
             # === Tab 2+: 动态加载插件 ===
             # 直接在这里调用加载函数，它会在当前的 gr.Tabs() 上下文中自动渲染 Tab
-            load_plugins_from_dir("plugins")
+            record_plugins(load_plugins_from_dir("plugins", host=PluginHost()))
+
+        # 浏览器断开时自动取消该会话的进行中请求，避免继续消耗配额
+        demo.unload(gr_on_unload)
 
         return demo
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banana Studio Web UI")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="分析启动耗时（各模块导入 / UI 构建 / 各插件），打印报告后退出，不启动服务",
+    )
+    parser.add_argument("--no-warmup", action="store_true", help="不在后台预热连接（Client / 令牌 / TLS）")
+    args = parser.parse_args()
+
+    # 父进程：用 -X importtime 重新拉起自己（子进程带 BANANA_STARTUP_PROFILE），汇总报告
+    if args.profile_startup and not is_profiling():
+        print(format_startup_report(profile_startup(__file__)))
+        sys.exit(0)
+
     # ① 加载 Key
-    load_google_api_key_from_file()
+    with phase("加载凭证"):
+        load_google_api_key_from_file()
 
     # ② 创建 UI
-    demo = create_gradio_app()
-    
+    with phase("构建 UI"):
+        demo = create_gradio_app()
+
     # 查找端口
-    port = find_free_port(7860, 7880, host="127.0.0.1")
+    with phase("查找端口"):
+        port = find_free_port(7860, 7880, host="127.0.0.1")
+
+    # 分析模式的子进程到这里就结束：写出阶段耗时，不真正启动服务
+    if is_profiling():
+        write_profile()
+        sys.exit(0)
+
+    # 后台预热：与 Gradio 启动并行，用户第一次发送时连接和令牌都已就绪
+    if not args.no_warmup:
+        start_background_warmup()
 
     # ③ 启动 (🛠️ 修复点：添加 allowed_paths)
     # 允许 Gradio 读取当前目录下的 outputs 文件夹和根目录文件
@@ -1183,5 +1139,3 @@ if __name__ == "__main__":
         allowed_paths=[".", "outputs"] 
     )
     print(f"[banana] Gradio running on http://127.0.0.1:{port}")
-
-
@@ -1,57 +1,288 @@
 import gradio as gr
-from PIL import Image
 import tempfile
 import os
 import time
+import zipfile
 
-def process_sprite_sheet(image, rows, cols, duration, loop):
+from PIL import ImageDraw
+
+from banana.sprite import (
+    FORMAT_EXT,
+    FORMAT_GIF,
+    FORMAT_LABELS,
+    VIDEO_FORMATS,
+    available_formats,
+    convert_sprite_sheet,
+    format_convert_report,
+    sheet_to_array,
+)
+from banana.accounting import BUDGET_HARD, BUDGET_SOFT, get_ledger
+from banana.cancellation import cancel_session, new_token, release_token
+from banana.core import DEFAULT_ADVANCED_CONFIG, DEFAULT_MODEL_OPTIONS, load_sprite_batch_config
+from banana.sprite_batch import collect_inputs, is_within_roots, make_archive, parse_overrides, run_batch
+from banana.sprite_grid import detect_grid, format_grid_guess
+from banana.sprite_pipeline import PIPELINE_MAX_FRAMES, assemble_sheet, frame_prompts, generate_frames, load_frame
+
+# 网格识别预览图的最长边（只用于显示）
+GRID_PREVIEW_SIDE = 1024
+# AI 生成动画默认使用的画图模型
+DEFAULT_ANIMATION_MODEL = "gemini-3.1-flash-image-preview"
+# 拼图前单帧长边的可选上限（0 = 保持原尺寸）
+FRAME_SIDE_OPTIONS = [256, 512, 1024, 0]
+# 视为本机访问的客户端地址
+# 宿主上下文（create_tab(host) 注入），用于统一管理输出目录
+_host = None
+
+def _out_path(fmt):
+    """outputs/gif 下的新文件路径，文件名带时间戳 + 随机后缀 (避免覆盖)"""
+    ext = FORMAT_EXT[fmt]
+    if _host is not None:
+        return str(_host.outputs.new_path("sprite", ext, "gif"))
+    output_dir = os.path.join("outputs", "gif")
+    os.makedirs(output_dir, exist_ok=True)
+    return os.path.join(output_dir, f"sprite_{int(time.time() * 1000)}{ext}")
+
+def _grid_preview(image, guess):
+    """在缩小的精灵图上画出识别出的网格（绿）和各帧内容框（红）"""
+    scale = min(1.0, GRID_PREVIEW_SIDE / max(image.size))
+    preview = image.convert("RGBA").resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+    draw = ImageDraw.Draw(preview)
+    x0, y0, cw, ch = guess.cell
+    for r in range(guess.rows):
+        for c in range(guess.cols):
+            left, top = x0 + c * cw, y0 + r * ch
+            draw.rectangle([left * scale, top * scale, (left + cw) * scale - 1, (top + ch) * scale - 1], outline=(0, 200, 0, 255))
+    for left, top, right, bottom in guess.boxes:
+        draw.rectangle([left * scale, top * scale, right * scale - 1, bottom * scale - 1], outline=(230, 0, 0, 255))
+    return preview
+
+def detect_sprite_grid(image):
     """
-    核心处理逻辑
-    注意：Pillow 保存 GIF 时，duration 参数单位是毫秒(int)
+    自动识别行列数（上传图片时自动执行，也可点按钮重新识别）
+    返回 (行数, 列数, 标注了网格的预览图, 识别说明, 识别结果 State)
     """
     if image is None:
-        return None
+        return gr.update(), gr.update(), None, "", None
+    guess = detect_grid(sheet_to_array(image))
+    info = format_grid_guess(guess)
+    print(f"[SpriteTool] 网格识别：{info}")
+    if guess.method == "none":
+        return gr.update(), gr.update(), None, info, None
+    return guess.rows, guess.cols, _grid_preview(image, guess), info, guess.to_dict()
+
+def process_sprite_sheet(image, rows, cols, duration, loop, formats=None, dedupe=True, grid=None):
+    """
+    核心处理逻辑（切帧 / 全局调色板 / 各格式编码见 banana.sprite）
+    注意：Pillow 保存动图时，duration 参数单位是毫秒(int)
+    grid: detect_sprite_grid 的识别结果；行列数未被手动改动时，按识别出的起点 / 格距切帧
+    返回 (预览文件, 所有输出文件, 各格式大小 / 耗时报告)
+    """
+    if image is None:
+        return None, None, ""
     
     # 防止 duration 为空或 0 导致报错
     if not duration or duration <= 0:
         duration = 100
+    formats = [f for f in (formats or [FORMAT_GIF]) if f in FORMAT_EXT] or [FORMAT_GIF]
+    cell, occupied = None, None
+    if grid and grid["rows"] == int(rows) and grid["cols"] == int(cols):
+        cell, occupied = grid["cell"], grid["occupied"]
     
-    img_width, img_height = image.size
-    frame_width = img_width // int(cols)
-    frame_height = img_height // int(rows)
-    
-    frames = []
-    for r in range(int(rows)):
-        for c in range(int(cols)):
-            left = c * frame_width
-            top = r * frame_height
-            right = left + frame_width
-            bottom = top + frame_height
-            frame = image.crop((left, top, right, bottom))
-            frames.append(frame)
+    # 切帧只做一次，各格式共用；单个格式失败不影响其他格式
+    try:
+        report = convert_sprite_sheet(
+            image, int(rows), int(cols), int(duration), bool(loop), formats, _out_path,
+            dedupe=bool(dedupe), cell=cell, occupied=occupied,
+        )
+    except ValueError as e:
+        raise gr.Error(str(e))
     
-    # 保存为 GIF
-    # 1. 定义保存目录 (例如根目录下的 outputs/gif)
-    output_dir = os.path.join("outputs", "gif")
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
+    files = [r["path"] for r in report["results"] if r["path"]]
+    # 预览用第一个图片格式（视频只提供下载）
+    preview = next((r["path"] for r in report["results"] if r["path"] and r["format"] not in VIDEO_FORMATS), None)
+    for r in report["results"]:
+        if r["path"]:
+            print(f"[SpriteTool] {FORMAT_LABELS[r['format']]} 已保存: {r['path']}（{r['frames']} 帧，{r['bytes'] / 1024:.0f} KB，耗时 {r['encode_s']:.2f}s）")
+    return preview, files or None, format_convert_report(report)
+
+def _check_server_path(path, cfg):
+    """
+    路径输入读取的是服务器上的文件：只允许 input_roots 中的目录，没有配置时一律拒绝
+    （请求来源地址经过反向代理后不可信，不能据此放行“本机访问”）
+    """
+    roots = [r for r in (cfg.get("input_roots") or []) if r]
+    if not roots:
+        raise gr.Error("目录 / zip 路径输入未启用：请在 config.json 的 sprite_batch.input_roots 中配置允许读取的目录")
+    if not is_within_roots(path, roots):
+        raise gr.Error(f"只能读取以下目录中的文件：{', '.join(roots)}")
+
+
+def process_batch(files, dir_path, rows, cols, duration, loop, formats, dedupe, overrides_text, auto_grid=False):
+    """
+    批量转换（生成器）：多个精灵图 / 目录 / zip 提交到进程池并行转换，
+    每完成一个就更新画廊和进度，全部完成后打包 zip 供下载。
+    auto_grid: 未在逐文件设置中列出的文件各自自动识别行列数
+    dir_path: 服务器上的目录 / zip，受 config.json 的 sprite_batch.input_roots 限制
+    """
+    cfg = load_sprite_batch_config()
+    inputs = [getattr(f, "name", f) for f in (files or [])]
+    if dir_path and dir_path.strip():
+        path = dir_path.strip().strip('"')
+        _check_server_path(path, cfg)
+        inputs.append(path)
+    out_dir = str(_host.outputs.dir("gif", f"batch_{int(time.time() * 1000)}")) if _host is not None \
+        else os.path.join("outputs", "gif", f"batch_{int(time.time() * 1000)}")
+    try:
+        overrides = parse_overrides(overrides_text)
+        sources = collect_inputs(
+            inputs,
+            extract_dir=os.path.join(out_dir, "_sources"),
+            max_files=int(cfg["max_files"]),
+            max_member_bytes=int(float(cfg["max_zip_member_mb"]) * 1024 * 1024),
+            max_zip_bytes=int(float(cfg["max_zip_mb"]) * 1024 * 1024),
+        )
+    except (ValueError, OSError, zipfile.BadZipFile) as e:
+        raise gr.Error(str(e))
+    if not sources:
+        raise gr.Error("没有找到可转换的图片（支持 png / jpg / webp / gif / bmp，以及包含它们的目录或 zip）")
     
-    # 2. 生成带时间戳的文件名 (避免覆盖)
-    timestamp = int(time.time())
-    filename = f"sprite_{timestamp}.gif"
-    out_path = os.path.join(output_dir, filename)
+    formats = [f for f in (formats or [FORMAT_GIF]) if f in FORMAT_EXT] or [FORMAT_GIF]
+    shared = {"rows": int(rows), "cols": int(cols), "duration": int(duration) if duration and duration > 0 else 100, "loop": bool(loop)}
+    gallery, outputs, lines = [], [], []
+    started = time.perf_counter()
+    yield gallery, f"⏳ 0 / {len(sources)} 个精灵图转换中…", None
     
-    # 3. 保存
-    frames[0].save(
-        out_path,
-        save_all=True,
-        append_images=frames[1:],
-        duration=int(duration),
-        loop=0 if loop else 1
-    )
+    for done, row in enumerate(run_batch(sources, shared, overrides, formats, out_dir, dedupe=bool(dedupe), auto_grid=bool(auto_grid)), 1):
+        ok = [r for r in row["results"] if r.get("path")]
+        outputs += [r["path"] for r in ok]
+        preview = next((r["path"] for r in ok if r["format"] not in VIDEO_FORMATS), None)
+        if preview:
+            gallery.append((preview, row["name"]))
+        if row["error"]:
+            lines.append(f"❌ {row['name']}：{row['error']}")
+        else:
+            sizes = "，".join(f"{FORMAT_LABELS[r['format']]} {r['bytes'] / 1024:.0f} KB" for r in ok)
+            auto = "，自动识别" if row.get("grid") else ""
+            lines.append(f"✅ {row['name']}（{row['rows']}×{row['cols']}{auto}，{row['elapsed_s']:.2f}s）{sizes}")
+        yield gallery, f"⏳ {done} / {len(sources)}\n\n" + "\n\n".join(lines[-20:]), None
     
-    print(f"[SpriteTool] GIF 已保存: {out_path}")
-    return out_path
+    archive = make_archive(outputs, os.path.join(out_dir, "sprites.zip")) if outputs else None
+    summary = f"✅ 完成 {len(sources)} 个精灵图，共 {time.perf_counter() - started:.1f}s，输出目录 `{out_dir}`"
+    print(f"[SpriteTool] 批量转换完成：{len(sources)} 个，{len(outputs)} 个文件 -> {out_dir}")
+    yield gallery, summary + "\n\n" + "\n\n".join(lines), archive
+
+def _image_models():
+    """可选的画图模型（宿主提供的模型列表中名字带 image 的）"""
+    options = list(_host.model_options) if _host is not None else list(DEFAULT_MODEL_OPTIONS)
+    return [m for m in options if "image" in m] or [DEFAULT_ANIMATION_MODEL]
+
+def _call_model():
+    if _host is not None:
+        return _host.call_model
+    from banana.core import call_gemini_vertex
+    return call_gemini_vertex
+
+def generate_animation(
+    reference, subject, action, frame_count, gen_cols, model_name, aspect_ratio, image_size, frame_side,
+    duration, loop, formats, dedupe, api_key, request: gr.Request = None,
+):
+    """
+    AI 生成动画（生成器）：各帧经全局调度器并发生成（banana.sprite_pipeline），
+    全部完成后在内存中拼成精灵图，直接走 process_sprite_sheet 转换。
+    yield (帧画廊, 状态, 精灵图, 行数, 列数, 网格 State, 预览, 下载文件, 报告)
+    """
+    if not subject or not subject.strip():
+        raise gr.Error("请填写角色 / 主体描述")
+    prompts = frame_prompts(subject, action, frame_count)
+    session_id = getattr(request, "session_hash", None) or ""
+    flow = getattr(request, "username", None) or session_id or "anonymous"
+    out_dir = str(_host.outputs.dir("gif", f"frames_{int(time.time() * 1000)}")) if _host is not None \
+        else os.path.join("outputs", "gif", f"frames_{int(time.time() * 1000)}")
+    call_kwargs = {
+        "api_key": api_key or "",
+        "aspect_ratio": aspect_ratio,
+        "image_size": image_size,
+        "system_instruction": DEFAULT_ADVANCED_CONFIG["system_instruction"],
+        "temperature": DEFAULT_ADVANCED_CONFIG["temperature"],
+        "top_p": DEFAULT_ADVANCED_CONFIG["top_p"],
+        "top_k": DEFAULT_ADVANCED_CONFIG["top_k"],
+        "max_output_tokens": DEFAULT_ADVANCED_CONFIG["max_output_tokens"],
+        "enable_search": False,
+        "output_dir": out_dir,
+    }
+    keep = gr.update()
+    paths, lines = {}, []
+    started = time.perf_counter()
+
+    def _status(head):
+        return head + ("\n\n" + "\n\n".join(lines[-8:]) if lines else "")
+
+    def _gallery():
+        return [(paths[i], f"第 {i + 1} 帧") for i in sorted(paths)]
+
+    ledger = get_ledger()
+    paused_head = "⏸️ 预算已超出，动画生成暂停（修改 config.json 的 budgets 或点击取消）"
+
+    def _budget_gate():
+        budget_state, budget_msg = ledger.check_budget(session_id=session_id)
+        return budget_msg if budget_state == BUDGET_HARD else ""
+
+    token = new_token(session_id, scope="sprite")
+    try:
+        # --- 预算检查：与队列一致，硬预算暂停等待（可取消），软预算提示后继续 ---
+        budget_state, budget_msg = ledger.check_budget(session_id=session_id)
+        while budget_state == BUDGET_HARD:
+            yield [], f"{paused_head}\n{budget_msg}", keep, keep, keep, keep, keep, keep, keep
+            if token.sleep(10):
+                break
+            budget_state, budget_msg = ledger.check_budget(session_id=session_id)
+        if token.cancelled:
+            yield [], "⏹️ 已取消", keep, keep, keep, keep, keep, keep, keep
+            return
+        if budget_state == BUDGET_SOFT:
+            lines.append(f"⚠️ {budget_msg}，继续执行")
+
+        hint = "以参考图保持一致" if reference else "先生成第 1 帧作为关键帧，其余帧以它为参考"
+        yield [], _status(f"⏳ 0 / {len(prompts)} 帧（{hint}）"), keep, keep, keep, keep, keep, keep, keep
+        done = 0
+        for row in generate_frames(
+            _call_model(), prompts, [reference] if reference else [], model_name, call_kwargs,
+            flow=flow, cancel_token=token, usage_tags={"session_id": session_id, "flow": flow},
+            budget_gate=_budget_gate,
+        ):
+            # 硬预算超出：尚未开始的帧暂停，恢复后继续
+            if row.get("paused"):
+                yield _gallery(), _status(f"{paused_head}（已完成 {done} / {len(prompts)} 帧）\n{row['paused']}"), keep, keep, keep, keep, keep, keep, keep
+                continue
+            done += 1
+            if row["path"]:
+                paths[row["index"]] = row["path"]
+                if row["model"] != model_name:
+                    lines.append(f"🔀 第 {row['index'] + 1} 帧改用 {row['model']}")
+            else:
+                lines.append(f"❌ 第 {row['index'] + 1} 帧：{row['error']}")
+            yield _gallery(), _status(f"⏳ {done} / {len(prompts)} 帧"), keep, keep, keep, keep, keep, keep, keep
+    finally:
+        release_token(token)
+
+    if token.cancelled or not paths:
+        head = "⏹️ 已取消" if token.cancelled else "❌ 没有生成任何帧"
+        yield _gallery(), _status(head), keep, keep, keep, keep, keep, keep, keep
+        return
+
+    # 缺失的帧直接跳过，按原顺序拼接
+    frames = [load_frame(paths[i], int(frame_side or 0)) for i in sorted(paths)]
+    sheet, rows, cols, occupied = assemble_sheet(frames, int(gen_cols))
+    grid = {"rows": rows, "cols": cols, "cell": (0, 0) + frames[0].size, "occupied": occupied}
+    preview, files, report = process_sprite_sheet(sheet, rows, cols, duration, loop, formats, dedupe, grid)
+    head = f"✅ {len(paths)} / {len(prompts)} 帧，共 {time.perf_counter() - started:.1f}s，已拼成 {rows}×{cols} 精灵图并转换"
+    print(f"[SpriteTool] AI 生成动画：{len(paths)} / {len(prompts)} 帧 -> {rows}×{cols}，单帧目录 {out_dir}")
+    yield _gallery(), _status(head), sheet, rows, cols, grid, preview, files, report
+
+def cancel_animation(request: gr.Request = None):
+    session_id = getattr(request, "session_hash", None) or ""
+    n = cancel_session(session_id, scope="sprite")
+    return "⏹️ 正在取消…" if n else gr.update()
 
 # === 联动逻辑函数 ===
 
@@ -72,12 +303,15 @@ def sync_fps_from_duration(duration):
 
 # ====================
 
-def create_tab():
+def create_tab(host=None):
     """
     插件入口函数
+    host: banana.plugin_host.PluginHost，由主程序传入
     """
+    global _host
+    _host = host
     with gr.Tab("🎞️ 精灵图转 GIF"):
-        gr.Markdown("### 👾 Sprite Sheet to GIF Converter")
+        gr.Markdown("### 👾 Sprite Sheet to GIF / WebP / APNG / Video Converter")
         
         with gr.Row():
             # 左侧：设置区
@@ -87,6 +321,10 @@ def create_tab():
                 with gr.Row():
                     rows = gr.Number(label="行数 (Rows)", value=1, precision=0, minimum=1)
                     cols = gr.Number(label="列数 (Cols)", value=4, precision=0, minimum=1)
+                with gr.Row():
+                    btn_detect = gr.Button("🔍 自动识别行列", size="sm")
+                grid_info = gr.Markdown()
+                grid_state = gr.State(None)
                 
                 # --- 联动区域 ---
                 with gr.Group():
@@ -111,11 +349,72 @@ def create_tab():
                 # ----------------
                 
                 loop = gr.Checkbox(label="循环播放 (Loop)", value=True)
+                formats = gr.CheckboxGroup(
+                    label="输出格式（视频需要本机 ffmpeg）",
+                    choices=[(FORMAT_LABELS[f], f) for f in available_formats()],
+                    value=[FORMAT_GIF],
+                )
+                dedupe = gr.Checkbox(label="合并相同的连续帧（延长停留时间）", value=True)
                 btn_convert = gr.Button("开始转换", variant="primary")
             
             # 右侧：预览区
             with gr.Column(scale=1):
-                output_gif = gr.Image(label="结果 GIF")
+                output_gif = gr.Image(label="预览")
+                output_files = gr.File(label="下载", file_count="multiple")
+                output_report = gr.Markdown()
+
+        # --- 批量转换：共用上方的行列 / 帧间隔 / 格式设置 ---
+        with gr.Accordion("📦 批量转换（多个文件 / 目录 / zip，多进程并行）", open=False):
+            with gr.Row():
+                with gr.Column(scale=1):
+                    batch_files = gr.File(label="精灵图或 zip", file_count="multiple", file_types=["image", ".zip"])
+                    batch_dir = gr.Textbox(label="或服务器目录 / zip 路径（需在 sprite_batch.input_roots 中配置）", placeholder="D:/sprites 或 /data/sprites.zip")
+                    batch_overrides = gr.Textbox(
+                        label="逐文件设置（可选，每行：文件名, 行数, 列数[, 帧间隔ms]；未列出的文件用上方设置）",
+                        placeholder="walk.png, 4, 8\nidle, 1, 6, 150",
+                        lines=4,
+                    )
+                    batch_auto_grid = gr.Checkbox(label="未列出的文件自动识别行列", value=True)
+                    btn_batch = gr.Button("开始批量转换", variant="primary")
+                with gr.Column(scale=1):
+                    batch_gallery = gr.Gallery(label="已完成", columns=4, height="auto")
+                    batch_status = gr.Markdown()
+                    batch_zip = gr.File(label="打包下载")
+
+        # --- AI 生成动画：各帧并发生成，拼好的精灵图直接填入上方并转换 ---
+        with gr.Accordion("🎬 AI 生成动画（逐帧并发生成 -> 自动拼图 -> 转换）", open=False):
+            with gr.Row():
+                with gr.Column(scale=1):
+                    gen_reference = gr.Image(label="参考图（可选，所有帧共用以保持角色一致）", type="filepath")
+                    gen_subject = gr.Textbox(label="角色 / 主体", placeholder="a chibi knight with a blue cape, pixel art", lines=2)
+                    gen_action = gr.Textbox(label="动作", placeholder="walk cycle / idle / attack", value="walk cycle")
+                    with gr.Row():
+                        gen_frames = gr.Slider(label="帧数", minimum=2, maximum=PIPELINE_MAX_FRAMES, step=1, value=8)
+                        gen_cols = gr.Number(label="拼图列数", value=4, precision=0, minimum=1)
+                    image_models = _image_models()
+                    with gr.Row():
+                        gen_model = gr.Dropdown(
+                            label="模型",
+                            choices=image_models,
+                            value=DEFAULT_ANIMATION_MODEL if DEFAULT_ANIMATION_MODEL in image_models else image_models[0],
+                        )
+                        gen_frame_side = gr.Dropdown(
+                            label="单帧长边上限",
+                            choices=[(f"{v}px" if v else "原尺寸", v) for v in FRAME_SIDE_OPTIONS],
+                            value=512,
+                        )
+                    with gr.Row():
+                        aspect_options = list(_host.aspect_ratio_options) if _host is not None else ["1:1"]
+                        size_options = list(_host.image_size_options) if _host is not None else ["1K"]
+                        gen_aspect = gr.Dropdown(label="宽高比", choices=aspect_options, value=aspect_options[0])
+                        gen_size = gr.Dropdown(label="尺寸", choices=size_options, value=size_options[0])
+                    gen_api_key = gr.Textbox(label="API Key (如未设置环境变量请在此输入)", type="password")
+                    with gr.Row():
+                        btn_generate = gr.Button("开始生成", variant="primary")
+                        btn_gen_cancel = gr.Button("⏹️ 取消", variant="stop")
+                with gr.Column(scale=1):
+                    gen_gallery = gr.Gallery(label="已生成的帧", columns=4, height="auto")
+                    gen_status = gr.Markdown()
 
         # === 事件绑定 ===
         
@@ -133,11 +432,37 @@ def create_tab():
             outputs=fps
         )
 
-        # 3. 点击转换按钮
+        # 3. 上传精灵图时自动识别行列（也可手动点按钮重新识别）
+        for trigger in (input_img.upload, btn_detect.click):
+            trigger(
+                fn=detect_sprite_grid,
+                inputs=input_img,
+                outputs=[rows, cols, output_gif, grid_info, grid_state],
+            )
+
+        # 4. 点击转换按钮
         # 注意：inputs 里我们只需要 duration，因为 PIL 最终要的是毫秒数
         # FPS 只是为了方便用户计算，最终值已经同步到了 duration 框里
         btn_convert.click(
             fn=process_sprite_sheet,
-            inputs=[input_img, rows, cols, duration, loop],
-            outputs=output_gif
+            inputs=[input_img, rows, cols, duration, loop, formats, dedupe, grid_state],
+            outputs=[output_gif, output_files, output_report]
+        )
+
+        # 5. 批量转换（流式更新画廊）
+        btn_batch.click(
+            fn=process_batch,
+            inputs=[batch_files, batch_dir, rows, cols, duration, loop, formats, dedupe, batch_overrides, batch_auto_grid],
+            outputs=[batch_gallery, batch_status, batch_zip],
+        )
+
+        # 6. AI 生成动画（帧流式出现在画廊，拼好的精灵图填入上方输入框，可调整行列后重新转换）
+        btn_generate.click(
+            fn=generate_animation,
+            inputs=[
+                gen_reference, gen_subject, gen_action, gen_frames, gen_cols, gen_model, gen_aspect, gen_size,
+                gen_frame_side, duration, loop, formats, dedupe, gen_api_key,
+            ],
+            outputs=[gen_gallery, gen_status, input_img, rows, cols, grid_state, output_gif, output_files, output_report],
         )
+        btn_gen_cancel.click(fn=cancel_animation, outputs=gen_status)
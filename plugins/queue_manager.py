@@ -2,17 +2,77 @@ import gradio as gr
 import time
 import random
 import json
+import os
+import tempfile
 import traceback
+import uuid
+from bisect import bisect_right
 from datetime import datetime
 
-# 尝试从主程序导入核心调用函数和配置
-# 注意：为了避免循环导入，建议在函数内部导入，或者确保 nano_banana_pro.py 结构允许
-try:
-    from nano_banana_pro import call_gemini_vertex, DEFAULT_MODEL_OPTIONS
-except ImportError:
-    # 如果独立运行或导入失败的 fallback
-    DEFAULT_MODEL_OPTIONS = ["gemini-3-pro-image-preview"]
-    print("[QueueManager] ⚠️ 无法导入 nano_banana_pro.py，请确保文件在同一目录下")
+from banana.accounting import BUDGET_HARD, BUDGET_SOFT, get_ledger
+from banana.cancellation import CancelledError, cancel_session, new_token, release_token
+from banana.context_cache import format_cache_snapshot, get_context_cache
+from banana.dedupe import format_duplicate_summary, new_tracker
+from banana.errors import ERROR_LABELS
+from banana.pricing import estimate_latency
+from banana.retry import format_retry_stats, get_retry_policy
+from banana.rewrite import REWRITE_MODEL, fallback_variants, submit_rewrite
+from banana.routing import format_router_snapshot, get_router
+from banana.session_store import get_session_store
+from banana.storage import format_storage_snapshot, get_storage
+from banana.scheduler import (
+    PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL,
+    format_scheduler_snapshot, get_scheduler,
+)
+from banana.sweep import AXIS_SHORT, SWEEP_MODE_FULL, SWEEP_MODE_SAMPLED, format_sweep_plan, plan_sweep
+from banana.variants import format_transcoder_snapshot, get_transcoder, pick_variant
+
+# 队列默认使用的画图模型（熔断时由路由器切换到 config.json 中配置的备选模型）
+DEFAULT_QUEUE_MODEL = "gemini-3-pro-image-preview"
+
+# 差异化策略
+STRATEGY_SEED_SALTING = "随机噪声 (Seed Salting)"
+STRATEGY_FLASH_REWRITE = "语义重写 (Flash Rewrite)"
+STRATEGY_PARAMS_ONLY = "仅参数变化"
+
+# 会话存储中保留的队列任务记录条数
+MAX_QUEUE_HISTORY = 50
+# 画廊显示变体的最小长边
+GALLERY_MIN_SIDE = 1024
+# 画廊中没有结果的格子用的占位图：类型 -> 颜色
+PLACEHOLDER_COLORS = {
+    "failed": (96, 32, 32),
+    "pending": (64, 64, 64),
+    "duplicate": (32, 72, 48),
+}
+PLACEHOLDER_SIDE = 256
+# UI 选项 -> 调度优先级
+QUEUE_PRIORITY_OPTIONS = {
+    "高": PRIORITY_HIGH,
+    "普通": PRIORITY_NORMAL,
+    "低": PRIORITY_LOW,
+}
+
+# 宿主上下文：由 create_tab(host) 注入，提供与主对话共享的调用函数 / Client 池
+# 不再 import nano_banana_pro，避免以 __main__ 运行时主程序被重复执行
+_host = None
+
+
+def _call_model():
+    if _host is not None:
+        return _host.call_model
+    # 独立使用（未经宿主加载）时直接用核心层
+    from banana.core import call_gemini_vertex
+    return call_gemini_vertex
+
+def _image_models():
+    """队列可选的画图模型（宿主提供的模型列表中名字带 image 的）"""
+    if _host is not None:
+        options = list(_host.model_options)
+    else:
+        from banana.core import DEFAULT_MODEL_OPTIONS
+        options = list(DEFAULT_MODEL_OPTIONS)
+    return [m for m in options if "image" in m] or [DEFAULT_QUEUE_MODEL]
 
 # ================= 工具函数：参数解析 =================
 
@@ -48,6 +108,34 @@ def parse_param_array(input_str: str, target_length: int, default_val, converter
         last_val = processed_list[-1]
         return processed_list + [last_val] * (target_length - current_len)
 
+def build_batch_plan(param_arrays, batch_count):
+    """
+    批量模式：按 parse_param_array 的规则把参数数组逐项对应到每一次循环
+    返回与 plan_sweep 相同结构的 item 列表
+    """
+    # 将 "1:1, 16:9" 这种字符串解析为对应每次循环的 list
+    parsed_params = {
+        "aspect_ratio": parse_param_array(param_arrays['aspect_ratio'], batch_count, "1:1"),
+        "image_size": parse_param_array(param_arrays['image_size'], batch_count, "1K"),
+        "enable_search": parse_param_array(param_arrays['enable_search'], batch_count, 0, int), # 0/1
+        "temperature": parse_param_array(param_arrays['temperature'], batch_count, 0.9, float),
+        "top_p": parse_param_array(param_arrays['top_p'], batch_count, 0.95, float),
+        "top_k": parse_param_array(param_arrays['top_k'], batch_count, 40, int),
+        "max_output_tokens": parse_param_array(param_arrays['max_output_tokens'], batch_count, 8192, int),
+    }
+    # 标签只列出这一批里取值有变化的参数（与扫描模式一致）
+    varying = [k for k, v in parsed_params.items() if len(set(v)) > 1]
+    items = []
+    for i in range(batch_count):
+        params = {k: v[i] for k, v in parsed_params.items()}
+        detail = ", ".join(f"{AXIS_SHORT[k]}={params[k]}" for k in varying)
+        items.append({
+            "params": params,
+            "label": f"#{i+1} {detail}".rstrip(),
+            "grid_index": i,
+        })
+    return items
+
 def format_queue_log(queue_data, current_status=""):
     """格式化队列状态日志"""
     log = f"=== 📟 队列监控面板 ({datetime.now().strftime('%H:%M:%S')}) ===\n"
@@ -64,11 +152,23 @@ def format_queue_log(queue_data, current_status=""):
             "running": "🔄 执行中",
             "completed": "✅ 已完成",
             "failed": "❌ 已失败",
-            "partial": "⚠️ 部分完成"
+            "partial": "⚠️ 部分完成",
+            "cancelled": "⏹️ 已取消",
+            "paused": "⏸️ 预算暂停",
+            "converged": "♻️ 已收敛",
         }.get(item['status'], item['status'])
         
         log += f"[{real_idx+1}] {status_icon} | 批次: {item['done_count']}/{item['total_count']}\n"
         log += f"   📝 提示词: {item['prompt'][:30]}...\n"
+        if item.get('cost_usd'):
+            log += f"   💰 已花费: ${item['cost_usd']:.3f}\n"
+        if item.get('retries'):
+            log += f"   🔁 重试: {item['retries']} 次\n"
+        if item.get('models'):
+            used = ", ".join(f"{m} ×{n}" for m, n in item['models'].items())
+            log += f"   🤖 模型: {used}\n"
+        if item.get('duplicates'):
+            log += f"   {item['duplicates']}\n"
         if item.get('error_msg'):
             log += f"   ❗ 错误: {item['error_msg']}\n"
         log += "-"*30 + "\n"
@@ -81,118 +181,207 @@ def execute_queue_task(
     prompt, ref_images, batch_count,
     param_arrays, # 字典：包含所有参数的原始字符串
     api_key, system_instruction,
-    strategy_mode
+    strategy_mode,
+    cancel_token=None,
+    plan_items=None,
+    flow="",
+    priority=PRIORITY_NORMAL,
+    session_id="",
+    task_id="",
+    model_name=DEFAULT_QUEUE_MODEL,
+    on_model=None,
+    on_retry=None,
+    dedupe=None,
+    on_item=None,
 ):
     """
     生成器函数：逐步执行队列任务并 yield 状态
+    cancel_token 被取消时：中断进行中的请求，剩余批次全部跳过
+    plan_items: 扫描模式下由 plan_sweep 给出的执行计划；为空时按批量模式解析 param_arrays
+    flow / priority: 提交给全局调度器的会话标识与优先级，每张图作为一个调度单元
+    session_id / task_id: 用量记账与预算检查；超过硬预算时队列暂停，直到预算放宽或被取消
+    model_name: 主模型；熔断时经由 get_router() 自动切换到备选模型，实际模型记在结果标签上
+    on_model: 每张图成功后回调 on_model(实际模型)，用于在任务记录里统计
+    on_retry: 每次失败回调 on_retry(错误类别, 是否重试)，用于在任务记录里统计重试次数
+    dedupe: banana.dedupe.DuplicateTracker；每张结果计算感知哈希聚类，输出收敛时跳过剩余批次
+    on_item: 每个计划项结束时回调 on_item(grid_index, 结果 "done"/"empty"/"failed", 图片路径列表, 说明)，
+             供画廊给失败的格子放占位图；被取消 / 提前停止而没有执行的项不回调
+
+    yield 的 results 为 [(图片路径, 标签), ...]，始终按网格位置排序，便于画廊按网格展示
     """
-    from nano_banana_pro import call_gemini_vertex # 延迟导入
+    call_gemini_vertex = _call_model()
     
     results = []
+    result_keys = []
     logs = []
     
-    # 1. 解析所有参数数组
-    # 将 "1:1, 16:9" 这种字符串解析为对应每次循环的 list
-    parsed_params = {
-        "aspect_ratio": parse_param_array(param_arrays['aspect_ratio'], batch_count, "1:1"),
-        "image_size": parse_param_array(param_arrays['image_size'], batch_count, "1K"),
-        "enable_search": parse_param_array(param_arrays['enable_search'], batch_count, 0, int), # 0/1
-        "temperature": parse_param_array(param_arrays['temperature'], batch_count, 0.9, float),
-        "top_p": parse_param_array(param_arrays['top_p'], batch_count, 0.95, float),
-        "top_k": parse_param_array(param_arrays['top_k'], batch_count, 40, int),
-        "max_output_tokens": parse_param_array(param_arrays['max_output_tokens'], batch_count, 8192, int),
-    }
+    # 1. 生成执行计划
+    items = plan_items or build_batch_plan(param_arrays, batch_count)
+    batch_count = len(items)
+
+    def _cancelled():
+        return cancel_token is not None and cancel_token.cancelled
+
+    def _sleep(seconds):
+        # 可被取消打断的等待
+        if cancel_token is not None:
+            return cancel_token.sleep(seconds)
+        time.sleep(seconds)
+        return False
+
+    ledger = get_ledger()
+    router = get_router()
+    retry_policy = get_retry_policy()
+    soft_warned = False
+
+    # 语义重写：整个任务只调用一次文本模型拿到全部变体，和第一张图并行
+    rewrite_future = None
+    rewrite_variants = None
+    if strategy_mode == STRATEGY_FLASH_REWRITE and batch_count > 1:
+        rewrite_future = submit_rewrite(
+            prompt, batch_count,
+            api_key=api_key,
+            cancel_token=cancel_token,
+            usage_tags={"session_id": session_id, "flow": flow, "task_id": task_id},
+        )
 
     # 2. 循环执行
-    for i in range(batch_count):
+    for i, item in enumerate(items):
+        if _cancelled():
+            yield results, i, f"⏹️ 已取消，跳过剩余 {batch_count - i} 张", f"已取消: {cancel_token.reason}"
+            return
+
+        # --- 预算检查：软预算提示一次，硬预算暂停等待 ---
+        budget_state, budget_msg = ledger.check_budget(session_id=session_id, task_id=task_id)
+        while budget_state == BUDGET_HARD:
+            yield results, i, f"⏸️ 预算已超出，队列暂停（修改 config.json 的 budgets 或点击取消）\n{budget_msg}", None
+            if _sleep(10):
+                break
+            budget_state, budget_msg = ledger.check_budget(session_id=session_id, task_id=task_id)
+        if _cancelled():
+            yield results, i, f"⏹️ 已取消，跳过剩余 {batch_count - i} 张", f"已取消: {cancel_token.reason}"
+            return
+        if budget_state == BUDGET_SOFT and not soft_warned:
+            soft_warned = True
+            yield results, i, f"⚠️ {budget_msg}，继续执行", None
         current_prompt = prompt
         
         # --- 策略应用 ---
-        if strategy_mode == "随机噪声 (Seed Salting)":
+        if strategy_mode == STRATEGY_SEED_SALTING:
             seed = random.randint(10000, 99999)
             current_prompt = f"{prompt} \n(Random Seed: {seed}, Batch: {i+1})"
-        elif strategy_mode == "语义重写 (Flash Rewrite)":
-            # 这里简化处理，实际应该调用 flash 模型重写
-            # 暂时用简单的后缀模拟
-            modifiers = ["Cinematic Lighting", "Wide Angle", "Close-up", "Cyberpunk Style", "Watercolor"]
-            mod = modifiers[i % len(modifiers)]
-            current_prompt = f"{prompt}, {mod}"
+        elif rewrite_future is not None and i > 0:
+            # 第一张用原始提示词，和改写请求并行；之后的每张取改写结果（通常此时早已返回）
+            if rewrite_variants is None:
+                try:
+                    rewrite_variants, cache_hit = rewrite_future.result()
+                except Exception as e:
+                    # 只有被取消时 rewrite_prompt 才会抛出，交给下面的取消检查处理
+                    print(f"[Queue] 语义重写中断: {e}")
+                    rewrite_variants, cache_hit = fallback_variants(prompt, batch_count), False
+                if not _cancelled():
+                    yield results, i, f"✍️ 语义重写完成（{'缓存命中' if cache_hit else REWRITE_MODEL}），共 {len(rewrite_variants)} 个变体", None
+            current_prompt = rewrite_variants[i % len(rewrite_variants)]
         
         # --- 获取当前轮次的参数 ---
-        cur_aspect = parsed_params["aspect_ratio"][i]
-        cur_size = parsed_params["image_size"][i]
-        cur_search = bool(parsed_params["enable_search"][i])
-        cur_temp = parsed_params["temperature"][i]
-        cur_top_p = parsed_params["top_p"][i]
-        cur_top_k = parsed_params["top_k"][i]
-        cur_tokens = parsed_params["max_output_tokens"][i]
+        params = item["params"]
+        cur_aspect = params["aspect_ratio"]
+        cur_size = params["image_size"]
+        cur_search = bool(params["enable_search"])
+        cur_temp = params["temperature"]
+        cur_top_p = params["top_p"]
+        cur_top_k = params["top_k"]
+        cur_tokens = params["max_output_tokens"]
         
         status_msg = f"正在执行第 {i+1}/{batch_count} 张... \n尺寸: {cur_aspect} | 搜索: {cur_search} | Temp: {cur_temp}"
         yield results, i, status_msg, None # 更新状态
 
         # --- 带有错误退让的 API 调用 ---
-        max_retries = 3
-        retry_delay = 5 # 初始等待秒数
-        success = False
+        # 是否重试、等多久由全局重试策略按错误类别决定（banana.retry），这里只负责在等待前上报状态
+        retry = retry_policy.begin()
         
-        for attempt in range(max_retries):
+        while True:
             try:
-                # 调用主程序的函数
+                # 调用主程序的函数（经由全局调度器排队）
                 # 注意：history_messages 传空，确保单次独立生成
-                text_out, img_paths = call_gemini_vertex(
-                    api_key=api_key,
-                    model_name="gemini-3-pro-image-preview", # 强制使用画图模型，或者做成参数
-                    history_messages=[], 
-                    user_text=current_prompt,
-                    user_images=ref_images,
-                    aspect_ratio=cur_aspect,
-                    image_size=cur_size,
-                    system_instruction=system_instruction,
-                    temperature=cur_temp,
-                    top_p=cur_top_p,
-                    top_k=cur_top_k,
-                    max_output_tokens=cur_tokens,
-                    enable_search=cur_search
+                # 路由器挑选模型（主模型熔断时切换到备选），每次尝试都单独排队
+                (text_out, img_paths), used_model = router.call(
+                    model_name,
+                    lambda m: get_scheduler().run(
+                        lambda: call_gemini_vertex(
+                            api_key=api_key,
+                            model_name=m,
+                            history_messages=[], 
+                            user_text=current_prompt,
+                            user_images=ref_images,
+                            aspect_ratio=cur_aspect,
+                            image_size=cur_size,
+                            system_instruction=system_instruction,
+                            temperature=cur_temp,
+                            top_p=cur_top_p,
+                            top_k=cur_top_k,
+                            max_output_tokens=cur_tokens,
+                            enable_search=cur_search,
+                            cancel_token=cancel_token,
+                            usage_tags={"session_id": session_id, "flow": flow, "task_id": task_id, "source": "queue"},
+                        ),
+                        flow=flow,
+                        priority=priority,
+                        cost=estimate_latency(m, cur_size, cur_search),
+                        label=f"队列 {i+1}/{batch_count}",
+                        cancel_token=cancel_token,
+                    ),
                 )
                 
+                retry.on_success()
                 if img_paths:
-                    results.extend(img_paths)
-                    success = True
+                    # 按网格位置插入，保证画廊布局与参数网格一致；回退到备选模型时在标签上注明
+                    label = item["label"] if used_model == model_name else f"{item['label']} [{used_model}]"
+                    for path in img_paths:
+                        pos = bisect_right(result_keys, item["grid_index"])
+                        result_keys.insert(pos, item["grid_index"])
+                        results.insert(pos, (path, label))
+                        if dedupe is not None:
+                            dedupe.add(path)
+                    if on_model is not None:
+                        on_model(used_model)
+                    if on_item is not None:
+                        on_item(item["grid_index"], "done", list(img_paths), "")
+                    if used_model != model_name:
+                        yield results, i, f"🔀 {model_name} 熔断中，第 {i+1} 张改用 {used_model}", None
                     break # 成功，跳出重试循环
                 else:
                     # 如果返回空（可能是被拦截），视为非致命错误，不重试，直接下一张
                     print(f"[Queue] 第 {i+1} 张未生成图片: {text_out}")
+                    if on_item is not None:
+                        on_item(item["grid_index"], "empty", [], (text_out or "").strip()[:60])
                     break 
 
+            except CancelledError as e:
+                yield results, i, f"⏹️ 已取消，跳过剩余 {batch_count - i} 张", f"已取消: {e}"
+                return
+
             except Exception as e:
-                err_str = str(e)
-                print(f"[Queue Error] Attempt {attempt+1}: {err_str}")
-                
-                # === 错误分类处理 ===
-                if "429" in err_str or "RESOURCE_EXHAUSTED" in err_str:
-                    wait_time = retry_delay * (2 ** attempt) # 指数退避: 5s, 10s, 20s
-                    yield results, i, f"⚠️ 触发限流 (429)，冷却 {wait_time} 秒...", None
-                    time.sleep(wait_time)
-                    continue # 重试
-                
-                elif "400" in err_str or "INVALID_ARGUMENT" in err_str:
-                    yield results, i, f"❌ 参数错误 (400)，跳过本任务...", f"400 Error: {err_str}"
-                    # 400 错误通常无法通过重试解决（如参数不对），直接跳出重试，甚至可以 return 终止整个 batch
-                    # 这里选择跳过当前这张，继续下一张
-                    success = False
-                    break 
-                
-                else:
-                    # 其他未知错误，尝试重试
-                    wait_time = 5
-                    time.sleep(wait_time)
-        
-        if not success:
-            # 如果重试多次依然失败
-            pass
+                delay = retry.on_error(e)
+                label = ERROR_LABELS[retry.last_class]
+                print(f"[Queue Error] Attempt {retry.attempts} ({retry.last_class}): {e}")
+                if on_retry is not None:
+                    on_retry(retry.last_class, delay is not None)
+                if delay is None:
+                    # 不可重试（参数 / 权限错误）或次数、总时长用尽：跳过这一张，继续下一张
+                    if on_item is not None:
+                        on_item(item["grid_index"], "failed", [], label)
+                    yield results, i, f"❌ 第 {i+1} 张{label}，跳过", f"{label}: {e}"
+                    break
+                yield results, i, f"⚠️ 第 {i+1} 张{label}，{delay:.0f} 秒后第 {retry.attempts + 1} 次尝试...", None
+                _sleep(delay)  # 被取消时提前返回，下一次调用会抛出 CancelledError
             
+        if dedupe is not None and dedupe.converged and i + 1 < batch_count:
+            yield results, i + 1, f"♻️ 连续 {dedupe.converge_after} 张与之前的结果近似重复，输出已收敛，跳过剩余 {batch_count - i - 1} 张", None
+            return
+
         # 强制冷却一小会儿，避免连续请求过于密集
-        time.sleep(2)
+        _sleep(2)
 
     yield results, batch_count, "任务完成", None
 
@@ -203,71 +392,306 @@ def process_queue_click(
     prompt, ref_images, batch_count, strategy,
     ar_arr, size_arr, search_arr, temp_arr, top_p_arr, top_k_arr, token_arr,
     api_key, sys_inst,
-    queue_data
+    sweep_enabled, sweep_mode, sweep_max,
+    priority_label,
+    model_name,
+    collapse_duplicates,
+    early_stop,
+    queue_key,
+    request: gr.Request = None,
 ):
     """
     响应“加入队列并执行”按钮
+    扫描模式下忽略执行次数，按参数矩阵展开笛卡尔网格执行
+    队列任务列表保存在外部会话存储（queue_key 对应浏览器里的会话 ID），每次状态变化都写回
+    每个任务记录实际使用的模型及张数（主模型熔断时会回退到备选模型）
+    collapse_duplicates: 画廊中近似重复的结果只显示每组的第一张；否则在标签上标注
+    early_stop: 连续多张结果近似重复时提前停止（banana.dedupe）
     """
+    model_name = model_name or DEFAULT_QUEUE_MODEL
+    param_arrays = {
+        "aspect_ratio": ar_arr, "image_size": size_arr, "enable_search": search_arr,
+        "temperature": temp_arr, "top_p": top_p_arr, "top_k": top_k_arr, "max_output_tokens": token_arr
+    }
+
+    gallery_columns = 3
+    grid_layout = True
+    if sweep_enabled:
+        plan = plan_sweep(param_arrays, model_name, mode=sweep_mode, max_items=int(sweep_max or 1))
+        plan_items = plan["items"]
+        gallery_columns = plan["grid_columns"]
+        # 随机采样只抽了网格中的一部分，按执行顺序平铺，不假装成网格
+        grid_layout = sweep_mode != SWEEP_MODE_SAMPLED
+        if not grid_layout:
+            gallery_columns = 3
+        batch_count = len(plan_items)
+    else:
+        plan_items = build_batch_plan(param_arrays, int(batch_count))
+    # grid_index -> {"status", "paths", "note"}，按完成顺序
+    outcomes = {}
+
+    def _on_item(grid_index, status, paths, note):
+        outcomes[grid_index] = {"status": status, "paths": paths, "note": note}
+
+    def _gallery():
+        # 画廊显示长边够用的最小变体（4K PNG 太重）；原图路径按位置记下，供“固定”使用（占位格为空）
+        cells = _gallery_cells(plan_items, outcomes, tracker, collapse_duplicates, grid_layout)
+        get_session_store().save_shown(queue_key, [path for path, _, _ in cells])
+        shown = [
+            (pick_variant(path, min_side=GALLERY_MIN_SIDE) if path else _placeholder_image(kind), label)
+            for path, kind, label in cells
+        ]
+        return gr.update(value=shown, columns=gallery_columns)
+
     # 1. 新建任务对象
     new_task = {
-        "id": int(time.time()),
+        "id": f"{int(time.time())}-{uuid.uuid4().hex[:6]}",
         "prompt": prompt,
         "total_count": int(batch_count),
         "done_count": 0,
         "status": "pending", # pending -> running -> completed/failed
-        "error_msg": ""
+        "error_msg": "",
+        "model": model_name,
+        "models": {},  # 实际使用的模型 -> 张数
     }
     
-    queue_data = queue_data or []
+    queue_key = queue_key or uuid.uuid4().hex
+    tracker = new_tracker(scope=queue_key, task_id=new_task["id"], early_stop=bool(early_stop))
+    store = get_session_store()
+    queue_data = store.load_queue(queue_key)
     queue_data.append(new_task)
+
+    def _merge(stored):
+        merged = [new_task if t.get("id") == new_task["id"] else t for t in stored]
+        if not any(t.get("id") == new_task["id"] for t in stored):
+            merged.append(new_task)
+        # 只保留最近的任务记录，避免会话存储无限增长
+        return merged[-MAX_QUEUE_HISTORY:]
+
+    def _emit(status_text, gallery_items):
+        if tracker is not None:
+            new_task["duplicates"] = format_duplicate_summary(tracker.summary())
+        # 同一会话可能有多个任务并行（甚至在不同进程里），原子地读取最新列表并只替换本任务
+        merged = store.update_queue(queue_key, _merge)
+        # 本任务的结果在会话有效期内不会被存储清理删除
+        get_storage().hold(f"{queue_key}:{new_task['id']}", gallery_items)
+        return queue_key, format_queue_log(merged, status_text), _gallery()
     
     # 2. 更新日志显示 (Pending)
-    yield queue_data, format_queue_log(queue_data, "准备开始..."), []
+    yield _emit("准备开始...", [])
     
     # 3. 开始执行
     # 更新当前任务状态为 running
     queue_data[-1]['status'] = "running"
     
-    param_arrays = {
-        "aspect_ratio": ar_arr, "image_size": size_arr, "enable_search": search_arr,
-        "temperature": temp_arr, "top_p": top_p_arr, "top_k": top_k_arr, "max_output_tokens": token_arr
-    }
-    
+    session_id = getattr(request, "session_hash", None) or ""
+    flow = getattr(request, "username", None) or session_id or "anonymous"
+    token = new_token(session_id, scope="queue")
+    img_results = []
+
+    def _on_model(used_model):
+        models = queue_data[-1]["models"]
+        models[used_model] = models.get(used_model, 0) + 1
+
+    def _on_retry(err_class, retried):
+        if retried:
+            queue_data[-1]["retries"] = queue_data[-1].get("retries", 0) + 1
+
     try:
         # 调用生成器
         iterator = execute_queue_task(
             prompt, ref_images, int(batch_count), param_arrays,
-            api_key, sys_inst, strategy
+            api_key, sys_inst, strategy,
+            cancel_token=token,
+            plan_items=plan_items,
+            flow=flow,
+            priority=QUEUE_PRIORITY_OPTIONS.get(priority_label, PRIORITY_NORMAL),
+            session_id=session_id,
+            task_id=new_task["id"],
+            model_name=model_name,
+            on_model=_on_model,
+            on_retry=_on_retry,
+            dedupe=tracker,
+            on_item=_on_item,
         )
         
         for img_results, done_idx, status_text, err in iterator:
             # 实时更新状态
             queue_data[-1]['done_count'] = done_idx
+            queue_data[-1]['status'] = "paused" if status_text.startswith("⏸️") else "running"
+            queue_data[-1]['cost_usd'] = get_ledger().totals(task_id=new_task["id"])["cost_usd"]
             
             if err:
                 queue_data[-1]['error_msg'] = err
             
             # 刷新界面
-            log_str = format_queue_log(queue_data, status_text)
-            yield queue_data, log_str, img_results
+            yield _emit(status_text, img_results)
             
         # 完成
-        queue_data[-1]['status'] = "completed" if not queue_data[-1].get('error_msg') else "partial"
-        yield queue_data, format_queue_log(queue_data, "✅ 所有任务执行完毕"), img_results
+        if token.cancelled:
+            queue_data[-1]['status'] = "cancelled"
+            yield _emit("⏹️ 任务已取消", img_results)
+        elif tracker is not None and tracker.converged and queue_data[-1]['done_count'] < queue_data[-1]['total_count']:
+            queue_data[-1]['status'] = "converged"
+            yield _emit("♻️ 输出已收敛，提前结束", img_results)
+        else:
+            queue_data[-1]['status'] = "completed" if not queue_data[-1].get('error_msg') else "partial"
+            yield _emit("✅ 所有任务执行完毕", img_results)
         
     except Exception as e:
         traceback.print_exc()
         queue_data[-1]['status'] = "failed"
         queue_data[-1]['error_msg'] = str(e)
-        yield queue_data, format_queue_log(queue_data, "❌ 执行过程中发生致命错误"), []
+        yield _emit("❌ 执行过程中发生致命错误", [])
+    finally:
+        release_token(token)
+
+
+def preview_sweep_click(ar_arr, size_arr, search_arr, temp_arr, top_p_arr, top_k_arr, token_arr, sweep_mode, sweep_max, model_name=None):
+    """
+    响应“预览扫描计划”按钮：只规划不执行，展示组合、顺序与成本/耗时估算
+    """
+    param_arrays = {
+        "aspect_ratio": ar_arr, "image_size": size_arr, "enable_search": search_arr,
+        "temperature": temp_arr, "top_p": top_p_arr, "top_k": top_k_arr, "max_output_tokens": token_arr
+    }
+    plan = plan_sweep(param_arrays, model_name or DEFAULT_QUEUE_MODEL, mode=sweep_mode, max_items=int(sweep_max or 1))
+    return format_sweep_plan(plan)
+
+
+def refresh_global_monitor():
+    """定时刷新：全局调度器中所有会话的执行 / 排队情况，各模型的熔断状态、重试、上下文缓存、输出变体与存储配额统计"""
+    text = format_scheduler_snapshot(get_scheduler().snapshot())
+    breakers = format_router_snapshot(get_router().snapshot())
+    if breakers:
+        text += "\n--- 模型熔断 ---\n" + breakers
+    retries = format_retry_stats(get_retry_policy().stats.snapshot())
+    if retries:
+        text += "\n--- 错误与重试 ---\n" + retries
+    caches = format_cache_snapshot(get_context_cache().snapshot())
+    if caches:
+        text += "\n--- 上下文缓存 ---\n" + caches
+    variants = format_transcoder_snapshot(get_transcoder().snapshot())
+    if variants:
+        text += "\n--- 输出变体 ---\n" + variants
+    storage = format_storage_snapshot(get_storage().snapshot())
+    if storage:
+        text += "\n--- 存储配额 ---\n" + storage
+    return text
+
+
+def cancel_queue_click(request: gr.Request = None):
+    """
+    响应“取消”按钮：中断当前会话正在执行的队列任务（进行中 + 剩余批次）
+    """
+    session_id = getattr(request, "session_hash", None) or ""
+    n = cancel_session(session_id, scope="queue", reason="用户取消")
+    if n:
+        print(f"[Queue] 已取消 {n} 个队列任务")
+
+
+_placeholders = {}
+
+
+def _placeholder_image(kind):
+    """纯色占位图（首次使用时写到临时目录），标签里写明原因"""
+    path = _placeholders.get(kind)
+    if path and os.path.exists(path):
+        return path
+    from PIL import Image
+
+    path = os.path.join(tempfile.gettempdir(), f"banana_queue_{kind}.png")
+    Image.new("RGB", (PLACEHOLDER_SIDE, PLACEHOLDER_SIDE), PLACEHOLDER_COLORS[kind]).save(path)
+    _placeholders[kind] = path
+    return path
 
 
-def create_tab():
+def _gallery_cells(plan_items, outcomes, tracker=None, collapse=False, grid=True):
+    """
+    把执行计划和各项结果排成画廊条目 [(原图路径, 占位类型, 标签)]，有图时占位类型为空，占位时路径为空
+    grid=True：每个计划项固定占一格（按 grid_index），失败 / 尚未执行 / 被折叠的近似重复放占位图，
+    画廊位置始终与参数网格对应；同一项返回多张图时只有第一张占格子，其余张数记在标签上
+    grid=False：按执行顺序列出已执行的项，被折叠的近似重复直接省略
+    近似重复：collapse 时每组只保留第一张并注明组内张数，否则注明与第几格重复；与之前任务近似的也标注出来
+    """
+    by_index = {it["grid_index"]: it for it in plan_items}
+    if grid:
+        order = sorted(by_index)
+    else:
+        order = [g for g in outcomes if g in by_index]
+
+    cells = []
+    for g in order:
+        label = by_index[g]["label"]
+        out = outcomes.get(g)
+        if out is None:
+            if grid:
+                cells.append(["", "pending", f"{label} · ⏳ 未执行"])
+            continue
+        paths = out["paths"]
+        if not paths:
+            reason = "未生成图片" if out["status"] == "empty" else (out["note"] or "失败")
+            cells.append(["", "failed", f"{label} · ❌ {reason}"])
+            continue
+        if grid:
+            extra = f" · +{len(paths) - 1} 张" if len(paths) > 1 else ""
+            cells.append([paths[0], "", label + extra])
+        else:
+            cells.extend([p, "", label] for p in paths)
+
+    if tracker is None:
+        return [tuple(c) for c in cells]
+
+    infos = [tracker.info(path) or {} if path else {} for path, _, _ in cells]
+    if collapse and not grid:
+        kept = [(c, info) for c, info in zip(cells, infos) if not info.get("duplicate_of")]
+        cells, infos = [c for c, _ in kept], [info for _, info in kept]
+    position = {path: n for n, (path, _, _) in enumerate(cells, 1) if path}
+    group_size = {}
+    for info in infos:
+        if info.get("duplicate_of"):
+            group_size[info["duplicate_of"]] = group_size.get(info["duplicate_of"], 1) + 1
+    for cell, info in zip(cells, infos):
+        path = cell[0]
+        dup = info.get("duplicate_of")
+        if dup:
+            cell[2] = f"{cell[2]} · ♻️ 近似 #{position.get(dup, '?')}"
+            if collapse:
+                cell[0], cell[1] = "", "duplicate"
+        elif collapse and path in group_size:
+            cell[2] = f"{cell[2]} · ♻️ ×{group_size[path]}"
+        if info.get("history"):
+            cell[2] = f"{cell[2]} · 🕘 与之前的结果近似"
+    return [tuple(c) for c in cells]
+
+
+def select_result_image(queue_key, evt: gr.SelectData):
+    """记录画廊中选中的原图路径（画廊里显示的是变体 / Gradio 缓存副本，按位置找回原图）"""
+    # 路径存在会话存储里，画廊由哪个进程渲染都能找回
+    paths = get_session_store().load_shown(queue_key) if queue_key else []
+    return paths[evt.index] if isinstance(evt.index, int) and 0 <= evt.index < len(paths) else ""
+
+
+def pin_result_image(path, pinned):
+    """固定 / 取消固定选中的图片"""
+    if not path:
+        return "请先在画廊中点击一张图片"
+    storage = get_storage()
+    if pinned:
+        storage.pin(path)
+    else:
+        storage.unpin(path)
+    return f"{'📌 已固定' if pinned else '已取消固定'}：`{path}`（共固定 {len(storage.pins())} 项）"
+
+
+def create_tab(host=None):
+    global _host
+    _host = host
     with gr.Tab("📚 智能队列 (Smart Queue)"):
         gr.Markdown("### 🛠️ 批量生成与参数矩阵")
         
-        # 状态存储
-        queue_state = gr.State([]) 
+        # 状态存储：浏览器只保存会话 ID，任务列表在外部会话存储里
+        queue_state = gr.BrowserState("", storage_key="banana_queue_session_id")
         
         with gr.Row():
             # --- 左侧：控制面板 ---
@@ -282,6 +706,13 @@ def create_tab():
                     interactive=False,
                     elem_id="queue-log"
                 )
+                global_box = gr.TextArea(
+                    label="全局调度（所有会话）",
+                    value="",
+                    lines=5,
+                    max_lines=12,
+                    interactive=False,
+                )
                 
                 # 2. 基础输入 (与主界面一致)
                 prompt_input = gr.Textbox(label="提示词 (Prompt)", lines=3, placeholder="输入画面描述...")
@@ -291,9 +722,24 @@ def create_tab():
                     batch_slider = gr.Slider(label="执行次数 (Batch Size)", minimum=1, maximum=9, value=4, step=1)
                     strategy_radio = gr.Radio(
                         label="差异化策略", 
-                        choices=["随机噪声 (Seed Salting)", "语义重写 (Flash Rewrite)", "仅参数变化"], 
-                        value="随机噪声 (Seed Salting)"
+                        choices=[STRATEGY_SEED_SALTING, STRATEGY_FLASH_REWRITE, STRATEGY_PARAMS_ONLY], 
+                        value=STRATEGY_SEED_SALTING
+                    )
+                    priority_radio = gr.Radio(
+                        label="优先级",
+                        choices=list(QUEUE_PRIORITY_OPTIONS.keys()),
+                        value="普通",
                     )
+                with gr.Row():
+                    # 感知哈希近似重复检测（config.json 的 dedupe 段可调整阈值 / 收敛张数）
+                    collapse_checkbox = gr.Checkbox(label="♻️ 折叠近似重复的结果", value=True)
+                    early_stop_checkbox = gr.Checkbox(label="输出收敛时提前停止（连续多张近似重复）", value=False)
+                model_dropdown = gr.Dropdown(
+                    label="模型（熔断时自动回退到 config.json 中配置的备选模型）",
+                    choices=_image_models(),
+                    value=DEFAULT_QUEUE_MODEL,
+                    allow_custom_value=True,
+                )
                 
                 # 3. 高级参数矩阵 (Accordion 折叠)
                 with gr.Accordion("📐 参数矩阵 (数组模式)", open=False):
@@ -314,16 +760,41 @@ def create_tab():
                         topk_input = gr.Textbox(label="Top K", value="40")
                         token_input = gr.Textbox(label="Max Tokens", value="8192")
 
+                # 3.1 参数扫描 (笛卡尔网格)
+                with gr.Accordion("🧮 参数扫描 (Sweep)", open=False):
+                    gr.Markdown(
+                        "开启后忽略执行次数，把上面参数矩阵中的每一列当作一个维度做笛卡尔组合（自动去重）。\n"
+                        "便宜/快速的组合（如 1K）优先执行，结果按参数网格排列。"
+                    )
+                    sweep_enabled = gr.Checkbox(label="启用参数扫描", value=False)
+                    with gr.Row():
+                        sweep_mode = gr.Radio(
+                            label="网格模式",
+                            choices=[SWEEP_MODE_FULL, SWEEP_MODE_SAMPLED],
+                            value=SWEEP_MODE_FULL,
+                        )
+                        sweep_max = gr.Number(label="最多执行组合数", value=27, precision=0, minimum=1, maximum=256)
+                    btn_preview = gr.Button("📋 预览扫描计划")
+                    sweep_plan_md = gr.Markdown()
+
                 # 4. 隐藏的 API Key 输入 (从主 Tab 传递过来比较麻烦，这里简单再放一个或默认读取环境变量)
                 # 为了简便，建议用户在主 Tab 填好 Key，这里直接用环境变量，或者再放一个 Textbox
                 api_key_input = gr.Textbox(label="API Key (如未设置环境变量请在此输入)", type="password")
                 sys_inst_input = gr.Textbox(label="系统指令", value="", lines=1)
 
-                btn_run = gr.Button("🚀 加入队列并启动", variant="primary")
+                with gr.Row():
+                    btn_run = gr.Button("🚀 加入队列并启动", variant="primary")
+                    btn_cancel = gr.Button("⏹️ 取消", variant="stop")
 
             # --- 右侧：结果画廊 ---
             with gr.Column(scale=5):
                 gallery = gr.Gallery(label="生成结果", columns=3, height=800, object_fit="contain")
+                # 固定的图片不会被存储配额清理删除（banana.storage）
+                selected_image = gr.State("")
+                with gr.Row():
+                    btn_pin = gr.Button("📌 固定选中的图片", size="sm")
+                    btn_unpin = gr.Button("取消固定", size="sm")
+                pin_status = gr.Markdown()
 
         # 事件绑定
         btn_run.click(
@@ -332,7 +803,27 @@ def create_tab():
                 prompt_input, ref_image_input, batch_slider, strategy_radio,
                 ar_input, size_input, search_input, temp_input, topp_input, topk_input, token_input,
                 api_key_input, sys_inst_input,
+                sweep_enabled, sweep_mode, sweep_max,
+                priority_radio,
+                model_dropdown,
+                collapse_checkbox,
+                early_stop_checkbox,
                 queue_state
             ],
-            outputs=[queue_state, log_box, gallery]
+            outputs=[queue_state, log_box, gallery],
+            # 并发由全局调度器控制
+            concurrency_limit=None,
+        )
+        gr.Timer(2.0).tick(fn=refresh_global_monitor, inputs=None, outputs=global_box)
+        btn_preview.click(
+            fn=preview_sweep_click,
+            inputs=[
+                ar_input, size_input, search_input, temp_input, topp_input, topk_input, token_input,
+                sweep_mode, sweep_max, model_dropdown,
+            ],
+            outputs=sweep_plan_md,
         )
+        btn_cancel.click(fn=cancel_queue_click, inputs=None, outputs=None, queue=False)
+        gallery.select(fn=select_result_image, inputs=queue_state, outputs=selected_image)
+        btn_pin.click(fn=lambda p: pin_result_image(p, True), inputs=selected_image, outputs=pin_status)
+        btn_unpin.click(fn=lambda p: pin_result_image(p, False), inputs=selected_image, outputs=pin_status)
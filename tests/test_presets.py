@@ -0,0 +1,82 @@
+# banana.presets 并发写入测试：多个进程 × 多个线程同时保存预设，不能丢更新、不能写坏 config.json
+import json
+import multiprocessing
+import os
+import threading
+
+from banana.presets import PresetStore
+
+PROCESSES = 4
+THREADS = 4
+PUTS = 20
+
+
+def _params(n):
+    return {"model_name": "gemini-3-pro-image-preview", "temperature": 0.9, "n": n}
+
+
+def _writer(path, worker):
+    """子进程：THREADS 个线程各保存 PUTS 个预设，一半写共享命名空间，一半写用户命名空间"""
+    store = PresetStore(path)
+
+    def _run(thread):
+        for i in range(PUTS):
+            user = "alice" if i % 2 else ""
+            store.put(f"p{worker}-{thread}-{i}", _params(i), user=user)
+
+    threads = [threading.Thread(target=_run, args=(t,)) for t in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_concurrent_put_keeps_every_update(tmp_path):
+    path = str(tmp_path / "config.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"scheduler": {"max_concurrency": 2}}, f)
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_writer, args=(path, w)) for w in range(PROCESSES)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=120)
+        assert p.exitcode == 0
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)  # 文件始终是完整的 JSON
+    expected = {
+        f"p{w}-{t}-{i}" for w in range(PROCESSES) for t in range(THREADS) for i in range(PUTS)
+    }
+    shared = set(data["presets"])
+    own = set(data["user_presets"]["alice"])
+    assert shared | own == expected
+    assert not shared & own
+    assert data["scheduler"] == {"max_concurrency": 2}
+    assert not [n for n in os.listdir(tmp_path) if n.endswith(".tmp")]
+
+
+def test_user_namespace_overlays_shared(tmp_path):
+    store = PresetStore(str(tmp_path / "config.json"))
+    store.put("a", _params(1))
+    store.put("a", _params(2), user="bob")
+    store.put("b", _params(3), user="bob")
+
+    assert store.presets()["a"]["n"] == 1
+    assert {k: v["n"] for k, v in store.presets("bob").items()} == {"a": 2, "b": 3}
+    # 删除只作用于自己的命名空间
+    assert store.delete("a", user="bob")
+    assert store.presets("bob")["a"]["n"] == 1
+    assert not store.delete("missing", user="bob")
+
+
+def test_legacy_file_is_migrated_on_write(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"old": _params(0)}), encoding="utf-8")
+    store = PresetStore(str(path))
+
+    assert set(store.presets()) == {"old"}
+    store.put("new", _params(1))
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert set(data["presets"]) == {"old", "new"}
@@ -0,0 +1,158 @@
+# banana.storage 测试：超额按 LRU 清理、固定 / 会话引用的文件不删、固定列表与会话引用跨实例（进程）共享
+import os
+import time
+
+from banana.session_store import SessionStore, open_kv
+from banana.storage import UNIT_DIR, RootPolicy, StorageManager
+
+KB = 1024
+
+
+def _write(path, size, age_s):
+    """写 size 字节，并把修改 / 访问时间设为 age_s 秒前"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    t = time.time() - age_s
+    os.utime(path, (t, t))
+    return path
+
+
+def _manager(root, max_kb, **kwargs):
+    kwargs.setdefault("grace_s", 0)
+    unit = kwargs.pop("unit", "file")
+    return StorageManager([RootPolicy(str(root), max_bytes=max_kb * KB, unit=unit)], **kwargs)
+
+
+def test_evicts_least_recently_used_over_quota(tmp_path):
+    old = _write(str(tmp_path / "a.png"), 4 * KB, 300)
+    mid = _write(str(tmp_path / "b.png"), 4 * KB, 200)
+    new = _write(str(tmp_path / "c.png"), 4 * KB, 100)
+
+    result = _manager(tmp_path, 9).sweep()
+
+    assert result["files"] == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(mid) and os.path.exists(new)
+
+
+def test_grace_period_keeps_fresh_files(tmp_path):
+    fresh = _write(str(tmp_path / "a.png"), 8 * KB, 5)
+
+    _manager(tmp_path, 1, grace_s=60).sweep()
+
+    assert os.path.exists(fresh)
+
+
+def test_pinned_files_are_kept(tmp_path):
+    old = _write(str(tmp_path / "a.png"), 4 * KB, 300)
+    mid = _write(str(tmp_path / "b.png"), 4 * KB, 200)
+    manager = _manager(tmp_path, 5)
+    manager.pin(old)
+
+    manager.sweep()
+
+    assert os.path.exists(old)
+    assert not os.path.exists(mid)
+
+
+def test_dir_unit_removes_whole_subdirectory(tmp_path):
+    _write(str(tmp_path / "s1" / "chat.md"), 1 * KB, 300)
+    _write(str(tmp_path / "s1" / "img.png"), 4 * KB, 300)
+    _write(str(tmp_path / "s2" / "img.png"), 4 * KB, 100)
+
+    _manager(tmp_path, 6, unit=UNIT_DIR).sweep()
+
+    assert not os.path.exists(tmp_path / "s1")
+    assert os.path.exists(tmp_path / "s2" / "img.png")
+
+
+def test_pins_merge_across_instances(tmp_path):
+    pins_path = str(tmp_path / "pins.json")
+    a = _manager(tmp_path / "out", 0, pins_path=pins_path)
+    b = _manager(tmp_path / "out", 0, pins_path=pins_path)
+
+    a.pin(str(tmp_path / "out" / "1.png"))
+    b.pin(str(tmp_path / "out" / "2.png"))
+    a.unpin(str(tmp_path / "out" / "1.png"))
+
+    expected = [os.path.normcase(os.path.abspath(str(tmp_path / "out" / "2.png")))]
+    assert a.pins() == expected
+    assert b.pins() == expected
+
+
+def test_holds_are_shared_through_session_store(tmp_path):
+    store = SessionStore(open_kv("memory://"))
+    held = _write(str(tmp_path / "held.png"), 4 * KB, 300)
+    other = _write(str(tmp_path / "other.png"), 4 * KB, 200)
+    web = _manager(tmp_path, 1, hold_store=store)
+    sweeper = _manager(tmp_path, 1, hold_store=store)
+
+    web.hold("session-1", [held])
+    sweeper.sweep()
+
+    assert os.path.exists(held)
+    assert not os.path.exists(other)
+
+    web.release("session-1")
+    sweeper.sweep()
+
+    assert not os.path.exists(held)
+
+
+def test_expired_holds_stop_protecting(tmp_path):
+    store = SessionStore(open_kv("memory://"))
+    held = _write(str(tmp_path / "held.png"), 4 * KB, 300)
+    web = _manager(tmp_path, 1, hold_store=store, hold_ttl_s=1)
+    sweeper = _manager(tmp_path, 1, hold_store=store, hold_ttl_s=1)
+
+    web.hold("session-1", [held])
+    sweeper.sweep()
+    assert os.path.exists(held)
+
+    time.sleep(1.1)
+    sweeper.sweep()
+
+    assert not os.path.exists(held)
+
+
+def _with_variants(folder, stem, age_s):
+    """原图 + variants/ 下的两个变体与清单"""
+    original = _write(os.path.join(folder, f"{stem}.png"), 4 * KB, age_s)
+    variants = [
+        _write(os.path.join(folder, "variants", f"{stem}.web.webp"), 1 * KB, age_s),
+        _write(os.path.join(folder, "variants", f"{stem}.thumb.jpg"), 1 * KB, age_s),
+    ]
+    manifest = _write(os.path.join(folder, "variants", f"{stem}.json"), 1, age_s)
+    return original, variants, manifest
+
+
+def test_original_and_variants_are_one_unit(tmp_path):
+    old = _with_variants(str(tmp_path), "old", 300)
+    new = _with_variants(str(tmp_path), "new", 100)
+
+    result = _manager(tmp_path, 8).sweep()
+
+    assert result["files"] == 1
+    assert not any(os.path.exists(p) for p in [old[0], *old[1], old[2]])
+    assert all(os.path.exists(p) for p in [new[0], *new[1], new[2]])
+
+
+def test_holding_a_variant_keeps_its_original(tmp_path):
+    original, variants, manifest = _with_variants(str(tmp_path), "a", 300)
+    manager = _manager(tmp_path, 1)
+    manager.hold("session-1", variants[0])
+
+    manager.sweep()
+
+    assert os.path.exists(original) and os.path.exists(manifest)
+
+
+def test_manifest_of_tiered_original_is_kept(tmp_path):
+    original, variants, manifest = _with_variants(str(tmp_path), "a", 300)
+    os.remove(original)  # 已迁到冷存储
+
+    _manager(tmp_path, 0.5).sweep()
+
+    assert not any(os.path.exists(p) for p in variants)
+    assert os.path.exists(manifest)